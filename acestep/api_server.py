@@ -10,7 +10,8 @@ Endpoints:
 - GET  /health                Health check
 
 NOTE:
-- In-memory queue and job store -> run uvicorn with workers=1.
+- Jobs and the queue live in a SQLite (WAL) database (ACESTEP_JOB_DB), so several
+  uvicorn worker processes can share one queue and queued jobs survive restarts.
 """
 
 from __future__ import annotations
@@ -26,13 +27,12 @@ import traceback
 import tempfile
 import urllib.parse
 from collections import deque
-from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace as dataclass_replace
 from contextlib import asynccontextmanager
-from dataclasses import dataclass
 from pathlib import Path
 from threading import Lock
-from typing import Any, Dict, List, Literal, Optional
 from uuid import uuid4
+from typing import Any, Dict, List, Literal, Optional, Tuple
 from loguru import logger
 
 try:
@@ -41,10 +41,21 @@ except ImportError:  # Optional dependency
     load_dotenv = None  # type: ignore
 
 from fastapi import FastAPI, HTTPException, Request, Depends, Header
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 from starlette.datastructures import UploadFile as StarletteUploadFile
 
 from acestep.handler import AceStepHandler
+from acestep.eta_model import LM_STAGES, JobFeatures, StageLatencyModel
+from acestep.handler_pool import HandlerPool, HandlerReplica, parse_devices
+from acestep.job_store import SQLiteJobStore, make_worker_id
+from acestep.audio_utils import (
+    audio_to_pcm16_bytes,
+    generate_uuid_from_params,
+    get_audio_file_hash,
+    pcm16_wav_header,
+)
+from acestep.audio_serving import VARIANT_FORMATS, AudioVariantEncoder, audio_file_response
 from acestep.llm_inference import LLMHandler
 from acestep.constants import (
     DEFAULT_DIT_INSTRUCTION,
@@ -54,11 +65,14 @@ from acestep.constants import (
 from acestep.inference import (
     GenerationParams,
     GenerationConfig,
+    GenerationResult,
     generate_music,
+    generate_music_batch,
     create_sample,
     format_sample,
 )
 from acestep.gradio_ui.events.results_handlers import _build_generation_info
+from acestep.test_time_scaling import score_batch
 from acestep.gpu_config import (
     get_gpu_config,
     get_gpu_memory_gb,
@@ -217,6 +231,18 @@ def _ensure_model_downloaded(model_name: str, checkpoint_dir: str) -> str:
             return _download_from_huggingface(repo_id, checkpoint_dir, model_name)
 
 
+def _ensure_draft_lm_downloaded(checkpoint_dir: str) -> Optional[str]:
+    """Return the speculative-decoding draft LM from ACESTEP_LM_DRAFT_MODEL_PATH, downloading it if needed."""
+    draft_model_path = os.getenv("ACESTEP_LM_DRAFT_MODEL_PATH", "").strip()
+    if not draft_model_path:
+        return None
+    try:
+        _ensure_model_downloaded(draft_model_path, checkpoint_dir)
+    except Exception as e:
+        print(f"[API Server] Warning: Failed to download draft LM model {draft_model_path}: {e}")
+    return draft_model_path
+
+
 def _get_project_root() -> str:
     current_file = os.path.abspath(__file__)
     return os.path.dirname(os.path.dirname(current_file))
@@ -231,7 +257,11 @@ RESULT_EXPIRE_SECONDS = 7 * 24 * 60 * 60  # 7 days
 TASK_TIMEOUT_SECONDS = 3600  # 1 hour
 JOB_STORE_CLEANUP_INTERVAL = 300  # 5 minutes - interval for cleaning up old jobs
 JOB_STORE_MAX_AGE_SECONDS = 86400  # 24 hours - completed jobs older than this will be cleaned
+JOB_STORE_DB_PATH = os.getenv("ACESTEP_JOB_DB") or os.path.join(_get_project_root(), ".cache", "acestep", "jobs.sqlite3")
 STATUS_MAP = {"queued": 0, "running": 0, "succeeded": 1, "failed": 2}
+# Formats lossless outputs are transcoded to in the background ("" disables)
+AUDIO_PREENCODE_FORMATS = [f for f in os.getenv("ACESTEP_AUDIO_PREENCODE", "mp3,opus").split(",") if f.strip()]
+AUDIO_CACHE_MAX_AGE = int(os.getenv("ACESTEP_AUDIO_CACHE_MAX_AGE", "86400"))
 
 LM_DEFAULT_TEMPERATURE = 0.85
 LM_DEFAULT_CFG_SCALE = 2.5
@@ -476,6 +506,8 @@ class GenerateMusicRequest(BaseModel):
     src_audio_path: Optional[str] = None
     audio_duration: Optional[float] = None
     batch_size: Optional[int] = None
+    # Best-of-N: generate this many candidates, score them and keep the best batch_size
+    best_of: int = 1
 
     audio_code_string: str = ""
 
@@ -552,6 +584,9 @@ class JobResult(BaseModel):
     lm_model: Optional[str] = None
     dit_model: Optional[str] = None
 
+    # Best-of-N: per-audio scores, aligned with audio_paths
+    scores: list[Dict[str, Any]] = Field(default_factory=list)
+
 
 class JobResponse(BaseModel):
     job_id: str
@@ -569,118 +604,6 @@ class JobResponse(BaseModel):
     error: Optional[str] = None
 
 
-@dataclass
-class _JobRecord:
-    job_id: str
-    status: JobStatus
-    created_at: float
-    started_at: Optional[float] = None
-    finished_at: Optional[float] = None
-    result: Optional[Dict[str, Any]] = None
-    error: Optional[str] = None
-    status_text: str = ""
-    env: str = "development"
-
-
-class _JobStore:
-    def __init__(self, max_age_seconds: int = JOB_STORE_MAX_AGE_SECONDS) -> None:
-        self._lock = Lock()
-        self._jobs: Dict[str, _JobRecord] = {}
-        self._max_age = max_age_seconds
-
-    def create(self) -> _JobRecord:
-        job_id = str(uuid4())
-        rec = _JobRecord(job_id=job_id, status="queued", created_at=time.time())
-        with self._lock:
-            self._jobs[job_id] = rec
-        return rec
-
-    def create_with_id(self, job_id: str, env: str = "development") -> _JobRecord:
-        """Create job record with specified ID"""
-        rec = _JobRecord(
-            job_id=job_id,
-            status="queued",
-            created_at=time.time(),
-            env=env
-        )
-        with self._lock:
-            self._jobs[job_id] = rec
-        return rec
-
-    def get(self, job_id: str) -> Optional[_JobRecord]:
-        with self._lock:
-            return self._jobs.get(job_id)
-
-    def mark_running(self, job_id: str) -> None:
-        with self._lock:
-            rec = self._jobs[job_id]
-            rec.status = "running"
-            rec.started_at = time.time()
-
-    def mark_succeeded(self, job_id: str, result: Dict[str, Any]) -> None:
-        with self._lock:
-            rec = self._jobs[job_id]
-            rec.status = "succeeded"
-            rec.finished_at = time.time()
-            rec.result = result
-            rec.error = None
-
-    def mark_failed(self, job_id: str, error: str) -> None:
-        with self._lock:
-            rec = self._jobs[job_id]
-            rec.status = "failed"
-            rec.finished_at = time.time()
-            rec.result = None
-            rec.error = error
-
-    def cleanup_old_jobs(self, max_age_seconds: Optional[int] = None) -> int:
-        """
-        Clean up completed jobs older than max_age_seconds.
-
-        Only removes jobs with status 'succeeded' or 'failed'.
-        Jobs that are 'queued' or 'running' are never removed.
-
-        Returns the number of jobs removed.
-        """
-        max_age = max_age_seconds if max_age_seconds is not None else self._max_age
-        now = time.time()
-        removed = 0
-
-        with self._lock:
-            to_remove = []
-            for job_id, rec in self._jobs.items():
-                if rec.status in ("succeeded", "failed"):
-                    finish_time = rec.finished_at or rec.created_at
-                    age = now - finish_time
-                    if age > max_age:
-                        to_remove.append(job_id)
-
-            for job_id in to_remove:
-                del self._jobs[job_id]
-                removed += 1
-
-        return removed
-
-    def get_stats(self) -> Dict[str, int]:
-        """Get statistics about jobs in the store."""
-        with self._lock:
-            stats = {
-                "total": len(self._jobs),
-                "queued": 0,
-                "running": 0,
-                "succeeded": 0,
-                "failed": 0,
-            }
-            for rec in self._jobs.values():
-                if rec.status in stats:
-                    stats[rec.status] += 1
-            return stats
-    
-    def update_status_text(self, job_id: str, text: str) -> None:
-        with self._lock:
-            if job_id in self._jobs:
-                self._jobs[job_id].status_text = text
-
 def _env_bool(name: str, default: bool) -> bool:
     v = os.getenv(name)
     if v is None:
@@ -880,7 +803,7 @@ log_buffer = LogBuffer()
 logger.add(lambda msg: log_buffer.write(msg), format="{time:HH:mm:ss} | {level} | {message}")
 
 def create_app() -> FastAPI:
-    store = _JobStore()
+    store = SQLiteJobStore(JOB_STORE_DB_PATH, max_age_seconds=JOB_STORE_MAX_AGE_SECONDS)
 
     # API Key authentication (from environment variable)
     api_key = os.getenv("ACESTEP_API_KEY", None)
@@ -888,10 +811,22 @@ def create_app() -> FastAPI:
 
     QUEUE_MAXSIZE = int(os.getenv("ACESTEP_QUEUE_MAXSIZE", "200"))
     WORKER_COUNT = int(os.getenv("ACESTEP_QUEUE_WORKERS", "1"))  # Single GPU recommended
+    # Idle workers re-check the shared queue this often for jobs submitted to other processes
+    QUEUE_POLL_SECONDS = float(os.getenv("ACESTEP_QUEUE_POLL_MS", "200")) / 1000.0
+    # Running jobs whose worker has not renewed their lease for this long are requeued by idle workers
+    JOB_LEASE_SECONDS = float(os.getenv("ACESTEP_JOB_LEASE_SECONDS", "60"))
 
     INITIAL_AVG_JOB_SECONDS = float(os.getenv("ACESTEP_AVG_JOB_SECONDS", "5.0"))
     AVG_WINDOW = int(os.getenv("ACESTEP_AVG_WINDOW", "50"))
 
+    # DiT batching: coalesce compatible queued jobs into one DiT/VAE batch.
+    # Max size counts audios (sum of job batch sizes); 0 = GPU tier default, 1 = disabled.
+    BATCH_MAX_SIZE = int(os.getenv("ACESTEP_BATCH_MAX_SIZE", "0"))
+    BATCH_MAX_WAIT_MS = float(os.getenv("ACESTEP_BATCH_MAX_WAIT_MS", "50"))
+
+    # Fully seeded requests join an identical queued/running job or reuse its finished audio
+    DEDUP_ENABLED = _env_bool("ACESTEP_DEDUP", True)
+
     def _path_to_audio_url(path: str) -> str:
         """Convert local file path to downloadable relative URL"""
         if not path:
@@ -901,6 +836,221 @@ def create_app() -> FastAPI:
         encoded_path = urllib.parse.quote(path, safe="")
         return f"/v1/audio?path={encoded_path}"
 
+    def _gpu_batch_limit() -> Optional[int]:
+        """Max audios per DiT call for this GPU tier, or None before the GPU config is known."""
+        gpu_config = getattr(app.state, "gpu_config", None)
+        if gpu_config is None:
+            return None
+        if getattr(app.state, "_llm_initialized", False):
+            return gpu_config.max_batch_size_with_lm
+        return gpu_config.max_batch_size_without_lm
+
+    def _validate_best_of(req: GenerateMusicRequest) -> None:
+        """Reject best_of values below 1 or above the GPU batch limit (all candidates run in one job)."""
+        if req.best_of is None:
+            return
+        if req.best_of < 1:
+            raise HTTPException(status_code=400, detail="best_of must be at least 1")
+        limit = _gpu_batch_limit()
+        if limit is not None and req.best_of > limit:
+            raise HTTPException(status_code=400, detail=f"best_of must not exceed {limit} on this server")
+
+    def _job_batch_size(req: GenerateMusicRequest) -> int:
+        # Audios generated: same default as GenerationConfig in _prepare_generation,
+        # raised to best_of when more candidates are generated than returned
+        return max(1, req.batch_size if req.batch_size is not None else 2, req.best_of or 1)
+
+    def _batch_key(req: GenerateMusicRequest) -> Optional[str]:
+        """Key of queued jobs that may share a DiT batch, or None if the job must run alone.
+
+        Jobs with reference/source audio, best-of-N jobs and analysis-only jobs always run alone. Final
+        compatibility (e.g. LM-chosen duration) is re-checked by generate_music_batch.
+        """
+        if req.analysis_only or req.reference_audio_path or req.src_audio_path or (req.best_of or 1) > 1:
+            return None
+        duration = round(float(req.audio_duration), 1) if req.audio_duration and req.audio_duration > 0 else None
+        return json.dumps([
+            req.model or "",
+            req.task_type,
+            req.inference_steps,
+            req.timesteps or "",
+            req.guidance_scale,
+            req.shift,
+            req.infer_method,
+            req.use_adg,
+            req.cfg_interval_start,
+            req.cfg_interval_end,
+            req.audio_cover_strength,
+            duration,
+        ])
+
+    def _dedup_key(req: GenerateMusicRequest) -> Optional[str]:
+        """Deterministic key of a request whose output is fully fixed by its parameters, else None.
+
+        Only requests with an explicit seed for their single audio qualify; sample/format
+        modes run unseeded LM passes and never do. Uploaded audio is keyed by content, so
+        a retried upload (saved under a new temp name) still matches.
+        """
+        if not DEDUP_ENABLED or req.use_random_seed or req.seed is None or req.seed < 0:
+            return None
+        if _job_batch_size(req) != 1 or req.analysis_only or req.sample_mode or req.use_format or req.sample_query:
+            return None
+        data = req.model_dump() if hasattr(req, "model_dump") else req.dict()
+        data.pop("constrained_decoding_debug", None)
+        pool: Optional[HandlerPool] = getattr(app.state, "handler_pool", None)
+        available = pool.models() if pool is not None else []
+        data["model"] = req.model if req.model in available else (available[0] if available else req.model)
+        data["lm_model_path"] = _get_model_name(
+            req.lm_model_path or os.getenv("ACESTEP_LM_MODEL_PATH") or "acestep-5Hz-lm-0.6B"
+        )
+        for field_name in ("reference_audio_path", "src_audio_path"):
+            if data.get(field_name):
+                data[field_name] = get_audio_file_hash(data[field_name])
+        return generate_uuid_from_params(data)
+
+    def _result_files_exist(rec: Any) -> bool:
+        """Whether a finished job's audio can be handed out again."""
+        paths = (rec.result or {}).get("audio_paths") or []
+        return bool(paths) and all(p and os.path.exists(p) for p in paths)
+
+    def _eta_features(req: GenerateMusicRequest, dit_model: Optional[str] = None) -> JobFeatures:
+        """Features of a request that its per-stage run time depends on."""
+        if dit_model is None:
+            pool: Optional[HandlerPool] = getattr(app.state, "handler_pool", None)
+            available = pool.models() if pool is not None else []
+            dit_model = req.model if req.model in available else (available[0] if available else "")
+        llm_ready = bool(getattr(app.state, "_llm_initialized", False))
+        use_lm = llm_ready and req.task_type not in ("cover", "repaint") and (
+            bool(req.thinking) or bool(req.use_cot_caption) or bool(req.use_cot_language)
+        )
+        return JobFeatures(
+            dit_model=dit_model or "",
+            lm_model=_get_model_name(req.lm_model_path or os.getenv("ACESTEP_LM_MODEL_PATH") or "acestep-5Hz-lm-0.6B"),
+            batch_size=_job_batch_size(req),
+            duration=float(req.audio_duration) if req.audio_duration and req.audio_duration > 0 else None,
+            inference_steps=int(req.inference_steps or 8),
+            lm_phase1=use_lm,
+            lm_phase2=use_lm and bool(req.thinking) and not (req.audio_code_string or "").strip(),
+        )
+
+    def _observe_job_timing(
+        features: JobFeatures,
+        result: Any,
+        wall_seconds: Optional[float] = None,
+        stages: Optional[List[str]] = None,
+        batch_size: Optional[int] = None,
+    ) -> None:
+        """Feed the time_costs of a finished generation into the ETA model.
+
+        ``batch_size`` overrides the audio count of ``result`` when its DiT stages
+        were shared with other jobs of a coalesced batch.
+        """
+        if result is None or not getattr(result, "success", False):
+            return
+        time_costs = (result.extra_outputs or {}).get("time_costs", {}) or {}
+        durations = [
+            a["tensor"].shape[-1] / float(a.get("sample_rate") or 48000)
+            for a in result.audios
+            if a.get("tensor") is not None
+        ]
+        observed = dataclass_replace(
+            features,
+            batch_size=batch_size or len(result.audios) or features.batch_size,
+            duration=max(durations) if durations else features.duration,
+            lm_phase1=time_costs.get("lm_phase1_time", 0.0) > 0,
+            lm_phase2=time_costs.get("lm_phase2_time", 0.0) > 0,
+        )
+        eta_model: StageLatencyModel = app.state.eta_model
+        eta_model.observe(observed, time_costs, wall_seconds=wall_seconds, stages=stages)
+        if features.duration is None and durations:
+            eta_model.observe_default_duration(max(durations))
+
+    def _build_result_data(rec: Optional[Any], result: Optional[Dict], status: str) -> List[Dict[str, Any]]:
+        """Build the per-audio result list returned by /query_result (and kept in the local cache)."""
+        env = getattr(rec, 'env', 'development') if rec else 'development'
+        create_time = rec.created_at if rec else time.time()
+
+        status_int = _map_status(status)
+
+        if status == "succeeded" and result:
+            audio_paths = result.get("audio_paths", [])
+            # Final prompt/lyrics (may be modified by thinking/format)
+            final_prompt = result.get("prompt", "")
+            final_lyrics = result.get("lyrics", "")
+            # Original user input from metas
+            metas_raw = result.get("metas", {}) or {}
+            original_prompt = metas_raw.get("prompt", "")
+            original_lyrics = metas_raw.get("lyrics", "")
+            # metas contains original input + other metadata
+            metas = {
+                "bpm": metas_raw.get("bpm"),
+                "duration": metas_raw.get("duration"),
+                "genres": metas_raw.get("genres", ""),
+                "keyscale": metas_raw.get("keyscale", ""),
+                "timesignature": metas_raw.get("timesignature", ""),
+                "prompt": original_prompt,
+                "lyrics": original_lyrics,
+            }
+            # Extra fields for Discord bot
+            generation_info = result.get("generation_info", "")
+            seed_value = result.get("seed_value", "")
+            lm_model = result.get("lm_model", "")
+            dit_model = result.get("dit_model", "")
+
+            if audio_paths:
+                result_data = [
+                    {
+                        "file": p,
+                        "wave": "",
+                        "status": status_int,
+                        "create_time": int(create_time),
+                        "env": env,
+                        "prompt": final_prompt,
+                        "lyrics": final_lyrics,
+                        "metas": metas,
+                        "generation_info": generation_info,
+                        "seed_value": seed_value,
+                        "lm_model": lm_model,
+                        "dit_model": dit_model,
+                    }
+                    for p in audio_paths
+                ]
+                # best-of-N jobs: scores are in the same (best first) order as the audios
+                for entry, score in zip(result_data, result.get("scores") or []):
+                    entry["score"] = score
+            else:
+                result_data = [{
+                    "file": "",
+                    "wave": "",
+                    "status": status_int,
+                    "create_time": int(create_time),
+                    "env": env,
+                    "prompt": final_prompt,
+                    "lyrics": final_lyrics,
+                    "metas": metas,
+                    "generation_info": generation_info,
+                    "seed_value": seed_value,
+                    "lm_model": lm_model,
+                    "dit_model": dit_model,
+                }]
+        else:
+            # Failed or other status - include error from job store
+            error_msg = rec.error if rec and rec.error else None
+            result_data = [{
+                "file": "", "wave": "", "status": status_int,
+                "create_time": int(create_time), "env": env,
+                "prompt": "", "lyrics": "", "metas": {},
+                "error": error_msg,
+            }]
+        return result_data
+
+    def _serialize_request(req: GenerateMusicRequest) -> str:
+        data = req.model_dump() if hasattr(req, "model_dump") else req.dict()
+        return json.dumps(data, ensure_ascii=False)
+
+    def _deserialize_request(payload: str) -> GenerateMusicRequest:
+        return GenerateMusicRequest(**json.loads(payload))
+
     @asynccontextmanager
     async def lifespan(app: FastAPI):
         # Clear proxy env that may affect downstream libs
@@ -948,50 +1098,61 @@ def create_app() -> FastAPI:
         app.state._llm_init_lock = Lock()
         app.state._llm_lazy_load_disabled = False  # Will be set to True if LLM skipped due to GPU config
 
-        # Multi-model support: secondary DiT handlers
-        handler2 = None
-        handler3 = None
-        config_path2 = os.getenv("ACESTEP_CONFIG_PATH2", "").strip()
-        config_path3 = os.getenv("ACESTEP_CONFIG_PATH3", "").strip()
-        
-        if config_path2:
-            handler2 = AceStepHandler()
-        if config_path3:
-            handler3 = AceStepHandler()
-        
-        app.state.handler2 = handler2
-        app.state.handler3 = handler3
-        app.state._initialized2 = False
-        app.state._initialized3 = False
+        # Multi-model / multi-device support: every DiT model (ACESTEP_CONFIG_PATH, _PATH2, _PATH3)
+        # gets one replica per device in ACESTEP_DEVICES; jobs are routed to the least-loaded
+        # replica serving the requested model. The first replica is the primary handler.
         app.state._config_path = os.getenv("ACESTEP_CONFIG_PATH", "acestep-v15-turbo")
-        app.state._config_path2 = config_path2
-        app.state._config_path3 = config_path3
-
-        max_workers = int(os.getenv("ACESTEP_API_WORKERS", "1"))
-        executor = ThreadPoolExecutor(max_workers=max_workers)
-
-        # Queue & observability
-        app.state.job_queue = asyncio.Queue(maxsize=QUEUE_MAXSIZE)  # (job_id, req)
-        app.state.pending_ids = deque()  # queued job_ids
-        app.state.pending_lock = asyncio.Lock()
+        config_paths = [
+            app.state._config_path,
+            os.getenv("ACESTEP_CONFIG_PATH2", "").strip(),
+            os.getenv("ACESTEP_CONFIG_PATH3", "").strip(),
+        ]
+        devices = parse_devices(os.getenv("ACESTEP_DEVICES"), default=os.getenv("ACESTEP_DEVICE", "auto"))
+        pool = HandlerPool(max_workers_per_replica=int(os.getenv("ACESTEP_API_WORKERS", "1")))
+        for model_idx, cfg in enumerate(dict.fromkeys(p for p in config_paths if p)):
+            for device_idx, dev in enumerate(devices):
+                pool.add(
+                    model=_get_model_name(cfg),
+                    device=dev,
+                    handler=handler if model_idx == 0 and device_idx == 0 else AceStepHandler(),
+                    llm_handler=llm_handler,
+                    config_path=cfg,
+                    is_default=model_idx == 0,
+                )
+        app.state.handler_pool = pool
 
-        # temp files per job (from multipart uploads)
-        app.state.job_temp_files = {}  # job_id -> list[path]
-        app.state.job_temp_files_lock = asyncio.Lock()
+        # Queue & observability: queued jobs live in the job store, shared by all processes.
+        # The wakeup event lets local workers pick up jobs submitted to this process at once.
+        app.state.worker_id = make_worker_id()
+        app.state.job_wakeup = asyncio.Event()
+        app.state.last_lease_check = 0.0
+        recovered = store.requeue_orphaned(own_worker_id=app.state.worker_id)
+        if recovered:
+            print(f"[API Server] Requeued {recovered} jobs left running by exited workers")
 
         # stats
         app.state.stats_lock = asyncio.Lock()
         app.state.recent_durations = deque(maxlen=AVG_WINDOW)
         app.state.avg_job_seconds = INITIAL_AVG_JOB_SECONDS
+        app.state.batch_stats = {"batches": 0, "batched_jobs": 0}
+        app.state.dedup_stats = {"joined": 0, "reused": 0}
+
+        # Per-stage latency model behind queue ETAs, kept across restarts
+        app.state.eta_model_path = os.path.join(cache_root, "eta_model.json")
+        if app.state.eta_model.load(app.state.eta_model_path):
+            print(f"[API Server] Loaded ETA timing history from {app.state.eta_model_path}")
+
+        # Live PCM chunk queues of jobs submitted via /release_task_stream
+        app.state.audio_streams = {}  # job_id -> asyncio.Queue[bytes | None]
 
         app.state.handler = handler
-        app.state.executor = executor
         app.state.job_store = store
         app.state._python_executable = sys.executable
         
         # Temporary directory for saving generated audio files
         app.state.temp_audio_dir = os.path.join(tmp_root, "api_audio")
         os.makedirs(app.state.temp_audio_dir, exist_ok=True)
+        app.state.audio_encoder = AudioVariantEncoder(AUDIO_PREENCODE_FORMATS)
 
         # Initialize local cache
         try:
@@ -1009,8 +1170,7 @@ def create_app() -> FastAPI:
                 raise RuntimeError("Model not initialized")
 
         async def _cleanup_job_temp_files(job_id: str) -> None:
-            async with app.state.job_temp_files_lock:
-                paths = app.state.job_temp_files.pop(job_id, [])
+            paths = store.pop_temp_files(job_id)
             for p in paths:
                 try:
                     os.remove(p)
@@ -1024,535 +1184,574 @@ def create_app() -> FastAPI:
                 return
 
             rec = store.get(job_id)
-            env = getattr(rec, 'env', 'development') if rec else 'development'
-            create_time = rec.created_at if rec else time.time()
-
-            status_int = _map_status(status)
+            result_data = _build_result_data(rec, result, status)
+            result_key = f"{RESULT_KEY_PREFIX}{job_id}"
+            local_cache.set(result_key, result_data, ex=RESULT_EXPIRE_SECONDS)
 
-            if status == "succeeded" and result:
-                audio_paths = result.get("audio_paths", [])
-                # Final prompt/lyrics (may be modified by thinking/format)
-                final_prompt = result.get("prompt", "")
-                final_lyrics = result.get("lyrics", "")
-                # Original user input from metas
-                metas_raw = result.get("metas", {}) or {}
-                original_prompt = metas_raw.get("prompt", "")
-                original_lyrics = metas_raw.get("lyrics", "")
-                # metas contains original input + other metadata
-                metas = {
-                    "bpm": metas_raw.get("bpm"),
-                    "duration": metas_raw.get("duration"),
-                    "genres": metas_raw.get("genres", ""),
-                    "keyscale": metas_raw.get("keyscale", ""),
-                    "timesignature": metas_raw.get("timesignature", ""),
-                    "prompt": original_prompt,
-                    "lyrics": original_lyrics,
-                }
-                # Extra fields for Discord bot
-                generation_info = result.get("generation_info", "")
-                seed_value = result.get("seed_value", "")
-                lm_model = result.get("lm_model", "")
-                dit_model = result.get("dit_model", "")
-
-                if audio_paths:
-                    result_data = [
-                        {
-                            "file": p,
-                            "wave": "",
-                            "status": status_int,
-                            "create_time": int(create_time),
-                            "env": env,
-                            "prompt": final_prompt,
-                            "lyrics": final_lyrics,
-                            "metas": metas,
-                            "generation_info": generation_info,
-                            "seed_value": seed_value,
-                            "lm_model": lm_model,
-                            "dit_model": dit_model,
-                        }
-                        for p in audio_paths
-                    ]
+        def _acquire_replica(job_id: str, req: GenerateMusicRequest, jobs: int = 1) -> HandlerReplica:
+            """Reserve the least-loaded DiT replica serving the user's model choice."""
+            pool: HandlerPool = app.state.handler_pool
+            replica, matched = pool.acquire(req.model, jobs=jobs)
+            if req.model and not matched:
+                print(f"[API Server] Job {job_id}: Model '{req.model}' not found in {pool.models()}, using default: {replica.model}")
+            elif len(pool.replicas) > 1:
+                print(f"[API Server] Job {job_id}: Using {replica.name} (queue depth {replica.inflight})")
+            return replica
+
+        def _prepare_generation(
+            req: GenerateMusicRequest, h: AceStepHandler, llm: Optional[LLMHandler] = None
+        ) -> Dict[str, Any]:
+            """Run the LM-side preprocessing of a job and build its GenerationParams/GenerationConfig.
+
+            ``llm`` is the LM of the replica running the job (default: the shared LM handler).
+            Returns a context dict consumed by ``_finalize_generation``; for analysis-only jobs
+            the dict holds the final job result under ``"result"`` instead.
+            """
+            llm = llm or app.state.llm_handler
+
+            def _ensure_llm_ready() -> None:
+                """Ensure LLM handler is initialized when needed"""
+                with app.state._llm_init_lock:
+                    initialized = getattr(app.state, "_llm_initialized", False)
+                    had_error = getattr(app.state, "_llm_init_error", None)
+                    if initialized or had_error is not None:
+                        return
+
+                    # Check if lazy loading is disabled (GPU memory insufficient)
+                    if getattr(app.state, "_llm_lazy_load_disabled", False):
+                        app.state._llm_init_error = (
+                            "LLM not initialized at startup. To enable LLM, set ACESTEP_INIT_LLM=true "
+                            "in .env or environment variables. For this request, optional LLM features "
+                            "(use_cot_caption, use_cot_language) will be auto-disabled."
+                        )
+                        print(f"[API Server] LLM lazy load blocked: LLM was not initialized at startup")
+                        return
+
+                    project_root = _get_project_root()
+                    checkpoint_dir = os.path.join(project_root, "checkpoints")
+                    lm_model_path = (req.lm_model_path or os.getenv("ACESTEP_LM_MODEL_PATH") or "acestep-5Hz-lm-0.6B").strip()
+                    backend = (req.lm_backend or os.getenv("ACESTEP_LM_BACKEND") or "vllm").strip().lower()
+                    if backend not in {"vllm", "pt"}:
+                        backend = "vllm"
+
+                    # Auto-download LM model if not present
+                    lm_model_name = _get_model_name(lm_model_path)
+                    if lm_model_name:
+                        try:
+                            _ensure_model_downloaded(lm_model_name, checkpoint_dir)
+                        except Exception as e:
+                            print(f"[API Server] Warning: Failed to download LM model {lm_model_name}: {e}")
+
+                    lm_device = os.getenv("ACESTEP_LM_DEVICE", os.getenv("ACESTEP_DEVICE", "auto"))
+                    lm_offload = _env_bool("ACESTEP_LM_OFFLOAD_TO_CPU", False)
+                    draft_lm_model_path = _ensure_draft_lm_downloaded(checkpoint_dir)
+
+                    status, ok = llm.initialize(
+                        checkpoint_dir=checkpoint_dir,
+                        lm_model_path=lm_model_path,
+                        backend=backend,
+                        device=lm_device,
+                        offload_to_cpu=lm_offload,
+                        dtype=h.dtype,
+                        draft_lm_model_path=draft_lm_model_path,
+                        num_speculative_tokens=int(os.getenv("ACESTEP_LM_NUM_SPECULATIVE_TOKENS", "4")),
+                        compile_pt_decode=_env_bool("ACESTEP_LM_COMPILE", False),
+                    )
+                    if not ok:
+                        app.state._llm_init_error = status
+                    else:
+                        app.state._llm_initialized = True
+
+            # Normalize LM sampling parameters
+            lm_top_k = req.lm_top_k if req.lm_top_k and req.lm_top_k > 0 else 0
+            lm_top_p = req.lm_top_p if req.lm_top_p and req.lm_top_p < 1.0 else 0.9
+
+            # Determine if LLM is needed
+            thinking = bool(req.thinking)
+            sample_mode = bool(req.sample_mode)
+            has_sample_query = bool(req.sample_query and req.sample_query.strip())
+            use_format = bool(req.use_format)
+            use_cot_caption = bool(req.use_cot_caption)
+            use_cot_language = bool(req.use_cot_language)
+
+            # LLM is REQUIRED for these features (fail if unavailable):
+            # - thinking mode (LM generates audio codes)
+            # - sample_mode (LM generates random caption/lyrics/metas)
+            # - sample_query/description (LM generates from description)
+            # - use_format (LM enhances caption/lyrics)
+            require_llm = thinking or sample_mode or has_sample_query or use_format
+
+            # LLM is OPTIONAL for these features (auto-disable if unavailable):
+            # - use_cot_caption or use_cot_language (LM enhances metadata)
+            want_llm = use_cot_caption or use_cot_language
+
+            # Check if LLM is available
+            llm_available = True
+            if require_llm or want_llm:
+                _ensure_llm_ready()
+                if getattr(app.state, "_llm_init_error", None):
+                    llm_available = False
+
+            # Fail if LLM is required but unavailable
+            if require_llm and not llm_available:
+                raise RuntimeError(f"5Hz LM init failed: {app.state._llm_init_error}")
+
+            # Auto-disable optional LLM features if unavailable
+            if want_llm and not llm_available:
+                if use_cot_caption or use_cot_language:
+                    print(f"[API Server] LLM unavailable, auto-disabling: use_cot_caption={use_cot_caption}->False, use_cot_language={use_cot_language}->False")
+                use_cot_caption = False
+                use_cot_language = False
+
+            # Handle sample mode or description: generate caption/lyrics/metas via LM
+            caption = req.prompt
+            lyrics = req.lyrics
+            bpm = req.bpm
+            key_scale = req.key_scale
+            time_signature = req.time_signature
+            audio_duration = req.audio_duration
+
+            # Save original user input for metas
+            original_prompt = req.prompt or ""
+            original_lyrics = req.lyrics or ""
+            
+            if sample_mode or has_sample_query:
+                # Parse description hints from sample_query (if provided)
+                sample_query = req.sample_query if has_sample_query else "NO USER INPUT"
+                parsed_language, parsed_instrumental = _parse_description_hints(sample_query)
+
+                # Determine vocal_language with priority:
+                # 1. User-specified vocal_language (if not default "en")
+                # 2. Language parsed from description
+                # 3. None (no constraint)
+                if req.vocal_language and req.vocal_language not in ("en", "unknown", ""):
+                    sample_language = req.vocal_language
                 else:
-                    result_data = [{
-                        "file": "",
-                        "wave": "",
-                        "status": status_int,
-                        "create_time": int(create_time),
-                        "env": env,
-                        "prompt": final_prompt,
-                        "lyrics": final_lyrics,
-                        "metas": metas,
-                        "generation_info": generation_info,
-                        "seed_value": seed_value,
-                        "lm_model": lm_model,
-                        "dit_model": dit_model,
-                    }]
-            else:
-                # Failed or other status - include error from job store
-                error_msg = rec.error if rec and rec.error else None
-                result_data = [{"file": "", "wave": "", "status": status_int, "create_time": int(create_time), "env": env, "error": error_msg}]
+                    sample_language = parsed_language
+
+                sample_result = create_sample(
+                    llm_handler=llm,
+                    query=sample_query,
+                    instrumental=parsed_instrumental,
+                    vocal_language=sample_language,
+                    temperature=req.lm_temperature,
+                    top_k=lm_top_k if lm_top_k > 0 else None,
+                    top_p=lm_top_p if lm_top_p < 1.0 else None,
+                    use_constrained_decoding=True,
+                )
 
-            result_key = f"{RESULT_KEY_PREFIX}{job_id}"
-            local_cache.set(result_key, result_data, ex=RESULT_EXPIRE_SECONDS)
+                if not sample_result.success:
+                    raise RuntimeError(f"create_sample failed: {sample_result.error or sample_result.status_message}")
 
-        async def _run_one_job(job_id: str, req: GenerateMusicRequest) -> None:
-            job_store: _JobStore = app.state.job_store
-            llm: LLMHandler = app.state.llm_handler
-            executor: ThreadPoolExecutor = app.state.executor
+                # Use generated sample data
+                caption = sample_result.caption
+                lyrics = sample_result.lyrics
+                bpm = sample_result.bpm
+                key_scale = sample_result.keyscale
+                time_signature = sample_result.timesignature
+                audio_duration = sample_result.duration
 
-            await _ensure_initialized()
-            job_store.mark_running(job_id)
-            
-            # Select DiT handler based on user's model choice
-            # Default: use primary handler
-            selected_handler: AceStepHandler = app.state.handler
-            selected_model_name = _get_model_name(app.state._config_path)
+            # Apply format_sample() if use_format is True and caption/lyrics are provided
+            format_has_duration = False
+
+            if req.use_format and (caption or lyrics):
+                _ensure_llm_ready()
+                if getattr(app.state, "_llm_init_error", None):
+                    raise RuntimeError(f"5Hz LM init failed (needed for format): {app.state._llm_init_error}")
+                
+                # Build user_metadata from request params (matching bot.py behavior)
+                user_metadata_for_format = {}
+                if bpm is not None:
+                    user_metadata_for_format['bpm'] = bpm
+                if audio_duration is not None and float(audio_duration) > 0:
+                    user_metadata_for_format['duration'] = float(audio_duration)
+                if key_scale:
+                    user_metadata_for_format['keyscale'] = key_scale
+                if time_signature:
+                    user_metadata_for_format['timesignature'] = time_signature
+                if req.vocal_language and req.vocal_language != "unknown":
+                    user_metadata_for_format['language'] = req.vocal_language
+                
+                format_result = format_sample(
+                    llm_handler=llm,
+                    caption=caption,
+                    lyrics=lyrics,
+                    user_metadata=user_metadata_for_format if user_metadata_for_format else None,
+                    temperature=req.lm_temperature,
+                    top_k=lm_top_k if lm_top_k > 0 else None,
+                    top_p=lm_top_p if lm_top_p < 1.0 else None,
+                    use_constrained_decoding=True,
+                )
+                
+                if format_result.success:
+                    # Extract all formatted data (matching bot.py behavior)
+                    caption = format_result.caption or caption
+                    lyrics = format_result.lyrics or lyrics
+                    if format_result.duration:
+                        audio_duration = format_result.duration
+                        format_has_duration = True
+                    if format_result.bpm:
+                        bpm = format_result.bpm
+                    if format_result.keyscale:
+                        key_scale = format_result.keyscale
+                    if format_result.timesignature:
+                        time_signature = format_result.timesignature
+
+            # Parse timesteps string to list of floats if provided
+            parsed_timesteps = _parse_timesteps(req.timesteps)
+
+            # Determine actual inference steps (timesteps override inference_steps)
+            actual_inference_steps = len(parsed_timesteps) if parsed_timesteps else req.inference_steps
+
+            # Auto-select instruction based on task_type if user didn't provide custom instruction
+            # This matches gradio behavior which uses TASK_INSTRUCTIONS for each task type
+            instruction_to_use = req.instruction
+            if instruction_to_use == DEFAULT_DIT_INSTRUCTION and req.task_type in TASK_INSTRUCTIONS:
+                instruction_to_use = TASK_INSTRUCTIONS[req.task_type]
+
+            # Build GenerationParams using unified interface
+            # Note: thinking controls LM code generation, sample_mode only affects CoT metas
+            params = GenerationParams(
+                task_type=req.task_type,
+                instruction=instruction_to_use,
+                reference_audio=req.reference_audio_path,
+                src_audio=req.src_audio_path,
+                audio_codes=req.audio_code_string,
+                caption=caption,
+                lyrics=lyrics,
+                instrumental=_is_instrumental(lyrics),
+                vocal_language=req.vocal_language,
+                bpm=bpm,
+                keyscale=key_scale,
+                timesignature=time_signature,
+                duration=audio_duration if audio_duration else -1.0,
+                inference_steps=req.inference_steps,
+                seed=req.seed,
+                guidance_scale=req.guidance_scale,
+                use_adg=req.use_adg,
+                cfg_interval_start=req.cfg_interval_start,
+                cfg_interval_end=req.cfg_interval_end,
+                shift=req.shift,
+                infer_method=req.infer_method,
+                timesteps=parsed_timesteps,
+                repainting_start=req.repainting_start,
+                repainting_end=req.repainting_end if req.repainting_end else -1,
+                audio_cover_strength=req.audio_cover_strength,
+                # LM parameters
+                thinking=thinking,  # Use LM for code generation when thinking=True
+                lm_temperature=req.lm_temperature,
+                lm_cfg_scale=req.lm_cfg_scale,
+                lm_top_k=lm_top_k,
+                lm_top_p=lm_top_p,
+                lm_negative_prompt=req.lm_negative_prompt,
+                # use_cot_metas logic:
+                # - sample_mode: metas already generated, skip Phase 1
+                # - format with duration: metas already generated, skip Phase 1
+                # - format without duration: need Phase 1 to generate duration
+                # - no format: need Phase 1 to generate all metas
+                use_cot_metas=not sample_mode and not format_has_duration,
+                use_cot_caption=use_cot_caption,  # Use local var (may be auto-disabled)
+                use_cot_language=use_cot_language,  # Use local var (may be auto-disabled)
+                use_constrained_decoding=True,
+            )
+
+            # Build GenerationConfig - default to 2 audios like gradio_ui
+            # (best-of-N generates every candidate, see _select_best_of)
+            batch_size = _job_batch_size(req)
+            config = GenerationConfig(
+                batch_size=batch_size,
+                allow_lm_batch=req.allow_lm_batch,
+                use_random_seed=req.use_random_seed,
+                seeds=None,  # Let unified logic handle seed generation
+                audio_format=req.audio_format,
+                constrained_decoding_debug=req.constrained_decoding_debug,
+            )
+
+            # Check LLM initialization status
+            llm_is_initialized = getattr(app.state, "_llm_initialized", False)
+            llm_to_pass = llm if llm_is_initialized else None
+
+            if req.analysis_only:
+                lm_res = llm_to_pass.generate_with_stop_condition(
+                    caption=params.caption,
+                    lyrics=params.lyrics,
+                    infer_type="dit",
+                    temperature=req.lm_temperature,
+                    top_p=req.lm_top_p,
+                    use_cot_metas=True,
+                    use_cot_caption=req.use_cot_caption,
+                    use_cot_language=req.use_cot_language,
+                    use_constrained_decoding=True
+                )
+
+                if not lm_res.get("success"):
+                    raise RuntimeError(f"Analysis Failed: {lm_res.get('error')}")
+
+                metas_found = lm_res.get("metadata", {})
+                return {"result": {
+                    "first_audio_path": None,
+                    "audio_paths": [],
+                    "generation_info": "Analysis Only Mode Complete",
+                    "status_message": "Success",
+                    "metas": metas_found,
+                    "bpm": metas_found.get("bpm"),
+                    "keyscale": metas_found.get("keyscale"),
+                    "duration": metas_found.get("duration"),
+                    "prompt": metas_found.get("caption", params.caption),
+                    "lyrics": params.lyrics,
+                    "lm_model": os.getenv("ACESTEP_LM_MODEL_PATH", ""),
+                    "dit_model": "None (Analysis Only)"
+                }}
+
+            return {
+                "params": params,
+                "config": config,
+                "llm_handler": llm_to_pass,
+                "caption": caption,
+                "lyrics": lyrics,
+                "bpm": bpm,
+                "key_scale": key_scale,
+                "time_signature": time_signature,
+                "audio_duration": audio_duration,
+                "original_prompt": original_prompt,
+                "original_lyrics": original_lyrics,
+            }
+
+        def _finalize_generation(
+            req: GenerateMusicRequest,
+            prep: Dict[str, Any],
+            result: GenerationResult,
+            selected_model_name: str,
+        ) -> Dict[str, Any]:
+            """Turn a GenerationResult into the job result dict stored for `/query_result`."""
+            if not result.success:
+                raise RuntimeError(f"Music generation failed: {result.error or result.status_message}")
+
+            params: GenerationParams = prep["params"]
+            caption = prep["caption"]
+            lyrics = prep["lyrics"]
+            bpm = prep["bpm"]
+            key_scale = prep["key_scale"]
+            time_signature = prep["time_signature"]
+            audio_duration = prep["audio_duration"]
+            original_prompt = prep["original_prompt"]
+            original_lyrics = prep["original_lyrics"]
+
+            def _normalize_metas(meta: Dict[str, Any]) -> Dict[str, Any]:
+                """Ensure a stable `metas` dict (keys always present)."""
+                meta = meta or {}
+                out: Dict[str, Any] = dict(meta)
+
+                # Normalize key aliases
+                if "keyscale" not in out and "key_scale" in out:
+                    out["keyscale"] = out.get("key_scale")
+                if "timesignature" not in out and "time_signature" in out:
+                    out["timesignature"] = out.get("time_signature")
+
+                # Ensure required keys exist
+                for k in ["bpm", "duration", "genres", "keyscale", "timesignature"]:
+                    if out.get(k) in (None, ""):
+                        out[k] = "N/A"
+                return out
+
+            # Extract results
+            audio_paths = [audio["path"] for audio in result.audios if audio.get("path")]
+            for path in audio_paths:
+                app.state.audio_encoder.schedule(path)
+            first_audio = audio_paths[0] if len(audio_paths) > 0 else None
+            second_audio = audio_paths[1] if len(audio_paths) > 1 else None
+
+            # Get metadata from LM or CoT results
+            lm_metadata = result.extra_outputs.get("lm_metadata", {})
+            metas_out = _normalize_metas(lm_metadata)
             
-            if req.model:
-                model_matched = False
+            # Update metas with actual values used
+            if params.cot_bpm:
+                metas_out["bpm"] = params.cot_bpm
+            elif bpm:
+                metas_out["bpm"] = bpm
                 
-                # Check if it matches the second model
-                if app.state.handler2 and getattr(app.state, "_initialized2", False):
-                    model2_name = _get_model_name(app.state._config_path2)
-                    if req.model == model2_name:
-                        selected_handler = app.state.handler2
-                        selected_model_name = model2_name
-                        model_matched = True
-                        print(f"[API Server] Job {job_id}: Using second model: {model2_name}")
+            if params.cot_duration:
+                metas_out["duration"] = params.cot_duration
+            elif audio_duration:
+                metas_out["duration"] = audio_duration
                 
-                # Check if it matches the third model
-                if not model_matched and app.state.handler3 and getattr(app.state, "_initialized3", False):
-                    model3_name = _get_model_name(app.state._config_path3)
-                    if req.model == model3_name:
-                        selected_handler = app.state.handler3
-                        selected_model_name = model3_name
-                        model_matched = True
-                        print(f"[API Server] Job {job_id}: Using third model: {model3_name}")
+            if params.cot_keyscale:
+                metas_out["keyscale"] = params.cot_keyscale
+            elif key_scale:
+                metas_out["keyscale"] = key_scale
                 
-                if not model_matched:
-                    available_models = [_get_model_name(app.state._config_path)]
-                    if app.state.handler2 and getattr(app.state, "_initialized2", False):
-                        available_models.append(_get_model_name(app.state._config_path2))
-                    if app.state.handler3 and getattr(app.state, "_initialized3", False):
-                        available_models.append(_get_model_name(app.state._config_path3))
-                    print(f"[API Server] Job {job_id}: Model '{req.model}' not found in {available_models}, using primary: {selected_model_name}")
+            if params.cot_timesignature:
+                metas_out["timesignature"] = params.cot_timesignature
+            elif time_signature:
+                metas_out["timesignature"] = time_signature
+
+            # Store original user input in metas (not the final/modified values)
+            metas_out["prompt"] = original_prompt
+            metas_out["lyrics"] = original_lyrics
+
+            # Extract seed values for response (comma-separated for multiple audios)
+            seed_values = []
+            for audio in result.audios:
+                audio_params = audio.get("params", {})
+                seed = audio_params.get("seed")
+                if seed is not None:
+                    seed_values.append(str(seed))
+            seed_value = ",".join(seed_values) if seed_values else ""
+
+            # Build generation_info using the helper function (like gradio_ui)
+            time_costs = result.extra_outputs.get("time_costs", {})
+            generation_info = _build_generation_info(
+                lm_metadata=lm_metadata,
+                time_costs=time_costs,
+                seed_value=seed_value,
+                inference_steps=req.inference_steps,
+                num_audios=len(result.audios),
+            )
+
+            def _none_if_na_str(v: Any) -> Optional[str]:
+                if v is None:
+                    return None
+                s = str(v).strip()
+                if s in {"", "N/A"}:
+                    return None
+                return s
+
+            # Get model information
+            lm_model_name = os.getenv("ACESTEP_LM_MODEL_PATH", "acestep-5Hz-lm-0.6B")
+            # Use selected_model_name (set at the beginning of _run_one_job)
+            dit_model_name = selected_model_name
             
-            # Use selected handler for generation
-            h: AceStepHandler = selected_handler
+            return {
+                "first_audio_path": _path_to_audio_url(first_audio) if first_audio else None,
+                "second_audio_path": _path_to_audio_url(second_audio) if second_audio else None,
+                "audio_paths": [_path_to_audio_url(p) for p in audio_paths],
+                "generation_info": generation_info,
+                "status_message": result.status_message,
+                "seed_value": seed_value,
+                # Final prompt/lyrics (may be modified by thinking/format)
+                "prompt": caption or "",
+                "lyrics": lyrics or "",
+                # metas contains original user input + other metadata
+                "metas": metas_out,
+                "bpm": metas_out.get("bpm") if isinstance(metas_out.get("bpm"), int) else None,
+                "duration": metas_out.get("duration") if isinstance(metas_out.get("duration"), (int, float)) else None,
+                "genres": _none_if_na_str(metas_out.get("genres")),
+                "keyscale": _none_if_na_str(metas_out.get("keyscale")),
+                "timesignature": _none_if_na_str(metas_out.get("timesignature")),
+                "lm_model": lm_model_name,
+                "dit_model": dit_model_name,
+            }
 
-            def _blocking_generate() -> Dict[str, Any]:
-                """Generate music using unified inference logic from acestep.inference"""
+        def _select_best_of(
+            req: GenerateMusicRequest,
+            prep: Dict[str, Any],
+            result: GenerationResult,
+            dit_handler: AceStepHandler,
+        ) -> Tuple[GenerationResult, List[Dict[str, Any]]]:
+            """Score every best-of-N candidate and keep the top batch_size of them, best first."""
+            num_keep = max(1, req.batch_size if req.batch_size is not None else 2)
+            if not result.success or len(result.audios) <= num_keep:
+                return result, []
+
+            params: GenerationParams = prep["params"]
+            extra = result.extra_outputs or {}
+            # Same condition set as the Gradio score button: LM metadata, then the request's values
+            metadata = dict(extra.get("lm_metadata") or {})
+            for key, value in (
+                ("bpm", prep["bpm"]),
+                ("duration", int(prep["audio_duration"]) if prep["audio_duration"] else None),
+                ("keyscale", prep["key_scale"]),
+                ("timesignature", prep["time_signature"]),
+                ("language", params.vocal_language),
+            ):
+                if value and key not in metadata:
+                    metadata[key] = value
+            alignment_keys = ("pred_latents", "encoder_hidden_states", "encoder_attention_mask",
+                              "context_latents", "lyric_token_idss")
+            alignment_inputs = None
+            if all(extra.get(key) is not None for key in alignment_keys):
+                alignment_inputs = {key: extra[key] for key in alignment_keys}
+
+            scored = score_batch(
+                llm_handler=prep["llm_handler"],
+                audio_codes_list=[audio["params"].get("audio_codes") or "" for audio in result.audios],
+                caption=prep["caption"] or "",
+                lyrics=prep["lyrics"] or "",
+                metadata=metadata,
+                dit_handler=dit_handler,
+                alignment_inputs=alignment_inputs,
+                vocal_language=params.vocal_language,
+                inference_steps=req.inference_steps,
+            )
+            for candidate, item in enumerate(scored):
+                item["candidate"] = candidate
+            # Unscored candidates rank last; ties keep generation order
+            ranked = sorted(scored, key=lambda item: -item["score"] if item["score"] is not None else float("inf"))
+            kept = ranked[:num_keep]
+            for item in ranked[num_keep:]:
+                path = result.audios[item["candidate"]].get("path")
+                if path and os.path.exists(path):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+            result.audios = [result.audios[item["candidate"]] for item in kept]
+            return result, kept
 
-                def _ensure_llm_ready() -> None:
-                    """Ensure LLM handler is initialized when needed"""
-                    with app.state._llm_init_lock:
-                        initialized = getattr(app.state, "_llm_initialized", False)
-                        had_error = getattr(app.state, "_llm_init_error", None)
-                        if initialized or had_error is not None:
-                            return
-
-                        # Check if lazy loading is disabled (GPU memory insufficient)
-                        if getattr(app.state, "_llm_lazy_load_disabled", False):
-                            app.state._llm_init_error = (
-                                "LLM not initialized at startup. To enable LLM, set ACESTEP_INIT_LLM=true "
-                                "in .env or environment variables. For this request, optional LLM features "
-                                "(use_cot_caption, use_cot_language) will be auto-disabled."
-                            )
-                            print(f"[API Server] LLM lazy load blocked: LLM was not initialized at startup")
-                            return
-
-                        project_root = _get_project_root()
-                        checkpoint_dir = os.path.join(project_root, "checkpoints")
-                        lm_model_path = (req.lm_model_path or os.getenv("ACESTEP_LM_MODEL_PATH") or "acestep-5Hz-lm-0.6B").strip()
-                        backend = (req.lm_backend or os.getenv("ACESTEP_LM_BACKEND") or "vllm").strip().lower()
-                        if backend not in {"vllm", "pt"}:
-                            backend = "vllm"
-
-                        # Auto-download LM model if not present
-                        lm_model_name = _get_model_name(lm_model_path)
-                        if lm_model_name:
-                            try:
-                                _ensure_model_downloaded(lm_model_name, checkpoint_dir)
-                            except Exception as e:
-                                print(f"[API Server] Warning: Failed to download LM model {lm_model_name}: {e}")
-
-                        lm_device = os.getenv("ACESTEP_LM_DEVICE", os.getenv("ACESTEP_DEVICE", "auto"))
-                        lm_offload = _env_bool("ACESTEP_LM_OFFLOAD_TO_CPU", False)
-
-                        status, ok = llm.initialize(
-                            checkpoint_dir=checkpoint_dir,
-                            lm_model_path=lm_model_path,
-                            backend=backend,
-                            device=lm_device,
-                            offload_to_cpu=lm_offload,
-                            dtype=h.dtype,
-                        )
-                        if not ok:
-                            app.state._llm_init_error = status
-                        else:
-                            app.state._llm_initialized = True
-
-                def _normalize_metas(meta: Dict[str, Any]) -> Dict[str, Any]:
-                    """Ensure a stable `metas` dict (keys always present)."""
-                    meta = meta or {}
-                    out: Dict[str, Any] = dict(meta)
-
-                    # Normalize key aliases
-                    if "keyscale" not in out and "key_scale" in out:
-                        out["keyscale"] = out.get("key_scale")
-                    if "timesignature" not in out and "time_signature" in out:
-                        out["timesignature"] = out.get("time_signature")
-
-                    # Ensure required keys exist
-                    for k in ["bpm", "duration", "genres", "keyscale", "timesignature"]:
-                        if out.get(k) in (None, ""):
-                            out[k] = "N/A"
-                    return out
-
-                # Normalize LM sampling parameters
-                lm_top_k = req.lm_top_k if req.lm_top_k and req.lm_top_k > 0 else 0
-                lm_top_p = req.lm_top_p if req.lm_top_p and req.lm_top_p < 1.0 else 0.9
-
-                # Determine if LLM is needed
-                thinking = bool(req.thinking)
-                sample_mode = bool(req.sample_mode)
-                has_sample_query = bool(req.sample_query and req.sample_query.strip())
-                use_format = bool(req.use_format)
-                use_cot_caption = bool(req.use_cot_caption)
-                use_cot_language = bool(req.use_cot_language)
-
-                # LLM is REQUIRED for these features (fail if unavailable):
-                # - thinking mode (LM generates audio codes)
-                # - sample_mode (LM generates random caption/lyrics/metas)
-                # - sample_query/description (LM generates from description)
-                # - use_format (LM enhances caption/lyrics)
-                require_llm = thinking or sample_mode or has_sample_query or use_format
-
-                # LLM is OPTIONAL for these features (auto-disable if unavailable):
-                # - use_cot_caption or use_cot_language (LM enhances metadata)
-                want_llm = use_cot_caption or use_cot_language
-
-                # Check if LLM is available
-                llm_available = True
-                if require_llm or want_llm:
-                    _ensure_llm_ready()
-                    if getattr(app.state, "_llm_init_error", None):
-                        llm_available = False
-
-                # Fail if LLM is required but unavailable
-                if require_llm and not llm_available:
-                    raise RuntimeError(f"5Hz LM init failed: {app.state._llm_init_error}")
-
-                # Auto-disable optional LLM features if unavailable
-                if want_llm and not llm_available:
-                    if use_cot_caption or use_cot_language:
-                        print(f"[API Server] LLM unavailable, auto-disabling: use_cot_caption={use_cot_caption}->False, use_cot_language={use_cot_language}->False")
-                    use_cot_caption = False
-                    use_cot_language = False
-
-                # Handle sample mode or description: generate caption/lyrics/metas via LM
-                caption = req.prompt
-                lyrics = req.lyrics
-                bpm = req.bpm
-                key_scale = req.key_scale
-                time_signature = req.time_signature
-                audio_duration = req.audio_duration
-
-                # Save original user input for metas
-                original_prompt = req.prompt or ""
-                original_lyrics = req.lyrics or ""
-                
-                if sample_mode or has_sample_query:
-                    # Parse description hints from sample_query (if provided)
-                    sample_query = req.sample_query if has_sample_query else "NO USER INPUT"
-                    parsed_language, parsed_instrumental = _parse_description_hints(sample_query)
-
-                    # Determine vocal_language with priority:
-                    # 1. User-specified vocal_language (if not default "en")
-                    # 2. Language parsed from description
-                    # 3. None (no constraint)
-                    if req.vocal_language and req.vocal_language not in ("en", "unknown", ""):
-                        sample_language = req.vocal_language
-                    else:
-                        sample_language = parsed_language
-
-                    sample_result = create_sample(
-                        llm_handler=llm,
-                        query=sample_query,
-                        instrumental=parsed_instrumental,
-                        vocal_language=sample_language,
-                        temperature=req.lm_temperature,
-                        top_k=lm_top_k if lm_top_k > 0 else None,
-                        top_p=lm_top_p if lm_top_p < 1.0 else None,
-                        use_constrained_decoding=True,
-                    )
+        async def _run_one_job(job_id: str, req: GenerateMusicRequest) -> None:
+            job_store: SQLiteJobStore = app.state.job_store
+            pool: HandlerPool = app.state.handler_pool
 
-                    if not sample_result.success:
-                        raise RuntimeError(f"create_sample failed: {sample_result.error or sample_result.status_message}")
-
-                    # Use generated sample data
-                    caption = sample_result.caption
-                    lyrics = sample_result.lyrics
-                    bpm = sample_result.bpm
-                    key_scale = sample_result.keyscale
-                    time_signature = sample_result.timesignature
-                    audio_duration = sample_result.duration
-
-                # Apply format_sample() if use_format is True and caption/lyrics are provided
-                format_has_duration = False
-
-                if req.use_format and (caption or lyrics):
-                    _ensure_llm_ready()
-                    if getattr(app.state, "_llm_init_error", None):
-                        raise RuntimeError(f"5Hz LM init failed (needed for format): {app.state._llm_init_error}")
-                    
-                    # Build user_metadata from request params (matching bot.py behavior)
-                    user_metadata_for_format = {}
-                    if bpm is not None:
-                        user_metadata_for_format['bpm'] = bpm
-                    if audio_duration is not None and float(audio_duration) > 0:
-                        user_metadata_for_format['duration'] = float(audio_duration)
-                    if key_scale:
-                        user_metadata_for_format['keyscale'] = key_scale
-                    if time_signature:
-                        user_metadata_for_format['timesignature'] = time_signature
-                    if req.vocal_language and req.vocal_language != "unknown":
-                        user_metadata_for_format['language'] = req.vocal_language
-                    
-                    format_result = format_sample(
-                        llm_handler=llm,
-                        caption=caption,
-                        lyrics=lyrics,
-                        user_metadata=user_metadata_for_format if user_metadata_for_format else None,
-                        temperature=req.lm_temperature,
-                        top_k=lm_top_k if lm_top_k > 0 else None,
-                        top_p=lm_top_p if lm_top_p < 1.0 else None,
-                        use_constrained_decoding=True,
-                    )
-                    
-                    if format_result.success:
-                        # Extract all formatted data (matching bot.py behavior)
-                        caption = format_result.caption or caption
-                        lyrics = format_result.lyrics or lyrics
-                        if format_result.duration:
-                            audio_duration = format_result.duration
-                            format_has_duration = True
-                        if format_result.bpm:
-                            bpm = format_result.bpm
-                        if format_result.keyscale:
-                            key_scale = format_result.keyscale
-                        if format_result.timesignature:
-                            time_signature = format_result.timesignature
-
-                # Parse timesteps string to list of floats if provided
-                parsed_timesteps = _parse_timesteps(req.timesteps)
-
-                # Determine actual inference steps (timesteps override inference_steps)
-                actual_inference_steps = len(parsed_timesteps) if parsed_timesteps else req.inference_steps
-
-                # Auto-select instruction based on task_type if user didn't provide custom instruction
-                # This matches gradio behavior which uses TASK_INSTRUCTIONS for each task type
-                instruction_to_use = req.instruction
-                if instruction_to_use == DEFAULT_DIT_INSTRUCTION and req.task_type in TASK_INSTRUCTIONS:
-                    instruction_to_use = TASK_INSTRUCTIONS[req.task_type]
-
-                # Build GenerationParams using unified interface
-                # Note: thinking controls LM code generation, sample_mode only affects CoT metas
-                params = GenerationParams(
-                    task_type=req.task_type,
-                    instruction=instruction_to_use,
-                    reference_audio=req.reference_audio_path,
-                    src_audio=req.src_audio_path,
-                    audio_codes=req.audio_code_string,
-                    caption=caption,
-                    lyrics=lyrics,
-                    instrumental=_is_instrumental(lyrics),
-                    vocal_language=req.vocal_language,
-                    bpm=bpm,
-                    keyscale=key_scale,
-                    timesignature=time_signature,
-                    duration=audio_duration if audio_duration else -1.0,
-                    inference_steps=req.inference_steps,
-                    seed=req.seed,
-                    guidance_scale=req.guidance_scale,
-                    use_adg=req.use_adg,
-                    cfg_interval_start=req.cfg_interval_start,
-                    cfg_interval_end=req.cfg_interval_end,
-                    shift=req.shift,
-                    infer_method=req.infer_method,
-                    timesteps=parsed_timesteps,
-                    repainting_start=req.repainting_start,
-                    repainting_end=req.repainting_end if req.repainting_end else -1,
-                    audio_cover_strength=req.audio_cover_strength,
-                    # LM parameters
-                    thinking=thinking,  # Use LM for code generation when thinking=True
-                    lm_temperature=req.lm_temperature,
-                    lm_cfg_scale=req.lm_cfg_scale,
-                    lm_top_k=lm_top_k,
-                    lm_top_p=lm_top_p,
-                    lm_negative_prompt=req.lm_negative_prompt,
-                    # use_cot_metas logic:
-                    # - sample_mode: metas already generated, skip Phase 1
-                    # - format with duration: metas already generated, skip Phase 1
-                    # - format without duration: need Phase 1 to generate duration
-                    # - no format: need Phase 1 to generate all metas
-                    use_cot_metas=not sample_mode and not format_has_duration,
-                    use_cot_caption=use_cot_caption,  # Use local var (may be auto-disabled)
-                    use_cot_language=use_cot_language,  # Use local var (may be auto-disabled)
-                    use_constrained_decoding=True,
-                )
+            await _ensure_initialized()
 
-                # Build GenerationConfig - default to 2 audios like gradio_ui
-                batch_size = req.batch_size if req.batch_size is not None else 2
-                config = GenerationConfig(
-                    batch_size=batch_size,
-                    allow_lm_batch=req.allow_lm_batch,
-                    use_random_seed=req.use_random_seed,
-                    seeds=None,  # Let unified logic handle seed generation
-                    audio_format=req.audio_format,
-                    constrained_decoding_debug=req.constrained_decoding_debug,
-                )
+            # Select the least-loaded DiT replica serving the user's model choice
+            replica = _acquire_replica(job_id, req)
+            h, selected_model_name = replica.handler, replica.model
 
-                # Check LLM initialization status
-                llm_is_initialized = getattr(app.state, "_llm_initialized", False)
-                llm_to_pass = llm if llm_is_initialized else None
-
-                if req.analysis_only:
-                    lm_res = llm_to_pass.generate_with_stop_condition(
-                        caption=params.caption,
-                        lyrics=params.lyrics,
-                        infer_type="dit",
-                        temperature=req.lm_temperature,
-                        top_p=req.lm_top_p,
-                        use_cot_metas=True,
-                        use_cot_caption=req.use_cot_caption,
-                        use_cot_language=req.use_cot_language,
-                        use_constrained_decoding=True
-                    )
+            loop = asyncio.get_running_loop()
+            audio_stream: Optional[asyncio.Queue] = app.state.audio_streams.get(job_id)
+            stream_state = {"header_sent": False}
 
-                    if not lm_res.get("success"):
-                        raise RuntimeError(f"Analysis Failed: {lm_res.get('error')}")
-
-                    metas_found = lm_res.get("metadata", {})
-                    return {
-                        "first_audio_path": None,
-                        "audio_paths": [],
-                        "generation_info": "Analysis Only Mode Complete",
-                        "status_message": "Success",
-                        "metas": metas_found,
-                        "bpm": metas_found.get("bpm"),
-                        "keyscale": metas_found.get("keyscale"),
-                        "duration": metas_found.get("duration"),
-                        "prompt": metas_found.get("caption", params.caption),
-                        "lyrics": params.lyrics,
-                        "lm_model": os.getenv("ACESTEP_LM_MODEL_PATH", ""),
-                        "dit_model": "None (Analysis Only)"
-                    }
+            def _on_audio_chunk(chunk) -> None:
+                """Forward the first batch item of each decoded chunk as PCM to the stream."""
+                data = audio_to_pcm16_bytes(chunk[0])
+                if not stream_state["header_sent"]:
+                    data = pcm16_wav_header(h.sample_rate, chunk.shape[1]) + data
+                    stream_state["header_sent"] = True
+                loop.call_soon_threadsafe(audio_stream.put_nowait, data)
+
+            audio_chunk_callback = _on_audio_chunk if audio_stream is not None else None
+
+            def _blocking_generate() -> Dict[str, Any]:
+                """Generate music using unified inference logic from acestep.inference"""
+                started = time.time()
+                prep = _prepare_generation(req, h, replica.llm_handler)
+                if "result" in prep:
+                    return prep["result"]
 
                 # Generate music using unified interface
                 result = generate_music(
                     dit_handler=h,
-                    llm_handler=llm_to_pass,
-                    params=params,
-                    config=config,
+                    llm_handler=prep["llm_handler"],
+                    params=prep["params"],
+                    config=prep["config"],
                     save_dir=app.state.temp_audio_dir,
                     progress=None,
+                    audio_chunk_callback=audio_chunk_callback,
                 )
-
-                if not result.success:
-                    raise RuntimeError(f"Music generation failed: {result.error or result.status_message}")
-
-                # Extract results
-                audio_paths = [audio["path"] for audio in result.audios if audio.get("path")]
-                first_audio = audio_paths[0] if len(audio_paths) > 0 else None
-                second_audio = audio_paths[1] if len(audio_paths) > 1 else None
-
-                # Get metadata from LM or CoT results
-                lm_metadata = result.extra_outputs.get("lm_metadata", {})
-                metas_out = _normalize_metas(lm_metadata)
-                
-                # Update metas with actual values used
-                if params.cot_bpm:
-                    metas_out["bpm"] = params.cot_bpm
-                elif bpm:
-                    metas_out["bpm"] = bpm
-                    
-                if params.cot_duration:
-                    metas_out["duration"] = params.cot_duration
-                elif audio_duration:
-                    metas_out["duration"] = audio_duration
-                    
-                if params.cot_keyscale:
-                    metas_out["keyscale"] = params.cot_keyscale
-                elif key_scale:
-                    metas_out["keyscale"] = key_scale
-                    
-                if params.cot_timesignature:
-                    metas_out["timesignature"] = params.cot_timesignature
-                elif time_signature:
-                    metas_out["timesignature"] = time_signature
-
-                # Store original user input in metas (not the final/modified values)
-                metas_out["prompt"] = original_prompt
-                metas_out["lyrics"] = original_lyrics
-
-                # Extract seed values for response (comma-separated for multiple audios)
-                seed_values = []
-                for audio in result.audios:
-                    audio_params = audio.get("params", {})
-                    seed = audio_params.get("seed")
-                    if seed is not None:
-                        seed_values.append(str(seed))
-                seed_value = ",".join(seed_values) if seed_values else ""
-
-                # Build generation_info using the helper function (like gradio_ui)
-                time_costs = result.extra_outputs.get("time_costs", {})
-                generation_info = _build_generation_info(
-                    lm_metadata=lm_metadata,
-                    time_costs=time_costs,
-                    seed_value=seed_value,
-                    inference_steps=req.inference_steps,
-                    num_audios=len(result.audios),
-                )
-
-                def _none_if_na_str(v: Any) -> Optional[str]:
-                    if v is None:
-                        return None
-                    s = str(v).strip()
-                    if s in {"", "N/A"}:
-                        return None
-                    return s
-
-                # Get model information
-                lm_model_name = os.getenv("ACESTEP_LM_MODEL_PATH", "acestep-5Hz-lm-0.6B")
-                # Use selected_model_name (set at the beginning of _run_one_job)
-                dit_model_name = selected_model_name
-                
-                return {
-                    "first_audio_path": _path_to_audio_url(first_audio) if first_audio else None,
-                    "second_audio_path": _path_to_audio_url(second_audio) if second_audio else None,
-                    "audio_paths": [_path_to_audio_url(p) for p in audio_paths],
-                    "generation_info": generation_info,
-                    "status_message": result.status_message,
-                    "seed_value": seed_value,
-                    # Final prompt/lyrics (may be modified by thinking/format)
-                    "prompt": caption or "",
-                    "lyrics": lyrics or "",
-                    # metas contains original user input + other metadata
-                    "metas": metas_out,
-                    "bpm": metas_out.get("bpm") if isinstance(metas_out.get("bpm"), int) else None,
-                    "duration": metas_out.get("duration") if isinstance(metas_out.get("duration"), (int, float)) else None,
-                    "genres": _none_if_na_str(metas_out.get("genres")),
-                    "keyscale": _none_if_na_str(metas_out.get("keyscale")),
-                    "timesignature": _none_if_na_str(metas_out.get("timesignature")),
-                    "lm_model": lm_model_name,
-                    "dit_model": dit_model_name,
-                }
+                scores: List[Dict[str, Any]] = []
+                if (req.best_of or 1) > 1:
+                    result, scores = _select_best_of(req, prep, result, h)
+                final = _finalize_generation(req, prep, result, selected_model_name)
+                if scores:
+                    final["scores"] = scores
+                _observe_job_timing(_eta_features(req, selected_model_name), result, time.time() - started)
+                return final
 
             t0 = time.time()
             try:
-                loop = asyncio.get_running_loop()
-                result = await loop.run_in_executor(executor, _blocking_generate)
+                result = await pool.run(replica, _blocking_generate)
                 job_store.mark_succeeded(job_id, result)
 
                 # Update local cache
@@ -1566,32 +1765,214 @@ def create_app() -> FastAPI:
                 # Update local cache
                 _update_local_cache(job_id, None, "failed")
             finally:
-                dt = max(0.0, time.time() - t0)
-                async with app.state.stats_lock:
-                    app.state.recent_durations.append(dt)
-                    if app.state.recent_durations:
-                        app.state.avg_job_seconds = sum(app.state.recent_durations) / len(app.state.recent_durations)
+                pool.release(replica)
+                if audio_stream is not None:
+                    audio_stream.put_nowait(None)
+                await _record_job_duration(max(0.0, time.time() - t0))
+
+        async def _record_job_duration(dt: float) -> None:
+            async with app.state.stats_lock:
+                app.state.recent_durations.append(dt)
+                if app.state.recent_durations:
+                    app.state.avg_job_seconds = sum(app.state.recent_durations) / len(app.state.recent_durations)
+
+        def _batch_max_items() -> int:
+            """Max audios per coalesced DiT batch (ACESTEP_BATCH_MAX_SIZE, or the GPU tier limit)."""
+            if BATCH_MAX_SIZE > 0:
+                return BATCH_MAX_SIZE
+            return _gpu_batch_limit() or 1
+
+        def _claim_job(
+            batch_key: Optional[str] = None, max_items: Optional[int] = None
+        ) -> Optional[Tuple[Tuple[str, GenerateMusicRequest], Optional[str], int]]:
+            """Claim the next queued job from the shared store; returns ((job_id, req), batch_key, items)."""
+            while True:
+                claimed = store.claim_next(app.state.worker_id, batch_key=batch_key, max_items=max_items)
+                if claimed is None:
+                    return None
+                job_id, payload, key, items = claimed
+                try:
+                    return (job_id, _deserialize_request(payload)), key, items
+                except Exception:
+                    error_traceback = traceback.format_exc()
+                    print(f"[API Server] Job {job_id}: unreadable request, failing it")
+                    store.mark_failed(job_id, error_traceback)
+
+        def _requeue_expired_jobs() -> None:
+            """Requeue jobs of workers that stopped renewing their leases (checked at most every quarter lease)."""
+            now = time.time()
+            if now - app.state.last_lease_check < JOB_LEASE_SECONDS / 4:
+                return
+            app.state.last_lease_check = now
+            recovered = store.requeue_expired(JOB_LEASE_SECONDS)
+            if recovered:
+                print(f"[API Server] Requeued {recovered} jobs whose worker stopped renewing their lease")
+
+        async def _collect_batch() -> List[Tuple[str, GenerateMusicRequest]]:
+            """Claim the next job plus compatible jobs queued within ACESTEP_BATCH_MAX_WAIT_MS."""
+            wakeup: asyncio.Event = app.state.job_wakeup
+            while True:
+                # Clear before claiming so a submit between the two is not missed
+                wakeup.clear()
+                claimed = _claim_job()
+                if claimed is not None:
+                    break
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout=QUEUE_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    _requeue_expired_jobs()
+
+            first, key, items = claimed
+            max_items = _batch_max_items()
+            if key is None or items >= max_items:
+                return [first]
+
+            batch = [first]
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + max(0.0, BATCH_MAX_WAIT_MS) / 1000.0
+            while items < max_items:
+                wakeup.clear()
+                claimed = _claim_job(batch_key=key, max_items=max_items - items)
+                if claimed is not None:
+                    batch.append(claimed[0])
+                    items += claimed[2]
+                    continue
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout=min(remaining, QUEUE_POLL_SECONDS))
+                except asyncio.TimeoutError:
+                    pass
+            if len(batch) > 1:
+                # Other idle workers may have skipped jobs this batch did not take
+                wakeup.set()
+            return batch
+
+        async def _run_job_batch(jobs: List[Tuple[str, GenerateMusicRequest]]) -> None:
+            """Run several compatible jobs with shared DiT/VAE passes and fan results out per job."""
+            job_store: SQLiteJobStore = app.state.job_store
+            pool: HandlerPool = app.state.handler_pool
+
+            await _ensure_initialized()
+
+            replica = _acquire_replica(jobs[0][0], jobs[0][1], jobs=len(jobs))
+            h, selected_model_name = replica.handler, replica.model
+            print(f"[API Server] Running {len(jobs)} jobs as one DiT batch: {[job_id for job_id, _ in jobs]}")
+
+            def _blocking_generate_batch() -> List[Tuple[Optional[Dict[str, Any]], Optional[str]]]:
+                """Returns one (result, error_traceback) pair per job."""
+                outcomes: List[Tuple[Optional[Dict[str, Any]], Optional[str]]] = [(None, None)] * len(jobs)
+                preps: Dict[int, Dict[str, Any]] = {}
+                for i, (_, req) in enumerate(jobs):
+                    try:
+                        prep = _prepare_generation(req, h, replica.llm_handler)
+                    except Exception:
+                        outcomes[i] = (None, traceback.format_exc())
+                        continue
+                    if "result" in prep:
+                        outcomes[i] = (prep["result"], None)
+                    else:
+                        preps[i] = prep
+
+                if not preps:
+                    return outcomes
+
+                # LM init state is final once every job has been prepared
+                llm_to_pass = replica.llm_handler if getattr(app.state, "_llm_initialized", False) else None
+                order = list(preps.keys())
+                results = generate_music_batch(
+                    dit_handler=h,
+                    llm_handler=llm_to_pass,
+                    jobs=[(preps[i]["params"], preps[i]["config"]) for i in order],
+                    save_dir=app.state.temp_audio_dir,
+                    max_batch_size=_batch_max_items(),
+                )
+                succeeded = []
+                for i, result in zip(order, results):
+                    try:
+                        outcomes[i] = (_finalize_generation(jobs[i][1], preps[i], result, selected_model_name), None)
+                    except Exception:
+                        outcomes[i] = (None, traceback.format_exc())
+                        continue
+                    # LM passes and saving are per job; DiT/VAE stages are learned once per shared batch
+                    _observe_job_timing(_eta_features(jobs[i][1], selected_model_name), result, stages=[*LM_STAGES, "save"])
+                    if result.success:
+                        succeeded.append((i, result))
+                if succeeded:
+                    first_idx, first_result = succeeded[0]
+                    _observe_job_timing(
+                        _eta_features(jobs[first_idx][1], selected_model_name),
+                        first_result,
+                        stages=["dit_encoder", "dit_model", "vae_decode", "offload"],
+                        batch_size=sum(len(result.audios) for _, result in succeeded),
+                    )
+                return outcomes
+
+            t0 = time.time()
+            try:
+                outcomes = await pool.run(replica, _blocking_generate_batch, jobs=len(jobs))
+            except Exception:
+                error_traceback = traceback.format_exc()
+                outcomes = [(None, error_traceback)] * len(jobs)
+            finally:
+                pool.release(replica, jobs=len(jobs))
+
+            for (job_id, _), (result, error_traceback) in zip(jobs, outcomes):
+                if error_traceback is None:
+                    job_store.mark_succeeded(job_id, result)
+                    _update_local_cache(job_id, result, "succeeded")
+                else:
+                    print(f"[API Server] Job {job_id} FAILED (batched)")
+                    print(f"[API Server] Traceback:\n{error_traceback}")
+                    job_store.mark_failed(job_id, error_traceback)
+                    _update_local_cache(job_id, None, "failed")
+
+            # Amortize the batch time over its jobs so queue ETAs reflect throughput
+            dt = max(0.0, time.time() - t0) / len(jobs)
+            for _ in jobs:
+                await _record_job_duration(dt)
+            async with app.state.stats_lock:
+                app.state.batch_stats["batches"] += 1
+                app.state.batch_stats["batched_jobs"] += len(jobs)
 
         async def _queue_worker(worker_idx: int) -> None:
             while True:
-                job_id, req = await app.state.job_queue.get()
+                jobs = await _collect_batch()
                 try:
-                    async with app.state.pending_lock:
-                        try:
-                            app.state.pending_ids.remove(job_id)
-                        except ValueError:
-                            pass
-
-                    await _run_one_job(job_id, req)
+                    if len(jobs) == 1:
+                        await _run_one_job(*jobs[0])
+                    else:
+                        await _run_job_batch(jobs)
+                except Exception:
+                    # Claimed jobs must not stay "running" forever if the run itself blew up
+                    error_traceback = traceback.format_exc()
+                    print(f"[API Server] Queue worker {worker_idx} error:\n{error_traceback}")
+                    for job_id, rec in store.get_many([job_id for job_id, _ in jobs]).items():
+                        if rec.status == "running":
+                            store.mark_failed(job_id, error_traceback)
+                            _update_local_cache(job_id, None, "failed")
                 finally:
-                    await _cleanup_job_temp_files(job_id)
-                    app.state.job_queue.task_done()
+                    for job_id, _ in jobs:
+                        await _cleanup_job_temp_files(job_id)
+
+        async def _job_lease_worker() -> None:
+            """Renew the leases of the jobs this process runs or streams, every quarter lease."""
+            while True:
+                try:
+                    await asyncio.sleep(JOB_LEASE_SECONDS / 4)
+                    store.renew_leases(app.state.worker_id)
+                except asyncio.CancelledError:
+                    break
+                except Exception as e:
+                    print(f"[API Server] Job lease renewal error: {e}")
 
         async def _job_store_cleanup_worker() -> None:
             """Background task to periodically clean up old completed jobs."""
             while True:
                 try:
                     await asyncio.sleep(JOB_STORE_CLEANUP_INTERVAL)
+                    app.state.eta_model.save(app.state.eta_model_path)
                     removed = store.cleanup_old_jobs()
                     if removed > 0:
                         stats = store.get_stats()
@@ -1601,9 +1982,12 @@ def create_app() -> FastAPI:
                 except Exception as e:
                     print(f"[API Server] Job cleanup error: {e}")
 
-        worker_count = max(1, WORKER_COUNT)
+        # At least one queue worker per device so every device can be busy at once; replicas of
+        # several models on one device don't add workers (their jobs would run concurrently there)
+        worker_count = max(1, WORKER_COUNT, len(devices))
         workers = [asyncio.create_task(_queue_worker(i)) for i in range(worker_count)]
         cleanup_task = asyncio.create_task(_job_store_cleanup_worker())
+        lease_task = asyncio.create_task(_job_lease_worker())
         app.state.worker_tasks = workers
         app.state.cleanup_task = cleanup_task
 
@@ -1642,8 +2026,7 @@ def create_app() -> FastAPI:
             print("[API Server] No GPU detected, running on CPU")
 
         project_root = _get_project_root()
-        config_path = os.getenv("ACESTEP_CONFIG_PATH", "acestep-v15-turbo")
-        device = os.getenv("ACESTEP_DEVICE", "auto")
+        device = devices[0]  # Primary device: first of ACESTEP_DEVICES, else ACESTEP_DEVICE
         use_flash_attention = _env_bool("ACESTEP_USE_FLASH_ATTENTION", True)
 
         # Auto-determine offload settings based on GPU config if not explicitly set
@@ -1661,94 +2044,51 @@ def create_app() -> FastAPI:
         checkpoint_dir = os.path.join(project_root, "checkpoints")
         os.makedirs(checkpoint_dir, exist_ok=True)
 
-        # Download and initialize primary DiT model
-        dit_model_name = _get_model_name(config_path)
-        if dit_model_name:
-            try:
-                _ensure_model_downloaded(dit_model_name, checkpoint_dir)
-            except Exception as e:
-                print(f"[API Server] Warning: Failed to download DiT model: {e}")
-
         # Download VAE model
         try:
             _ensure_model_downloaded("vae", checkpoint_dir)
         except Exception as e:
             print(f"[API Server] Warning: Failed to download VAE model: {e}")
 
-        print(f"[API Server] Loading primary DiT model: {config_path}")
-        status_msg, ok = handler.initialize_service(
-            project_root=project_root,
-            config_path=config_path,
-            device=device,
-            use_flash_attention=use_flash_attention,
-            compile_model=False,
-            offload_to_cpu=offload_to_cpu,
-            offload_dit_to_cpu=offload_dit_to_cpu,
-        )
-        if not ok:
-            app.state._init_error = status_msg
-            print(f"[API Server] ERROR: Primary model failed to load: {status_msg}")
-            raise RuntimeError(status_msg)
-        app.state._initialized = True
-        print(f"[API Server] Primary model loaded: {_get_model_name(config_path)}")
-
-        # Initialize secondary model if configured
-        if handler2 and config_path2:
-            model2_name = _get_model_name(config_path2)
-            if model2_name:
+        # Download and initialize every DiT replica; only the primary one is required
+        downloaded_models = set()
+        for replica in pool.replicas:
+            if replica.model and replica.model not in downloaded_models:
+                downloaded_models.add(replica.model)
                 try:
-                    _ensure_model_downloaded(model2_name, checkpoint_dir)
+                    _ensure_model_downloaded(replica.model, checkpoint_dir)
                 except Exception as e:
-                    print(f"[API Server] Warning: Failed to download secondary model: {e}")
+                    print(f"[API Server] Warning: Failed to download DiT model {replica.model}: {e}")
 
-            print(f"[API Server] Loading secondary DiT model: {config_path2}")
+            is_primary = replica.handler is handler
+            print(f"[API Server] Loading {'primary ' if is_primary else ''}DiT model: {replica.config_path} on {replica.device}")
             try:
-                status_msg2, ok2 = handler2.initialize_service(
+                status_msg, ok = replica.handler.initialize_service(
                     project_root=project_root,
-                    config_path=config_path2,
-                    device=device,
+                    config_path=replica.config_path,
+                    device=replica.device,
                     use_flash_attention=use_flash_attention,
                     compile_model=False,
                     offload_to_cpu=offload_to_cpu,
                     offload_dit_to_cpu=offload_dit_to_cpu,
                 )
-                app.state._initialized2 = ok2
-                if ok2:
-                    print(f"[API Server] Secondary model loaded: {model2_name}")
-                else:
-                    print(f"[API Server] Warning: Secondary model failed: {status_msg2}")
             except Exception as e:
-                print(f"[API Server] Warning: Failed to initialize secondary model: {e}")
-                app.state._initialized2 = False
-
-        # Initialize third model if configured
-        if handler3 and config_path3:
-            model3_name = _get_model_name(config_path3)
-            if model3_name:
-                try:
-                    _ensure_model_downloaded(model3_name, checkpoint_dir)
-                except Exception as e:
-                    print(f"[API Server] Warning: Failed to download third model: {e}")
+                if is_primary:
+                    raise
+                status_msg, ok = str(e), False
+            replica.initialized = ok
 
-            print(f"[API Server] Loading third DiT model: {config_path3}")
-            try:
-                status_msg3, ok3 = handler3.initialize_service(
-                    project_root=project_root,
-                    config_path=config_path3,
-                    device=device,
-                    use_flash_attention=use_flash_attention,
-                    compile_model=False,
-                    offload_to_cpu=offload_to_cpu,
-                    offload_dit_to_cpu=offload_dit_to_cpu,
-                )
-                app.state._initialized3 = ok3
-                if ok3:
-                    print(f"[API Server] Third model loaded: {model3_name}")
-                else:
-                    print(f"[API Server] Warning: Third model failed: {status_msg3}")
-            except Exception as e:
-                print(f"[API Server] Warning: Failed to initialize third model: {e}")
-                app.state._initialized3 = False
+            if is_primary:
+                if not ok:
+                    app.state._init_error = status_msg
+                    print(f"[API Server] ERROR: Primary model failed to load: {status_msg}")
+                    raise RuntimeError(status_msg)
+                app.state._initialized = True
+                print(f"[API Server] Primary model loaded: {replica.name}")
+            elif ok:
+                print(f"[API Server] DiT replica loaded: {replica.name}")
+            else:
+                print(f"[API Server] Warning: DiT replica {replica.name} failed: {status_msg}")
 
         # Initialize LLM model based on GPU configuration
         # ACESTEP_INIT_LLM controls LLM initialization:
@@ -1829,6 +2169,7 @@ def create_app() -> FastAPI:
                 _ensure_model_downloaded(lm_model_path, checkpoint_dir)
             except Exception as e:
                 print(f"[API Server] Warning: Failed to download LLM model: {e}")
+            draft_lm_model_path = _ensure_draft_lm_downloaded(checkpoint_dir)
 
             llm_status, llm_ok = llm_handler.initialize(
                 checkpoint_dir=checkpoint_dir,
@@ -1838,10 +2179,36 @@ def create_app() -> FastAPI:
                 offload_to_cpu=lm_offload,
                 dtype=handler.dtype,
                 disable_cuda_graphs=True,
+                draft_lm_model_path=draft_lm_model_path,
+                num_speculative_tokens=int(os.getenv("ACESTEP_LM_NUM_SPECULATIVE_TOKENS", "4")),
+                compile_pt_decode=_env_bool("ACESTEP_LM_COMPILE", False),
             )
             if llm_ok:
                 app.state._llm_initialized = True
                 print(f"[API Server] LLM model loaded: {lm_model_path}")
+
+                # Optionally give every other device its own LM replica. nano-vllm binds to
+                # cuda:0 with a process-wide process group, so extra replicas use the PyTorch backend.
+                if _env_bool("ACESTEP_LM_PER_DEVICE", False):
+                    for dev in devices:
+                        if dev == lm_device:
+                            continue
+                        device_llm = LLMHandler()
+                        dev_status, dev_ok = device_llm.initialize(
+                            checkpoint_dir=checkpoint_dir,
+                            lm_model_path=lm_model_path,
+                            backend="pt",
+                            device=dev,
+                            offload_to_cpu=lm_offload,
+                            dtype=handler.dtype,
+                        )
+                        if not dev_ok:
+                            print(f"[API Server] Warning: LM replica on {dev} failed, sharing {lm_device}: {dev_status}")
+                            continue
+                        for replica in pool.replicas:
+                            if replica.device == dev:
+                                replica.llm_handler = device_llm
+                        print(f"[API Server] LM replica loaded on {dev}")
             else:
                 app.state._llm_init_error = llm_status
                 print(f"[API Server] Warning: LLM model failed to load: {llm_status}")
@@ -1860,28 +2227,47 @@ def create_app() -> FastAPI:
             yield
         finally:
             cleanup_task.cancel()
+            lease_task.cancel()
             for t in workers:
                 t.cancel()
-            executor.shutdown(wait=False, cancel_futures=True)
+            pool.shutdown()
+            app.state.audio_encoder.shutdown()
+            app.state.eta_model.save(app.state.eta_model_path)
 
     app = FastAPI(title="ACE-Step API", version="1.0", lifespan=lifespan)
+    app.state.eta_model = StageLatencyModel()
 
-    async def _queue_position(job_id: str) -> int:
-        async with app.state.pending_lock:
-            try:
-                return list(app.state.pending_ids).index(job_id) + 1
-            except ValueError:
-                return 0
+    def _parallel_capacity(busy_workers: int) -> int:
+        """How many jobs run at once: local replicas, or more if other processes are busy too."""
+        pool: Optional[HandlerPool] = getattr(app.state, "handler_pool", None)
+        local = len(pool.ready()) if pool is not None else 1
+        return max(1, local, busy_workers)
 
-    async def _eta_seconds_for_position(pos: int) -> Optional[float]:
-        if pos <= 0:
-            return None
-        async with app.state.stats_lock:
-            avg = float(getattr(app.state, "avg_job_seconds", INITIAL_AVG_JOB_SECONDS))
-        return pos * avg
+    def _job_eta(rec: Any, backlog: Optional[Tuple[int, float]] = None) -> Tuple[int, Optional[float]]:
+        """(queue position, seconds until the job finishes) for a queued or running job.
 
-    @app.post("/release_task")
-    async def create_music_generate_job(request: Request, authorization: Optional[str] = Header(None)):
+        A queued job waits for the predicted remaining time of running jobs plus the
+        predicted time of queued jobs ahead of it, spread over the parallel workers.
+        """
+        if rec is None or rec.status not in ("queued", "running"):
+            return 0, None
+        if rec.status == "running":
+            if rec.est_seconds is None:
+                return 0, None
+            elapsed = time.time() - (rec.started_at or time.time())
+            return 0, round(max(0.0, rec.est_seconds - elapsed), 1)
+        inputs = store.queue_eta_inputs(rec.job_id)
+        if inputs is None:
+            return 0, None
+        position, ahead, own = inputs
+        busy, remaining = backlog if backlog is not None else store.running_backlog()
+        eta = (remaining + ahead) / _parallel_capacity(busy) + own
+        return position, round(eta, 1)
+
+    async def _parse_generate_request(
+        request: Request, authorization: Optional[str]
+    ) -> Tuple[GenerateMusicRequest, List[str]]:
+        """Parse a /release_task style body; returns the request and uploaded temp files."""
         content_type = (request.headers.get("content-type") or "").lower()
         temp_files: list[str] = []
 
@@ -1906,6 +2292,7 @@ def create_app() -> FastAPI:
                 use_random_seed=p.bool("use_random_seed", True),
                 seed=p.int("seed", -1),
                 batch_size=p.int("batch_size"),
+                best_of=p.int("best_of", 1),
                 audio_code_string=p.str("audio_code_string"),
                 repainting_start=p.float("repainting_start", 0.0),
                 repainting_end=p.float("repainting_end"),
@@ -2032,10 +2419,61 @@ def create_app() -> FastAPI:
                     ),
                 )
 
-        rec = store.create()
+        try:
+            _validate_best_of(req)
+        except HTTPException:
+            for p in temp_files:
+                try:
+                    os.remove(p)
+                except Exception:
+                    pass
+            raise
+        return req, temp_files
+
+    async def _enqueue_job(
+        req: GenerateMusicRequest,
+        temp_files: List[str],
+        audio_stream: Optional[asyncio.Queue] = None,
+    ) -> Tuple[str, int]:
+        """Queue a parsed job; returns (job_id, queue_position).
+
+        Streaming jobs are pinned to this process (which holds the client connection)
+        and never batched. Fully seeded jobs may return the id of an identical job
+        instead (see ``_dedup_key``); its position is 0 once it is no longer queued.
+        """
+        streaming = audio_stream is not None
+        job_id = str(uuid4())
+        est_seconds = app.state.eta_model.predict(_eta_features(req), fallback=app.state.avg_job_seconds)
+
+        loop = asyncio.get_running_loop()
+        dedup_key = None if streaming else await loop.run_in_executor(None, _dedup_key, req)
+        if dedup_key is not None:
+            rec, created = await loop.run_in_executor(None, lambda: store.create_or_join(
+                job_id,
+                dedup_key,
+                reusable=_result_files_exist,
+                request=_serialize_request(req),
+                batch_key=_batch_key(req),
+                items=_job_batch_size(req),
+                temp_files=temp_files,
+                est_seconds=est_seconds,
+                max_queued=QUEUE_MAXSIZE,
+            ))
+            if created:
+                app.state.job_wakeup.set()
+                return job_id, store.queue_position(job_id)
+            if rec is not None:
+                for p in temp_files:
+                    try:
+                        os.remove(p)
+                    except Exception:
+                        pass
+                async with app.state.stats_lock:
+                    app.state.dedup_stats["reused" if rec.status == "succeeded" else "joined"] += 1
+                print(f"[API Server] Request matches job {rec.job_id} ({rec.status}), not queuing a new one")
+                return rec.job_id, store.queue_position(rec.job_id)
 
-        q: asyncio.Queue = app.state.job_queue
-        if q.full():
+        if dedup_key is not None or store.queued_count() >= QUEUE_MAXSIZE:
             for p in temp_files:
                 try:
                     os.remove(p)
@@ -2043,16 +2481,94 @@ def create_app() -> FastAPI:
                     pass
             raise HTTPException(status_code=429, detail="Server busy: queue is full")
 
-        if temp_files:
-            async with app.state.job_temp_files_lock:
-                app.state.job_temp_files[rec.job_id] = temp_files
+        if streaming:
+            # Register before the job becomes claimable so no chunk is missed
+            app.state.audio_streams[job_id] = audio_stream
+        store.create_with_id(
+            job_id,
+            request=_serialize_request(req),
+            batch_key=None if streaming else _batch_key(req),
+            items=_job_batch_size(req),
+            pinned_to=app.state.worker_id if streaming else None,
+            temp_files=temp_files,
+            est_seconds=est_seconds,
+        )
+        position = store.queue_position(job_id)
+        app.state.job_wakeup.set()
+        return job_id, position
+
+    @app.post("/release_task")
+    async def create_music_generate_job(request: Request, authorization: Optional[str] = Header(None)):
+        req, temp_files = await _parse_generate_request(request, authorization)
+        job_id, position = await _enqueue_job(req, temp_files)
+        rec = store.get(job_id)
+        _, eta_seconds = _job_eta(rec)
+        return _wrap_response({
+            "task_id": job_id,
+            "status": rec.status if rec else "queued",
+            "queue_position": position,
+            "eta_seconds": eta_seconds,
+        })
+
+    @app.post("/release_task_stream")
+    async def create_music_generate_stream(request: Request, authorization: Optional[str] = Header(None)):
+        """Queue a job and stream its audio as WAV while the VAE decodes it.
+
+        Accepts the same body as /release_task. The response is 16-bit PCM WAV of
+        unknown length for the first audio of the job (batch_size defaults to 1), sent
+        chunk by chunk as each decode tile is finalized. The task id is returned in the
+        ``X-Task-Id`` header; the saved file and metadata are available via /query_result.
 
-        async with app.state.pending_lock:
-            app.state.pending_ids.append(rec.job_id)
-            position = len(app.state.pending_ids)
+        The response starts once the first chunk is decoded. If the job fails before
+        that, a 500 JSON error with the task id is returned instead. A failure after
+        streaming started can only cut the WAV short, so clients should check
+        /query_result for the final status once the stream ends.
+        """
+        req, temp_files = await _parse_generate_request(request, authorization)
+        if req.analysis_only:
+            raise HTTPException(status_code=400, detail="analysis_only jobs produce no audio to stream")
+        if req.batch_size is None:
+            req.batch_size = 1
+        if (req.best_of or 1) > 1:
+            raise HTTPException(status_code=400, detail="best_of picks audios after generation and cannot be streamed")
+
+        audio_stream: asyncio.Queue = asyncio.Queue()
+        job_id, position = await _enqueue_job(req, temp_files, audio_stream=audio_stream)
 
-        await q.put((rec.job_id, req))
-        return _wrap_response({"task_id": rec.job_id, "status": "queued", "queue_position": position})
+        try:
+            first = await audio_stream.get()
+        except BaseException:
+            # Client went away while queued: the job still runs, nobody reads its chunks
+            app.state.audio_streams.pop(job_id, None)
+            raise
+        if first is None:
+            # The job ended without producing audio
+            app.state.audio_streams.pop(job_id, None)
+            rec = store.get(job_id)
+            status = rec.status if rec else "failed"
+            error = rec.error if rec and rec.error else "Generation produced no audio"
+            return JSONResponse(
+                status_code=500,
+                content=_wrap_response({"task_id": job_id, "status": status}, code=500, error=error),
+                headers={"X-Task-Id": job_id},
+            )
+
+        async def _iter_audio():
+            try:
+                yield first
+                while True:
+                    data = await audio_stream.get()
+                    if data is None:
+                        break
+                    yield data
+            finally:
+                app.state.audio_streams.pop(job_id, None)
+
+        return StreamingResponse(
+            _iter_audio(),
+            media_type="audio/wav",
+            headers={"X-Task-Id": job_id, "X-Queue-Position": str(position), "Cache-Control": "no-cache"},
+        )
 
     @app.post("/query_result")
     async def query_result(request: Request, authorization: Optional[str] = Header(None)):
@@ -2081,87 +2597,51 @@ def create_app() -> FastAPI:
         data_list = []
         current_time = time.time()
 
-        for task_id in task_id_list:
-            result_key = f"{RESULT_KEY_PREFIX}{task_id}"
-
-            # Read from local cache first
-            if local_cache:
-                data = local_cache.get(result_key)
-                if data:
-                    try:
-                        data_json = json.loads(data)
-                    except Exception:
-                        data_json = []
-
-                    if len(data_json) <= 0:
-                        data_list.append({"task_id": task_id, "result": data, "status": 2})
-                    else:
-                        status = data_json[0].get("status")
-                        create_time = data_json[0].get("create_time", 0)
-                        if status == 0 and (current_time - create_time) > TASK_TIMEOUT_SECONDS:
-                            data_list.append({"task_id": task_id, "result": data, "status": 2})
-                        else:
-                            data_list.append({
-                                "task_id": task_id,
-                                "result": data,
-                                "status": int(status) if status is not None else 1,
-                                "progress_text": log_buffer.last_message
-                            })
-                    continue
+        # One indexed lookup for the whole batch; the local cache only covers jobs
+        # already cleaned out of the store (it keeps results for RESULT_EXPIRE_SECONDS).
+        records = store.get_many([str(task_id) for task_id in task_id_list])
+        backlog = None
 
-            # Fallback to job_store query
-            rec = store.get(task_id)
+        for task_id in task_id_list:
+            rec = records.get(str(task_id))
             if rec:
-                env = getattr(rec, 'env', 'development')
-                create_time = rec.created_at
                 status_int = _map_status(rec.status)
-
-                if rec.result and rec.status == "succeeded":
-                    audio_paths = rec.result.get("audio_paths", [])
-                    metas = rec.result.get("metas", {}) or {}
-                    result_data = [
-                        {
-                            "file": p, "wave": "", "status": status_int,
-                            "create_time": int(create_time), "env": env,
-                            "prompt": metas.get("caption", ""),
-                            "lyrics": metas.get("lyrics", ""),
-                            "metas": {
-                                "bpm": metas.get("bpm"),
-                                "duration": metas.get("duration"),
-                                "genres": metas.get("genres", ""),
-                                "keyscale": metas.get("keyscale", ""),
-                                "timesignature": metas.get("timesignature", ""),
-                            }
-                        }
-                        for p in audio_paths
-                    ] if audio_paths else [{
-                        "file": "", "wave": "", "status": status_int,
-                        "create_time": int(create_time), "env": env,
-                        "prompt": metas.get("caption", ""),
-                        "lyrics": metas.get("lyrics", ""),
-                        "metas": {
-                            "bpm": metas.get("bpm"),
-                            "duration": metas.get("duration"),
-                            "genres": metas.get("genres", ""),
-                            "keyscale": metas.get("keyscale", ""),
-                            "timesignature": metas.get("timesignature", ""),
-                        }
-                    }]
-                else:
-                    result_data = [{
-                        "file": "", "wave": "", "status": status_int,
-                        "create_time": int(create_time), "env": env,
-                        "prompt": "", "lyrics": "",
-                        "metas": {},
-                        "error": rec.error if rec.error else None,
-                    }]
-
-                data_list.append({
+                result_data = _build_result_data(rec, rec.result, rec.status)
+                item = {
                     "task_id": task_id,
                     "result": json.dumps(result_data, ensure_ascii=False),
                     "status": status_int,
                     "progress_text": log_buffer.last_message
-                })
+                }
+                if rec.status in ("queued", "running"):
+                    if backlog is None and rec.status == "queued":
+                        backlog = store.running_backlog()
+                    item["queue_position"], item["eta_seconds"] = _job_eta(rec, backlog)
+                data_list.append(item)
+                continue
+
+            result_key = f"{RESULT_KEY_PREFIX}{task_id}"
+            data = local_cache.get(result_key) if local_cache else None
+            if data:
+                try:
+                    data_json = json.loads(data)
+                except Exception:
+                    data_json = []
+
+                if len(data_json) <= 0:
+                    data_list.append({"task_id": task_id, "result": data, "status": 2})
+                else:
+                    status = data_json[0].get("status")
+                    create_time = data_json[0].get("create_time", 0)
+                    if status == 0 and (current_time - create_time) > TASK_TIMEOUT_SECONDS:
+                        data_list.append({"task_id": task_id, "result": data, "status": 2})
+                    else:
+                        data_list.append({
+                            "task_id": task_id,
+                            "result": data,
+                            "status": int(status) if status is not None else 1,
+                            "progress_text": log_buffer.last_message
+                        })
             else:
                 data_list.append({"task_id": task_id, "result": "[]", "status": 0})
 
@@ -2180,47 +2660,60 @@ def create_app() -> FastAPI:
     async def get_stats(_: None = Depends(verify_api_key)):
         """Get server statistics including job store stats."""
         job_stats = store.get_stats()
+        busy_workers, running_remaining = store.running_backlog()
+        queued_seconds = store.queued_seconds()
         async with app.state.stats_lock:
             avg_job_seconds = getattr(app.state, "avg_job_seconds", INITIAL_AVG_JOB_SECONDS)
+            batch_stats = dict(getattr(app.state, "batch_stats", {}))
+            dedup_stats = dict(getattr(app.state, "dedup_stats", {}))
+
+        # Per-replica embedding / audio latent cache counters
+        pool: HandlerPool = app.state.handler_pool
+        embedding_cache_stats = {}
+        audio_cache_stats = {}
+        for replica in pool.replicas:
+            h = replica.handler
+            if getattr(h, "embedding_cache", None) is not None:
+                embedding_cache_stats[replica.name] = h.embedding_cache.stats()
+            if getattr(h, "audio_cache", None) is not None:
+                audio_cache_stats[replica.name] = h.audio_cache.stats()
+
         return _wrap_response({
             "jobs": job_stats,
-            "queue_size": app.state.job_queue.qsize(),
+            "queue_size": job_stats.get("queued", 0),
             "queue_maxsize": QUEUE_MAXSIZE,
             "avg_job_seconds": avg_job_seconds,
+            "eta": {
+                "queued_seconds": round(queued_seconds, 1),
+                "running_remaining_seconds": round(running_remaining, 1),
+                "drain_seconds": round((queued_seconds + running_remaining) / _parallel_capacity(busy_workers), 1),
+                "stages": app.state.eta_model.stats(),
+            },
+            "batching": {
+                "max_batch_size": BATCH_MAX_SIZE,
+                "max_wait_ms": BATCH_MAX_WAIT_MS,
+                **batch_stats,
+            },
+            "dedup": {"enabled": DEDUP_ENABLED, **dedup_stats},
+            "replicas": pool.stats(),
+            "embedding_cache": embedding_cache_stats,
+            "audio_cache": audio_cache_stats,
         })
 
     @app.get("/v1/models")
     async def list_models(_: None = Depends(verify_api_key)):
         """List available DiT models."""
+        pool: HandlerPool = app.state.handler_pool
+        default_model = pool.default_model
         models = []
-        
-        # Primary model (always available if initialized)
-        if getattr(app.state, "_initialized", False):
-            primary_model = _get_model_name(app.state._config_path)
-            if primary_model:
-                models.append({
-                    "name": primary_model,
-                    "is_default": True,
-                })
-        
-        # Secondary model
-        if getattr(app.state, "_initialized2", False) and app.state._config_path2:
-            secondary_model = _get_model_name(app.state._config_path2)
-            if secondary_model:
-                models.append({
-                    "name": secondary_model,
-                    "is_default": False,
-                })
-        
-        # Third model
-        if getattr(app.state, "_initialized3", False) and app.state._config_path3:
-            third_model = _get_model_name(app.state._config_path3)
-            if third_model:
-                models.append({
-                    "name": third_model,
-                    "is_default": False,
-                })
-        
+        for name in pool.models():
+            replicas = [r for r in pool.ready() if r.model == name]
+            models.append({
+                "name": name,
+                "is_default": name == default_model,
+                "devices": [r.device for r in replicas],
+            })
+
         return _wrap_response({
             "models": models,
             "default_model": models[0]["name"] if models else None,
@@ -2390,10 +2883,13 @@ def create_app() -> FastAPI:
             return _wrap_response(None, code=500, error=f"format_sample error: {str(e)}")
 
     @app.get("/v1/audio")
-    async def get_audio(path: str, request: Request, _: None = Depends(verify_api_key)):
-        """Serve audio file by path."""
-        from fastapi.responses import FileResponse
-
+    async def get_audio(
+        path: str,
+        request: Request,
+        format: Optional[str] = None,
+        _: None = Depends(verify_api_key),
+    ):
+        """Serve audio file by path, optionally as another format, with Range/ETag support."""
         # Security: Validate path is within allowed directory to prevent path traversal
         resolved_path = os.path.realpath(path)
         allowed_dir = os.path.realpath(request.app.state.temp_audio_dir)
@@ -2402,16 +2898,20 @@ def create_app() -> FastAPI:
         if not os.path.exists(resolved_path):
             raise HTTPException(status_code=404, detail="Audio file not found")
 
-        ext = os.path.splitext(resolved_path)[1].lower()
-        media_types = {
-            ".mp3": "audio/mpeg",
-            ".wav": "audio/wav",
-            ".flac": "audio/flac",
-            ".ogg": "audio/ogg",
-        }
-        media_type = media_types.get(ext, "audio/mpeg")
+        if format:
+            fmt = format.lower().lstrip(".")
+            if fmt not in VARIANT_FORMATS:
+                raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+            loop = asyncio.get_running_loop()
+            try:
+                # Usually already pre-encoded right after generation
+                resolved_path = await loop.run_in_executor(
+                    None, request.app.state.audio_encoder.get, resolved_path, fmt
+                )
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Failed to encode audio as {fmt}: {e}")
 
-        return FileResponse(resolved_path, media_type=media_type)
+        return audio_file_response(request, resolved_path, max_age=AUDIO_CACHE_MAX_AGE)
 
     return app
 
@@ -2461,6 +2961,13 @@ def main() -> None:
         default=os.getenv("ACESTEP_LM_MODEL_PATH", ""),
         help="LM model to load (e.g., 'acestep-5Hz-lm-0.6B'). Default from ACESTEP_LM_MODEL_PATH.",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("ACESTEP_UVICORN_WORKERS", "1")),
+        help="Number of uvicorn worker processes sharing the SQLite job queue "
+             "(default from ACESTEP_UVICORN_WORKERS or 1). Each worker loads its own models.",
+    )
     args = parser.parse_args()
 
     # Set API key from command line argument
@@ -2482,13 +2989,14 @@ def main() -> None:
         os.environ["ACESTEP_LM_MODEL_PATH"] = args.lm_model_path
         print(f"[API Server] Using LM model: {args.lm_model_path}")
 
-    # IMPORTANT: in-memory queue/store -> workers MUST be 1
+    # Jobs live in the SQLite store (ACESTEP_JOB_DB), so any worker can accept a
+    # request and any worker can run it; only streaming jobs stay on their process.
     uvicorn.run(
         "acestep.api_server:app",
         host=str(args.host),
         port=int(args.port),
         reload=False,
-        workers=1,
+        workers=max(1, int(args.workers)),
     )
 
 if __name__ == "__main__":
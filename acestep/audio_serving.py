@@ -0,0 +1,230 @@
+"""HTTP serving of generated audio files
+
+Shared by the API server and the OpenRouter server:
+
+- ``audio_file_response`` answers a download with ``ETag``/``Last-Modified``
+  validators (the ETag is derived from the deterministic audio UUID in the
+  file name), ``304 Not Modified`` for revalidations and single byte-range
+  ``206 Partial Content`` responses so players can seek.
+- ``AudioVariantEncoder`` transcodes lossless outputs (FLAC/WAV) to MP3/Opus on
+  a background thread right after generation, so a download in another format
+  normally finds the variant already on disk instead of blocking on ffmpeg.
+"""
+
+import email.utils
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from loguru import logger
+
+from acestep.audio_utils import AudioSaver
+
+
+AUDIO_MEDIA_TYPES: Dict[str, str] = {
+    ".mp3": "audio/mpeg",
+    ".wav": "audio/wav",
+    ".flac": "audio/flac",
+    ".ogg": "audio/ogg",
+    ".opus": "audio/ogg",
+}
+
+# Formats a stored output can be served as
+VARIANT_FORMATS = ("mp3", "opus", "flac", "wav")
+LOSSLESS_FORMATS = ("flac", "wav")
+
+_READ_CHUNK_BYTES = 256 * 1024
+
+
+class _RangeNotSatisfiable(Exception):
+    pass
+
+
+def _etag_for(path: str, size: int) -> str:
+    """Strong validator from the file name (the params UUID), format and size."""
+    stem, ext = os.path.splitext(os.path.basename(path))
+    return f'"{stem}-{ext.lstrip(".")}-{size:x}"'
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a ``Range`` header into an inclusive (start, end) byte span.
+
+    Returns None when the header should be ignored (not bytes, malformed or
+    multi-range, which we answer with the whole file).
+    """
+    header = header.strip()
+    if not header.lower().startswith("bytes="):
+        return None
+    spec = header[6:].strip()
+    if "," in spec:
+        return None
+    start_s, sep, end_s = spec.partition("-")
+    if not sep:
+        return None
+    try:
+        if not start_s.strip():
+            suffix = int(end_s)
+            if suffix <= 0:
+                raise _RangeNotSatisfiable()
+            start, end = max(0, size - suffix), size - 1
+        else:
+            start = int(start_s)
+            end = min(int(end_s), size - 1) if end_s.strip() else size - 1
+    except ValueError:
+        return None
+    if start < 0 or start >= size or start > end:
+        raise _RangeNotSatisfiable()
+    return start, end
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(mtime) <= since
+    return False
+
+
+def _iter_file_range(path: str, start: int, length: int) -> Iterator[bytes]:
+    with open(path, "rb") as fh:
+        fh.seek(start)
+        remaining = length
+        while remaining > 0:
+            data = fh.read(min(_READ_CHUNK_BYTES, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+def audio_file_response(request: Request, path: str, max_age: int = 86400) -> Response:
+    """
+    Serve an audio file with caching validators and byte-range support.
+
+    Args:
+        request: Incoming request (conditional and Range headers are read from it)
+        path: Already validated path of the file to serve
+        max_age: ``Cache-Control`` max-age in seconds; outputs never change in place
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Audio file not found")
+
+    media_type = AUDIO_MEDIA_TYPES.get(os.path.splitext(path)[1].lower(), "audio/mpeg")
+    etag = _etag_for(path, st.st_size)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": email.utils.formatdate(st.st_mtime, usegmt=True),
+        "Accept-Ranges": "bytes",
+        "Cache-Control": f"private, max-age={int(max_age)}",
+    }
+
+    if _not_modified(request, etag, st.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and st.st_size > 0 and (if_range is None or if_range.strip() == etag):
+        try:
+            span = _parse_range(range_header, st.st_size)
+        except _RangeNotSatisfiable:
+            headers["Content-Range"] = f"bytes */{st.st_size}"
+            return Response(status_code=416, headers=headers)
+        if span is not None:
+            start, end = span
+            length = end - start + 1
+            headers["Content-Range"] = f"bytes {start}-{end}/{st.st_size}"
+            headers["Content-Length"] = str(length)
+            return StreamingResponse(
+                _iter_file_range(path, start, length),
+                status_code=206,
+                media_type=media_type,
+                headers=headers,
+            )
+
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=st)
+
+
+class AudioVariantEncoder:
+    """
+    Background transcoder producing sibling ``<uuid>.<format>`` files.
+
+    Only lossless sources are pre-encoded (re-encoding MP3 to Opus would stack
+    lossy passes); requests for other conversions are encoded on demand.
+    """
+
+    def __init__(self, formats: Iterable[str] = ("mp3", "opus"), max_workers: int = 1):
+        self.formats = [f for f in (x.strip().lower() for x in formats) if f in VARIANT_FORMATS]
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="acestep-audio-encode")
+        self._pending: Dict[str, Future] = {}
+        self._lock = Lock()
+        self._saver = AudioSaver()
+
+    @staticmethod
+    def variant_path(path: str, fmt: str) -> str:
+        return f"{os.path.splitext(path)[0]}.{fmt}"
+
+    def _encode(self, path: str, fmt: str) -> str:
+        out_path = self.variant_path(path, fmt)
+        if os.path.exists(out_path):
+            return out_path
+        # Encode next to the target and rename, so readers never see a partial file
+        tmp_path = f"{os.path.splitext(path)[0]}.{os.getpid()}.partial.{fmt}"
+        try:
+            self._saver.convert_audio(path, tmp_path, fmt)
+            os.replace(tmp_path, out_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        logger.debug(f"[AudioVariantEncoder] Encoded {out_path}")
+        return out_path
+
+    def submit(self, path: str, fmt: str) -> Future:
+        """Queue one conversion; concurrent requests for the same variant share a future."""
+        key = self.variant_path(path, fmt)
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+            future = self._executor.submit(self._encode, path, fmt)
+            self._pending[key] = future
+
+        def _done(_: Future) -> None:
+            with self._lock:
+                self._pending.pop(key, None)
+
+        future.add_done_callback(_done)
+        return future
+
+    def schedule(self, path: str) -> None:
+        """Pre-encode the configured formats of a freshly written lossless output."""
+        ext = os.path.splitext(path)[1].lower().lstrip(".")
+        if ext not in LOSSLESS_FORMATS:
+            return
+        for fmt in self.formats:
+            if fmt != ext and not os.path.exists(self.variant_path(path, fmt)):
+                self.submit(path, fmt)
+
+    def get(self, path: str, fmt: str) -> str:
+        """Blocking: path of the ``fmt`` variant, waiting for or running its encode."""
+        if os.path.splitext(path)[1].lower().lstrip(".") == fmt:
+            return path
+        out_path = self.variant_path(path, fmt)
+        if os.path.exists(out_path):
+            return out_path
+        return self.submit(path, fmt).result()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
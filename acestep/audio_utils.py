@@ -10,6 +10,7 @@ Independent audio file operations outside of handler, supporting:
 import os
 import hashlib
 import json
+import struct
 from pathlib import Path
 from typing import Union, Optional, List, Tuple
 import torch
@@ -26,10 +27,10 @@ class AudioSaver:
         Initialize audio saver
         
         Args:
-            default_format: Default save format ('flac', 'wav', 'mp3')
+            default_format: Default save format ('flac', 'wav', 'mp3', 'opus')
         """
         self.default_format = default_format.lower()
-        if self.default_format not in ["flac", "wav", "mp3"]:
+        if self.default_format not in ["flac", "wav", "mp3", "opus"]:
             logger.warning(f"Unsupported format {default_format}, using 'flac'")
             self.default_format = "flac"
     
@@ -48,20 +49,20 @@ class AudioSaver:
             audio_data: Audio data, torch.Tensor [channels, samples] or numpy.ndarray
             output_path: Output file path (extension can be omitted)
             sample_rate: Sample rate
-            format: Audio format ('flac', 'wav', 'mp3'), defaults to default_format
+            format: Audio format ('flac', 'wav', 'mp3', 'opus'), defaults to default_format
             channels_first: If True, tensor format is [channels, samples], else [samples, channels]
         
         Returns:
             Actual saved file path
         """
         format = (format or self.default_format).lower()
-        if format not in ["flac", "wav", "mp3"]:
+        if format not in ["flac", "wav", "mp3", "opus"]:
             logger.warning(f"Unsupported format {format}, using {self.default_format}")
             format = self.default_format
         
         # Ensure output path has correct extension
         output_path = Path(output_path)
-        if output_path.suffix.lower() not in ['.flac', '.wav', '.mp3']:
+        if output_path.suffix.lower() not in ['.flac', '.wav', '.mp3', '.opus']:
             output_path = output_path.with_suffix(f'.{format}')
         
         # Convert to torch tensor
@@ -87,8 +88,8 @@ class AudioSaver:
         
         # Select backend and save
         try:
-            if format == "mp3":
-                # MP3 uses ffmpeg backend
+            if format in ["mp3", "opus"]:
+                # MP3 and Opus (Ogg container) use ffmpeg backend
                 torchaudio.save(
                     str(output_path),
                     audio_tensor,
@@ -141,7 +142,7 @@ class AudioSaver:
         Args:
             input_path: Input audio file path
             output_path: Output audio file path
-            output_format: Target format ('flac', 'wav', 'mp3')
+            output_format: Target format ('flac', 'wav', 'mp3', 'opus')
             remove_input: Whether to delete input file
         
         Returns:
@@ -238,8 +239,12 @@ def get_audio_file_hash(audio_file) -> str:
     try:
         if isinstance(audio_file, str):
             if os.path.exists(audio_file):
+                # Stream in chunks so large files are not read into memory at once
+                h = hashlib.md5()
                 with open(audio_file, 'rb') as f:
-                    return hashlib.md5(f.read()).hexdigest()
+                    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                        h.update(chunk)
+                return h.hexdigest()
             return hashlib.md5(audio_file.encode('utf-8')).hexdigest()
         elif hasattr(audio_file, 'name'):
             return hashlib.md5(str(audio_file.name).encode('utf-8')).hexdigest()
@@ -297,6 +302,46 @@ def generate_uuid_from_audio_data(
     return data_hash
 
 
+def pcm16_wav_header(sample_rate: int, channels: int, num_frames: Optional[int] = None) -> bytes:
+    """
+    Build a 44-byte 16-bit PCM WAV header
+    
+    Args:
+        sample_rate: Sample rate
+        channels: Number of channels
+        num_frames: Number of frames that follow; None writes the maximum sizes
+            so players accept a stream of unknown length
+    
+    Returns:
+        Header bytes
+    """
+    block_align = channels * 2
+    if num_frames is None:
+        data_size = 0xFFFFFFFF - 36
+    else:
+        data_size = num_frames * block_align
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", data_size + 36, b"WAVE",
+        b"fmt ", 16, 1, channels, sample_rate, sample_rate * block_align, block_align, 16,
+        b"data", data_size,
+    )
+
+
+def audio_to_pcm16_bytes(audio: torch.Tensor) -> bytes:
+    """
+    Convert a float audio tensor [channels, samples] to interleaved 16-bit PCM bytes
+    
+    Args:
+        audio: Float tensor in [-1, 1], [channels, samples]
+    
+    Returns:
+        Little-endian interleaved PCM bytes
+    """
+    pcm = (audio.detach().float().cpu().clamp(-1.0, 1.0) * 32767.0).round().to(torch.int16)
+    return pcm.transpose(0, 1).contiguous().numpy().tobytes()
+
+
 # Global default instance
 _default_saver = AudioSaver(default_format="flac")
 
@@ -1,6 +1,10 @@
 
+import copy
+import hashlib
+import json
+import time
 from enum import Enum, auto
-from typing import Optional, Dict, Any, Tuple, List, Callable, Set
+from typing import Optional, Dict, Any, Tuple, List, Callable, Set, Union
 from loguru import logger
 from transformers import AutoTokenizer
 from transformers.generation.logits_process import LogitsProcessor
@@ -86,6 +90,7 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
         genres_vocab_path: Optional[str] = None,
         skip_genres: bool = True,
         max_duration: Optional[int] = None,
+        cache_dir: Optional[str] = None,
     ):
         """
         Initialize the constrained logits processor.
@@ -99,6 +104,8 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
             genres_vocab_path: Path to genres vocabulary file
             skip_genres: Whether to skip genres field generation
             max_duration: Maximum duration in seconds (default: DURATION_MAX from constants)
+            cache_dir: Directory for the compiled genres automaton (default: .cache/acestep/genres_automaton
+                       under the project root)
         """
         self.tokenizer = tokenizer
         self.enabled = enabled
@@ -171,11 +178,18 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
         self.genres_trie: Dict = {}  # Trie for full vocab (fallback)
         self.caption_genres_trie: Dict = {}  # Trie for caption-matched genres (priority)
         self.caption_matched_genres: List[str] = []  # Genres matched from caption
+        # Token-level automata compiled from the tries: genre prefix -> sorted allowed next token IDs
+        self.genres_automaton: Dict[str, List[int]] = {}
+        self.caption_genres_automaton: Dict[str, List[int]] = {}
+        self.genres_cache_dir = cache_dir or os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "acestep", "genres_automaton"
+        )
         
         self._char_to_tokens: Dict[str, set] = {}  # Precomputed char -> token IDs mapping
         
         # Precompute token mappings once (O(vocab_size), runs once at init)
         self._precompute_char_token_mapping()
+        self._build_genres_token_index()
         
         # Field definitions (needed before building prefix trees)
         # Note: duration max uses self.max_duration which can be dynamically updated based on GPU config
@@ -215,6 +229,9 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
         
         # Build language prefix tree (similar to keyscale but for language codes)
         self.language_prefix_tree = self._build_language_prefix_tree()
+        
+        # Prefix trees compiled to per-node whitelist index tensors, per device (see compile_token_tables)
+        self._compiled_tables: Dict[torch.device, Dict[str, Dict[Tuple[int, ...], torch.Tensor]]] = {}
 
         self._load_genres_vocab()
         
@@ -515,6 +532,10 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
         self.audio_code_mask: Optional[torch.Tensor] = None
         # Inverse mask: block all non-audio-code tokens (for CODES_GENERATION state)
         self.non_audio_code_mask: Optional[torch.Tensor] = None
+        # Sorted allowed ids (audio codes + EOS) for restricted-vocabulary decoding in CODES_GENERATION,
+        # and the position of EOS inside that reduced row
+        self.codes_vocab_ids: Optional[torch.Tensor] = None
+        self.codes_vocab_eos_index: Optional[int] = None
         self._build_audio_code_mask()
         
         # Build valid keyscales set (prefix tree will be built after _char_to_tokens is initialized)
@@ -597,6 +618,8 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
         if not self.audio_code_token_ids:
             self.audio_code_mask = None
             self.non_audio_code_mask = None
+            self.codes_vocab_ids = None
+            self.codes_vocab_eos_index = None
             return
         
         # Create mask tensor: 0 everywhere, -inf at audio code positions
@@ -622,6 +645,13 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
         
         self.non_audio_code_mask = inverse_mask
         
+        # Same allowed set as an explicit id list, so the engine can compute logits for it alone
+        codes_vocab = sorted(self.audio_code_token_ids)
+        if self.eos_token_id is not None and self.eos_token_id not in self.audio_code_token_ids:
+            codes_vocab = sorted(codes_vocab + [self.eos_token_id])
+        self.codes_vocab_ids = torch.tensor(codes_vocab, dtype=torch.long)
+        self.codes_vocab_eos_index = codes_vocab.index(self.eos_token_id) if self.eos_token_id is not None else None
+        
         if self.debug:
             logger.debug(f"Built audio code masks for {len(self.audio_code_token_ids)} tokens")
 
@@ -635,15 +665,27 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
         
         Args:
             scores: [1, vocab_size] scores tensor to modify inplace
-            allowed_tokens: List of token IDs to allow (all others will be set to -inf)
+            allowed_tokens: List of token IDs to allow (all others will be set to -inf), or a
+                precompiled index tensor on the scores device (see compile_token_tables)
         """
-        if not allowed_tokens:
+        if len(allowed_tokens) == 0:
             # No tokens allowed, set all to -inf
             scores.fill_(float('-inf'))
             return
         
+        if not isinstance(allowed_tokens, torch.Tensor) and len(allowed_tokens) == 1:
+            # Single forced token: plain indexing, no index tensor needed
+            token_id = allowed_tokens[0]
+            saved_value = scores[0, token_id].clone()
+            scores.fill_(float('-inf'))
+            scores[0, token_id] = saved_value
+            return
+        
         # Save the original values of allowed tokens
-        allowed_indices = torch.tensor(allowed_tokens, device=scores.device, dtype=torch.long)
+        if isinstance(allowed_tokens, torch.Tensor):
+            allowed_indices = allowed_tokens
+        else:
+            allowed_indices = torch.tensor(allowed_tokens, device=scores.device, dtype=torch.long)
         saved_values = scores[0, allowed_indices].clone()
         
         # Set all scores to -inf
@@ -954,6 +996,7 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
                 self.genres_vocab = genres
                 self.genres_vocab_mtime = mtime
                 self._build_genres_trie()
+                self._load_genres_automaton()
                 
                 if self.debug:
                     logger.debug(f"Loaded {len(self.genres_vocab)} genres from {self.genres_vocab_path}")
@@ -980,6 +1023,131 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
         if self.debug:
             logger.debug(f"Built genres trie with {len(self.genres_vocab)} entries")
     
+    def _genres_automaton_cache_path(self) -> str:
+        """Cache file for the genres automaton, keyed by tokenizer texts and genres vocab content."""
+        digest = hashlib.sha256()
+        digest.update(f"v2|{self.vocab_size}|{self.newline_token}|".encode("utf-8"))
+        for token_id, text in self._token_to_text.items():
+            digest.update(f"{token_id}\x00{text}\x01".encode("utf-8", "surrogatepass"))
+        digest.update("\n".join(self.genres_vocab).encode("utf-8"))
+        return os.path.join(self.genres_cache_dir, f"{digest.hexdigest()[:32]}.json")
+    
+    def _load_genres_automaton(self):
+        """
+        Load the full-vocab genres automaton from the disk cache, or compile and cache it.
+        
+        Compiling walks every trie node against the tokenizer vocabulary, which is slow for
+        large genre lists, so the result is reused across server restarts. The cache key
+        covers the tokenizer texts and the vocab file content, so edits or a different
+        tokenizer trigger a rebuild.
+        """
+        cache_path = self._genres_automaton_cache_path()
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                automaton = json.load(f)
+            if not isinstance(automaton, dict) or not all(
+                isinstance(ids, list) and all(isinstance(i, int) for i in ids) for ids in automaton.values()
+            ):
+                raise ValueError("expected a mapping of prefixes to token id lists")
+            self.genres_automaton = automaton
+            if self.debug:
+                logger.debug(f"Loaded genres automaton ({len(self.genres_automaton)} nodes) from {cache_path}")
+            return
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable genres automaton cache {cache_path}: {e}")
+        
+        start = time.time()
+        self.genres_automaton = self._build_genres_automaton(self.genres_trie)
+        logger.info(f"Built genres automaton ({len(self.genres_automaton)} nodes) in {time.time() - start:.2f}s")
+        try:
+            os.makedirs(self.genres_cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.genres_automaton, f, separators=(",", ":"))
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.warning(f"Failed to cache genres automaton: {e}")
+    
+    def _build_genres_automaton(self, trie: Dict) -> Dict[str, List[int]]:
+        """
+        Compile a character trie of genres into a token-level automaton.
+        
+        Maps every reachable trie node (by its prefix string, as seen by the FSM after strip)
+        to the sorted token IDs allowed next, with the same rules the per-step search used:
+        - tokens whose normalized text extends the prefix to another trie node
+        - whitespace-only tokens, when a space or comma may follow
+        - newline, when the prefix is a complete genre
+        
+        Tokens come from the index built once by _build_genres_token_index, so each node only
+        checks the tokens that can match its next two characters, and compiling a small
+        caption trie costs time proportional to that trie rather than to the vocabulary.
+        
+        Args:
+            trie: Character trie built by _build_genres_trie (or the caption-matched trie)
+            
+        Returns:
+            Dict mapping genre prefix -> sorted list of allowed next token IDs
+        """
+        singles, buckets, whitespace = self._genres_token_index
+        automaton: Dict[str, List[int]] = {}
+        stack = [("", trie)]
+        while stack:
+            prefix, node = stack.pop()
+            next_chars = [k for k in node if k not in ('_end', '_tokens')]
+            allowed = set()
+            allow_whitespace = ' ' in next_chars or ',' in next_chars
+            for char in next_chars:
+                child = node[char]
+                stack.append((prefix + char, child))
+                allowed.update(singles.get(char, ()))
+                if allow_whitespace:
+                    allowed.update(whitespace.get(char, ()))
+                for char2, grandchild in child.items():
+                    if char2 in ('_end', '_tokens'):
+                        continue
+                    for token_id, rest in buckets.get(char + char2, ()):
+                        walk = grandchild
+                        for c in rest:
+                            walk = walk.get(c)
+                            if walk is None:
+                                break
+                        else:
+                            allowed.add(token_id)
+            if node.get('_end', False) and self.newline_token:
+                allowed.add(self.newline_token)
+            # The FSM strips the accumulated value, so prefixes ending in whitespace are never looked up
+            if prefix == prefix.rstrip():
+                automaton[prefix] = sorted(allowed)
+        return automaton
+    
+    def _build_genres_token_index(self):
+        """
+        Index the tokenizer vocabulary for compiling genre tries (runs once at init).
+        
+        Builds three lookups used by _build_genres_automaton:
+        - singles: single-character token text -> token IDs
+        - buckets: first two characters -> (token ID, remaining text) for longer tokens
+        - whitespace: raw first character -> whitespace-only token IDs
+        """
+        singles: Dict[str, List[int]] = {}
+        buckets: Dict[str, List[Tuple[int, str]]] = {}
+        for token_id, text in self._token_to_text.items():
+            if not text.strip():
+                continue  # Whitespace-only tokens are matched by their raw first character below
+            if len(text) == 1:
+                singles.setdefault(text, []).append(token_id)
+            else:
+                buckets.setdefault(text[:2], []).append((token_id, text[2:]))
+        whitespace = {
+            char: [t for t in token_ids if not self._token_to_text.get(t, "x").strip()]
+            for char, token_ids in self._char_to_tokens.items() if not char.strip()
+        }
+        self._genres_token_index: Tuple[
+            Dict[str, List[int]], Dict[str, List[Tuple[int, str]]], Dict[str, List[int]]
+        ] = (singles, buckets, whitespace)
+    
     def _extract_caption_genres(self, caption: str):
         """
         Extract genres from the user's caption that match entries in the vocabulary.
@@ -1032,6 +1200,8 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
                     node[char] = {}
                 node = node[char]
             node['_end'] = True
+        # Only walks the caption trie; the vocabulary index is shared and built once at init
+        self.caption_genres_automaton = self._build_genres_automaton(self.caption_genres_trie)
         
         if self.debug:
             logger.debug(f"Matched {len(matched_genres)} genres from caption: {list(matched_genres)[:5]}...")
@@ -1136,116 +1306,37 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
         node = self._get_genres_trie_node(text.strip())
         return node is not None and node.get('_end', False)
     
-    def _get_trie_node_from_trie(self, trie: Dict, prefix: str) -> Optional[Dict]:
-        """Get a trie node from a specific trie (helper for caption vs full trie)."""
-        node = trie
-        for char in prefix.lower():
-            if char not in node:
-                return None
-            node = node[char]
-        return node
-
     def _get_allowed_genres_tokens(self) -> List[int]:
         """
-        Get allowed tokens for genres field based on trie matching.
+        Get allowed tokens for genres field from the precompiled token-level automaton.
         
         The entire genres string (including commas) must match a complete entry in the vocab.
         For example, if vocab contains "pop, rock, jazz", the generated string must exactly
         match that entry - we don't treat commas as separators for individual genres.
         
         Strategy:
-        1. If caption-matched genres exist, use that smaller trie first (faster + more relevant)
-        2. If no caption matches or prefix not in caption trie, fallback to full vocab trie
-        3. Get valid next characters from current trie node
-        4. For each candidate token, verify the full decoded text forms a valid trie prefix
+        1. If caption-matched genres exist and contain the current prefix, use that smaller
+           automaton (faster + more relevant)
+        2. Otherwise fall back to the full vocab automaton
+        3. The allowed next tokens of each prefix are precomputed (see _build_genres_automaton),
+           so each step is a single dict lookup
         """
         if not self.genres_vocab:
             # No vocab loaded, allow all except newline if empty
             return []
         
         # Use the full accumulated value (don't split by comma - treat as single entry)
-        accumulated = self.accumulated_value.lower()
-        current_genre_prefix = accumulated.strip()
-        
-        # Determine which trie to use: caption-matched (priority) or full vocab (fallback)
-        use_caption_trie = False
-        current_node = None
-        
-        # Try caption-matched trie first if available
-        if self.caption_genres_trie:
-            if current_genre_prefix == "":
-                current_node = self.caption_genres_trie
-                use_caption_trie = True
-            else:
-                current_node = self._get_trie_node_from_trie(self.caption_genres_trie, current_genre_prefix)
-                if current_node is not None:
-                    use_caption_trie = True
-        
-        # Fallback to full vocab trie
-        if current_node is None:
-            if current_genre_prefix == "":
-                current_node = self.genres_trie
-            else:
-                current_node = self._get_genres_trie_node(current_genre_prefix)
+        current_genre_prefix = self.accumulated_value.lower().strip()
         
-        if current_node is None:
+        allowed = self.caption_genres_automaton.get(current_genre_prefix)
+        if allowed is None:
+            allowed = self.genres_automaton.get(current_genre_prefix)
+        if allowed is None:
             # Invalid prefix, force newline to end
             if self.newline_token:
                 return [self.newline_token]
             return []
-        
-        # Get valid next characters from trie node
-        valid_next_chars = set(k for k in current_node.keys() if k not in ('_end', '_tokens'))
-        
-        # If current value is a complete genre, allow newline to end
-        is_complete = current_node.get('_end', False)
-        
-        if not valid_next_chars:
-            # No more characters to match, only allow newline if complete
-            allowed = set()
-            if is_complete and self.newline_token:
-                allowed.add(self.newline_token)
-            return list(allowed)
-        
-        # Collect candidate tokens based on first character
-        candidate_tokens = set()
-        for char in valid_next_chars:
-            if char in self._char_to_tokens:
-                candidate_tokens.update(self._char_to_tokens[char])
-        
-        # Select the appropriate trie for validation
-        active_trie = self.caption_genres_trie if use_caption_trie else self.genres_trie
-        
-        # Validate each candidate token: check if prefix + decoded_token is a valid trie prefix
-        allowed = set()
-        for token_id in candidate_tokens:
-            # Use precomputed decoded text (already normalized)
-            decoded_normalized = self._token_to_text.get(token_id, "")
-            
-            if not decoded_normalized or not decoded_normalized.strip():
-                # Token decodes to empty or only whitespace - allow if space/comma is a valid next char
-                if ' ' in valid_next_chars or ',' in valid_next_chars:
-                    allowed.add(token_id)
-                continue
-            
-            # Build new prefix by appending decoded token
-            # Handle space-prefixed tokens (e.g., " rock" from "pop rock")
-            if decoded_normalized.startswith(' ') or decoded_normalized.startswith(','):
-                # Token has leading space/comma - append directly
-                new_prefix = current_genre_prefix + decoded_normalized
-            else:
-                new_prefix = current_genre_prefix + decoded_normalized
-            
-            # Check if new_prefix is a valid prefix in the active trie
-            new_node = self._get_trie_node_from_trie(active_trie, new_prefix)
-            if new_node is not None:
-                allowed.add(token_id)
-        
-        # If current value is a complete genre, also allow newline
-        if is_complete and self.newline_token:
-            allowed.add(self.newline_token)
-        
-        return list(allowed)
+        return allowed
     
     def reset(self):
         """Reset the processor state for a new generation."""
@@ -1261,6 +1352,25 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
         self.caption_ending = False  # Reset caption ending tracking
         self.pending_field_name = ""  # Reset pending field name
     
+    def clone(self) -> "MetadataConstrainedLogitsProcessor":
+        """
+        Return a copy with its own FSM state that shares the precomputed token tables.
+        The device -> tables mapping is copied, so recompiling on one copy leaves the others as is.
+        
+        The copy keeps the current settings (generation phase, user metadata, target duration,
+        phase temperatures), so a configured processor can be cloned once per sequence in a
+        batch and each copy then advances independently.
+        """
+        other = copy.copy(self)
+        other.user_provided_metadata = dict(self.user_provided_metadata)
+        other.next_state = dict(self.next_state)
+        other.accumulated_token_ids = list(self.accumulated_token_ids)
+        other.user_field_token_queue = list(self.user_field_token_queue)
+        # set_max_duration() on a clone must not change the others' duration spec and tables
+        other.field_specs = {field: dict(spec) for field, spec in self.field_specs.items()}
+        other._compiled_tables = dict(self._compiled_tables)
+        return other
+    
     def set_target_duration(self, duration: Optional[float]):
         """
         Set the target duration for codes generation.
@@ -1308,6 +1418,10 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
             context_prefix_for_tokenization="duration: "
         )
         
+        # Compiled whitelists are stale now; recompile on the devices that had them
+        for device in list(self._compiled_tables):
+            self.compile_token_tables(device)
+        
         if self.debug:
             logger.debug(f"Updated max duration: {old_max}s -> {max_duration}s, rebuilt prefix tree with {len(self.valid_duration_values)} values")
     
@@ -1420,27 +1534,6 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
         
         return [self.digit_tokens[d] for d in allowed if d in self.digit_tokens]
     
-    def _get_allowed_numeric_tokens(self, prefix_tree: Dict[Tuple[int, ...], Set[int]]) -> List[int]:
-        """
-        Get allowed tokens for numeric field using the precomputed prefix tree.
-        
-        IMPORTANT: Uses token ID sequence as key (not string) to avoid tokenization mismatches.
-        
-        Args:
-            prefix_tree: Precomputed prefix tree mapping token ID sequence -> set of allowed token IDs
-            
-        Returns:
-            List of allowed token IDs for current accumulated_token_ids
-        """
-        token_prefix = tuple(self.accumulated_token_ids)
-        
-        if token_prefix in prefix_tree:
-            return list(prefix_tree[token_prefix])
-        
-        # No valid continuation found - return empty list
-        # The caller will handle this by forcing newline to end the field
-        return []
-    
     def _should_end_numeric_field(self, logits: torch.Tensor, min_val: int, max_val: int) -> bool:
         """
         Determine if we should end the current numeric field.
@@ -1490,21 +1583,6 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
         
         return newline_prob > max_other_prob
     
-    def _get_allowed_keyscale_tokens(self) -> List[int]:
-        """
-        Get allowed tokens for keyscale field using the precomputed prefix tree.
-        Uses token ID sequence as key (not string) to avoid tokenization mismatches.
-        """
-        # Use token ID sequence as key
-        token_prefix = tuple(self.accumulated_token_ids)
-        
-        if token_prefix in self.keyscale_prefix_tree:
-            return list(self.keyscale_prefix_tree[token_prefix])
-        
-        # Fallback: if we somehow drifted off (shouldn't happen with constrained decoding),
-        # return empty to force newline logic or stop.
-        return []
-    
     def _is_keyscale_complete(self) -> bool:
         """
         Check if keyscale value is complete and valid.
@@ -1516,33 +1594,78 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
             return self.newline_token in self.keyscale_prefix_tree[token_prefix]
         return False
     
-    def _get_allowed_language_tokens(self) -> List[int]:
+    def compile_token_tables(self, device: Union[str, torch.device]) -> None:
         """
-        Get allowed tokens for language field using the precomputed prefix tree.
-        Uses token ID sequence as key (not string) to avoid tokenization mismatches.
-        Similar to keyscale.
-        """
-        token_prefix = tuple(self.accumulated_token_ids)
+        Precompile the BPM, duration, keyscale, language and timesignature prefix trees into
+        one whitelist index tensor per (field, token prefix) node on the given device.
         
-        if token_prefix in self.language_prefix_tree:
-            return list(self.language_prefix_tree[token_prefix])
+        The grammar of these fields is finite, so every reachable node is known up front.
+        Constrained steps in those states then look up a ready tensor instead of building a
+        Python list of allowed ids and copying it to the device. Called once per device
+        (lazily on first use otherwise); clones share the compiled tables.
         
-        # Fallback: no valid continuation found
-        return []
+        Args:
+            device: Device the logits will live on (e.g. "cuda" or "cpu")
+        """
+        # Resolve "cuda" to the concrete device index so lookups by scores.device match
+        device = torch.empty(0, device=device).device
+        newline = [self.newline_token] if self.newline_token is not None else []
+        trees = {
+            "bpm": self.bpm_prefix_tree,
+            "duration": self.duration_prefix_tree,
+            "keyscale": self.keyscale_prefix_tree,
+            "language": self.language_prefix_tree,
+            "timesignature": self.timesig_prefix_tree,
+        }
+        tables = {}
+        for field, tree in trees.items():
+            table = {}
+            for prefix, allowed in tree.items():
+                if field in ("bpm", "duration") or self.newline_token not in allowed:
+                    # Numeric fields keep newline alongside digits; the others offer
+                    # continuations only until the value is complete
+                    tokens = sorted(allowed)
+                else:
+                    # Complete keyscale/language/timesignature value: only newline
+                    tokens = newline
+                if not tokens and field in ("keyscale", "language"):
+                    # Dead end in the tree: force newline to end the field
+                    tokens = newline
+                table[prefix] = torch.tensor(tokens, dtype=torch.long, device=device)
+            tables[field] = table
+        # Lookups that fall off the tree: keyscale/language force newline, numeric fields block all
+        tables["fallback"] = {
+            "bpm": torch.tensor([], dtype=torch.long, device=device),
+            "duration": torch.tensor([], dtype=torch.long, device=device),
+            "keyscale": torch.tensor(newline, dtype=torch.long, device=device),
+            "language": torch.tensor(newline, dtype=torch.long, device=device),
+            "timesignature": torch.tensor([], dtype=torch.long, device=device),
+        }
+        self._compiled_tables[device] = tables
+        if self.debug:
+            num_nodes = sum(len(tables[field]) for field in trees)
+            logger.debug(f"Compiled {num_nodes} constrained decoding whitelist nodes on {device}")
     
-    def _get_allowed_timesig_tokens(self) -> List[int]:
-        """
-        Get allowed tokens for timesignature field using the precomputed prefix tree.
-        Uses token ID sequence as key (not string) to avoid tokenization mismatches.
+    def _node_whitelist(self, field: str, device: torch.device) -> torch.Tensor:
+        """Return the precompiled whitelist for the current token prefix of a field."""
+        tables = self._compiled_tables.get(device)
+        if tables is None:
+            self.compile_token_tables(device)
+            tables = self._compiled_tables[device]
+        allowed = tables[field].get(tuple(self.accumulated_token_ids))
+        return allowed if allowed is not None else tables["fallback"][field]
+    
+    def allowed_token_ids(self) -> Optional[torch.Tensor]:
         """
-        token_prefix = tuple(self.accumulated_token_ids)
-        
-        if token_prefix in self.timesig_prefix_tree:
-            return list(self.timesig_prefix_tree[token_prefix])
+        Return the sorted token ids that may be sampled next, or None for the full vocabulary.
         
-        # No valid continuation found - return empty list
-        # The caller will handle this by forcing newline to end the field
-        return []
+        Only CODES_GENERATION is restricted (audio codes + EOS). The same tensor object is
+        returned on every call so the engine can cache its device copy and weight slices.
+        When the engine honours it, ``__call__`` receives scores of shape [batch, len(ids)].
+        """
+        if not self.enabled or self.state != FSMState.CODES_GENERATION:
+            return None
+        return self.codes_vocab_ids
     
     def __call__(
         self,
@@ -1582,27 +1705,31 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
                     logger.debug("Codes phase: detected </think> in input, skipping to CODES_GENERATION")
         
         if self.state == FSMState.CODES_GENERATION:
+            # Scores may already be restricted to codes_vocab_ids (see allowed_token_ids), in which
+            # case nothing needs masking and EOS lives at its local index in the reduced row
+            restricted = self.codes_vocab_ids is not None and scores.shape[-1] == self.codes_vocab_ids.numel()
+            eos_index = self.codes_vocab_eos_index if restricted else self.eos_token_id
             # Block all non-audio-code tokens (only allow audio codes and EOS)
             # Note: audio_code_token_ids already contains only valid tokens (0-63999 range)
             # because _precompute_audio_code_tokens() filters out invalid tokens during initialization
-            if self.non_audio_code_mask is not None:
+            if not restricted and self.non_audio_code_mask is not None:
                 # Move mask to same device/dtype as scores if needed
                 if self.non_audio_code_mask.device != scores.device or self.non_audio_code_mask.dtype != scores.dtype:
                     self.non_audio_code_mask = self.non_audio_code_mask.to(device=scores.device, dtype=scores.dtype)
                 scores = scores + self.non_audio_code_mask
             
             # Apply duration constraint in codes generation phase
-            if self.target_codes is not None and self.eos_token_id is not None:
+            if self.target_codes is not None and eos_index is not None:
                 if self.codes_count < self.target_codes:
                     # Block EOS token until target codes count is reached
-                    scores[:, self.eos_token_id] = float('-inf')
+                    scores[:, eos_index] = float('-inf')
                     if self.debug:
                         logger.debug(f"Codes generation: {self.codes_count}/{self.target_codes}, blocking EOS")
                 else:
                     # Force EOS token when target codes count is reached - inplace
-                    eos_scores = scores[:, self.eos_token_id].clone()
+                    eos_scores = scores[:, eos_index].clone()
                     scores.fill_(float('-inf'))
-                    scores[:, self.eos_token_id] = eos_scores
+                    scores[:, eos_index] = eos_scores
                     if self.debug:
                         logger.debug(f"Codes generation: {self.codes_count}/{self.target_codes}, forcing EOS")
             return self._apply_temperature_scaling(scores)
@@ -1617,6 +1744,76 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
         # Apply temperature scaling after constraint masking
         return self._apply_temperature_scaling(scores)
     
+    @staticmethod
+    def process_batch(
+        processors: List["MetadataConstrainedLogitsProcessor"],
+        token_ids: List[List[int]],
+        scores: torch.FloatTensor,
+    ) -> torch.FloatTensor:
+        """
+        Apply one processor per row of scores, where each row belongs to its own sequence.
+        
+        Rows whose processor is in CODES_GENERATION are handled together: the audio-code mask
+        is added once for all of them, the duration constraint is applied with row indices and
+        the codes temperatures with a single division. Other rows go through __call__ one by
+        one, and only they get an input_ids tensor built.
+        
+        Args:
+            processors: One processor per row (the same processor may appear on several rows)
+            token_ids: Token IDs (prompt + completion) of each row's sequence
+            scores: [batch_size, vocab_size] logits, or [batch_size, len(codes_vocab_ids)]
+                when the engine restricted the vocabulary
+            
+        Returns:
+            Modified scores
+        """
+        codes_rows = [
+            i for i, processor in enumerate(processors)
+            if processor.enabled and processor.state == FSMState.CODES_GENERATION
+        ]
+        codes_set = set(codes_rows)
+        for i, processor in enumerate(processors):
+            if i not in codes_set:
+                row_input_ids = torch.tensor([token_ids[i]], device=scores.device)
+                scores[i:i+1] = processor(row_input_ids, scores[i:i+1])
+        if not codes_rows:
+            return scores
+        
+        lead = processors[codes_rows[0]]
+        all_rows = len(codes_rows) == len(processors)
+        codes_scores = scores if all_rows else scores[codes_rows]
+        restricted = lead.codes_vocab_ids is not None and scores.shape[-1] == lead.codes_vocab_ids.numel()
+        eos_index = lead.codes_vocab_eos_index if restricted else lead.eos_token_id
+        if not restricted and lead.non_audio_code_mask is not None:
+            if lead.non_audio_code_mask.device != scores.device or lead.non_audio_code_mask.dtype != scores.dtype:
+                lead.non_audio_code_mask = lead.non_audio_code_mask.to(device=scores.device, dtype=scores.dtype)
+            codes_scores = codes_scores + lead.non_audio_code_mask
+        
+        # Duration constraint: block EOS before each row's target, force it once reached
+        if eos_index is not None:
+            block_rows, force_rows = [], []
+            for k, i in enumerate(codes_rows):
+                processor = processors[i]
+                if processor.target_codes is None:
+                    continue
+                (block_rows if processor.codes_count < processor.target_codes else force_rows).append(k)
+            if block_rows:
+                codes_scores[block_rows, eos_index] = float('-inf')
+            if force_rows:
+                eos_scores = codes_scores[force_rows, eos_index].clone()
+                codes_scores[force_rows] = float('-inf')
+                codes_scores[force_rows, eos_index] = eos_scores
+        
+        temperatures = [processors[i].codes_temperature for i in codes_rows]
+        if any(t is not None for t in temperatures):
+            temperatures = [1.0 if t is None else max(t, 1e-6) for t in temperatures]
+            codes_scores = codes_scores / torch.tensor(temperatures, device=scores.device, dtype=codes_scores.dtype).unsqueeze(1)
+        
+        if all_rows:
+            return codes_scores
+        scores[codes_rows] = codes_scores.to(scores.dtype)
+        return scores
+    
     def _input_contains_think_end_tag(self, input_ids: torch.LongTensor) -> bool:
         """
         Check if input contains the </think> closing tag.
@@ -1794,15 +1991,9 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
                     self._apply_whitelist_inplace(scores, [value_tokens[0]])
                     return scores
             
-            # Allow valid numeric tokens using prefix tree (supports multi-digit tokens like "120")
-            allowed = self._get_allowed_numeric_tokens(self.bpm_prefix_tree)
-            
-            # Also allow newline if current token sequence prefix allows it
-            token_prefix = tuple(self.accumulated_token_ids)
-            if token_prefix in self.bpm_prefix_tree and self.newline_token in self.bpm_prefix_tree[token_prefix]:
-                allowed = allowed + [self.newline_token]
-            
-            self._apply_whitelist_inplace(scores, allowed)
+            # Allow valid numeric tokens using prefix tree (supports multi-digit tokens like "120"),
+            # plus newline where the prefix is already a valid value (precompiled per node)
+            self._apply_whitelist_inplace(scores, self._node_whitelist("bpm", scores.device))
         
         elif self.state == FSMState.CAPTION_VALUE:
             # Caption field generation with YAML format support:
@@ -1905,15 +2096,9 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
                         self._apply_whitelist_inplace(scores, [self.newline_token])
             else:
                 # Normal duration generation with range constraint
-                # Allow valid numeric tokens using prefix tree (supports multi-digit tokens like "60", "120")
-                allowed = self._get_allowed_numeric_tokens(self.duration_prefix_tree)
-                
-                # Also allow newline if current token sequence prefix allows it
-                token_prefix = tuple(self.accumulated_token_ids)
-                if token_prefix in self.duration_prefix_tree and self.newline_token in self.duration_prefix_tree[token_prefix]:
-                    allowed = allowed + [self.newline_token]
-                
-                self._apply_whitelist_inplace(scores, allowed)
+                # Allow valid numeric tokens using prefix tree (supports multi-digit tokens like "60", "120"),
+                # plus newline where the prefix is already a valid value (precompiled per node)
+                self._apply_whitelist_inplace(scores, self._node_whitelist("duration", scores.device))
         
         elif self.state == FSMState.GENRES_VALUE:
             # Check if field is user-provided and we haven't started injecting yet
@@ -1972,22 +2157,9 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
                     self._apply_whitelist_inplace(scores, [value_tokens[0]])
                     return scores
             
-            # Check if current token sequence is complete (allows newline)
-            token_prefix = tuple(self.accumulated_token_ids)
-            if token_prefix in self.keyscale_prefix_tree and self.newline_token in self.keyscale_prefix_tree[token_prefix]:
-                # Complete keyscale, allow newline
-                if self.newline_token:
-                    self._apply_whitelist_inplace(scores, [self.newline_token])
-            else:
-                # Not complete, allow valid continuation tokens
-                allowed = self._get_allowed_keyscale_tokens()
-                if allowed:
-                    self._apply_whitelist_inplace(scores, allowed)
-                else:
-                    # No valid tokens found - force newline to end field
-                    # This handles edge cases where keyscale format is unexpected
-                    if self.newline_token:
-                        self._apply_whitelist_inplace(scores, [self.newline_token])
+            # Precompiled node whitelist: newline once the keyscale is complete, valid continuation
+            # tokens otherwise, and newline if the prefix fell off the tree (unexpected format)
+            self._apply_whitelist_inplace(scores, self._node_whitelist("keyscale", scores.device))
         
         elif self.state == FSMState.LANGUAGE_VALUE:
             # Language field: Use top-1 probability language (greedy selection)
@@ -2014,24 +2186,22 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
                 # Get all possible first tokens for all languages
                 empty_prefix = tuple()
                 if empty_prefix in self.language_prefix_tree:
-                    candidate_tokens = list(self.language_prefix_tree[empty_prefix])
+                    candidate_indices = self._node_whitelist("language", scores.device)
                     
-                    if candidate_tokens:
+                    if candidate_indices.numel() > 0:
                         # Find the token with highest probability (top-1) among candidates
                         # Use tensor indexing to get scores of candidate tokens directly
-                        candidate_indices = torch.tensor(candidate_tokens, device=scores.device, dtype=torch.long)
                         candidate_scores = scores[0, candidate_indices]
                         
                         # Get the highest probability token among candidates
-                        best_idx = torch.argmax(candidate_scores).item()
-                        top_token_id = candidate_tokens[best_idx]
+                        top_token_id = candidate_indices[torch.argmax(candidate_scores)].item()
                         
                         # Only allow this top-1 token, block all others
                         self._apply_whitelist_inplace(scores, [top_token_id])
                         
                         if self.debug:
                             top_token_text = self.tokenizer.decode([top_token_id])
-                            logger.debug(f"Language field: selected top-1 token {top_token_id} ({repr(top_token_text)}) from {len(candidate_tokens)} candidates")
+                            logger.debug(f"Language field: selected top-1 token {top_token_id} ({repr(top_token_text)}) from {candidate_indices.numel()} candidates")
                     else:
                         # No valid first tokens found - force newline
                         if self.newline_token:
@@ -2041,22 +2211,9 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
                     if self.newline_token:
                         self._apply_whitelist_inplace(scores, [self.newline_token])
             else:
-                # We've started generating a language, continue with prefix tree constraints
-                # Check if current token sequence is complete (allows newline)
-                token_prefix = tuple(self.accumulated_token_ids)
-                if token_prefix in self.language_prefix_tree and self.newline_token in self.language_prefix_tree[token_prefix]:
-                    # Complete language, allow newline
-                    if self.newline_token:
-                        self._apply_whitelist_inplace(scores, [self.newline_token])
-                else:
-                    # Not complete, allow valid continuation tokens
-                    allowed = self._get_allowed_language_tokens()
-                    if allowed:
-                        self._apply_whitelist_inplace(scores, allowed)
-                    else:
-                        # No valid tokens found - force newline to end field
-                        if self.newline_token:
-                            self._apply_whitelist_inplace(scores, [self.newline_token])
+                # We've started generating a language, continue with prefix tree constraints:
+                # newline once complete, valid continuations otherwise, newline if off the tree
+                self._apply_whitelist_inplace(scores, self._node_whitelist("language", scores.device))
         
         elif self.state == FSMState.TIMESIG_VALUE:
             # Check if field is user-provided and we haven't started injecting yet
@@ -2072,16 +2229,8 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
                     self._apply_whitelist_inplace(scores, [value_tokens[0]])
                     return scores
             
-            # Check if current token sequence is complete (allows newline)
-            token_prefix = tuple(self.accumulated_token_ids)
-            if token_prefix in self.timesig_prefix_tree and self.newline_token in self.timesig_prefix_tree[token_prefix]:
-                # Complete value, allow newline
-                if self.newline_token:
-                    self._apply_whitelist_inplace(scores, [self.newline_token])
-            else:
-                # Not complete, allow valid continuation tokens
-                allowed = self._get_allowed_timesig_tokens()
-                self._apply_whitelist_inplace(scores, allowed)
+            # Precompiled node whitelist: newline once the value is complete, valid continuations otherwise
+            self._apply_whitelist_inplace(scores, self._node_whitelist("timesignature", scores.device))
         
         return scores
     
@@ -10,6 +10,7 @@ import numba
 import torch
 import numpy as np
 import torch.nn.functional as F
+from loguru import logger
 from dataclasses import dataclass, asdict
 from typing import List, Dict, Any, Optional, Tuple, Union
 
@@ -115,6 +116,106 @@ def _backtrace(trace: np.ndarray, N: int, M: int):
     return path[:, path_idx + 1:max_path_len]
 
 
+# ================= DTW Algorithm (Batched Torch Wavefront) =================
+@torch.no_grad()
+def dtw_batch(costs: List[torch.Tensor]) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Batched Dynamic Time Warping on the device of the cost matrices.
+
+    Cells on one anti-diagonal (i + j = d) only depend on the two previous
+    anti-diagonals, so the DP runs as a wavefront of N + M vectorized steps
+    over the whole (padded) batch instead of N * M scalar steps per sample.
+    Costs and tie-breaking match dtw_cpu, so float32 inputs give identical
+    paths. Only the int8 trace is copied to the CPU for the backtrace.
+
+    Args:
+        costs: Cost matrices of shape [N_b, M_b] (sizes may differ, same device)
+
+    Returns:
+        List of (text_indices, time_indices) arrays, as returned by dtw_cpu
+    """
+    if not costs:
+        return []
+    device = costs[0].device
+    sizes = [tuple(c.shape) for c in costs]
+    B = len(costs)
+    N = max(n for n, _ in sizes)
+    M = max(m for _, m in sizes)
+
+    # Cells outside a sample's [N_b, M_b] are never predecessors of cells inside it,
+    # so padding values do not matter
+    x = torch.zeros(B, N, M, dtype=torch.float32, device=device)
+    for b, c in enumerate(costs):
+        x[b, :c.shape[0], :c.shape[1]] = c.to(device=device, dtype=torch.float32)
+
+    # Skewed layout: diag[:, d, i] = cost[i, d - i] and x_diag[:, d, i] = x[i - 1, d - i - 1],
+    # so every wavefront step only touches contiguous slices
+    d_idx = torch.arange(N + M + 1, device=device)[:, None]
+    i_idx = torch.arange(N + 1, device=device)[None, :]
+    j_idx = d_idx - i_idx
+    valid = (i_idx >= 1) & (j_idx >= 1) & (j_idx <= M)
+    flat = torch.where(valid, (i_idx - 1) * M + (j_idx - 1), torch.zeros_like(j_idx))
+    x_diag = x.reshape(B, -1)[:, flat.reshape(-1)].reshape(B, N + M + 1, N + 1)
+
+    diag = torch.full((B, N + M + 1, N + 1), float("inf"), dtype=torch.float32, device=device)
+    diag[:, 0, 0] = 0
+    pick0_diag = torch.zeros((B, N + M + 1, N + 1), dtype=torch.bool, device=device)
+    pick1_diag = torch.zeros_like(pick0_diag)
+
+    for d in range(2, N + M + 1):
+        lo, hi = max(1, d - M), min(N, d - 1)
+        c0 = diag[:, d - 2, lo - 1:hi]  # cost[i - 1, j - 1]
+        c1 = diag[:, d - 1, lo - 1:hi]  # cost[i - 1, j]
+        c2 = diag[:, d - 1, lo:hi + 1]  # cost[i, j - 1]
+        pick0 = (c0 < c1) & (c0 < c2)
+        pick1 = (c1 < c0) & (c1 < c2)
+        diag[:, d, lo:hi + 1] = x_diag[:, d, lo:hi + 1] + torch.where(pick0, c0, torch.where(pick1, c1, c2))
+        pick0_diag[:, d, lo:hi + 1] = pick0
+        pick1_diag[:, d, lo:hi + 1] = pick1
+
+    # Back to the [N + 1, M + 1] trace of dtw_cpu (0: diagonal, 1: up, 2: left)
+    trace_diag = 2 - 2 * pick0_diag.to(torch.int8) - pick1_diag.to(torch.int8)
+    i_grid = torch.arange(N + 1, device=device)[:, None]
+    j_grid = torch.arange(M + 1, device=device)[None, :]
+    trace = trace_diag[:, i_grid + j_grid, i_grid.expand(N + 1, M + 1)]
+
+    trace = trace.cpu().numpy()
+    paths = []
+    for b, (n, m) in enumerate(sizes):
+        path = _backtrace(np.ascontiguousarray(trace[b, :n + 1, :m + 1]), n, m)
+        paths.append((path[0], path[1]))
+    return paths
+
+
+def dtw_paths(costs: List[torch.Tensor], use_wavefront: Optional[bool] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    DTW paths for a batch of cost matrices.
+
+    Uses dtw_batch when the matrices live on an accelerator (no copy of the
+    matrices to the CPU), and the Numba dtw_cpu per sample on the CPU, where it
+    is faster, or if the wavefront fails.
+
+    Args:
+        costs: Cost matrices of shape [N_b, M_b]
+        use_wavefront: Force (True) or disable (False) the batched torch path
+
+    Returns:
+        List of (text_indices, time_indices) arrays
+    """
+    if use_wavefront is None:
+        use_wavefront = bool(costs) and costs[0].device.type != "cpu"
+    if use_wavefront:
+        try:
+            return dtw_batch(costs)
+        except Exception as e:
+            logger.warning(f"Batched DTW failed, falling back to dtw_cpu: {e}")
+    paths = []
+    for c in costs:
+        path = dtw_cpu(c.detach().float().cpu().numpy())
+        paths.append((path[0], path[1]))
+    return paths
+
+
 # ================= Utility Functions =================
 def median_filter(x: torch.Tensor, filter_width: int) -> torch.Tensor:
     """
@@ -171,7 +272,7 @@ class MusicStampsAligner:
             medfilt_width: Median filter width
             
         Returns:
-            Tuple of (calc_matrix, energy_matrix) as numpy arrays
+            Tuple of (calc_matrix, energy_matrix) tensors on the device of weights_stack
         """
         # A. Bidirectional Consensus
         row_prob = F.softmax(weights_stack, dim=-1)  # Token -> Frame
@@ -192,7 +293,7 @@ class MusicStampsAligner:
         processed = processed ** 2
 
         # Energy matrix for confidence
-        energy_matrix = processed.mean(dim=0).cpu().numpy()
+        energy_matrix = processed.mean(dim=0)
         
         # D. Z-Score normalization
         std, mean = torch.std_mean(processed, unbiased=False)
@@ -200,7 +301,7 @@ class MusicStampsAligner:
 
         # E. Median filtering
         weights_processed = median_filter(weights_processed, filter_width=medfilt_width)
-        calc_matrix = weights_processed.mean(dim=0).numpy()
+        calc_matrix = weights_processed.mean(dim=0)
         
         return calc_matrix, energy_matrix
 
@@ -228,7 +329,33 @@ class MusicStampsAligner:
         else:
             weights = attention_matrix.clone()
 
-        weights = weights.cpu().float()
+        calc_matrix, energy_matrix, visual_matrix = self._preprocess_attention_tensor(
+            weights.cpu(), custom_config, violence_level, medfilt_width
+        )
+        if calc_matrix is None:
+            return None, None, None
+        return calc_matrix.numpy(), energy_matrix.numpy(), visual_matrix.numpy()
+
+    def _preprocess_attention_tensor(
+        self,
+        attention_matrix: torch.Tensor,
+        custom_config: Dict[int, List[int]],
+        violence_level: float,
+        medfilt_width: int = 7
+    ) -> tuple:
+        """
+        Preprocess attention matrix on its own device.
+
+        Args:
+            attention_matrix: Attention tensor [Layers, Heads, Tokens, Frames]
+            custom_config: Dict mapping layer indices to head indices
+            violence_level: Denoising strength
+            medfilt_width: Median filter width
+
+        Returns:
+            Tuple of (calc_matrix, energy_matrix, visual_matrix) tensors
+        """
+        weights = attention_matrix.float()
 
         selected_tensors = []
         for layer_idx, head_indices in custom_config.items():
@@ -242,7 +369,7 @@ class MusicStampsAligner:
 
         # Stack selected heads: [Heads, Tokens, Frames]
         weights_stack = torch.stack(selected_tensors, dim=0)
-        visual_matrix = weights_stack.mean(dim=0).numpy()
+        visual_matrix = weights_stack.mean(dim=0)
 
         calc_matrix, energy_matrix = self._apply_bidirectional_consensus(
             weights_stack, violence_level, medfilt_width
@@ -300,6 +427,66 @@ class MusicStampsAligner:
 
         return return_dict
 
+    @torch.no_grad()
+    def stamps_align_info_batch(
+        self,
+        attention_matrices: List[torch.Tensor],
+        lyrics_tokens_list: List[List[int]],
+        total_duration_seconds: Union[float, List[float]],
+        custom_config: Dict[int, List[int]],
+        violence_level: float = 2.0,
+        medfilt_width: int = 1
+    ) -> List[Dict[str, Any]]:
+        """
+        Batched stamps_align_info.
+
+        Preprocessing stays on the device of the attention matrices and the DTW
+        paths of the whole batch come from one dtw_paths call.
+
+        Args:
+            attention_matrices: Cross-attention tensors [Layers, Heads, Tokens_b, Frames_b]
+            lyrics_tokens_list: Lyrics token IDs of each sample
+            total_duration_seconds: Audio duration in seconds (per sample or shared)
+            custom_config: Dict mapping layer indices to head indices
+            violence_level: Denoising strength
+            medfilt_width: Median filter width
+
+        Returns:
+            One stamps_align_info dict per sample, with the DTW "path"
+            (text_indices, time_indices) added when calc_matrix is available
+        """
+        if not isinstance(total_duration_seconds, (list, tuple)):
+            total_duration_seconds = [total_duration_seconds] * len(attention_matrices)
+
+        results, calc_tensors = [], []
+        for attention_matrix, lyrics_tokens, duration in zip(
+            attention_matrices, lyrics_tokens_list, total_duration_seconds
+        ):
+            calc_matrix, _, _ = self._preprocess_attention_tensor(
+                attention_matrix, custom_config, violence_level, medfilt_width
+            )
+            if calc_matrix is None:
+                results.append({
+                    "calc_matrix": None,
+                    "lyrics_tokens": lyrics_tokens,
+                    "total_duration_seconds": duration,
+                    "error": "No valid attention heads found"
+                })
+                continue
+            calc_tensors.append(calc_matrix)
+            results.append({
+                "calc_matrix": calc_matrix,
+                "lyrics_tokens": lyrics_tokens,
+                "total_duration_seconds": duration
+            })
+
+        paths = iter(dtw_paths([-calc for calc in calc_tensors]))
+        for result in results:
+            if result["calc_matrix"] is not None:
+                result["calc_matrix"] = result["calc_matrix"].cpu().numpy()
+                result["path"] = next(paths)
+        return results
+
     def _decode_tokens_incrementally(self, token_ids: List[int]) -> List[str]:
         """
         Decode tokens incrementally to properly handle multi-byte UTF-8 characters.
@@ -345,7 +532,8 @@ class MusicStampsAligner:
         self,
         calc_matrix: np.ndarray,
         lyrics_tokens: List[int],
-        total_duration_seconds: float
+        total_duration_seconds: float,
+        path: Optional[Tuple[np.ndarray, np.ndarray]] = None
     ) -> List[TokenTimestamp]:
         """
         Generate per-token timestamps using DTW.
@@ -354,12 +542,15 @@ class MusicStampsAligner:
             calc_matrix: Processed attention matrix [Tokens, Frames]
             lyrics_tokens: List of token IDs
             total_duration_seconds: Total audio duration
+            path: Precomputed DTW path (e.g. from stamps_align_info_batch)
             
         Returns:
             List of TokenTimestamp objects
         """
         n_frames = calc_matrix.shape[-1]
-        text_indices, time_indices = dtw_cpu(-calc_matrix.astype(np.float64))
+        if path is None:
+            path = dtw_cpu(-calc_matrix.astype(np.float64))
+        text_indices, time_indices = path
 
         seconds_per_frame = total_duration_seconds / n_frames
         alignment_results = []
@@ -517,7 +708,8 @@ class MusicStampsAligner:
         self,
         calc_matrix: np.ndarray,
         lyrics_tokens: List[int],
-        total_duration_seconds: float
+        total_duration_seconds: float,
+        path: Optional[Tuple[np.ndarray, np.ndarray]] = None
     ) -> Dict[str, Any]:
         """
         Convenience method to get both timestamps and LRC in one call.
@@ -526,6 +718,7 @@ class MusicStampsAligner:
             calc_matrix: Processed attention matrix
             lyrics_tokens: List of token IDs
             total_duration_seconds: Total audio duration
+            path: Precomputed DTW path (e.g. from stamps_align_info_batch)
             
         Returns:
             Dict containing token_timestamps, sentence_timestamps, and lrc_text
@@ -533,7 +726,8 @@ class MusicStampsAligner:
         token_stamps = self.token_timestamps(
             calc_matrix=calc_matrix,
             lyrics_tokens=lyrics_tokens,
-            total_duration_seconds=total_duration_seconds
+            total_duration_seconds=total_duration_seconds,
+            path=path
         )
         
         sentence_stamps = self.sentence_timestamps(token_stamps)
@@ -612,7 +806,32 @@ class MusicLyricScorer:
             weights = torch.tensor(attention_matrix)
         else:
             weights = attention_matrix.clone()
-        weights = weights.cpu().float()
+
+        calc_matrix, energy_matrix, avg_weights = self._preprocess_attention_tensor(
+            weights.cpu(), custom_config, medfilt_width
+        )
+        if calc_matrix is None:
+            return None, None, None
+        return calc_matrix.numpy(), energy_matrix.numpy(), avg_weights
+
+    def _preprocess_attention_tensor(
+            self,
+            attention_matrix: torch.Tensor,
+            custom_config: Dict[int, List[int]],
+            medfilt_width: int = 1
+    ) -> Tuple[Optional[torch.Tensor], Optional[torch.Tensor], Optional[torch.Tensor]]:
+        """
+        Same as _preprocess_attention, on the device of attention_matrix.
+
+        Args:
+            attention_matrix: Raw attention tensor [Layers, Heads, Tokens, Frames].
+            custom_config: Config mapping layers to heads.
+            medfilt_width: Width for median filtering.
+
+        Returns:
+            Tuple of (calc_matrix, energy_matrix, avg_weights) tensors.
+        """
+        weights = attention_matrix.float()
 
         # 2. Select Heads based on config
         selected_tensors = []
@@ -632,15 +851,14 @@ class MusicLyricScorer:
         # 4. Preprocessing Logic
         # Min-Max normalization preserving energy distribution
         # Median filter is applied to the energy matrix
-        energy_tensor = median_filter(avg_weights, filter_width=medfilt_width)
-        energy_matrix = energy_tensor.numpy()
+        energy_matrix = median_filter(avg_weights, filter_width=medfilt_width)
 
         e_min, e_max = energy_matrix.min(), energy_matrix.max()
 
         if e_max - e_min > 1e-9:
             energy_matrix = (energy_matrix - e_min) / (e_max - e_min)
         else:
-            energy_matrix = np.zeros_like(energy_matrix)
+            energy_matrix = torch.zeros_like(energy_matrix)
 
         # Contrast enhancement for DTW pathfinding
         # calc_matrix is used for pathfinding, energy_matrix for scoring
@@ -811,6 +1029,58 @@ class MusicLyricScorer:
 
         return return_dict
 
+    @torch.no_grad()
+    def lyrics_alignment_info_batch(
+            self,
+            attention_matrices: List[torch.Tensor],
+            token_ids_list: List[List[int]],
+            custom_config: Dict[int, List[int]],
+            medfilt_width: int = 1
+    ) -> List[Dict[str, Any]]:
+        """
+        Batched lyrics_alignment_info.
+
+        Preprocessing stays on the device of the attention matrices and the DTW
+        paths of the whole batch come from one dtw_paths call.
+
+        Args:
+            attention_matrices: Attention tensors [Layers, Heads, Tokens_b, Frames_b].
+            token_ids_list: Token IDs of each sample.
+            custom_config: Layer/Head configuration.
+            medfilt_width: Median filter width.
+
+        Returns:
+            One lyrics_alignment_info dict per sample.
+        """
+        results, calc_tensors = [], []
+        for attention_matrix, token_ids in zip(attention_matrices, token_ids_list):
+            calc_matrix, energy_matrix, _ = self._preprocess_attention_tensor(
+                attention_matrix, custom_config, medfilt_width
+            )
+            if calc_matrix is None:
+                results.append({
+                    "calc_matrix": None,
+                    "error": "No valid attention heads found"
+                })
+                continue
+
+            type_mask = self._generate_token_type_mask(token_ids)
+            if len(type_mask) != energy_matrix.shape[0]:
+                type_mask = np.ones(energy_matrix.shape[0], dtype=np.int32)
+
+            calc_tensors.append(calc_matrix)
+            results.append({
+                "type_mask": type_mask,
+                "energy_matrix": energy_matrix.cpu().numpy()
+            })
+
+        paths = iter(dtw_paths([-calc for calc in calc_tensors]))
+        for result in results:
+            if "energy_matrix" in result:
+                text_indices, time_indices = next(paths)
+                result["path_coords"] = np.stack([text_indices, time_indices], axis=1)
+        return results
+
     def calculate_score(
             self,
             energy_matrix: Union[torch.Tensor, np.ndarray],
@@ -836,7 +1106,8 @@ class MusicLyricScorer:
         """
         # Ensure Inputs are Tensors on the correct device
         if not isinstance(energy_matrix, torch.Tensor):
-            energy_matrix = torch.tensor(energy_matrix, device='cuda', dtype=torch.float32)
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+            energy_matrix = torch.tensor(energy_matrix, device=device, dtype=torch.float32)
 
         device = energy_matrix.device
 
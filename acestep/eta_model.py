@@ -0,0 +1,238 @@
+"""Per-stage latency model for queue ETAs
+
+Learns how long each pipeline stage (LM phase 1/2, DiT encoder/model, VAE
+decode, offload, saving, leftover overhead) takes as a function of the work a
+request implies: batch size, audio duration and inference steps. Every stage
+keeps an exponentially weighted least-squares fit ``seconds = a + b * units``
+per model (plus one across all models as fallback), fed from the
+``time_costs`` dict that ``generate_music`` returns for each finished job.
+"""
+
+import json
+import os
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional
+
+from loguru import logger
+
+
+# Stage name -> key in the unified time_costs dict of acestep.inference.generate_music
+STAGE_TIME_KEYS: Dict[str, str] = {
+    "lm_phase1": "lm_phase1_time",
+    "lm_phase2": "lm_phase2_time",
+    "dit_encoder": "dit_encoder_time_cost",
+    "dit_model": "dit_model_time_cost",
+    "vae_decode": "dit_vae_decode_time_cost",
+    "offload": "dit_offload_time_cost",
+    "save": "save_time",
+}
+OVERHEAD_STAGE = "overhead"
+LM_STAGES = ("lm_phase1", "lm_phase2")
+ALL_MODELS = "*"
+
+
+@dataclass
+class JobFeatures:
+    """Request features the stage costs depend on."""
+
+    dit_model: str = ""
+    lm_model: str = ""
+    batch_size: int = 1
+    duration: Optional[float] = None  # audio seconds; None when decided at run time
+    inference_steps: int = 8
+    lm_phase1: bool = False  # LM chain-of-thought metadata pass
+    lm_phase2: bool = False  # LM audio code generation
+
+
+class _DecayedFit:
+    """Least-squares line through (units, seconds) with exponential forgetting."""
+
+    __slots__ = ("w", "sx", "sy", "sxx", "sxy", "n")
+
+    def __init__(self, w=0.0, sx=0.0, sy=0.0, sxx=0.0, sxy=0.0, n=0):
+        self.w, self.sx, self.sy, self.sxx, self.sxy, self.n = w, sx, sy, sxx, sxy, n
+
+    def update(self, x: float, y: float, decay: float) -> None:
+        self.w = self.w * decay + 1.0
+        self.sx = self.sx * decay + x
+        self.sy = self.sy * decay + y
+        self.sxx = self.sxx * decay + x * x
+        self.sxy = self.sxy * decay + x * y
+        self.n += 1
+
+    def predict(self, x: float) -> Optional[float]:
+        if self.w <= 0:
+            return None
+        mean_x = self.sx / self.w
+        mean_y = self.sy / self.w
+        var_x = self.sxx / self.w - mean_x * mean_x
+        if var_x > 1e-6 * max(mean_x * mean_x, 1e-12):
+            slope = (self.sxy / self.w - mean_x * mean_y) / var_x
+            if slope >= 0:
+                return max(0.0, mean_y + slope * (x - mean_x))
+        # Too little spread in the observed units (or a negative slope): scale the mean rate
+        if mean_x > 0:
+            return max(0.0, mean_y * x / mean_x)
+        return max(0.0, mean_y)
+
+    def to_list(self):
+        return [self.w, self.sx, self.sy, self.sxx, self.sxy, self.n]
+
+
+class StageLatencyModel:
+    """
+    Thread-safe per-stage, per-model latency regression.
+
+    Args:
+        decay: Weight kept by older observations at each update (0.9 ~ last 10 jobs).
+        default_duration: Audio seconds assumed for requests that leave the
+            duration to the model, until such jobs have been observed.
+    """
+
+    def __init__(self, decay: float = 0.9, default_duration: float = 65.0):
+        self.decay = decay
+        self.default_duration = default_duration
+        self._fits: Dict[str, _DecayedFit] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _units(stage: str, f: JobFeatures, duration: float) -> float:
+        """Work units a stage scales with."""
+        batch = max(1, int(f.batch_size))
+        if stage == "lm_phase2":
+            return batch * duration
+        if stage == "dit_encoder":
+            return float(batch)
+        if stage == "dit_model":
+            return batch * duration * max(1, int(f.inference_steps))
+        if stage in ("vae_decode", "save"):
+            return batch * duration
+        return 1.0  # lm_phase1, offload, overhead: roughly per job
+
+    @staticmethod
+    def _active(stage: str, f: JobFeatures) -> bool:
+        if stage == "lm_phase1":
+            return f.lm_phase1
+        if stage == "lm_phase2":
+            return f.lm_phase2
+        return True
+
+    @staticmethod
+    def _model(stage: str, f: JobFeatures) -> str:
+        return (f.lm_model if stage in LM_STAGES else f.dit_model) or ALL_MODELS
+
+    def _duration(self, f: JobFeatures) -> float:
+        if f.duration is not None and f.duration > 0:
+            return float(f.duration)
+        return self.default_duration
+
+    def _update(self, key: str, x: float, y: float) -> None:
+        fit = self._fits.get(key)
+        if fit is None:
+            fit = self._fits[key] = _DecayedFit()
+        fit.update(x, y, self.decay)
+
+    def predict_stages(self, f: JobFeatures) -> Dict[str, float]:
+        """Predicted seconds per stage; stages never observed are left out."""
+        duration = self._duration(f)
+        out: Dict[str, float] = {}
+        with self._lock:
+            for stage in list(STAGE_TIME_KEYS) + [OVERHEAD_STAGE]:
+                if not self._active(stage, f):
+                    continue
+                x = self._units(stage, f, duration)
+                fit = self._fits.get(f"{stage}|{self._model(stage, f)}") or self._fits.get(f"{stage}|{ALL_MODELS}")
+                value = fit.predict(x) if fit is not None else None
+                if value is not None:
+                    out[stage] = value
+        return out
+
+    def predict(self, f: JobFeatures, fallback: Optional[float] = None) -> Optional[float]:
+        """Predicted wall-clock seconds for a job, or ``fallback`` before any observation."""
+        stages = self.predict_stages(f)
+        if not stages:
+            return fallback
+        return sum(stages.values())
+
+    def observe(
+        self,
+        f: JobFeatures,
+        time_costs: Dict[str, float],
+        wall_seconds: Optional[float] = None,
+        stages: Optional[Iterable[str]] = None,
+    ) -> None:
+        """
+        Learn from a finished job.
+
+        ``f.duration`` must be the generated audio length. ``stages`` restricts
+        which stages are learned (e.g. DiT stages once per coalesced batch);
+        ``wall_seconds`` lets the model learn the time not covered by time_costs.
+        """
+        duration = self._duration(f)
+        wanted = set(stages) if stages is not None else None
+        measured = 0.0
+        with self._lock:
+            for stage, key in STAGE_TIME_KEYS.items():
+                value = time_costs.get(key)
+                if value is None or (wanted is not None and stage not in wanted) or not self._active(stage, f):
+                    continue
+                value = float(value)
+                measured += value
+                x = self._units(stage, f, duration)
+                self._update(f"{stage}|{self._model(stage, f)}", x, value)
+                if self._model(stage, f) != ALL_MODELS:
+                    self._update(f"{stage}|{ALL_MODELS}", x, value)
+            if wall_seconds is not None and (wanted is None or OVERHEAD_STAGE in wanted):
+                overhead = max(0.0, float(wall_seconds) - measured)
+                self._update(f"{OVERHEAD_STAGE}|{self._model(OVERHEAD_STAGE, f)}", 1.0, overhead)
+                if f.dit_model:
+                    self._update(f"{OVERHEAD_STAGE}|{ALL_MODELS}", 1.0, overhead)
+
+    def observe_default_duration(self, seconds: float) -> None:
+        """Track the audio length of jobs whose duration was chosen at run time."""
+        if seconds > 0:
+            with self._lock:
+                self.default_duration = self.decay * self.default_duration + (1.0 - self.decay) * float(seconds)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Observation count and mean seconds per stage across all models."""
+        out: Dict[str, Dict[str, float]] = {}
+        with self._lock:
+            for key, fit in self._fits.items():
+                stage, model = key.split("|", 1)
+                if model != ALL_MODELS or fit.w <= 0:
+                    continue
+                out[stage] = {"observations": fit.n, "mean_seconds": round(fit.sy / fit.w, 3)}
+        return out
+
+    def save(self, path: str) -> None:
+        with self._lock:
+            state = {
+                "decay": self.decay,
+                "default_duration": self.default_duration,
+                "fits": {k: v.to_list() for k, v in self._fits.items()},
+            }
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as fh:
+                json.dump(state, fh)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"[StageLatencyModel] Failed to save {path}: {e}")
+
+    def load(self, path: str) -> bool:
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path, "r", encoding="utf-8") as fh:
+                state = json.load(fh)
+            fits = {k: _DecayedFit(*v) for k, v in state.get("fits", {}).items()}
+        except Exception as e:
+            logger.warning(f"[StageLatencyModel] Ignoring unreadable {path}: {e}")
+            return False
+        with self._lock:
+            self._fits = fits
+            self.default_duration = float(state.get("default_duration", self.default_duration))
+        return True
@@ -690,7 +690,40 @@ def generate_with_progress(
         None,  # raw_codes placeholder
     )
     time_module.sleep(0.1)
-    
+
+    # Auto score / auto LRC: lyric alignment of the whole batch from one DiT pass
+    batch_alignments = None
+    alignment_keys = ["pred_latents", "encoder_hidden_states", "encoder_attention_mask", "context_latents", "lyric_token_idss"]
+    alignment_tensors = [result.extra_outputs.get(k) for k in alignment_keys]
+    align_scores = bool(auto_score and lyrics and lyrics.strip())
+    if (align_scores or auto_lrc) and all(x is not None for x in alignment_tensors):
+        alignment_start = time_module.time()
+        pred_latents, encoder_hidden_states, encoder_attention_mask, context_latents, lyric_token_idss = alignment_tensors
+        actual_duration = audio_duration
+        if actual_duration is None or actual_duration <= 0:
+            actual_duration = pred_latents.shape[1] / 25.0  # 25 Hz latent rate
+        try:
+            batch_alignments = dit_handler.get_lyric_alignments(
+                pred_latent=pred_latents[:len(audios)],
+                encoder_hidden_states=encoder_hidden_states[:len(audios)],
+                encoder_attention_mask=encoder_attention_mask[:len(audios)],
+                context_latents=context_latents[:len(audios)],
+                lyric_token_ids=lyric_token_idss[:len(audios)],
+                total_duration_seconds=float(actual_duration),
+                vocal_language=vocal_language or "en",
+                inference_steps=int(inference_steps),
+                seed=42,
+                with_timestamps=bool(auto_lrc),
+                with_scores=align_scores,
+            )
+        except Exception as e:
+            logger.warning(f"[auto_lrc] Batched lyric alignment failed: {e}")
+        alignment_time = time_module.time() - alignment_start
+        if auto_lrc:
+            total_auto_lrc_time += alignment_time
+        else:
+            total_auto_score_time += alignment_time
+
     for i in range(8):
         if i < len(audios):
             key = audios[i]["key"]
@@ -748,7 +781,8 @@ def generate_with_progress(
                     print(f"[Auto Score] Failed to prepare tensor data for sample {i}: {e}")
                     sample_tensor_data = None
 
-                score_str = calculate_score_handler(llm_handler, code_str, captions, lyrics, lm_generated_metadata, bpm, key_scale, time_signature, audio_duration, vocal_language, score_scale, dit_handler, sample_tensor_data, inference_steps)
+                precomputed_alignment = batch_alignments[i] if batch_alignments and align_scores else None
+                score_str = calculate_score_handler(llm_handler, code_str, captions, lyrics, lm_generated_metadata, bpm, key_scale, time_signature, audio_duration, vocal_language, score_scale, dit_handler, sample_tensor_data, inference_steps, precomputed_alignment=precomputed_alignment)
                 auto_score_end = time_module.time()
                 total_auto_score_time += (auto_score_end - auto_score_start)
             scores_ui_updates[i] = score_str
@@ -768,7 +802,18 @@ def generate_with_progress(
                     
                     logger.info(f"[auto_lrc] pred_latents: {pred_latents is not None}, encoder_hidden_states: {encoder_hidden_states is not None}, encoder_attention_mask: {encoder_attention_mask is not None}, context_latents: {context_latents is not None}, lyric_token_idss: {lyric_token_idss is not None}")
                     
-                    if all(x is not None for x in [pred_latents, encoder_hidden_states, encoder_attention_mask, context_latents, lyric_token_idss]):
+                    if batch_alignments is not None:
+                        lrc_result = batch_alignments[i]
+                        actual_duration = audio_duration
+                        if actual_duration is None or actual_duration <= 0:
+                            actual_duration = pred_latents.shape[1] / 25.0  # 25 Hz latent rate
+                        logger.info(f"[auto_lrc] LRC result for sample {i + 1}: success={lrc_result.get('success')}")
+                        if lrc_result.get("success"):
+                            lrc_text = lrc_result.get("lrc_text", "")
+                            final_lrcs_list[i] = lrc_text
+                            vtt_path = lrc_to_vtt_file(lrc_text, total_duration=float(actual_duration))
+                            final_subtitles_list[i] = vtt_path
+                    elif all(x is not None for x in [pred_latents, encoder_hidden_states, encoder_attention_mask, context_latents, lyric_token_idss]):
                         # Extract single sample tensors
                         sample_pred_latent = pred_latents[i:i+1]
                         sample_encoder_hidden_states = encoder_hidden_states[i:i+1]
@@ -983,6 +1028,7 @@ def calculate_score_handler(
         dit_handler,
         extra_tensor_data,
         inference_steps,
+        precomputed_alignment=None,
 ):
     """
     Calculate PMI-based quality score for generated audio.
@@ -1008,6 +1054,7 @@ def calculate_score_handler(
         dit_handler: DiT handler instance (for alignment scoring)
         extra_tensor_data: Dictionary containing tensors for the specific sample
         inference_steps: Number of inference steps used
+        precomputed_alignment: get_lyric_alignments result for this sample (skips the DiT pass)
         
     Returns:
         Score display string
@@ -1015,7 +1062,7 @@ def calculate_score_handler(
     from acestep.test_time_scaling import calculate_pmi_score_per_condition
     
     has_audio_codes = audio_codes_str and audio_codes_str.strip()
-    has_dit_alignment_data = dit_handler and extra_tensor_data and lyrics and lyrics.strip()
+    has_dit_alignment_data = dit_handler and (extra_tensor_data or precomputed_alignment) and lyrics and lyrics.strip()
     
     # Check if we can compute any scores
     if not has_audio_codes and not has_dit_alignment_data:
@@ -1083,16 +1130,19 @@ def calculate_score_handler(
         # DiT alignment scoring (works even without audio codes - for Cover/Repaint modes)
         if has_dit_alignment_data:
             try:
-                align_result = dit_handler.get_lyric_score(
-                    pred_latent=extra_tensor_data.get('pred_latent'),
-                    encoder_hidden_states=extra_tensor_data.get('encoder_hidden_states'),
-                    encoder_attention_mask=extra_tensor_data.get('encoder_attention_mask'),
-                    context_latents=extra_tensor_data.get('context_latents'),
-                    lyric_token_ids=extra_tensor_data.get('lyric_token_ids'),
-                    vocal_language=vocal_language or "en",
-                    inference_steps=int(inference_steps),
-                    seed=42,
-                )
+                if precomputed_alignment is not None:
+                    align_result = precomputed_alignment
+                else:
+                    align_result = dit_handler.get_lyric_score(
+                        pred_latent=extra_tensor_data.get('pred_latent'),
+                        encoder_hidden_states=extra_tensor_data.get('encoder_hidden_states'),
+                        encoder_attention_mask=extra_tensor_data.get('encoder_attention_mask'),
+                        context_latents=extra_tensor_data.get('context_latents'),
+                        lyric_token_ids=extra_tensor_data.get('lyric_token_ids'),
+                        vocal_language=vocal_language or "en",
+                        inference_steps=int(inference_steps),
+                        seed=42,
+                    )
 
                 if align_result.get("success"):
                     lm_align_score = align_result.get("lm_score", 0.0)
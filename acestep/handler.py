@@ -16,8 +16,10 @@ import random
 import uuid
 import hashlib
 import json
+import weakref
+import threading
 from contextlib import contextmanager
-from typing import Optional, Dict, Any, Tuple, List, Union
+from typing import Optional, Dict, Any, Tuple, List, Union, Callable
 
 import torch
 import torchaudio
@@ -44,10 +46,26 @@ from acestep.constants import (
 )
 from acestep.dit_alignment_score import MusicStampsAligner, MusicLyricScorer
 from acestep.gpu_config import get_gpu_memory_gb
+from acestep.tensor_cache import TensorLRUCache, make_cache_key
+from acestep.audio_utils import get_audio_file_hash
 
 
 warnings.filterwarnings("ignore")
 
+# Serializes the VAE memory measurement in tiled_decode_batched per device, since
+# it resets the device's peak-memory counter
+_VAE_MEASURE_LOCKS: Dict[str, threading.Lock] = {}
+_VAE_MEASURE_LOCKS_GUARD = threading.Lock()
+
+
+def _vae_measure_lock(device: torch.device) -> threading.Lock:
+    with _VAE_MEASURE_LOCKS_GUARD:
+        return _VAE_MEASURE_LOCKS.setdefault(str(device), threading.Lock())
+
+
+class _AttentionCaptureDone(Exception):
+    """Raised by the attention capture hooks to stop the decoder after the last needed layer."""
+
 
 class AceStepHandler:
     """ACE-Step Business Logic Handler"""
@@ -88,6 +106,35 @@ class AceStepHandler:
         self.use_lora = False
         self.lora_scale = 1.0  # LoRA influence scale (0-1)
         self._base_decoder = None  # Backup of original decoder
+
+        # Batched tiled VAE decode: windows per decode call (0 = size from free VRAM on CUDA,
+        # 1 = decode one window at a time) and latent frames cross-faded at tile seams
+        self.vae_decode_max_windows = int(os.getenv("ACESTEP_VAE_DECODE_MAX_WINDOWS", "1"))
+        self.vae_decode_crossfade = int(os.getenv("ACESTEP_VAE_DECODE_CROSSFADE", "0"))
+
+        # Lyric alignment: capture only the configured cross-attention heads with hooks instead
+        # of running the decoder with output_attentions, once verified per decoder
+        self.attention_capture = os.getenv("ACESTEP_ATTENTION_CAPTURE", "true").lower() in ("1", "true", "yes")
+        self._attention_capture_verified: "weakref.WeakKeyDictionary[Any, bool]" = weakref.WeakKeyDictionary()
+
+        # Text/lyric embedding cache, keyed by token ids + text encoder identity
+        self.embedding_cache = TensorLRUCache(
+            name="text_embeddings",
+            max_entries=int(os.getenv("ACESTEP_EMBEDDING_CACHE_ENTRIES", "256")),
+            max_bytes=int(float(os.getenv("ACESTEP_EMBEDDING_CACHE_MB", "512")) * 1024 * 1024),
+            disk_dir=os.getenv("ACESTEP_EMBEDDING_CACHE_DIR") or None,
+        )
+        self._text_encoder_identity = ""
+
+        # Decoded reference/source audio and their VAE latents, keyed by content hash
+        self.audio_cache = TensorLRUCache(
+            name="audio_latents",
+            max_entries=int(os.getenv("ACESTEP_AUDIO_CACHE_ENTRIES", "64")),
+            max_bytes=int(float(os.getenv("ACESTEP_AUDIO_CACHE_MB", "2048")) * 1024 * 1024),
+            disk_dir=os.getenv("ACESTEP_AUDIO_CACHE_DIR") or None,
+            disk_max_bytes=int(float(os.getenv("ACESTEP_AUDIO_CACHE_DISK_MB", "8192")) * 1024 * 1024),
+        )
+        self._vae_identity = ""
     
     def get_available_checkpoints(self) -> str:
         """Return project root directory path"""
@@ -350,7 +397,7 @@ class AceStepHandler:
             self.offload_to_cpu = offload_to_cpu
             self.offload_dit_to_cpu = offload_dit_to_cpu
             # Set dtype based on device: bfloat16 for cuda, float32 for cpu
-            self.dtype = torch.bfloat16 if device in ["cuda","xpu"] else torch.float32
+            self.dtype = torch.bfloat16 if device.split(":")[0] in ["cuda","xpu"] else torch.float32
             self.quantization = quantization
             if self.quantization is not None:
                 assert compile_model, "Quantization requires compile_model to be True"
@@ -484,6 +531,8 @@ class AceStepHandler:
                 self.vae.eval()
             else:
                 raise FileNotFoundError(f"VAE checkpoint not found at {vae_checkpoint_path}")
+            self._vae_identity = f"{vae_checkpoint_path}:{vae_dtype}"
+            self.audio_cache.clear()
 
             if compile_model:
                 # Add __len__ method to VAE to support torch.compile if needed
@@ -506,6 +555,8 @@ class AceStepHandler:
                 else:
                     self.text_encoder = self.text_encoder.to("cpu").to(self.dtype)
                 self.text_encoder.eval()
+                self._text_encoder_identity = f"{os.path.basename(text_encoder_path)}:{self.dtype}"
+                self.embedding_cache.clear()
             else:
                 raise FileNotFoundError(f"Text encoder not found at {text_encoder_path}")
 
@@ -1034,7 +1085,7 @@ class AceStepHandler:
     def _get_vae_dtype(self, device: Optional[str] = None) -> torch.dtype:
         """Get VAE dtype based on device."""
         device = device or self.device
-        return torch.bfloat16 if device in ["cuda", "xpu"] else self.dtype
+        return torch.bfloat16 if str(device).split(":")[0] in ["cuda", "xpu"] else self.dtype
     
     def _format_instruction(self, instruction: str) -> str:
         """Format instruction to ensure it ends with colon."""
@@ -1144,6 +1195,25 @@ class AceStepHandler:
         
         return actual_captions, actual_languages
     
+    def _audio_latent_cache_key(self, audio: torch.Tensor) -> str:
+        return make_cache_key("vae_latent", self._vae_identity, audio)
+
+    def _cached_tiled_encode(self, audio: torch.Tensor, cache_key: Optional[str] = None) -> torch.Tensor:
+        """tiled_encode with the VAE latents cached by waveform content."""
+        if not self.audio_cache.enabled:
+            with torch.no_grad():
+                return self.tiled_encode(audio, offload_latent_to_cpu=True)
+        if cache_key is None:
+            cache_key = self._audio_latent_cache_key(audio)
+        latents = self.audio_cache.get(cache_key)
+        if latents is not None:
+            logger.debug("[_cached_tiled_encode] Audio latent cache hit")
+            return latents
+        with torch.no_grad():
+            latents = self.tiled_encode(audio, offload_latent_to_cpu=True)
+        self.audio_cache.put(cache_key, latents)
+        return latents
+
     def _encode_audio_to_latents(self, audio: torch.Tensor) -> torch.Tensor:
         """
         Encode audio to latents using VAE with tiled encoding for long audio.
@@ -1163,8 +1233,7 @@ class AceStepHandler:
         
         # Use tiled_encode for memory-efficient encoding
         # tiled_encode handles device transfer and dtype conversion internally
-        with torch.no_grad():
-            latents = self.tiled_encode(audio, offload_latent_to_cpu=True)
+        latents = self._cached_tiled_encode(audio)
         
         # Move back to device and cast to model dtype
         latents = latents.to(self.device).to(self.dtype)
@@ -1250,21 +1319,38 @@ class AceStepHandler:
         else:
             return TASK_INSTRUCTIONS["text2music"]
     
+    def _load_audio_stereo_48k(self, audio_file) -> torch.Tensor:
+        """
+        Load an audio file as stereo 48kHz, reusing the decoded waveform from the audio cache.
+
+        Returns:
+            audio [2, samples]; a copy the caller may modify, also on cache hits
+        """
+        cache_key = None
+        if self.audio_cache.enabled and isinstance(audio_file, str) and os.path.isfile(audio_file):
+            cache_key = make_cache_key("wave_48k", get_audio_file_hash(audio_file))
+            cached = self.audio_cache.get(cache_key)
+            if cached is not None:
+                logger.debug(f"[_load_audio_stereo_48k] Audio cache hit for {audio_file}")
+                return cached.clone()
+
+        audio, sr = torchaudio.load(audio_file)
+        logger.debug(f"[_load_audio_stereo_48k] Audio shape: {audio.shape}, sample rate: {sr}")
+        audio = self._normalize_audio_to_stereo_48k(audio, sr)
+        if cache_key is not None:
+            self.audio_cache.put(cache_key, audio.clone())
+        return audio
+
     def process_reference_audio(self, audio_file) -> Optional[torch.Tensor]:
         if audio_file is None:
             return None
             
         try:
-            # Load audio file
-            audio, sr = torchaudio.load(audio_file)
+            # Load audio file and normalize to stereo 48kHz
+            audio = self._load_audio_stereo_48k(audio_file)
             
-            logger.debug(f"[process_reference_audio] Reference audio shape: {audio.shape}")
-            logger.debug(f"[process_reference_audio] Reference audio sample rate: {sr}")
             logger.debug(f"[process_reference_audio] Reference audio duration: {audio.shape[-1] / 48000.0} seconds")
             
-            # Normalize to stereo 48kHz
-            audio = self._normalize_audio_to_stereo_48k(audio, sr)
-            
             is_silence = self.is_silence(audio)
             if is_silence:
                 return None
@@ -1310,11 +1396,8 @@ class AceStepHandler:
             return None
             
         try:
-            # Load audio file
-            audio, sr = torchaudio.load(audio_file)
-            
-            # Normalize to stereo 48kHz
-            audio = self._normalize_audio_to_stereo_48k(audio, sr)
+            # Load audio file and normalize to stereo 48kHz
+            audio = self._load_audio_stereo_48k(audio_file)
             
             return audio
             
@@ -1393,11 +1476,17 @@ class AceStepHandler:
         key_scale,
         time_signature
     ):
-        pure_caption = self.extract_caption_from_sft_format(captions)
-        captions_batch = [pure_caption] * actual_batch_size
-        instructions_batch = [instruction] * actual_batch_size
-        lyrics_batch = [lyrics] * actual_batch_size
-        vocal_languages_batch = [vocal_language] * actual_batch_size
+        # Per-item values may be passed as lists (e.g. several API jobs coalesced into one batch);
+        # scalars are broadcast to the whole batch.
+        def _per_item(value):
+            if isinstance(value, list):
+                return list(value[:actual_batch_size]) + [value[-1]] * max(0, actual_batch_size - len(value))
+            return [value] * actual_batch_size
+
+        captions_batch = [self.extract_caption_from_sft_format(c) for c in _per_item(captions)]
+        instructions_batch = _per_item(instruction)
+        lyrics_batch = _per_item(lyrics)
+        vocal_languages_batch = _per_item(vocal_language)
         # Calculate duration for metadata
         calculated_duration = None
         if processed_src_audio is not None:
@@ -1406,11 +1495,14 @@ class AceStepHandler:
             calculated_duration = float(audio_duration)
 
         # Build metadata dict - use "N/A" as default for empty fields
-        metadata_dict = self._build_metadata_dict(bpm, key_scale, time_signature, calculated_duration)
-
         # Format metadata - inference service accepts dict and will convert to string
-        # Create a copy for each batch item (in case we modify it)
-        metas_batch = [metadata_dict.copy() for _ in range(actual_batch_size)]
+        # Create a separate dict for each batch item (in case we modify it)
+        metas_batch = [
+            self._build_metadata_dict(item_bpm, item_key_scale, item_time_signature, calculated_duration)
+            for item_bpm, item_key_scale, item_time_signature in zip(
+                _per_item(bpm), _per_item(key_scale), _per_item(time_signature)
+            )
+        ]
         return captions_batch, instructions_batch, lyrics_batch, vocal_languages_batch, metas_batch
     
     def determine_task_type(self, task_type, audio_code_string):
@@ -2003,6 +2095,10 @@ class AceStepHandler:
                     batch[k] = v.to(self.dtype)
         return batch
     
+    def _refer_audios_all_silent(self, refer_audioss) -> bool:
+        """True if infer_refer_latent will not need the VAE (every item uses the silence latent)."""
+        return all(len(refer_audios) == 1 and torch.all(refer_audios[0] == 0.0) for refer_audios in refer_audioss)
+
     def infer_refer_latent(self, refer_audioss):
         refer_audio_order_mask = []
         refer_audio_latents = []
@@ -2042,7 +2138,8 @@ class AceStepHandler:
             else:
                 for refer_audio in refer_audios:
                     refer_audio = _normalize_audio_2d(refer_audio)
-                    # Use tiled_encode for memory-efficient encoding of long audio
+                    # Use tiled_encode for memory-efficient encoding of long audio. Not cached:
+                    # process_reference_audio picks random segments, so the content never repeats
                     with torch.no_grad():
                         refer_audio_latent = self.tiled_encode(refer_audio, offload_latent_to_cpu=True)
                     # Move to device and cast to model dtype
@@ -2067,6 +2164,43 @@ class AceStepHandler:
             lyric_embeddings = self.text_encoder.embed_tokens(lyric_token_ids)
         return lyric_embeddings
 
+    def _lookup_cached_embeddings(
+        self, kind: str, token_idss: torch.Tensor, attention_mask: torch.Tensor
+    ) -> Tuple[List[str], List[int], List[Optional[torch.Tensor]]]:
+        """Look up per-row embeddings in the embedding cache; misses are returned as None.
+
+        Rows are right-padded, so each one is keyed by its unpadded token ids and hits do
+        not depend on how long the rest of the batch was.
+        """
+        lengths = attention_mask.bool().sum(dim=-1).tolist()
+        keys = [
+            make_cache_key(kind, self._text_encoder_identity, row[:length])
+            for row, length in zip(token_idss.cpu(), lengths)
+        ]
+        return keys, lengths, [self.embedding_cache.get(k) for k in keys]
+
+    def _fill_cached_embeddings(self, keys, lengths, rows, token_idss, encode_fn) -> torch.Tensor:
+        """Encode the missing rows with encode_fn, store them in the cache and return the full batch.
+
+        Only the unpadded part of each row is cached. When some rows come from the cache,
+        their padding positions are zero (masked out by the attention masks downstream).
+        """
+        missing = [i for i, row in enumerate(rows) if row is None]
+        if missing:
+            encoded = encode_fn(token_idss if len(missing) == len(rows) else token_idss[missing])
+            for j, i in enumerate(missing):
+                # Own copy, so the cache entry does not keep the whole batch tensor alive
+                rows[i] = encoded[j, :lengths[i]].contiguous().clone()
+                self.embedding_cache.put(keys[i], rows[i])
+            if len(missing) == len(rows):
+                return encoded
+        hidden_states = rows[0].new_zeros(
+            (len(rows), token_idss.shape[1], rows[0].shape[-1]), device=self.device
+        )
+        for i, row in enumerate(rows):
+            hidden_states[i, :row.shape[0]] = row.to(self.device)
+        return hidden_states
+
     def preprocess_batch(self, batch):
 
         # step 1: VAE encode latents, target_latents: N x T x d
@@ -2083,8 +2217,13 @@ class AceStepHandler:
 
         # step 2: refer_audio timbre
         keys = batch["keys"]
-        with self._load_model_context("vae"):
-            refer_audio_acoustic_hidden_states_packed, refer_audio_order_mask = self.infer_refer_latent(batch["refer_audioss"])
+        refer_audioss = batch["refer_audioss"]
+        if self._refer_audios_all_silent(refer_audioss):
+            # Only silence latents are needed: skip loading the VAE
+            refer_audio_acoustic_hidden_states_packed, refer_audio_order_mask = self.infer_refer_latent(refer_audioss)
+        else:
+            with self._load_model_context("vae"):
+                refer_audio_acoustic_hidden_states_packed, refer_audio_order_mask = self.infer_refer_latent(refer_audioss)
         if refer_audio_acoustic_hidden_states_packed.dtype != dtype:
             refer_audio_acoustic_hidden_states_packed = refer_audio_acoustic_hidden_states_packed.to(dtype)
 
@@ -2100,24 +2239,50 @@ class AceStepHandler:
         lyric_attention_mask = batch["lyric_attention_masks"]
         text_inputs = batch["text_inputs"]
 
-        logger.info("[preprocess_batch] Inferring prompt embeddings...")
-        with self._load_model_context("text_encoder"):
-            text_hidden_states = self.infer_text_embeddings(text_token_idss)
-            logger.info("[preprocess_batch] Inferring lyric embeddings...")
-            lyric_hidden_states = self.infer_lyric_embeddings(lyric_token_idss)
-
-            is_covers = batch["is_covers"]
-            
-            # Get precomputed hints from batch if available
-            precomputed_lm_hints_25Hz = batch.get("precomputed_lm_hints_25Hz", None)
-            
-            # Get non-cover text input ids and attention masks from batch if available
-            non_cover_text_input_ids = batch.get("non_cover_text_input_ids", None)
-            non_cover_text_attention_masks = batch.get("non_cover_text_attention_masks", None)
-            non_cover_text_hidden_states = None
+        is_covers = batch["is_covers"]
+
+        # Get precomputed hints from batch if available
+        precomputed_lm_hints_25Hz = batch.get("precomputed_lm_hints_25Hz", None)
+
+        # Get non-cover text input ids and attention masks from batch if available
+        non_cover_text_input_ids = batch.get("non_cover_text_input_ids", None)
+        non_cover_text_attention_masks = batch.get("non_cover_text_attention_masks", None)
+        non_cover_text_hidden_states = None
+
+        if not self.embedding_cache.enabled:
+            logger.info("[preprocess_batch] Inferring prompt embeddings...")
+            with self._load_model_context("text_encoder"):
+                text_hidden_states = self.infer_text_embeddings(text_token_idss)
+                logger.info("[preprocess_batch] Inferring lyric embeddings...")
+                lyric_hidden_states = self.infer_lyric_embeddings(lyric_token_idss)
+                if non_cover_text_input_ids is not None:
+                    logger.info("[preprocess_batch] Inferring non-cover text embeddings...")
+                    non_cover_text_hidden_states = self.infer_text_embeddings(non_cover_text_input_ids)
+        else:
+            # Look up every row first so the text encoder is only loaded when something is missing
+            lookups = [("text", text_token_idss, text_attention_mask, self.infer_text_embeddings),
+                       ("lyric", lyric_token_idss, lyric_attention_mask, self.infer_lyric_embeddings)]
             if non_cover_text_input_ids is not None:
-                logger.info("[preprocess_batch] Inferring non-cover text embeddings...")
-                non_cover_text_hidden_states = self.infer_text_embeddings(non_cover_text_input_ids)
+                lookups.append(("text", non_cover_text_input_ids, non_cover_text_attention_masks, self.infer_text_embeddings))
+            cached = [self._lookup_cached_embeddings(kind, ids, mask) for kind, ids, mask, _ in lookups]
+            num_missing = sum(row is None for _, _, rows in cached for row in rows)
+            num_rows = sum(len(rows) for _, _, rows in cached)
+            logger.info(f"[preprocess_batch] Embedding cache: {num_rows - num_missing}/{num_rows} rows cached")
+
+            if num_missing:
+                with self._load_model_context("text_encoder"):
+                    hidden_states = [
+                        self._fill_cached_embeddings(keys, lengths, rows, ids, encode_fn)
+                        for (keys, lengths, rows), (_, ids, _, encode_fn) in zip(cached, lookups)
+                    ]
+            else:
+                hidden_states = [
+                    self._fill_cached_embeddings(keys, lengths, rows, ids, encode_fn)
+                    for (keys, lengths, rows), (_, ids, _, encode_fn) in zip(cached, lookups)
+                ]
+            text_hidden_states, lyric_hidden_states = hidden_states[0], hidden_states[1]
+            if non_cover_text_input_ids is not None:
+                non_cover_text_hidden_states = hidden_states[2]
 
         return (
             keys,
@@ -2393,6 +2558,19 @@ class AceStepHandler:
             del decoder_output
             return result
 
+        # Stack windows into larger decode calls only when configured
+        # (ACESTEP_VAE_DECODE_MAX_WINDOWS > 1, or 0 to size from free VRAM)
+        use_batched = self.vae_decode_crossfade > 0 or self.vae_decode_max_windows != 1
+        if use_batched:
+            return self.tiled_decode_batched(
+                latents,
+                chunk_size=chunk_size,
+                overlap=overlap,
+                crossfade=self.vae_decode_crossfade,
+                max_windows_per_call=self.vae_decode_max_windows or None,
+                offload_wav_to_cpu=offload_wav_to_cpu,
+            )
+
         # Calculate stride (core size)
         stride = chunk_size - 2 * overlap
         if stride <= 0:
@@ -2407,11 +2585,43 @@ class AceStepHandler:
             # Default path: keep everything on GPU
             return self._tiled_decode_gpu(latents, B, T, stride, overlap, num_steps)
     
-    def _tiled_decode_gpu(self, latents, B, T, stride, overlap, num_steps):
-        """Standard tiled decode keeping all data on GPU."""
-        decoded_audio_list = []
+    def tiled_decode_stream(self, latents, chunk_size=512, overlap=64):
+        """
+        Decode latents tile by tile and yield finalized audio as soon as it is ready.
+
+        Uses the same overlap-discard tiling as ``tiled_decode``; concatenating all
+        yielded chunks along the last dim gives the same audio.
+
+        Args:
+            latents: [Batch, Channels, Length]
+            chunk_size: Size of latent chunk to process at once
+            overlap: Overlap size in latent frames
+
+        Yields:
+            CPU float32 audio chunks [Batch, AudioChannels, Samples]
+        """
+        B, C, T = latents.shape
+
+        if T <= chunk_size:
+            decoder_output = self.vae.decode(latents)
+            audio = decoder_output.sample
+            del decoder_output
+            yield audio.cpu().float()
+            return
+
+        stride = chunk_size - 2 * overlap
+        if stride <= 0:
+            raise ValueError(f"chunk_size {chunk_size} must be > 2 * overlap {overlap}")
+
+        num_steps = math.ceil(T / stride)
+        for audio_core, _ in self._iter_tiled_decode(latents, T, stride, overlap, num_steps):
+            yield audio_core.cpu().float()
+            del audio_core
+
+    def _iter_tiled_decode(self, latents, T, stride, overlap, num_steps):
+        """Decode each overlapping window and yield (trimmed core audio, upsample_factor)."""
         upsample_factor = None
-        
+
         for i in tqdm(range(num_steps), desc="Decoding audio chunks"):
             # Core range in latents
             core_start = i * stride
@@ -2448,77 +2658,30 @@ class AceStepHandler:
             end_idx = audio_len - trim_end if trim_end > 0 else audio_len
             
             audio_core = audio_chunk[:, :, trim_start:end_idx]
-            decoded_audio_list.append(audio_core)
-            
+            del audio_chunk, latent_chunk
+            yield audio_core, upsample_factor
+
+    def _tiled_decode_gpu(self, latents, B, T, stride, overlap, num_steps):
+        """Standard tiled decode keeping all data on GPU."""
+        decoded_audio_list = [
+            audio_core for audio_core, _ in self._iter_tiled_decode(latents, T, stride, overlap, num_steps)
+        ]
+        
         # Concatenate
         final_audio = torch.cat(decoded_audio_list, dim=-1)
         return final_audio
     
     def _tiled_decode_offload_cpu(self, latents, B, T, stride, overlap, num_steps):
         """Optimized tiled decode that offloads to CPU immediately to save VRAM."""
-        # First pass: decode first chunk to get upsample_factor and audio channels
-        first_core_start = 0
-        first_core_end = min(stride, T)
-        first_win_start = 0
-        first_win_end = min(T, first_core_end + overlap)
-        
-        first_latent_chunk = latents[:, :, first_win_start:first_win_end]
-        first_decoder_output = self.vae.decode(first_latent_chunk)
-        first_audio_chunk = first_decoder_output.sample
-        del first_decoder_output
-        
-        upsample_factor = first_audio_chunk.shape[-1] / first_latent_chunk.shape[-1]
-        audio_channels = first_audio_chunk.shape[1]
-        
-        # Calculate total audio length and pre-allocate CPU tensor
-        total_audio_length = int(round(T * upsample_factor))
-        final_audio = torch.zeros(B, audio_channels, total_audio_length, 
-                                  dtype=first_audio_chunk.dtype, device='cpu')
-        
-        # Process first chunk: trim and copy to CPU
-        first_added_end = first_win_end - first_core_end
-        first_trim_end = int(round(first_added_end * upsample_factor))
-        first_audio_len = first_audio_chunk.shape[-1]
-        first_end_idx = first_audio_len - first_trim_end if first_trim_end > 0 else first_audio_len
+        final_audio = None
+        audio_write_pos = 0
         
-        first_audio_core = first_audio_chunk[:, :, :first_end_idx]
-        audio_write_pos = first_audio_core.shape[-1]
-        final_audio[:, :, :audio_write_pos] = first_audio_core.cpu()
-        
-        # Free GPU memory
-        del first_audio_chunk, first_audio_core, first_latent_chunk
-        
-        # Process remaining chunks
-        for i in tqdm(range(1, num_steps), desc="Decoding audio chunks"):
-            # Core range in latents
-            core_start = i * stride
-            core_end = min(core_start + stride, T)
-            
-            # Window range (with overlap)
-            win_start = max(0, core_start - overlap)
-            win_end = min(T, core_end + overlap)
-            
-            # Extract chunk
-            latent_chunk = latents[:, :, win_start:win_end]
-            
-            # Decode on GPU
-            # [Batch, Channels, AudioSamples]
-            decoder_output = self.vae.decode(latent_chunk)
-            audio_chunk = decoder_output.sample
-            del decoder_output
-            
-            # Calculate trim amounts in audio samples
-            added_start = core_start - win_start  # latent frames
-            trim_start = int(round(added_start * upsample_factor))
-            
-            added_end = win_end - core_end  # latent frames
-            trim_end = int(round(added_end * upsample_factor))
-            
-            # Trim audio
-            audio_len = audio_chunk.shape[-1]
-            end_idx = audio_len - trim_end if trim_end > 0 else audio_len
-            
-            audio_core = audio_chunk[:, :, trim_start:end_idx]
+        for audio_core, upsample_factor in self._iter_tiled_decode(latents, T, stride, overlap, num_steps):
+            if final_audio is None:
+                # Calculate total audio length from the first chunk and pre-allocate CPU tensor
+                total_audio_length = int(round(T * upsample_factor))
+                final_audio = torch.zeros(B, audio_core.shape[1], total_audio_length,
+                                          dtype=audio_core.dtype, device='cpu')
             
             # Copy to pre-allocated CPU tensor
             core_len = audio_core.shape[-1]
@@ -2526,13 +2689,165 @@ class AceStepHandler:
             audio_write_pos += core_len
             
             # Free GPU memory immediately
-            del audio_chunk, audio_core, latent_chunk
+            del audio_core
         
         # Trim to actual length (in case of rounding differences)
         final_audio = final_audio[:, :, :audio_write_pos]
         
         return final_audio
     
+    @staticmethod
+    def _plan_decode_windows(T, chunk_size, overlap, crossfade):
+        """
+        Split T latent frames into equal-length decode windows.
+
+        Returns a list of (win_start, keep_start, keep_end) in latent frames. Each
+        window is ``chunk_size`` frames long so windows can be stacked into one batch.
+        Consecutive keep ranges overlap by ``crossfade`` frames (0 = they just touch),
+        and every keep range has at least ``overlap`` frames of context inside its
+        window unless it reaches the start or end of the track.
+        """
+        stride = chunk_size - 2 * overlap - crossfade
+        if stride <= 0:
+            raise ValueError(
+                f"chunk_size {chunk_size} must be > 2 * overlap {overlap} + crossfade {crossfade}"
+            )
+        fade_before = crossfade // 2
+        fade_after = crossfade - fade_before
+        num_steps = math.ceil(T / stride)
+        windows = []
+        for i in range(num_steps):
+            core_start = i * stride
+            core_end = min(core_start + stride, T)
+            keep_start = max(0, core_start - fade_before) if i > 0 else 0
+            keep_end = min(T, core_end + fade_after) if i < num_steps - 1 else T
+            win_start = min(max(0, keep_start - overlap), T - chunk_size)
+            windows.append((win_start, keep_start, keep_end))
+        return windows
+
+    def _vae_decode_windows_per_call(self, bytes_per_window, device=None):
+        """Windows that fit in one decode call given the measured peak bytes of one window."""
+        if bytes_per_window <= 0 or not torch.cuda.is_available():
+            return 1
+        free_bytes, _ = torch.cuda.mem_get_info(device)
+        # Keep headroom for allocator fragmentation and the output buffer
+        return max(1, int(free_bytes * 0.8) // bytes_per_window)
+
+    def tiled_decode_batched(
+        self,
+        latents,
+        chunk_size=512,
+        overlap=64,
+        crossfade=0,
+        max_windows_per_call=None,
+        offload_wav_to_cpu=True,
+    ):
+        """
+        Tiled decode that stacks windows across time and batch into larger VAE calls.
+
+        All windows have the same length, so ``k`` windows of a [B, C, T] input are
+        decoded as one [k * B, C, chunk_size] call. Seams are either hard-trimmed
+        (``crossfade=0``, same as ``tiled_decode``) or blended with a linear
+        overlap-add crossfade over ``crossfade`` latent frames, which hides small
+        mismatches between neighbouring windows and allows a smaller ``overlap``.
+
+        Args:
+            latents: [Batch, Channels, Length]
+            chunk_size: Window length in latent frames
+            overlap: Context frames decoded and discarded on each side of a window
+            crossfade: Latent frames blended at each seam (0 = hard trim)
+            max_windows_per_call: Windows per VAE call; None sizes it from free VRAM
+                after decoding the first window (CUDA only, 1 elsewhere)
+            offload_wav_to_cpu: If True, assemble the output on CPU
+
+        Returns:
+            Audio tensor [Batch, AudioChannels, Samples]
+        """
+        B, C, T = latents.shape
+        if T <= chunk_size:
+            decoder_output = self.vae.decode(latents)
+            result = decoder_output.sample
+            del decoder_output
+            return result
+
+        windows = self._plan_decode_windows(T, chunk_size, overlap, crossfade)
+        num_windows = len(windows)
+        measure_memory = max_windows_per_call is None and latents.is_cuda
+        windows_per_call = 1 if max_windows_per_call is None else max(1, max_windows_per_call)
+
+        final_audio = None
+        weight_sum = None
+        upsample_factor = None
+        pbar = tqdm(total=num_windows, desc="Decoding audio chunks")
+        i = 0
+        while i < num_windows:
+            group = windows[i:i + windows_per_call]
+
+            # [len(group) * B, C, chunk_size], window-major
+            latent_batch = torch.cat(
+                [latents[:, :, win_start:win_start + chunk_size] for win_start, _, _ in group], dim=0
+            )
+            if measure_memory:
+                # Reset the peak counter so the measurement covers this call and not the
+                # DiT forward before it. The lock keeps two measurements on one device from
+                # resetting each other; other work running on the device can only raise
+                # the peak, which errs towards fewer windows per call
+                with _vae_measure_lock(latents.device):
+                    torch.cuda.synchronize(latents.device)
+                    torch.cuda.reset_peak_memory_stats(latents.device)
+                    mem_before = torch.cuda.memory_allocated(latents.device)
+                    decoder_output = self.vae.decode(latent_batch)
+                    torch.cuda.synchronize(latents.device)
+                    peak = torch.cuda.max_memory_allocated(latents.device) - mem_before
+            else:
+                decoder_output = self.vae.decode(latent_batch)
+            audio_batch = decoder_output.sample
+            del decoder_output, latent_batch
+            if measure_memory:
+                windows_per_call = min(
+                    self._vae_decode_windows_per_call(peak // max(1, len(group)), latents.device), num_windows
+                )
+                measure_memory = False
+                logger.info(f"[tiled_decode_batched] Decoding {windows_per_call} windows per VAE call")
+
+            if final_audio is None:
+                upsample_factor = audio_batch.shape[-1] / chunk_size
+                total_audio_length = int(round(T * upsample_factor))
+                out_device = "cpu" if offload_wav_to_cpu else audio_batch.device
+                final_audio = torch.zeros(
+                    B, audio_batch.shape[1], total_audio_length, dtype=torch.float32, device=out_device
+                )
+                weight_sum = torch.zeros(total_audio_length, dtype=torch.float32, device=out_device)
+
+            audio_batch = audio_batch.view(len(group), B, audio_batch.shape[1], audio_batch.shape[-1])
+            for j, (win_start, keep_start, keep_end) in enumerate(group):
+                out_start = int(round(keep_start * upsample_factor))
+                out_end = int(round(keep_end * upsample_factor))
+                src_start = out_start - int(round(win_start * upsample_factor))
+                seg_len = min(out_end - out_start, audio_batch.shape[-1] - src_start)
+                segment = audio_batch[j, :, :, src_start:src_start + seg_len].to(final_audio.device, torch.float32)
+
+                weight = torch.ones(seg_len, dtype=torch.float32, device=final_audio.device)
+                if crossfade > 0:
+                    fade_len = min(seg_len, int(round(crossfade * upsample_factor)))
+                    ramp = (torch.arange(fade_len, dtype=torch.float32, device=weight.device) + 0.5) / fade_len
+                    if keep_start > 0:
+                        weight[:fade_len] *= ramp
+                    if keep_end < T:
+                        weight[seg_len - fade_len:] *= ramp.flip(0)
+
+                final_audio[:, :, out_start:out_start + seg_len] += segment * weight
+                weight_sum[out_start:out_start + seg_len] += weight
+                del segment
+
+            del audio_batch
+            i += len(group)
+            pbar.update(len(group))
+        pbar.close()
+
+        final_audio /= weight_sum.clamp_min(1e-8)
+        return final_audio
+
     def tiled_encode(self, audio, chunk_size=None, overlap=None, offload_latent_to_cpu=True):
         """
         Encode audio to latents using tiling to reduce VRAM usage.
@@ -2714,12 +3029,12 @@ class AceStepHandler:
 
     def generate_music(
         self,
-        captions: str,
-        lyrics: str,
-        bpm: Optional[int] = None,
-        key_scale: str = "",
-        time_signature: str = "",
-        vocal_language: str = "en",
+        captions: Union[str, List[str]],
+        lyrics: Union[str, List[str]],
+        bpm: Optional[Union[int, List[Optional[int]]]] = None,
+        key_scale: Union[str, List[str]] = "",
+        time_signature: Union[str, List[str]] = "",
+        vocal_language: Union[str, List[str]] = "en",
         inference_steps: int = 8,
         guidance_scale: float = 7.0,
         use_random_seed: bool = True,
@@ -2731,7 +3046,7 @@ class AceStepHandler:
         audio_code_string: Union[str, List[str]] = "",
         repainting_start: float = 0.0,
         repainting_end: Optional[float] = None,
-        instruction: str = DEFAULT_DIT_INSTRUCTION,
+        instruction: Union[str, List[str]] = DEFAULT_DIT_INSTRUCTION,
         audio_cover_strength: float = 1.0,
         task_type: str = "text2music",
         use_adg: bool = False,
@@ -2741,10 +3056,18 @@ class AceStepHandler:
         infer_method: str = "ode",
         use_tiled_decode: bool = True,
         timesteps: Optional[List[float]] = None,
-        progress=None
+        progress=None,
+        audio_chunk_callback: Optional[Callable[[torch.Tensor], None]] = None,
     ) -> Dict[str, Any]:
         """
         Main interface for music generation
+
+        Caption, lyrics, metadata, language and instruction may be given per batch item
+        as lists of length ``batch_size``; scalars apply to every item.
+
+        If ``audio_chunk_callback`` is given, the VAE decode runs tile by tile and the
+        callback receives each finalized CPU float32 chunk [batch, channels, samples]
+        as soon as it is decoded, so callers can start playback before decode finishes.
         
         Returns:
             Dictionary containing:
@@ -2922,7 +3245,15 @@ class AceStepHandler:
                     
                     logger.debug(f"[generate_music] Before VAE decode: allocated={torch.cuda.memory_allocated()/1024**3:.2f}GB, max={torch.cuda.max_memory_allocated()/1024**3:.2f}GB")
                     
-                    if use_tiled_decode:
+                    if audio_chunk_callback is not None:
+                        logger.info("[generate_music] Using streaming tiled VAE decode...")
+                        wav_chunks = []
+                        for wav_chunk in self.tiled_decode_stream(pred_latents_for_decode):
+                            audio_chunk_callback(wav_chunk)
+                            wav_chunks.append(wav_chunk)
+                        pred_wavs = torch.cat(wav_chunks, dim=-1)  # [batch, channels, samples], CPU
+                        del wav_chunks
+                    elif use_tiled_decode:
                         logger.info("[generate_music] Using tiled VAE decode to reduce VRAM usage...")
                         pred_wavs = self.tiled_decode(pred_latents_for_decode)  # [batch, channels, samples]
                     else:
@@ -3022,222 +3353,447 @@ class AceStepHandler:
                 "error": str(e),
             }
 
+    def _capture_cross_attentions(
+        self,
+        decoder,
+        decoder_inputs: Dict[str, Any],
+        custom_layers_config: Dict[int, List[int]],
+    ) -> Optional[torch.Tensor]:
+        """
+        Run the decoder and capture the cross-attention of the configured heads only.
+
+        Forward hooks on q_norm/k_norm of each configured cross-attention layer keep the
+        projected queries/keys, and softmax(q k^T) is recomputed for the selected heads
+        right after the layer runs. The decoder itself keeps its fused attention kernels
+        (no output_attentions, so no [frames x frames] self-attention weights are
+        materialized) and is stopped after the last configured layer.
+
+        This assumes the attention scores are computed from the q_norm/k_norm outputs as
+        is (no RoPE or other transform in between), which depends on the checkpoint's
+        modeling code, so callers first check it with _attention_capture_verified_for.
+
+        Args:
+            decoder: DiT decoder
+            decoder_inputs: Keyword arguments of the decoder call
+            custom_layers_config: Dict mapping layer indices to head indices
+
+        Returns:
+            Attention probabilities [batch, selected_heads, text_tokens, frames], or None
+            if the decoder layout is not recognized (callers fall back to output_attentions)
+        """
+        layers = getattr(decoder, "layers", None)
+        targets = []
+        for layer_idx, head_indices in sorted(custom_layers_config.items()):
+            if layers is None or layer_idx >= len(layers):
+                continue
+            attn = getattr(layers[layer_idx], "cross_attn", None)
+            if attn is None or not hasattr(attn, "q_norm") or not hasattr(attn, "k_norm"):
+                return None
+            targets.append((attn, list(head_indices)))
+        if not targets:
+            return None
+
+        key_mask = decoder_inputs["encoder_attention_mask"]
+        states: Dict[str, torch.Tensor] = {}
+        captured: List[torch.Tensor] = []
+
+        def keep(name):
+            def hook(module, args, output):
+                states[name] = output
+            return hook
+
+        def capture(head_indices, is_last):
+            def hook(module, args, output):
+                # q_norm/k_norm outputs: [batch, frames, heads, head_dim] / [batch, tokens, kv_heads, head_dim]
+                query, key = states.pop("query"), states.pop("key")
+                num_heads, num_kv_heads = query.shape[2], key.shape[2]
+                heads = [h for h in head_indices if h < num_heads]
+                if heads:
+                    kv_heads = [h // (num_heads // num_kv_heads) for h in heads]
+                    q = query[:, :, heads].transpose(1, 2).float()
+                    k = key[:, :, kv_heads].transpose(1, 2).float()
+                    scores = (q @ k.transpose(-1, -2)) * getattr(module, "scaling", q.shape[-1] ** -0.5)
+                    scores = scores.masked_fill(key_mask[:, None, None, :] == 0, torch.finfo(scores.dtype).min)
+                    captured.append(scores.softmax(dim=-1).transpose(-1, -2).to(self.dtype))
+                if is_last:
+                    raise _AttentionCaptureDone()
+            return hook
+
+        handles = []
+        try:
+            for i, (attn, head_indices) in enumerate(targets):
+                handles.append(attn.q_norm.register_forward_hook(keep("query")))
+                handles.append(attn.k_norm.register_forward_hook(keep("key")))
+                handles.append(attn.register_forward_hook(capture(head_indices, i == len(targets) - 1)))
+            try:
+                decoder(**decoder_inputs, use_cache=False, past_key_values=None)
+            except _AttentionCaptureDone:
+                pass
+        except Exception as e:
+            logger.warning(f"[_capture_cross_attentions] Hook capture failed, falling back to output_attentions: {e}")
+            return None
+        finally:
+            for handle in handles:
+                handle.remove()
+
+        if not captured:
+            return None
+        return torch.cat(captured, dim=1)
+
+    def _attention_capture_verified_for(
+        self,
+        decoder,
+        decoder_inputs: Dict[str, Any],
+        custom_layers_config: Dict[int, List[int]],
+    ) -> bool:
+        """
+        Whether _capture_cross_attentions reproduces output_attentions for this decoder.
+
+        Checked once per decoder module on the first item cut to at most 64 frames, so
+        the output_attentions run stays small. The maps must agree within 5% relative
+        L1 error; otherwise lyric alignment keeps using output_attentions for it.
+        """
+        verified = self._attention_capture_verified.get(decoder)
+        if verified is not None:
+            return verified
+
+        frames = min(decoder_inputs["hidden_states"].shape[1], 64)
+        probe = {}
+        for name, value in decoder_inputs.items():
+            value = value[:1]
+            if name in ("hidden_states", "attention_mask", "context_latents"):
+                value = value[:, :frames]
+            probe[name] = value
+        try:
+            captured = self._capture_cross_attentions(decoder, probe, custom_layers_config)
+            reference = self._output_cross_attentions(decoder, probe, custom_layers_config)
+        except Exception as e:
+            logger.warning(f"[_attention_capture_verified_for] Check failed, using output_attentions: {e}")
+            captured = reference = None
+
+        verified = False
+        if captured is not None and reference is not None and captured.shape == reference.shape:
+            error = ((captured.float() - reference.float()).abs().sum() / reference.float().abs().sum()).item()
+            verified = error <= 0.05
+            logger.info(
+                f"[_attention_capture_verified_for] Hook capture vs output_attentions: relative L1 error "
+                f"{error:.4f}, {'using hook capture' if verified else 'keeping output_attentions'}"
+            )
+        else:
+            logger.info("[_attention_capture_verified_for] Hook capture unavailable, keeping output_attentions")
+        self._attention_capture_verified[decoder] = verified
+        return verified
+
+    def _output_cross_attentions(
+        self,
+        decoder,
+        decoder_inputs: Dict[str, Any],
+        custom_layers_config: Dict[int, List[int]],
+    ) -> Optional[torch.Tensor]:
+        """
+        Same result as _capture_cross_attentions, from a decoder call with output_attentions=True.
+        """
+        decoder_outputs = decoder(
+            **decoder_inputs,
+            use_cache=False,
+            past_key_values=None,
+            output_attentions=True,
+            custom_layers_config=custom_layers_config,
+            enable_early_exit=True
+        )
+        if decoder_outputs[2] is None:
+            return None
+
+        # Tuple of tensors (some may be None); [batch, heads, frames, tokens] -> [batch, heads, tokens, frames]
+        layer_matrices = [attn.transpose(-1, -2) for attn in decoder_outputs[2] if attn is not None]
+        selected = []
+        for layer_idx, head_indices in custom_layers_config.items():
+            for head_idx in head_indices:
+                if layer_idx < len(layer_matrices) and head_idx < layer_matrices[layer_idx].shape[1]:
+                    selected.append(layer_matrices[layer_idx][:, head_idx])
+        if not selected:
+            return None
+        return torch.stack(selected, dim=1)
+
+    def _pure_lyric_span(self, raw_lyric_ids: List[int], vocal_language: str) -> Tuple[int, int]:
+        """Start/end of the lyrics inside the lyric token ids (after the language header, before <|endoftext|>)."""
+        # Parse header to find lyrics start position
+        header_str = f"# Languages\n{vocal_language}\n\n# Lyric\n"
+        start_idx = len(self.text_tokenizer.encode(header_str, add_special_tokens=False))
+
+        # Find end of lyrics (before endoftext token)
+        try:
+            end_idx = raw_lyric_ids.index(151643)  # <|endoftext|> token
+        except ValueError:
+            end_idx = len(raw_lyric_ids)
+        return start_idx, end_idx
+
     @torch.no_grad()
-    def get_lyric_timestamp(
+    def get_lyric_alignments(
         self,
         pred_latent: torch.Tensor,
         encoder_hidden_states: torch.Tensor,
         encoder_attention_mask: torch.Tensor,
         context_latents: torch.Tensor,
         lyric_token_ids: torch.Tensor,
-        total_duration_seconds: float,
-        vocal_language: str = "en",
+        total_duration_seconds: Optional[Union[float, List[float]]] = None,
+        vocal_language: Union[str, List[str]] = "en",
         inference_steps: int = 8,
         seed: int = 42,
         custom_layers_config: Optional[Dict] = None,
-    ) -> Dict[str, Any]:
+        with_timestamps: bool = True,
+        with_scores: bool = True,
+    ) -> List[Dict[str, Any]]:
         """
-        Generate lyrics timestamps from generated audio latents using cross-attention alignment.
-        
-        This method adds noise to the final pred_latent and re-infers one step to get
-        cross-attention matrices, then uses DTW to align lyrics tokens with audio frames.
-        
+        LRC timestamps and lyric alignment scores for a whole batch from one decoder pass.
+
+        The decoder runs once on [pure noise at t=1.0 (LM score), pred_latent re-noised
+        to t=1/steps (DiT score and timestamps)], and the cross-attention heads of
+        custom_layers_config are captured with hooks (see _capture_cross_attentions), or
+        selected from its output_attentions if the capture is disabled or does not match
+        this decoder. Alignment runs batched for all samples (see dit_alignment_score.dtw_paths).
+
         Args:
             pred_latent: Generated latent tensor [batch, T, D]
             encoder_hidden_states: Cached encoder hidden states
             encoder_attention_mask: Cached encoder attention mask
             context_latents: Cached context latents
-            lyric_token_ids: Tokenized lyrics tensor [batch, seq_len]
-            total_duration_seconds: Total audio duration in seconds
-            vocal_language: Language code for lyrics header parsing
+            lyric_token_ids: Tokenized lyrics tensor [batch, seq_len] (or one id list per sample)
+            total_duration_seconds: Audio duration in seconds, shared or per sample
+                (default: latent length at 25 Hz)
+            vocal_language: Language code for lyrics header parsing, or one per sample
             inference_steps: Number of inference steps (for noise level calculation)
             seed: Random seed for noise generation
             custom_layers_config: Dict mapping layer indices to head indices
-            
+            with_timestamps: Compute timestamps and LRC text
+            with_scores: Compute lm/dit scores (without them the t=1.0 half is skipped)
+
         Returns:
-            Dict containing:
-            - lrc_text: LRC formatted lyrics with timestamps
-            - sentence_timestamps: List of SentenceTimestamp objects
-            - token_timestamps: List of TokenTimestamp objects
-            - success: Whether generation succeeded
+            One dict per batch item containing:
+            - lrc_text, sentence_timestamps, token_timestamps (empty without timestamps)
+            - lm_score, dit_score: float (0.0 without scores)
+            - success: Whether alignment succeeded
             - error: Error message if failed
         """
-        from transformers.cache_utils import EncoderDecoderCache, DynamicCache
-        
-        if self.model is None:
+        bsz = pred_latent.shape[0]
+
+        def _failed(error: str) -> Dict[str, Any]:
             return {
                 "lrc_text": "",
                 "sentence_timestamps": [],
                 "token_timestamps": [],
+                "lm_score": 0.0,
+                "dit_score": 0.0,
                 "success": False,
-                "error": "Model not initialized"
+                "error": error
             }
-        
+
+        if self.model is None:
+            return [_failed("Model not initialized") for _ in range(bsz)]
+
         if custom_layers_config is None:
             custom_layers_config = self.custom_layers_config
-        
+        if total_duration_seconds is None:
+            total_duration_seconds = pred_latent.shape[1] / 25.0  # 25 Hz latent rate
+        if not isinstance(total_duration_seconds, (list, tuple)):
+            total_duration_seconds = [total_duration_seconds] * bsz
+
         try:
             # Move tensors to device
             device = self.device
             dtype = self.dtype
-            
+
             pred_latent = pred_latent.to(device=device, dtype=dtype)
             encoder_hidden_states = encoder_hidden_states.to(device=device, dtype=dtype)
             encoder_attention_mask = encoder_attention_mask.to(device=device, dtype=dtype)
             context_latents = context_latents.to(device=device, dtype=dtype)
-            
-            bsz = pred_latent.shape[0]
-            
-            # Calculate noise level: t_last = 1.0 / inference_steps
-            t_last_val = 1.0 / inference_steps
-            t_curr_tensor = torch.tensor([t_last_val] * bsz, device=device, dtype=dtype)
-            
-            x1 = pred_latent
-            
-            # Generate noise
+
             if seed is None:
-                x0 = torch.randn_like(x1)
+                x0 = torch.randn_like(pred_latent)
             else:
                 generator = torch.Generator(device=device).manual_seed(int(seed))
-                x0 = torch.randn(x1.shape, generator=generator, device=device, dtype=dtype)
-            
-            # Add noise to pred_latent: xt = t * noise + (1 - t) * x1
-            xt = t_last_val * x0 + (1.0 - t_last_val) * x1
+                x0 = torch.randn(pred_latent.shape, generator=generator, device=device, dtype=dtype)
+
+            # --- DiT score / timestamps input ---
+            # t = 1.0/steps, flow matching regression: xt = t*x0 + (1-t)*x1
+            t_last_val = 1.0 / inference_steps
+            xt_in = t_last_val * x0 + (1.0 - t_last_val) * pred_latent
+            t_in = torch.tensor([t_last_val] * bsz, device=device, dtype=dtype)
+            num_copies = 1
+            if with_scores:
+                # --- LM score input: t = 1.0, xt = pure noise ---
+                # Order: [Think_Batch, DiT_Batch]
+                xt_in = torch.cat([x0, xt_in], dim=0)
+                t_in = torch.cat([torch.ones_like(t_in), t_in], dim=0)
+                num_copies = 2
+
+            decoder_inputs = {
+                "hidden_states": xt_in,
+                "timestep": t_in,
+                "timestep_r": t_in,
+                "attention_mask": torch.ones(num_copies * bsz, xt_in.shape[1], device=device, dtype=dtype),
+                "encoder_hidden_states": torch.cat([encoder_hidden_states] * num_copies, dim=0),
+                "encoder_attention_mask": torch.cat([encoder_attention_mask] * num_copies, dim=0),
+                "context_latents": torch.cat([context_latents] * num_copies, dim=0),
+            }
 
-            xt_in = xt
-            t_in = t_curr_tensor
-            
-            # Get null condition embedding
-            encoder_hidden_states_in = encoder_hidden_states
-            encoder_attention_mask_in = encoder_attention_mask
-            context_latents_in = context_latents
-            latent_length = x1.shape[1]
-            attention_mask = torch.ones(bsz, latent_length, device=device, dtype=dtype)
-            attention_mask_in = attention_mask
-            past_key_values = None
-            
-            # Run decoder with output_attentions=True
             with self._load_model_context("model"):
                 decoder = self.model.decoder
-                decoder_outputs = decoder(
-                    hidden_states=xt_in,
-                    timestep=t_in,
-                    timestep_r=t_in,
-                    attention_mask=attention_mask_in,
-                    encoder_hidden_states=encoder_hidden_states_in,
-                    use_cache=False,
-                    past_key_values=past_key_values,
-                    encoder_attention_mask=encoder_attention_mask_in,
-                    context_latents=context_latents_in,
-                    output_attentions=True,
-                    custom_layers_config=custom_layers_config,
-                    enable_early_exit=True
-                )
-                
-                # Extract cross-attention matrices
-                if decoder_outputs[2] is None:
-                    return {
-                        "lrc_text": "",
-                        "sentence_timestamps": [],
-                        "token_timestamps": [],
-                        "success": False,
-                        "error": "Model did not return attentions"
-                    }
-                
-                cross_attns = decoder_outputs[2]  # Tuple of tensors (some may be None)
-                
-                captured_layers_list = []
-                for layer_attn in cross_attns:
-                    # Skip None values (layers that didn't return attention)
-                    if layer_attn is None:
-                        continue
-                    # Only take conditional part (first half of batch)
-                    cond_attn = layer_attn[:bsz]
-                    layer_matrix = cond_attn.transpose(-1, -2)
-                    captured_layers_list.append(layer_matrix)
-                
-                if not captured_layers_list:
-                    return {
-                        "lrc_text": "",
-                        "sentence_timestamps": [],
-                        "token_timestamps": [],
-                        "success": False,
-                        "error": "No valid attention layers returned"
-                    }
-                
-                stacked = torch.stack(captured_layers_list)
-                if bsz == 1:
-                    all_layers_matrix = stacked.squeeze(1)
+                if hasattr(decoder, 'eval'):
+                    decoder.eval()
+                attentions = None
+                if self.attention_capture and self._attention_capture_verified_for(
+                    decoder, decoder_inputs, custom_layers_config
+                ):
+                    attentions = self._capture_cross_attentions(decoder, decoder_inputs, custom_layers_config)
+                if attentions is None:
+                    attentions = self._output_cross_attentions(decoder, decoder_inputs, custom_layers_config)
+            if attentions is None:
+                return [_failed("No valid attention layers returned") for _ in range(bsz)]
+
+            # attentions: [copies * batch, heads, tokens, frames], heads already selected
+            selected_config = {0: list(range(attentions.shape[1]))}
+            dit_offset = bsz if with_scores else 0
+
+            results: List[Dict[str, Any]] = []
+            valid, lyric_ids_list, lm_matrices, dit_matrices = [], [], [], []
+            for b in range(bsz):
+                if isinstance(lyric_token_ids, torch.Tensor):
+                    raw_lyric_ids = lyric_token_ids[b].tolist()
+                elif lyric_token_ids and isinstance(lyric_token_ids[0], (list, tuple)):
+                    raw_lyric_ids = list(lyric_token_ids[b])
                 else:
-                    all_layers_matrix = stacked
-            
-            # Process lyric token IDs to extract pure lyrics
-            if isinstance(lyric_token_ids, torch.Tensor):
-                raw_lyric_ids = lyric_token_ids[0].tolist()
-            else:
-                raw_lyric_ids = lyric_token_ids
-            
-            # Parse header to find lyrics start position
-            header_str = f"# Languages\n{vocal_language}\n\n# Lyric\n"
-            header_ids = self.text_tokenizer.encode(header_str, add_special_tokens=False)
-            start_idx = len(header_ids)
-            
-            # Find end of lyrics (before endoftext token)
-            try:
-                end_idx = raw_lyric_ids.index(151643)  # <|endoftext|> token
-            except ValueError:
-                end_idx = len(raw_lyric_ids)
-            
-            pure_lyric_ids = raw_lyric_ids[start_idx:end_idx]
-            pure_lyric_matrix = all_layers_matrix[:, :, start_idx:end_idx, :]
-            
-            # Create aligner and generate timestamps
-            aligner = MusicStampsAligner(self.text_tokenizer)
-            
-            align_info = aligner.stamps_align_info(
-                attention_matrix=pure_lyric_matrix,
-                lyrics_tokens=pure_lyric_ids,
-                total_duration_seconds=total_duration_seconds,
-                custom_config=custom_layers_config,
-                return_matrices=False,
-                violence_level=2.0,
-                medfilt_width=1,
-            )
-            
-            if align_info.get("calc_matrix") is None:
-                return {
+                    raw_lyric_ids = lyric_token_ids
+                language = vocal_language[b] if isinstance(vocal_language, (list, tuple)) else vocal_language
+                start_idx, end_idx = self._pure_lyric_span(raw_lyric_ids, language)
+                if start_idx >= attentions.shape[-2]:  # Check text dim
+                    results.append(_failed("Lyrics indices out of bounds"))
+                    continue
+
+                valid.append(b)
+                lyric_ids_list.append(raw_lyric_ids[start_idx:end_idx])
+                # [1, heads, tokens, frames] -- the aligners' [Layers, Heads, Tokens, Frames] layout
+                lm_matrices.append(attentions[b:b + 1, :, start_idx:end_idx, :] if with_scores else None)
+                dit_matrices.append(attentions[dit_offset + b:dit_offset + b + 1, :, start_idx:end_idx, :])
+                results.append({
                     "lrc_text": "",
                     "sentence_timestamps": [],
                     "token_timestamps": [],
-                    "success": False,
-                    "error": align_info.get("error", "Failed to process attention matrix")
-                }
-            
-            # Generate timestamps
-            result = aligner.get_timestamps_and_lrc(
-                calc_matrix=align_info["calc_matrix"],
-                lyrics_tokens=pure_lyric_ids,
-                total_duration_seconds=total_duration_seconds
-            )
-            
-            return {
-                "lrc_text": result["lrc_text"],
-                "sentence_timestamps": result["sentence_timestamps"],
-                "token_timestamps": result["token_timestamps"],
-                "success": True,
-                "error": None
-            }
-            
+                    "lm_score": 0.0,
+                    "dit_score": 0.0,
+                    "success": True,
+                    "error": None
+                })
+
+            if with_scores and valid:
+                scorer = MusicLyricScorer(self.text_tokenizer)
+                infos = scorer.lyrics_alignment_info_batch(
+                    attention_matrices=lm_matrices + dit_matrices,
+                    token_ids_list=lyric_ids_list + lyric_ids_list,
+                    custom_config=selected_config,
+                    medfilt_width=1,
+                )
+
+                def score_from_info(info):
+                    """Final score of one alignment info dict"""
+                    if info.get("energy_matrix") is None:
+                        return 0.0
+                    res = scorer.calculate_score(
+                        energy_matrix=info["energy_matrix"],
+                        type_mask=info["type_mask"],
+                        path_coords=info["path_coords"],
+                    )
+                    return res.get("lyrics_score", res.get("final_score", 0.0))
+
+                for k, b in enumerate(valid):
+                    results[b]["lm_score"] = score_from_info(infos[k])
+                    results[b]["dit_score"] = score_from_info(infos[len(valid) + k])
+
+            if with_timestamps and valid:
+                aligner = MusicStampsAligner(self.text_tokenizer)
+                align_infos = aligner.stamps_align_info_batch(
+                    attention_matrices=dit_matrices,
+                    lyrics_tokens_list=lyric_ids_list,
+                    total_duration_seconds=[float(total_duration_seconds[b]) for b in valid],
+                    custom_config=selected_config,
+                    violence_level=2.0,
+                    medfilt_width=1,
+                )
+                for b, align_info in zip(valid, align_infos):
+                    if align_info.get("calc_matrix") is None:
+                        results[b] = _failed(align_info.get("error", "Failed to process attention matrix"))
+                        continue
+                    stamps = aligner.get_timestamps_and_lrc(
+                        calc_matrix=align_info["calc_matrix"],
+                        lyrics_tokens=align_info["lyrics_tokens"],
+                        total_duration_seconds=align_info["total_duration_seconds"],
+                        path=align_info["path"],
+                    )
+                    results[b]["lrc_text"] = stamps["lrc_text"]
+                    results[b]["sentence_timestamps"] = stamps["sentence_timestamps"]
+                    results[b]["token_timestamps"] = stamps["token_timestamps"]
+
+            return results
+
         except Exception as e:
-            error_msg = f"Error generating timestamps: {str(e)}"
-            logger.exception("[get_lyric_timestamp] Failed")
-            return {
-                "lrc_text": "",
-                "sentence_timestamps": [],
-                "token_timestamps": [],
-                "success": False,
-                "error": error_msg
-            }
+            error_msg = f"Error aligning lyrics: {str(e)}"
+            logger.exception("[get_lyric_alignments] Failed")
+            return [_failed(error_msg) for _ in range(bsz)]
+
+    @torch.no_grad()
+    def get_lyric_timestamp(
+        self,
+        pred_latent: torch.Tensor,
+        encoder_hidden_states: torch.Tensor,
+        encoder_attention_mask: torch.Tensor,
+        context_latents: torch.Tensor,
+        lyric_token_ids: torch.Tensor,
+        total_duration_seconds: float,
+        vocal_language: str = "en",
+        inference_steps: int = 8,
+        seed: int = 42,
+        custom_layers_config: Optional[Dict] = None,
+    ) -> Dict[str, Any]:
+        """
+        Generate lyrics timestamps from generated audio latents using cross-attention alignment.
+        
+        This method adds noise to the final pred_latent and re-infers one step to get
+        cross-attention matrices, then uses DTW to align lyrics tokens with audio frames.
+        
+        Args:
+            pred_latent: Generated latent tensor [batch, T, D]
+            encoder_hidden_states: Cached encoder hidden states
+            encoder_attention_mask: Cached encoder attention mask
+            context_latents: Cached context latents
+            lyric_token_ids: Tokenized lyrics tensor [batch, seq_len]
+            total_duration_seconds: Total audio duration in seconds
+            vocal_language: Language code for lyrics header parsing
+            inference_steps: Number of inference steps (for noise level calculation)
+            seed: Random seed for noise generation
+            custom_layers_config: Dict mapping layer indices to head indices
+            
+        Returns:
+            Dict containing (for the first batch item; see get_lyric_alignments):
+            - lrc_text: LRC formatted lyrics with timestamps
+            - sentence_timestamps: List of SentenceTimestamp objects
+            - token_timestamps: List of TokenTimestamp objects
+            - success: Whether generation succeeded
+            - error: Error message if failed
+        """
+        result = self.get_lyric_alignments(
+            pred_latent=pred_latent,
+            encoder_hidden_states=encoder_hidden_states,
+            encoder_attention_mask=encoder_attention_mask,
+            context_latents=context_latents,
+            lyric_token_ids=lyric_token_ids,
+            total_duration_seconds=total_duration_seconds,
+            vocal_language=vocal_language,
+            inference_steps=inference_steps,
+            seed=seed,
+            custom_layers_config=custom_layers_config,
+            with_scores=False,
+        )[0]
+        return {key: result[key] for key in ("lrc_text", "sentence_timestamps", "token_timestamps", "success", "error")}
 
     @torch.no_grad()
     def get_lyric_score(
@@ -3270,197 +3826,60 @@ class AceStepHandler:
             custom_layers_config: Dict mapping layer indices to head indices
 
         Returns:
-            Dict containing:
+            Dict containing (for the first batch item; see get_lyric_scores):
             - lm_score: float
             - dit_score: float
             - success: Whether generation succeeded
             - error: Error message if failed
         """
-        from transformers.cache_utils import EncoderDecoderCache, DynamicCache
+        return self.get_lyric_scores(
+            pred_latent=pred_latent,
+            encoder_hidden_states=encoder_hidden_states,
+            encoder_attention_mask=encoder_attention_mask,
+            context_latents=context_latents,
+            lyric_token_ids=lyric_token_ids,
+            vocal_language=vocal_language,
+            inference_steps=inference_steps,
+            seed=seed,
+            custom_layers_config=custom_layers_config,
+        )[0]
 
-        if self.model is None:
-            return {
-                "lm_score": 0.0,
-                "dit_score": 0.0,
-                "success": False,
-                "error": "Model not initialized"
-            }
-
-        if custom_layers_config is None:
-            custom_layers_config = self.custom_layers_config
-
-        try:
-            # Move tensors to device
-            device = self.device
-            dtype = self.dtype
-
-            pred_latent = pred_latent.to(device=device, dtype=dtype)
-            encoder_hidden_states = encoder_hidden_states.to(device=device, dtype=dtype)
-            encoder_attention_mask = encoder_attention_mask.to(device=device, dtype=dtype)
-            context_latents = context_latents.to(device=device, dtype=dtype)
-
-            bsz = pred_latent.shape[0]
-
-            if seed is None:
-                x0 = torch.randn_like(pred_latent)
-            else:
-                generator = torch.Generator(device=device).manual_seed(int(seed))
-                x0 = torch.randn(pred_latent.shape, generator=generator, device=device, dtype=dtype)
-
-            # --- Input A: LM Score ---
-            # t = 1.0, xt = Pure Noise
-            t_lm = torch.tensor([1.0] * bsz, device=device, dtype=dtype)
-            xt_lm = x0
-
-            # --- Input B: DiT Score ---
-            # t = 1.0/steps, xt = Regressed Latent
-            t_last_val = 1.0 / inference_steps
-            t_dit = torch.tensor([t_last_val] * bsz, device=device, dtype=dtype)
-            # Flow Matching Regression: xt = t*x0 + (1-t)*x1
-            xt_dit = t_last_val * x0 + (1.0 - t_last_val) * pred_latent
-
-            # Order: [Think_Batch, DiT_Batch]
-            xt_in = torch.cat([xt_lm, xt_dit], dim=0)
-            t_in = torch.cat([t_lm, t_dit], dim=0)
-
-            # Duplicate conditions
-            encoder_hidden_states_in = torch.cat([encoder_hidden_states, encoder_hidden_states], dim=0)
-            encoder_attention_mask_in = torch.cat([encoder_attention_mask, encoder_attention_mask], dim=0)
-            context_latents_in = torch.cat([context_latents, context_latents], dim=0)
-
-            # Prepare Attention Mask
-            latent_length = xt_in.shape[1]
-            attention_mask_in = torch.ones(2 * bsz, latent_length, device=device, dtype=dtype)
-            past_key_values = None
-
-            # Run decoder with output_attentions=True
-            with self._load_model_context("model"):
-                decoder = self.model.decoder
-                if hasattr(decoder, 'eval'):
-                    decoder.eval()
-
-                decoder_outputs = decoder(
-                    hidden_states=xt_in,
-                    timestep=t_in,
-                    timestep_r=t_in,
-                    attention_mask=attention_mask_in,
-                    encoder_hidden_states=encoder_hidden_states_in,
-                    use_cache=False,
-                    past_key_values=past_key_values,
-                    encoder_attention_mask=encoder_attention_mask_in,
-                    context_latents=context_latents_in,
-                    output_attentions=True,
-                    custom_layers_config=custom_layers_config,
-                    enable_early_exit=True
-                )
-
-                # Extract cross-attention matrices
-                if decoder_outputs[2] is None:
-                    return {
-                        "lm_score": 0.0,
-                        "dit_score": 0.0,
-                        "success": False,
-                        "error": "Model did not return attentions"
-                    }
-
-                cross_attns = decoder_outputs[2]  # Tuple of tensors (some may be None)
-
-                captured_layers_list = []
-                for layer_attn in cross_attns:
-                    if layer_attn is None:
-                        continue
-
-                    # Only take conditional part (first half of batch)
-                    layer_matrix = layer_attn.transpose(-1, -2)
-                    captured_layers_list.append(layer_matrix)
-
-                if not captured_layers_list:
-                    return {
-                        "lm_score": 0.0,
-                        "dit_score": 0.0,
-                        "success": False,
-                        "error": "No valid attention layers returned"
-                    }
-
-                stacked = torch.stack(captured_layers_list)
-
-                all_layers_matrix_lm = stacked[:, :bsz, ...]
-                all_layers_matrix_dit = stacked[:, bsz:, ...]
-
-                if bsz == 1:
-                    all_layers_matrix_lm = all_layers_matrix_lm.squeeze(1)
-                    all_layers_matrix_dit = all_layers_matrix_dit.squeeze(1)
-                else:
-                    pass
-
-            # Process lyric token IDs to extract pure lyrics
-            if isinstance(lyric_token_ids, torch.Tensor):
-                raw_lyric_ids = lyric_token_ids[0].tolist()
-            else:
-                raw_lyric_ids = lyric_token_ids
-
-            # Parse header to find lyrics start position
-            header_str = f"# Languages\n{vocal_language}\n\n# Lyric\n"
-            header_ids = self.text_tokenizer.encode(header_str, add_special_tokens=False)
-            start_idx = len(header_ids)
-
-            # Find end of lyrics (before endoftext token)
-            try:
-                end_idx = raw_lyric_ids.index(151643)  # <|endoftext|> token
-            except ValueError:
-                end_idx = len(raw_lyric_ids)
-
-            pure_lyric_ids = raw_lyric_ids[start_idx:end_idx]
-            if start_idx >= all_layers_matrix_lm.shape[-2]:  # Check text dim
-                return {
-                    "lm_score": 0.0,
-                    "dit_score": 0.0,
-                    "success": False,
-                    "error": "Lyrics indices out of bounds"
-                }
-
-            pure_matrix_lm = all_layers_matrix_lm[..., start_idx:end_idx, :]
-            pure_matrix_dit = all_layers_matrix_dit[..., start_idx:end_idx, :]
-
-            # Create aligner and calculate alignment info
-            aligner = MusicLyricScorer(self.text_tokenizer)
-
-            def calculate_single_score(matrix):
-                """Helper to run aligner on a matrix"""
-                info = aligner.lyrics_alignment_info(
-                    attention_matrix=matrix,
-                    token_ids=pure_lyric_ids,
-                    custom_config=custom_layers_config,
-                    return_matrices=False,
-                    medfilt_width=1,
-                )
-                if info.get("energy_matrix") is None:
-                    return 0.0
-
-                res = aligner.calculate_score(
-                    energy_matrix=info["energy_matrix"],
-                    type_mask=info["type_mask"],
-                    path_coords=info["path_coords"],
-                )
-                # Return the final score (check return key)
-                return res.get("lyrics_score", res.get("final_score", 0.0))
-
-            lm_score = calculate_single_score(pure_matrix_lm)
-            dit_score = calculate_single_score(pure_matrix_dit)
+    @torch.no_grad()
+    def get_lyric_scores(
+            self,
+            pred_latent: torch.Tensor,
+            encoder_hidden_states: torch.Tensor,
+            encoder_attention_mask: torch.Tensor,
+            context_latents: torch.Tensor,
+            lyric_token_ids: torch.Tensor,
+            vocal_language: Union[str, List[str]] = "en",
+            inference_steps: int = 8,
+            seed: int = 42,
+            custom_layers_config: Optional[Dict] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Batched get_lyric_score: one decoder pass for the whole batch (see get_lyric_alignments).
 
-            return {
-                "lm_score": lm_score,
-                "dit_score": dit_score,
-                "success": True,
-                "error": None
-            }
+        Args:
+            vocal_language: Language code for lyrics header parsing, or one per sample
+            (other args as in get_lyric_score)
 
-        except Exception as e:
-            error_msg = f"Error generating score: {str(e)}"
-            logger.exception("[get_lyric_score] Failed")
-            return {
-                "lm_score": 0.0,
-                "dit_score": 0.0,
-                "success": False,
-                "error": error_msg
-            }
+        Returns:
+            One get_lyric_score-style dict per batch item
+        """
+        results = self.get_lyric_alignments(
+            pred_latent=pred_latent,
+            encoder_hidden_states=encoder_hidden_states,
+            encoder_attention_mask=encoder_attention_mask,
+            context_latents=context_latents,
+            lyric_token_ids=lyric_token_ids,
+            vocal_language=vocal_language,
+            inference_steps=inference_steps,
+            seed=seed,
+            custom_layers_config=custom_layers_config,
+            with_timestamps=False,
+        )
+        return [
+            {key: result[key] for key in ("lm_score", "dit_score", "success", "error")}
+            for result in results
+        ]
@@ -0,0 +1,219 @@
+"""Pool of DiT/LM handler replicas pinned to devices, with least-loaded routing
+
+Each replica wraps one ``AceStepHandler`` (and the ``LLMHandler`` it should use)
+on one device, plus a dedicated executor whose threads are bound to that device.
+``acquire`` picks, among the initialized replicas serving the requested model,
+the one on the device with the fewest in-flight jobs, then the one with the
+fewest jobs of its own (ties broken by accumulated busy time),
+and the pool keeps per-replica queue depth and busy-time metrics.
+
+Handlers are duck-typed, so the pool can be exercised on CPU with fake handlers.
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import torch
+
+
+def parse_devices(spec: Optional[str], default: str = "auto") -> List[str]:
+    """
+    Parse a device list such as ``"cuda:0,cuda:1"`` (ACESTEP_DEVICES).
+
+    ``"cuda:all"`` expands to every visible CUDA device. An empty spec yields
+    ``[default]``. Duplicates are dropped, order is kept.
+    """
+    devices: List[str] = []
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if part in ("cuda:all", "all"):
+            count = torch.cuda.device_count() if torch.cuda.is_available() else 0
+            devices.extend(f"cuda:{i}" for i in range(count))
+        else:
+            devices.append(part)
+    devices = list(dict.fromkeys(devices))
+    return devices or [default]
+
+
+def _bind_thread_to_device(device: str) -> None:
+    """Executor initializer: make ``device`` the current device of the worker thread."""
+    try:
+        if device.startswith("cuda:") and torch.cuda.is_available():
+            torch.cuda.set_device(device)
+        elif device.startswith("xpu:") and hasattr(torch, "xpu") and torch.xpu.is_available():
+            torch.xpu.set_device(device)
+    except Exception:
+        # Keep the thread usable; handlers still move tensors to their own device
+        pass
+
+
+@dataclass
+class HandlerReplica:
+    """One handler instance on one device, with its executor and load counters."""
+
+    model: str
+    device: str
+    handler: Any
+    llm_handler: Any = None
+    config_path: str = ""
+    is_default: bool = False
+    initialized: bool = False
+    executor: Optional[ThreadPoolExecutor] = None
+    inflight: int = 0
+    busy_seconds: float = 0.0
+    jobs: int = 0
+    failures: int = 0
+    created_at: float = field(default_factory=time.time)
+
+    @property
+    def name(self) -> str:
+        return f"{self.model}@{self.device}"
+
+
+class HandlerPool:
+    """
+    Thread-safe registry of handler replicas with model-aware, least-loaded routing.
+
+    Typical use from an async worker::
+
+        replica, matched = pool.acquire(req.model, jobs=1)
+        try:
+            result = await pool.run(replica, blocking_fn)
+        finally:
+            pool.release(replica, jobs=1)
+    """
+
+    def __init__(self, max_workers_per_replica: int = 1):
+        self.max_workers_per_replica = max(1, int(max_workers_per_replica))
+        self._replicas: List[HandlerReplica] = []
+        self._lock = Lock()
+
+    def add(
+        self,
+        model: str,
+        device: str,
+        handler: Any,
+        llm_handler: Any = None,
+        config_path: str = "",
+        is_default: bool = False,
+        initialized: bool = False,
+    ) -> HandlerReplica:
+        """Register a replica and give it an executor bound to its device."""
+        replica = HandlerReplica(
+            model=model,
+            device=device,
+            handler=handler,
+            llm_handler=llm_handler,
+            config_path=config_path,
+            is_default=is_default,
+            initialized=initialized,
+        )
+        replica.executor = ThreadPoolExecutor(
+            max_workers=self.max_workers_per_replica,
+            thread_name_prefix=f"acestep-{replica.name}",
+            initializer=_bind_thread_to_device,
+            initargs=(device,),
+        )
+        with self._lock:
+            self._replicas.append(replica)
+        return replica
+
+    @property
+    def replicas(self) -> List[HandlerReplica]:
+        with self._lock:
+            return list(self._replicas)
+
+    def ready(self) -> List[HandlerReplica]:
+        """Initialized replicas, in registration order."""
+        return [r for r in self.replicas if r.initialized]
+
+    def models(self) -> List[str]:
+        """Names of models with at least one initialized replica; the default model first."""
+        ready = self.ready()
+        ready.sort(key=lambda r: not r.is_default)
+        return list(dict.fromkeys(r.model for r in ready))
+
+    @property
+    def default_model(self) -> Optional[str]:
+        models = self.models()
+        return models[0] if models else None
+
+    def acquire(self, model: Optional[str] = None, jobs: int = 1) -> Tuple[HandlerReplica, bool]:
+        """
+        Reserve the least-loaded initialized replica serving ``model``.
+
+        Unknown or empty model names fall back to the default model. Returns
+        ``(replica, matched)`` where ``matched`` tells whether ``model`` was
+        served as requested. Every acquire must be paired with ``release``.
+        """
+        with self._lock:
+            ready = [r for r in self._replicas if r.initialized]
+            if not ready:
+                raise RuntimeError("No initialized DiT handler available")
+            candidates = [r for r in ready if model and r.model == model]
+            matched = bool(candidates)
+            if not candidates:
+                default = next((r.model for r in ready if r.is_default), ready[0].model)
+                candidates = [r for r in ready if r.model == default]
+            # Prefer the least busy device first: replicas of different models may share one
+            device_load: Dict[str, int] = {}
+            for r in ready:
+                device_load[r.device] = device_load.get(r.device, 0) + r.inflight
+            replica = min(candidates, key=lambda r: (device_load[r.device], r.inflight, r.busy_seconds))
+            replica.inflight += jobs
+            return replica, matched
+
+    def release(self, replica: HandlerReplica, jobs: int = 1) -> None:
+        with self._lock:
+            replica.inflight = max(0, replica.inflight - jobs)
+
+    async def run(self, replica: HandlerReplica, fn: Callable[[], Any], jobs: int = 1) -> Any:
+        """Run ``fn`` on the replica's executor, charging its execution time to the replica."""
+
+        def _timed() -> Any:
+            t0 = time.time()
+            ok = False
+            try:
+                result = fn()
+                ok = True
+                return result
+            finally:
+                with self._lock:
+                    replica.busy_seconds += time.time() - t0
+                    replica.jobs += jobs
+                    if not ok:
+                        replica.failures += jobs
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(replica.executor, _timed)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Per-replica queue depth and busy-time metrics."""
+        now = time.time()
+        with self._lock:
+            return [
+                {
+                    "name": r.name,
+                    "model": r.model,
+                    "device": r.device,
+                    "initialized": r.initialized,
+                    "is_default": r.is_default,
+                    "queue_depth": r.inflight,
+                    "jobs": r.jobs,
+                    "failures": r.failures,
+                    "busy_seconds": round(r.busy_seconds, 3),
+                    "utilization": round(r.busy_seconds / max(now - r.created_at, 1e-6), 4),
+                }
+                for r in self._replicas
+            ]
+
+    def shutdown(self) -> None:
+        for r in self.replicas:
+            if r.executor is not None:
+                r.executor.shutdown(wait=False, cancel_futures=True)
@@ -9,6 +9,7 @@ backward-compatible Gradio UI support.
 import math
 import os
 import tempfile
+import time
 from typing import Optional, Union, List, Dict, Any, Tuple
 from dataclasses import dataclass, field, asdict
 from loguru import logger
@@ -289,6 +290,455 @@ def _update_metadata_from_lm(
     return bpm, key_scale, time_signature, audio_duration, vocal_language, caption, lyrics
 
 
+def _prepare_dit_inputs(
+    dit_handler,
+    llm_handler,
+    params: GenerationParams,
+    config: GenerationConfig,
+    progress=None,
+    audio_chunk_callback=None,
+    lm_text_callback=None,
+) -> Union[Dict[str, Any], GenerationResult]:
+    """Run the optional LM phase and resolve the inputs for the DiT phase.
+
+    Returns:
+        Dict with ``dit_kwargs`` (keyword arguments for ``dit_handler.generate_music``)
+        plus the LM bookkeeping needed by ``_build_generation_result``, or a failed
+        GenerationResult if the LM phase errored.
+    """
+    # Phase 1: LM-based metadata and code generation (if enabled)
+    audio_code_string_to_use = params.audio_codes
+    lm_generated_metadata = None
+    lm_generated_audio_codes_list = []
+    lm_total_time_costs = {
+        "phase1_time": 0.0,
+        "phase2_time": 0.0,
+        "total_time": 0.0,
+    }
+
+    # Extract mutable copies of metadata (will be updated by LM if needed)
+    bpm = params.bpm
+    key_scale = params.keyscale
+    time_signature = params.timesignature
+    audio_duration = params.duration
+    dit_input_caption = params.caption
+    dit_input_vocal_language = params.vocal_language
+    dit_input_lyrics = params.lyrics
+    # Determine if we need to generate audio codes
+    # If user has provided audio_codes, we don't need to generate them
+    # Otherwise, check if we need audio codes (lm_dit mode) or just metas (dit mode)
+    user_provided_audio_codes = bool(params.audio_codes and str(params.audio_codes).strip())
+
+    # Determine infer_type: use "llm_dit" if we need audio codes, "dit" if only metas needed
+    # For now, we use "llm_dit" if batch mode or if user hasn't provided codes
+    # Use "dit" if user has provided codes (only need metas) or if explicitly only need metas
+    # Note: This logic can be refined based on specific requirements
+    need_audio_codes = not user_provided_audio_codes
+
+    # Determine if we should use chunk-based LM generation (always use chunks for consistency)
+    # Determine actual batch size for chunk processing
+    actual_batch_size = config.batch_size if config.batch_size is not None else 1
+
+    # Prepare seeds for batch generation
+    # Use config.seed if provided, otherwise fallback to params.seed
+    # Convert config.seed (None, int, or List[int]) to format that prepare_seeds accepts
+    seed_for_generation = ""
+    # Original code (commented out because it crashes on int seeds):
+    # if config.seeds is not None and len(config.seeds) > 0:
+    #     if isinstance(config.seeds, list):
+    #         # Convert List[int] to comma-separated string
+    #         seed_for_generation = ",".join(str(s) for s in config.seeds)
+
+    if config.seeds is not None:
+        if isinstance(config.seeds, list) and len(config.seeds) > 0:
+            # Convert List[int] to comma-separated string
+            seed_for_generation = ",".join(str(s) for s in config.seeds)
+        elif isinstance(config.seeds, int):
+            # Fix: Explicitly handle single integer seeds by converting to string.
+            # Previously, this would crash because 'len()' was called on an int.
+            seed_for_generation = str(config.seeds)
+    elif not config.use_random_seed and params.seed is not None and params.seed >= 0:
+        # No explicit seed list: fall back to params.seed so fixed-seed requests are reproducible
+        seed_for_generation = str(params.seed)
+
+    # Use dit_handler.prepare_seeds to handle seed list generation and padding
+    # This will handle all the logic: padding with random seeds if needed, etc.
+    actual_seed_list, _ = dit_handler.prepare_seeds(actual_batch_size, seed_for_generation, config.use_random_seed)
+
+    # LM-based Chain-of-Thought reasoning
+    # Skip LM for cover/repaint tasks - these tasks use reference/src audio directly
+    # and don't need LM to generate audio codes
+    skip_lm_tasks = {"cover", "repaint"}
+
+    # Determine if we should use LLM
+    # LLM is needed for:
+    # 1. thinking=True: generate audio codes via LM
+    # 2. use_cot_caption=True: enhance/generate caption via CoT
+    # 3. use_cot_language=True: detect vocal language via CoT
+    # 4. use_cot_metas=True: fill missing metadata via CoT
+    need_lm_for_cot = params.use_cot_caption or params.use_cot_language or params.use_cot_metas
+    use_lm = (params.thinking or need_lm_for_cot) and llm_handler is not None and llm_handler.llm_initialized and params.task_type not in skip_lm_tasks
+    lm_status = []
+
+    if params.task_type in skip_lm_tasks:
+        logger.info(f"Skipping LM for task_type='{params.task_type}' - using DiT directly")
+
+    logger.info(f"[generate_music] LLM usage decision: thinking={params.thinking}, "
+               f"use_cot_caption={params.use_cot_caption}, use_cot_language={params.use_cot_language}, "
+               f"use_cot_metas={params.use_cot_metas}, need_lm_for_cot={need_lm_for_cot}, "
+               f"llm_initialized={llm_handler.llm_initialized if llm_handler else False}, use_lm={use_lm}")
+
+    if use_lm:
+        # Convert sampling parameters - handle None values safely
+        top_k_value = None if not params.lm_top_k or params.lm_top_k == 0 else int(params.lm_top_k)
+        top_p_value = None if not params.lm_top_p or params.lm_top_p >= 1.0 else params.lm_top_p
+
+        # Build user_metadata from user-provided values
+        user_metadata = {}
+        if bpm is not None:
+            try:
+                bpm_value = float(bpm)
+                if bpm_value > 0:
+                    user_metadata['bpm'] = int(bpm_value)
+            except (ValueError, TypeError):
+                pass
+
+        if key_scale and key_scale.strip():
+            key_scale_clean = key_scale.strip()
+            if key_scale_clean.lower() not in ["n/a", ""]:
+                user_metadata['keyscale'] = key_scale_clean
+
+        if time_signature and time_signature.strip():
+            time_sig_clean = time_signature.strip()
+            if time_sig_clean.lower() not in ["n/a", ""]:
+                user_metadata['timesignature'] = time_sig_clean
+
+        if audio_duration is not None:
+            try:
+                duration_value = float(audio_duration)
+                if duration_value > 0:
+                    user_metadata['duration'] = int(duration_value)
+            except (ValueError, TypeError):
+                pass
+
+        user_metadata_to_pass = user_metadata if user_metadata else None
+
+        # Determine infer_type based on whether we need audio codes
+        # - "llm_dit": generates both metas and audio codes (two-phase internally)
+        # - "dit": generates only metas (single phase)
+        infer_type = "llm_dit" if need_audio_codes and params.thinking else "dit"
+
+        # Use chunk size from config, or default to batch_size if not set
+        max_inference_batch_size = int(config.lm_batch_chunk_size) if config.lm_batch_chunk_size > 0 else actual_batch_size
+        num_chunks = math.ceil(actual_batch_size / max_inference_batch_size)
+
+        all_metadata_list = []
+        all_audio_codes_list = []
+
+        for chunk_idx in range(num_chunks):
+            chunk_start = chunk_idx * max_inference_batch_size
+            chunk_end = min(chunk_start + max_inference_batch_size, actual_batch_size)
+            chunk_size = chunk_end - chunk_start
+            chunk_seeds = actual_seed_list[chunk_start:chunk_end] if chunk_start < len(actual_seed_list) else None
+
+            logger.info(f"LM chunk {chunk_idx+1}/{num_chunks} (infer_type={infer_type}) "
+                        f"(size: {chunk_size}, seeds: {chunk_seeds})")
+
+            # Use the determined infer_type
+            # - "llm_dit" will internally run two phases (metas + codes)
+            # - "dit" will only run phase 1 (metas only)
+            result = llm_handler.generate_with_stop_condition(
+                caption=params.caption or "",
+                lyrics=params.lyrics or "",
+                infer_type=infer_type,
+                temperature=params.lm_temperature,
+                cfg_scale=params.lm_cfg_scale,
+                negative_prompt=params.lm_negative_prompt,
+                top_k=top_k_value,
+                top_p=top_p_value,
+                target_duration=audio_duration,  # Pass duration to limit audio codes generation
+                user_metadata=user_metadata_to_pass,
+                use_cot_caption=params.use_cot_caption,
+                use_cot_language=params.use_cot_language,
+                use_cot_metas=params.use_cot_metas,
+                use_constrained_decoding=params.use_constrained_decoding,
+                constrained_decoding_debug=config.constrained_decoding_debug,
+                batch_size=chunk_size,
+                seeds=chunk_seeds,
+                progress=progress,
+                cot_callback=lm_text_callback,
+            )
+
+            # Check if LM generation failed
+            if not result.get("success", False):
+                error_msg = result.get("error", "Unknown LM error")
+                lm_status.append(f"❌ LM Error: {error_msg}")
+                # Return early with error
+                return GenerationResult(
+                    audios=[],
+                    status_message=f"❌ LM generation failed: {error_msg}",
+                    extra_outputs={},
+                    success=False,
+                    error=error_msg,
+                )
+
+            # Extract metadata and audio_codes from result dict
+            if chunk_size > 1:
+                metadata_list = result.get("metadata", [])
+                audio_codes_list = result.get("audio_codes", [])
+                all_metadata_list.extend(metadata_list)
+                all_audio_codes_list.extend(audio_codes_list)
+            else:
+                metadata = result.get("metadata", {})
+                audio_codes = result.get("audio_codes", "")
+                all_metadata_list.append(metadata)
+                all_audio_codes_list.append(audio_codes)
+
+            # Collect time costs from LM extra_outputs
+            lm_extra = result.get("extra_outputs", {})
+            lm_chunk_time_costs = lm_extra.get("time_costs", {})
+            if lm_chunk_time_costs:
+                # Accumulate time costs from all chunks
+                for key in ["phase1_time", "phase2_time", "total_time"]:
+                    if key in lm_chunk_time_costs:
+                        lm_total_time_costs[key] += lm_chunk_time_costs[key]
+
+                time_str = ", ".join([f"{k}: {v:.2f}s" for k, v in lm_chunk_time_costs.items()])
+                lm_status.append(f"✅ LM chunk {chunk_idx+1}: {time_str}")
+
+        lm_generated_metadata = all_metadata_list[0] if all_metadata_list else None
+        lm_generated_audio_codes_list = all_audio_codes_list
+
+        # Set audio_code_string_to_use based on infer_type
+        if infer_type == "llm_dit":
+            # If batch mode, use list; otherwise use single string
+            if actual_batch_size > 1:
+                audio_code_string_to_use = all_audio_codes_list
+            else:
+                audio_code_string_to_use = all_audio_codes_list[0] if all_audio_codes_list else ""
+        else:
+            # For "dit" mode, keep user-provided codes or empty
+            audio_code_string_to_use = params.audio_codes
+
+        # Update metadata from LM if not provided by user
+        if lm_generated_metadata:
+            bpm, key_scale, time_signature, audio_duration, vocal_language, caption, lyrics = _update_metadata_from_lm(
+                metadata=lm_generated_metadata,
+                bpm=bpm,
+                key_scale=key_scale,
+                time_signature=time_signature,
+                audio_duration=audio_duration,
+                vocal_language=dit_input_vocal_language,
+                caption=dit_input_caption,
+                lyrics=dit_input_lyrics)
+            if not params.bpm:
+                params.cot_bpm = bpm
+            if not params.keyscale:
+                params.cot_keyscale = key_scale
+            if not params.timesignature:
+                params.cot_timesignature = time_signature
+            if not params.duration:
+                params.cot_duration = audio_duration
+            if not params.vocal_language:
+                params.cot_vocal_language = vocal_language
+            if not params.caption:
+                params.cot_caption = caption
+            if not params.lyrics:
+                params.cot_lyrics = lyrics
+
+        # set cot caption and language if needed
+        if params.use_cot_caption:
+            dit_input_caption = lm_generated_metadata.get("caption", dit_input_caption)
+        if params.use_cot_language:
+            dit_input_vocal_language = lm_generated_metadata.get("vocal_language", dit_input_vocal_language)
+
+    # Use seed_for_generation (from config.seed or params.seed) instead of params.seed for actual generation
+    dit_kwargs = dict(
+        captions=dit_input_caption,
+        lyrics=dit_input_lyrics,
+        bpm=bpm,
+        key_scale=key_scale,
+        time_signature=time_signature,
+        vocal_language=dit_input_vocal_language,
+        inference_steps=params.inference_steps,
+        guidance_scale=params.guidance_scale,
+        use_random_seed=config.use_random_seed,
+        seed=seed_for_generation,  # Use config.seed (or params.seed fallback) instead of params.seed directly
+        reference_audio=params.reference_audio,
+        audio_duration=audio_duration,
+        batch_size=config.batch_size if config.batch_size is not None else 1,
+        src_audio=params.src_audio,
+        audio_code_string=audio_code_string_to_use,
+        repainting_start=params.repainting_start,
+        repainting_end=params.repainting_end,
+        instruction=params.instruction,
+        audio_cover_strength=params.audio_cover_strength,
+        task_type=params.task_type,
+        use_adg=params.use_adg,
+        cfg_interval_start=params.cfg_interval_start,
+        cfg_interval_end=params.cfg_interval_end,
+        shift=params.shift,
+        infer_method=params.infer_method,
+        timesteps=params.timesteps,
+        progress=progress,
+        audio_chunk_callback=audio_chunk_callback,
+    )
+
+    return {
+        "dit_kwargs": dit_kwargs,
+        "actual_seed_list": actual_seed_list,
+        "audio_code_string_to_use": audio_code_string_to_use,
+        "lm_generated_metadata": lm_generated_metadata,
+        "lm_generated_audio_codes_list": lm_generated_audio_codes_list,
+        "lm_total_time_costs": lm_total_time_costs,
+        "lm_status": lm_status,
+        "use_lm": use_lm,
+    }
+
+
+def _build_generation_result(
+    params: GenerationParams,
+    config: GenerationConfig,
+    prepared: Dict[str, Any],
+    result: Dict[str, Any],
+    save_dir: Optional[str] = None,
+) -> GenerationResult:
+    """Save the DiT audios and merge LM/DiT outputs into a GenerationResult."""
+    actual_seed_list = prepared["actual_seed_list"]
+    audio_code_string_to_use = prepared["audio_code_string_to_use"]
+    lm_generated_metadata = prepared["lm_generated_metadata"]
+    lm_generated_audio_codes_list = prepared["lm_generated_audio_codes_list"]
+    lm_total_time_costs = prepared["lm_total_time_costs"]
+    lm_status = prepared["lm_status"]
+    use_lm = prepared["use_lm"]
+
+    # Check if generation failed
+    if not result.get("success", False):
+        return GenerationResult(
+            audios=[],
+            status_message=result.get("status_message", ""),
+            extra_outputs={},
+            success=False,
+            error=result.get("error"),
+        )
+
+    # Extract results from dit_handler.generate_music dict
+    dit_audios = result.get("audios", [])
+    status_message = result.get("status_message", "")
+    dit_extra_outputs = result.get("extra_outputs", {})
+
+    # Use the seed list already prepared above (from config.seed or params.seed fallback)
+    # actual_seed_list was computed earlier using dit_handler.prepare_seeds
+    seed_list = actual_seed_list
+
+    # Get base params dictionary
+    base_params_dict = params.to_dict()
+
+    # Save audio files using AudioSaver (format from config)
+    audio_format = config.audio_format if config.audio_format else "flac"
+    audio_saver = AudioSaver(default_format=audio_format)
+
+    # Use handler's temp_dir for saving files
+    if save_dir is not None:
+        os.makedirs(save_dir, exist_ok=True)
+
+    # Build audios list for GenerationResult with params and save files
+    # Audio saving and UUID generation handled here, outside of handler
+    audios = []
+    save_start_time = time.time()
+    for idx, dit_audio in enumerate(dit_audios):
+        # Create a copy of params dict for this audio
+        audio_params = base_params_dict.copy()
+
+        # Update audio-specific values
+        audio_params["seed"] = seed_list[idx] if idx < len(seed_list) else None
+
+        # Add audio codes if batch mode
+        if lm_generated_audio_codes_list and idx < len(lm_generated_audio_codes_list):
+            audio_params["audio_codes"] = lm_generated_audio_codes_list[idx]
+
+        # Get audio tensor and metadata
+        audio_tensor = dit_audio.get("tensor")
+        sample_rate = dit_audio.get("sample_rate", 48000)
+
+        # Generate UUID for this audio (moved from handler)
+        batch_seed = seed_list[idx] if idx < len(seed_list) else seed_list[0] if seed_list else -1
+        audio_code_str = lm_generated_audio_codes_list[idx] if (
+            lm_generated_audio_codes_list and idx < len(lm_generated_audio_codes_list)) else audio_code_string_to_use
+        if isinstance(audio_code_str, list):
+            audio_code_str = audio_code_str[idx] if idx < len(audio_code_str) else ""
+
+        audio_key = generate_uuid_from_params(audio_params)
+
+        # Save audio file (handled outside handler)
+        audio_path = None
+        if audio_tensor is not None and save_dir is not None:
+            try:
+                audio_file = os.path.join(save_dir, f"{audio_key}.{audio_format}")
+                audio_path = audio_saver.save_audio(audio_tensor,
+                                                    audio_file,
+                                                    sample_rate=sample_rate,
+                                                    format=audio_format,
+                                                    channels_first=True)
+            except Exception as e:
+                logger.error(f"[generate_music] Failed to save audio file: {e}")
+                audio_path = ""  # Fallback to empty path
+
+        audio_dict = {
+            "path": audio_path or "",  # File path (saved here, not in handler)
+            "tensor": audio_tensor,  # Audio tensor [channels, samples], CPU, float32
+            "key": audio_key,
+            "sample_rate": sample_rate,
+            "params": audio_params,
+        }
+
+        audios.append(audio_dict)
+    save_time = time.time() - save_start_time
+
+    # Merge extra_outputs: include dit_extra_outputs (latents, masks) and add LM metadata
+    extra_outputs = dit_extra_outputs.copy()
+    extra_outputs["lm_metadata"] = lm_generated_metadata
+
+    # Merge time_costs from both LM and DiT into a unified dictionary
+    unified_time_costs = {}
+
+    # Add LM time costs (if LM was used)
+    if use_lm and lm_total_time_costs:
+        for key, value in lm_total_time_costs.items():
+            unified_time_costs[f"lm_{key}"] = value
+
+    # Add DiT time costs (if available)
+    dit_time_costs = dit_extra_outputs.get("time_costs", {})
+    if dit_time_costs:
+        for key, value in dit_time_costs.items():
+            unified_time_costs[f"dit_{key}"] = value
+
+    # Calculate total pipeline time
+    if unified_time_costs:
+        lm_total = unified_time_costs.get("lm_total_time", 0.0)
+        dit_total = unified_time_costs.get("dit_total_time_cost", 0.0)
+        unified_time_costs["pipeline_total_time"] = lm_total + dit_total
+
+    if save_dir is not None:
+        unified_time_costs["save_time"] = save_time
+
+    # Update extra_outputs with unified time_costs
+    extra_outputs["time_costs"] = unified_time_costs
+
+    if lm_status:
+        status_message = "\n".join(lm_status) + "\n" + status_message
+    else:
+        status_message = status_message
+    # Create and return GenerationResult
+    return GenerationResult(
+        audios=audios,
+        status_message=status_message,
+        extra_outputs=extra_outputs,
+        success=True,
+        error=None,
+    )
+
+
 @_get_spaces_gpu_decorator(duration=180)
 def generate_music(
     dit_handler,
@@ -297,6 +747,8 @@ def generate_music(
     config: GenerationConfig,
     save_dir: Optional[str] = None,
     progress=None,
+    audio_chunk_callback=None,
+    lm_text_callback=None,
 ) -> GenerationResult:
     """Generate music using ACE-Step model with optional LM reasoning.
     
@@ -305,405 +757,24 @@ def generate_music(
         llm_handler: Initialized LLM handler (LLMHandler instance)
         params: Generation parameters (GenerationParams instance)
         config: Generation configuration (GenerationConfig instance)
+        audio_chunk_callback: Optional callable receiving decoded audio chunks
+            [batch, channels, samples] (CPU float32) as the VAE decode progresses
+        lm_text_callback: Optional callable receiving the LM CoT text (str deltas)
+            while Phase 1 is generated
         
     Returns:
         GenerationResult with generated audio files and metadata
     """
     try:
-        # Phase 1: LM-based metadata and code generation (if enabled)
-        audio_code_string_to_use = params.audio_codes
-        lm_generated_metadata = None
-        lm_generated_audio_codes_list = []
-        lm_total_time_costs = {
-            "phase1_time": 0.0,
-            "phase2_time": 0.0,
-            "total_time": 0.0,
-        }
-
-        # Extract mutable copies of metadata (will be updated by LM if needed)
-        bpm = params.bpm
-        key_scale = params.keyscale
-        time_signature = params.timesignature
-        audio_duration = params.duration
-        dit_input_caption = params.caption
-        dit_input_vocal_language = params.vocal_language
-        dit_input_lyrics = params.lyrics
-        # Determine if we need to generate audio codes
-        # If user has provided audio_codes, we don't need to generate them
-        # Otherwise, check if we need audio codes (lm_dit mode) or just metas (dit mode)
-        user_provided_audio_codes = bool(params.audio_codes and str(params.audio_codes).strip())
-
-        # Determine infer_type: use "llm_dit" if we need audio codes, "dit" if only metas needed
-        # For now, we use "llm_dit" if batch mode or if user hasn't provided codes
-        # Use "dit" if user has provided codes (only need metas) or if explicitly only need metas
-        # Note: This logic can be refined based on specific requirements
-        need_audio_codes = not user_provided_audio_codes
-
-        # Determine if we should use chunk-based LM generation (always use chunks for consistency)
-        # Determine actual batch size for chunk processing
-        actual_batch_size = config.batch_size if config.batch_size is not None else 1
-
-        # Prepare seeds for batch generation
-        # Use config.seed if provided, otherwise fallback to params.seed
-        # Convert config.seed (None, int, or List[int]) to format that prepare_seeds accepts
-        seed_for_generation = ""
-        # Original code (commented out because it crashes on int seeds):
-        # if config.seeds is not None and len(config.seeds) > 0:
-        #     if isinstance(config.seeds, list):
-        #         # Convert List[int] to comma-separated string
-        #         seed_for_generation = ",".join(str(s) for s in config.seeds)
-
-        if config.seeds is not None:
-            if isinstance(config.seeds, list) and len(config.seeds) > 0:
-                # Convert List[int] to comma-separated string
-                seed_for_generation = ",".join(str(s) for s in config.seeds)
-            elif isinstance(config.seeds, int):
-                # Fix: Explicitly handle single integer seeds by converting to string.
-                # Previously, this would crash because 'len()' was called on an int.
-                seed_for_generation = str(config.seeds)
-
-        # Use dit_handler.prepare_seeds to handle seed list generation and padding
-        # This will handle all the logic: padding with random seeds if needed, etc.
-        actual_seed_list, _ = dit_handler.prepare_seeds(actual_batch_size, seed_for_generation, config.use_random_seed)
-
-        # LM-based Chain-of-Thought reasoning
-        # Skip LM for cover/repaint tasks - these tasks use reference/src audio directly
-        # and don't need LM to generate audio codes
-        skip_lm_tasks = {"cover", "repaint"}
-        
-        # Determine if we should use LLM
-        # LLM is needed for:
-        # 1. thinking=True: generate audio codes via LM
-        # 2. use_cot_caption=True: enhance/generate caption via CoT
-        # 3. use_cot_language=True: detect vocal language via CoT
-        # 4. use_cot_metas=True: fill missing metadata via CoT
-        need_lm_for_cot = params.use_cot_caption or params.use_cot_language or params.use_cot_metas
-        use_lm = (params.thinking or need_lm_for_cot) and llm_handler is not None and llm_handler.llm_initialized and params.task_type not in skip_lm_tasks
-        lm_status = []
-        
-        if params.task_type in skip_lm_tasks:
-            logger.info(f"Skipping LM for task_type='{params.task_type}' - using DiT directly")
-        
-        logger.info(f"[generate_music] LLM usage decision: thinking={params.thinking}, "
-                   f"use_cot_caption={params.use_cot_caption}, use_cot_language={params.use_cot_language}, "
-                   f"use_cot_metas={params.use_cot_metas}, need_lm_for_cot={need_lm_for_cot}, "
-                   f"llm_initialized={llm_handler.llm_initialized if llm_handler else False}, use_lm={use_lm}")
-        
-        if use_lm:
-            # Convert sampling parameters - handle None values safely
-            top_k_value = None if not params.lm_top_k or params.lm_top_k == 0 else int(params.lm_top_k)
-            top_p_value = None if not params.lm_top_p or params.lm_top_p >= 1.0 else params.lm_top_p
-
-            # Build user_metadata from user-provided values
-            user_metadata = {}
-            if bpm is not None:
-                try:
-                    bpm_value = float(bpm)
-                    if bpm_value > 0:
-                        user_metadata['bpm'] = int(bpm_value)
-                except (ValueError, TypeError):
-                    pass
-
-            if key_scale and key_scale.strip():
-                key_scale_clean = key_scale.strip()
-                if key_scale_clean.lower() not in ["n/a", ""]:
-                    user_metadata['keyscale'] = key_scale_clean
-
-            if time_signature and time_signature.strip():
-                time_sig_clean = time_signature.strip()
-                if time_sig_clean.lower() not in ["n/a", ""]:
-                    user_metadata['timesignature'] = time_sig_clean
-
-            if audio_duration is not None:
-                try:
-                    duration_value = float(audio_duration)
-                    if duration_value > 0:
-                        user_metadata['duration'] = int(duration_value)
-                except (ValueError, TypeError):
-                    pass
-
-            user_metadata_to_pass = user_metadata if user_metadata else None
-
-            # Determine infer_type based on whether we need audio codes
-            # - "llm_dit": generates both metas and audio codes (two-phase internally)
-            # - "dit": generates only metas (single phase)
-            infer_type = "llm_dit" if need_audio_codes and params.thinking else "dit"
-
-            # Use chunk size from config, or default to batch_size if not set
-            max_inference_batch_size = int(config.lm_batch_chunk_size) if config.lm_batch_chunk_size > 0 else actual_batch_size
-            num_chunks = math.ceil(actual_batch_size / max_inference_batch_size)
-
-            all_metadata_list = []
-            all_audio_codes_list = []
-
-            for chunk_idx in range(num_chunks):
-                chunk_start = chunk_idx * max_inference_batch_size
-                chunk_end = min(chunk_start + max_inference_batch_size, actual_batch_size)
-                chunk_size = chunk_end - chunk_start
-                chunk_seeds = actual_seed_list[chunk_start:chunk_end] if chunk_start < len(actual_seed_list) else None
-
-                logger.info(f"LM chunk {chunk_idx+1}/{num_chunks} (infer_type={infer_type}) "
-                            f"(size: {chunk_size}, seeds: {chunk_seeds})")
-
-                # Use the determined infer_type
-                # - "llm_dit" will internally run two phases (metas + codes)
-                # - "dit" will only run phase 1 (metas only)
-                result = llm_handler.generate_with_stop_condition(
-                    caption=params.caption or "",
-                    lyrics=params.lyrics or "",
-                    infer_type=infer_type,
-                    temperature=params.lm_temperature,
-                    cfg_scale=params.lm_cfg_scale,
-                    negative_prompt=params.lm_negative_prompt,
-                    top_k=top_k_value,
-                    top_p=top_p_value,
-                    target_duration=audio_duration,  # Pass duration to limit audio codes generation
-                    user_metadata=user_metadata_to_pass,
-                    use_cot_caption=params.use_cot_caption,
-                    use_cot_language=params.use_cot_language,
-                    use_cot_metas=params.use_cot_metas,
-                    use_constrained_decoding=params.use_constrained_decoding,
-                    constrained_decoding_debug=config.constrained_decoding_debug,
-                    batch_size=chunk_size,
-                    seeds=chunk_seeds,
-                    progress=progress,
-                )
-
-                # Check if LM generation failed
-                if not result.get("success", False):
-                    error_msg = result.get("error", "Unknown LM error")
-                    lm_status.append(f"❌ LM Error: {error_msg}")
-                    # Return early with error
-                    return GenerationResult(
-                        audios=[],
-                        status_message=f"❌ LM generation failed: {error_msg}",
-                        extra_outputs={},
-                        success=False,
-                        error=error_msg,
-                    )
-
-                # Extract metadata and audio_codes from result dict
-                if chunk_size > 1:
-                    metadata_list = result.get("metadata", [])
-                    audio_codes_list = result.get("audio_codes", [])
-                    all_metadata_list.extend(metadata_list)
-                    all_audio_codes_list.extend(audio_codes_list)
-                else:
-                    metadata = result.get("metadata", {})
-                    audio_codes = result.get("audio_codes", "")
-                    all_metadata_list.append(metadata)
-                    all_audio_codes_list.append(audio_codes)
-
-                # Collect time costs from LM extra_outputs
-                lm_extra = result.get("extra_outputs", {})
-                lm_chunk_time_costs = lm_extra.get("time_costs", {})
-                if lm_chunk_time_costs:
-                    # Accumulate time costs from all chunks
-                    for key in ["phase1_time", "phase2_time", "total_time"]:
-                        if key in lm_chunk_time_costs:
-                            lm_total_time_costs[key] += lm_chunk_time_costs[key]
-
-                    time_str = ", ".join([f"{k}: {v:.2f}s" for k, v in lm_chunk_time_costs.items()])
-                    lm_status.append(f"✅ LM chunk {chunk_idx+1}: {time_str}")
-
-            lm_generated_metadata = all_metadata_list[0] if all_metadata_list else None
-            lm_generated_audio_codes_list = all_audio_codes_list
-
-            # Set audio_code_string_to_use based on infer_type
-            if infer_type == "llm_dit":
-                # If batch mode, use list; otherwise use single string
-                if actual_batch_size > 1:
-                    audio_code_string_to_use = all_audio_codes_list
-                else:
-                    audio_code_string_to_use = all_audio_codes_list[0] if all_audio_codes_list else ""
-            else:
-                # For "dit" mode, keep user-provided codes or empty
-                audio_code_string_to_use = params.audio_codes
-
-            # Update metadata from LM if not provided by user
-            if lm_generated_metadata:
-                bpm, key_scale, time_signature, audio_duration, vocal_language, caption, lyrics = _update_metadata_from_lm(
-                    metadata=lm_generated_metadata,
-                    bpm=bpm,
-                    key_scale=key_scale,
-                    time_signature=time_signature,
-                    audio_duration=audio_duration,
-                    vocal_language=dit_input_vocal_language,
-                    caption=dit_input_caption,
-                    lyrics=dit_input_lyrics)
-                if not params.bpm:
-                    params.cot_bpm = bpm
-                if not params.keyscale:
-                    params.cot_keyscale = key_scale
-                if not params.timesignature:
-                    params.cot_timesignature = time_signature
-                if not params.duration:
-                    params.cot_duration = audio_duration
-                if not params.vocal_language:
-                    params.cot_vocal_language = vocal_language
-                if not params.caption:
-                    params.cot_caption = caption
-                if not params.lyrics:
-                    params.cot_lyrics = lyrics
-
-            # set cot caption and language if needed
-            if params.use_cot_caption:
-                dit_input_caption = lm_generated_metadata.get("caption", dit_input_caption)
-            if params.use_cot_language:
-                dit_input_vocal_language = lm_generated_metadata.get("vocal_language", dit_input_vocal_language)
-
-        # Phase 2: DiT music generation
-        # Use seed_for_generation (from config.seed or params.seed) instead of params.seed for actual generation
-        result = dit_handler.generate_music(
-            captions=dit_input_caption,
-            lyrics=dit_input_lyrics,
-            bpm=bpm,
-            key_scale=key_scale,
-            time_signature=time_signature,
-            vocal_language=dit_input_vocal_language,
-            inference_steps=params.inference_steps,
-            guidance_scale=params.guidance_scale,
-            use_random_seed=config.use_random_seed,
-            seed=seed_for_generation,  # Use config.seed (or params.seed fallback) instead of params.seed directly
-            reference_audio=params.reference_audio,
-            audio_duration=audio_duration,
-            batch_size=config.batch_size if config.batch_size is not None else 1,
-            src_audio=params.src_audio,
-            audio_code_string=audio_code_string_to_use,
-            repainting_start=params.repainting_start,
-            repainting_end=params.repainting_end,
-            instruction=params.instruction,
-            audio_cover_strength=params.audio_cover_strength,
-            task_type=params.task_type,
-            use_adg=params.use_adg,
-            cfg_interval_start=params.cfg_interval_start,
-            cfg_interval_end=params.cfg_interval_end,
-            shift=params.shift,
-            infer_method=params.infer_method,
-            timesteps=params.timesteps,
-            progress=progress,
+        prepared = _prepare_dit_inputs(
+            dit_handler, llm_handler, params, config, progress, audio_chunk_callback, lm_text_callback
         )
+        if isinstance(prepared, GenerationResult):
+            return prepared
 
-        # Check if generation failed
-        if not result.get("success", False):
-            return GenerationResult(
-                audios=[],
-                status_message=result.get("status_message", ""),
-                extra_outputs={},
-                success=False,
-                error=result.get("error"),
-            )
-
-        # Extract results from dit_handler.generate_music dict
-        dit_audios = result.get("audios", [])
-        status_message = result.get("status_message", "")
-        dit_extra_outputs = result.get("extra_outputs", {})
-
-        # Use the seed list already prepared above (from config.seed or params.seed fallback)
-        # actual_seed_list was computed earlier using dit_handler.prepare_seeds
-        seed_list = actual_seed_list
-
-        # Get base params dictionary
-        base_params_dict = params.to_dict()
-
-        # Save audio files using AudioSaver (format from config)
-        audio_format = config.audio_format if config.audio_format else "flac"
-        audio_saver = AudioSaver(default_format=audio_format)
-
-        # Use handler's temp_dir for saving files
-        if save_dir is not None:
-            os.makedirs(save_dir, exist_ok=True)
-
-        # Build audios list for GenerationResult with params and save files
-        # Audio saving and UUID generation handled here, outside of handler
-        audios = []
-        for idx, dit_audio in enumerate(dit_audios):
-            # Create a copy of params dict for this audio
-            audio_params = base_params_dict.copy()
-
-            # Update audio-specific values
-            audio_params["seed"] = seed_list[idx] if idx < len(seed_list) else None
-
-            # Add audio codes if batch mode
-            if lm_generated_audio_codes_list and idx < len(lm_generated_audio_codes_list):
-                audio_params["audio_codes"] = lm_generated_audio_codes_list[idx]
-
-            # Get audio tensor and metadata
-            audio_tensor = dit_audio.get("tensor")
-            sample_rate = dit_audio.get("sample_rate", 48000)
-
-            # Generate UUID for this audio (moved from handler)
-            batch_seed = seed_list[idx] if idx < len(seed_list) else seed_list[0] if seed_list else -1
-            audio_code_str = lm_generated_audio_codes_list[idx] if (
-                lm_generated_audio_codes_list and idx < len(lm_generated_audio_codes_list)) else audio_code_string_to_use
-            if isinstance(audio_code_str, list):
-                audio_code_str = audio_code_str[idx] if idx < len(audio_code_str) else ""
-
-            audio_key = generate_uuid_from_params(audio_params)
-
-            # Save audio file (handled outside handler)
-            audio_path = None
-            if audio_tensor is not None and save_dir is not None:
-                try:
-                    audio_file = os.path.join(save_dir, f"{audio_key}.{audio_format}")
-                    audio_path = audio_saver.save_audio(audio_tensor,
-                                                        audio_file,
-                                                        sample_rate=sample_rate,
-                                                        format=audio_format,
-                                                        channels_first=True)
-                except Exception as e:
-                    logger.error(f"[generate_music] Failed to save audio file: {e}")
-                    audio_path = ""  # Fallback to empty path
-
-            audio_dict = {
-                "path": audio_path or "",  # File path (saved here, not in handler)
-                "tensor": audio_tensor,  # Audio tensor [channels, samples], CPU, float32
-                "key": audio_key,
-                "sample_rate": sample_rate,
-                "params": audio_params,
-            }
-
-            audios.append(audio_dict)
-
-        # Merge extra_outputs: include dit_extra_outputs (latents, masks) and add LM metadata
-        extra_outputs = dit_extra_outputs.copy()
-        extra_outputs["lm_metadata"] = lm_generated_metadata
-
-        # Merge time_costs from both LM and DiT into a unified dictionary
-        unified_time_costs = {}
-
-        # Add LM time costs (if LM was used)
-        if use_lm and lm_total_time_costs:
-            for key, value in lm_total_time_costs.items():
-                unified_time_costs[f"lm_{key}"] = value
-
-        # Add DiT time costs (if available)
-        dit_time_costs = dit_extra_outputs.get("time_costs", {})
-        if dit_time_costs:
-            for key, value in dit_time_costs.items():
-                unified_time_costs[f"dit_{key}"] = value
-
-        # Calculate total pipeline time
-        if unified_time_costs:
-            lm_total = unified_time_costs.get("lm_total_time", 0.0)
-            dit_total = unified_time_costs.get("dit_total_time_cost", 0.0)
-            unified_time_costs["pipeline_total_time"] = lm_total + dit_total
-
-        # Update extra_outputs with unified time_costs
-        extra_outputs["time_costs"] = unified_time_costs
-
-        if lm_status:
-            status_message = "\n".join(lm_status) + "\n" + status_message
-        else:
-            status_message = status_message
-        # Create and return GenerationResult
-        return GenerationResult(
-            audios=audios,
-            status_message=status_message,
-            extra_outputs=extra_outputs,
-            success=True,
-            error=None,
-        )
+        # Phase 2: DiT music generation
+        result = dit_handler.generate_music(**prepared["dit_kwargs"])
+        return _build_generation_result(params, config, prepared, result, save_dir)
 
     except Exception as e:
         logger.exception("Music generation failed")
@@ -716,6 +787,203 @@ def generate_music(
         )
 
 
+def _dit_batch_key(dit_kwargs: Dict[str, Any]) -> Optional[Tuple]:
+    """Return a key shared by DiT calls that can run as one batch, or None if not batchable.
+
+    Items in one ``service_generate`` batch share inference settings and are padded to
+    the longest target, so only jobs with the same duration and no per-job reference /
+    source audio are coalesced.
+    """
+    if dit_kwargs.get("reference_audio") is not None or dit_kwargs.get("src_audio") is not None:
+        return None
+    duration = dit_kwargs.get("audio_duration")
+    try:
+        duration = float(duration)
+    except (TypeError, ValueError):
+        return None
+    if duration <= 0:
+        return None
+    codes = dit_kwargs.get("audio_code_string")
+    if isinstance(codes, list):
+        has_codes = any((c or "").strip() for c in codes)
+    else:
+        has_codes = bool(codes and str(codes).strip())
+    timesteps = dit_kwargs.get("timesteps")
+    return (
+        round(duration, 1),
+        has_codes,
+        dit_kwargs.get("task_type"),
+        dit_kwargs.get("inference_steps"),
+        dit_kwargs.get("guidance_scale"),
+        dit_kwargs.get("audio_cover_strength"),
+        dit_kwargs.get("use_adg"),
+        dit_kwargs.get("cfg_interval_start"),
+        dit_kwargs.get("cfg_interval_end"),
+        dit_kwargs.get("shift"),
+        dit_kwargs.get("infer_method"),
+        tuple(timesteps) if timesteps else None,
+    )
+
+
+def _merge_dit_kwargs(prepared_list: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Merge compatible per-job DiT kwargs into one call with per-item lists."""
+    merged = dict(prepared_list[0]["dit_kwargs"])
+    per_item = {k: [] for k in ["captions", "lyrics", "bpm", "key_scale", "time_signature", "vocal_language", "instruction"]}
+    seeds: List[int] = []
+    codes_list: List[str] = []
+    for prepared in prepared_list:
+        kwargs = prepared["dit_kwargs"]
+        n = kwargs["batch_size"]
+        for k, values in per_item.items():
+            values.extend([kwargs[k]] * n)
+        seeds.extend(prepared["actual_seed_list"][:n])
+        codes = kwargs.get("audio_code_string")
+        if isinstance(codes, list):
+            codes_list.extend(list(codes[:n]) + [""] * max(0, n - len(codes)))
+        else:
+            codes_list.extend([codes or ""] * n)
+
+    merged.update(per_item)
+    merged["batch_size"] = len(seeds)
+    # Seeds were already resolved per job; pass them explicitly so each item keeps its own.
+    merged["seed"] = ",".join(str(s) for s in seeds)
+    merged["use_random_seed"] = False
+    merged["audio_code_string"] = codes_list if any(c.strip() for c in codes_list) else ""
+    merged["progress"] = None
+    merged["audio_chunk_callback"] = None
+    return merged
+
+
+def _split_dit_result(result: Dict[str, Any], sizes: List[int], seeds: List[int]) -> List[Dict[str, Any]]:
+    """Split a batched ``dit_handler.generate_music`` result back into per-job results."""
+    total = sum(sizes)
+    audios = result.get("audios", [])
+    extra_outputs = result.get("extra_outputs", {})
+    parts = []
+    start = 0
+    for n in sizes:
+        end = start + n
+        part_extra = {}
+        for k, v in extra_outputs.items():
+            if getattr(v, "shape", None) is not None and len(v.shape) > 0 and v.shape[0] == total:
+                part_extra[k] = v[start:end]
+            elif isinstance(v, list) and len(v) == total:
+                part_extra[k] = v[start:end]
+            elif isinstance(v, dict):
+                part_extra[k] = dict(v)
+            else:
+                part_extra[k] = v
+        part_extra["seed_value"] = ", ".join(str(s) for s in seeds[start:end])
+        parts.append({
+            "audios": audios[start:end],
+            "status_message": result.get("status_message", ""),
+            "extra_outputs": part_extra,
+            "success": True,
+            "error": None,
+        })
+        start = end
+    return parts
+
+
+def generate_music_batch(
+    dit_handler,
+    llm_handler,
+    jobs: List[Tuple[GenerationParams, GenerationConfig]],
+    save_dir: Optional[str] = None,
+    max_batch_size: Optional[int] = None,
+) -> List[GenerationResult]:
+    """Generate music for several independent jobs, sharing DiT/VAE passes where possible.
+
+    The LM phase runs per job exactly as in ``generate_music``. Jobs whose resolved DiT
+    inputs are compatible (see ``_dit_batch_key``) are then coalesced into a single
+    ``dit_handler.generate_music`` call and the audios are fanned back out per job.
+    If a coalesced call fails, its jobs are retried one by one.
+
+    Args:
+        dit_handler: Initialized DiT model handler (AceStepHandler instance)
+        llm_handler: Initialized LLM handler (LLMHandler instance), or None
+        jobs: List of (GenerationParams, GenerationConfig) pairs
+        save_dir: Directory to save generated audio files
+        max_batch_size: Maximum number of audios per coalesced DiT call (None = unlimited)
+
+    Returns:
+        List of GenerationResult, in the same order as ``jobs``
+    """
+    results: List[Optional[GenerationResult]] = [None] * len(jobs)
+    prepared_by_idx: Dict[int, Dict[str, Any]] = {}
+
+    for idx, (params, config) in enumerate(jobs):
+        try:
+            prepared = _prepare_dit_inputs(dit_handler, llm_handler, params, config)
+        except Exception as e:
+            logger.exception("Music generation failed")
+            prepared = GenerationResult(status_message=f"Error: {str(e)}", success=False, error=str(e))
+        if isinstance(prepared, GenerationResult):
+            results[idx] = prepared
+        else:
+            prepared_by_idx[idx] = prepared
+
+    # Group compatible jobs, then cap each group by the number of audios per DiT call
+    groups: Dict[Any, List[int]] = {}
+    for idx, prepared in prepared_by_idx.items():
+        key = _dit_batch_key(prepared["dit_kwargs"])
+        groups.setdefault(key if key is not None else ("solo", idx), []).append(idx)
+
+    chunks: List[List[int]] = []
+    for indices in groups.values():
+        chunk, chunk_items = [], 0
+        for idx in indices:
+            n = prepared_by_idx[idx]["dit_kwargs"]["batch_size"]
+            if chunk and max_batch_size and chunk_items + n > max_batch_size:
+                chunks.append(chunk)
+                chunk, chunk_items = [], 0
+            chunk.append(idx)
+            chunk_items += n
+        if chunk:
+            chunks.append(chunk)
+
+    def _run_single(idx: int) -> GenerationResult:
+        params, config = jobs[idx]
+        prepared = prepared_by_idx[idx]
+        try:
+            result = dit_handler.generate_music(**prepared["dit_kwargs"])
+            return _build_generation_result(params, config, prepared, result, save_dir)
+        except Exception as e:
+            logger.exception("Music generation failed")
+            return GenerationResult(status_message=f"Error: {str(e)}", success=False, error=str(e))
+
+    for chunk in chunks:
+        if len(chunk) == 1:
+            results[chunk[0]] = _run_single(chunk[0])
+            continue
+
+        prepared_list = [prepared_by_idx[idx] for idx in chunk]
+        sizes = [p["dit_kwargs"]["batch_size"] for p in prepared_list]
+        seeds = [s for p in prepared_list for s in p["actual_seed_list"][:p["dit_kwargs"]["batch_size"]]]
+        logger.info(f"[generate_music_batch] Coalescing {len(chunk)} jobs into one DiT batch of {sum(sizes)} audios")
+        try:
+            result = dit_handler.generate_music(**_merge_dit_kwargs(prepared_list))
+        except Exception as e:
+            logger.exception("[generate_music_batch] Batched DiT call raised")
+            result = {"success": False, "error": str(e)}
+
+        if not result.get("success", False):
+            logger.warning(f"[generate_music_batch] Batched DiT call failed ({result.get('error')}), retrying jobs individually")
+            for idx in chunk:
+                results[idx] = _run_single(idx)
+            continue
+
+        for idx, part in zip(chunk, _split_dit_result(result, sizes, seeds)):
+            params, config = jobs[idx]
+            try:
+                results[idx] = _build_generation_result(params, config, prepared_by_idx[idx], part, save_dir)
+            except Exception as e:
+                logger.exception("Music generation failed")
+                results[idx] = GenerationResult(status_message=f"Error: {str(e)}", success=False, error=str(e))
+
+    return results
+
+
 def understand_music(
     llm_handler,
     audio_codes: str,
@@ -0,0 +1,593 @@
+"""Durable job store and queue for the API server
+
+SQLite (WAL mode) backed replacement for the in-memory job dict and queue, so
+several uvicorn worker processes can share one queue and queued jobs survive a
+restart. Workers take jobs with ``claim_next``, which atomically moves the
+oldest claimable queued job to ``running``. Jobs created with a ``dedup_key``
+(deterministic requests) are coalesced with an identical queued, running or
+reusable finished job by ``create_or_join``.
+
+Running jobs (and queued jobs pinned to a worker) carry a lease in
+``heartbeat_at`` that their worker refreshes with ``renew_leases``; any process
+can requeue jobs whose lease expired with ``requeue_expired``, so jobs of a
+crashed worker are recovered without a restart.
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import time
+from dataclasses import dataclass
+from threading import Lock
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from uuid import uuid4
+
+from loguru import logger
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    env TEXT NOT NULL DEFAULT 'development',
+    status_text TEXT NOT NULL DEFAULT '',
+    request TEXT,
+    batch_key TEXT,
+    items INTEGER NOT NULL DEFAULT 1,
+    pinned_to TEXT,
+    claimed_by TEXT,
+    temp_files TEXT,
+    result TEXT,
+    error TEXT,
+    est_seconds REAL,
+    dedup_key TEXT,
+    heartbeat_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created_at);
+"""
+
+# Columns added after the first release of the schema: (name, type)
+_ADDED_COLUMNS = [("est_seconds", "REAL"), ("dedup_key", "TEXT"), ("heartbeat_at", "REAL")]
+
+# Created after the column migration, since older databases lack dedup_key until then
+_INDEXES = "CREATE INDEX IF NOT EXISTS idx_jobs_dedup ON jobs (dedup_key, created_at);"
+
+_RECORD_COLUMNS = "job_id, status, created_at, started_at, finished_at, result, error, status_text, env, est_seconds"
+
+# SQLite's default limit on host parameters per statement is 999
+_MAX_QUERY_PARAMS = 900
+
+
+@dataclass
+class JobRecord:
+    job_id: str
+    status: str  # "queued" | "running" | "succeeded" | "failed"
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    status_text: str = ""
+    env: str = "development"
+    est_seconds: Optional[float] = None
+
+
+def make_worker_id() -> str:
+    """Identify this process in ``claimed_by`` / ``pinned_to`` columns."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == "nt":
+        # os.kill(pid, 0) sends CTRL_C_EVENT on Windows instead of probing; leave these to the lease
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+class SQLiteJobStore:
+    """
+    Job records and queue in one SQLite table.
+
+    One connection per store instance (guarded by a lock) is shared by the event
+    loop and executor threads; WAL mode lets other processes read and write the
+    same file concurrently. The connection is opened lazily on first use.
+    """
+
+    def __init__(self, db_path: str, max_age_seconds: int = 86400) -> None:
+        self.db_path = db_path
+        self._max_age = max_age_seconds
+        self._lock = Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.db_path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.executescript(_SCHEMA)
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for name, col_type in _ADDED_COLUMNS:
+                if name not in existing:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {col_type}")
+            conn.executescript(_INDEXES)
+            self._conn = conn
+        return self._conn
+
+    def _execute(self, sql: str, params: Iterable[Any] = ()) -> int:
+        """Run a write statement; returns the number of affected rows."""
+        with self._lock:
+            return self._connect().execute(sql, tuple(params)).rowcount or 0
+
+    def _fetchone(self, sql: str, params: Iterable[Any] = ()) -> Optional[Tuple]:
+        with self._lock:
+            return self._connect().execute(sql, tuple(params)).fetchone()
+
+    def _fetchall(self, sql: str, params: Iterable[Any] = ()) -> List[Tuple]:
+        with self._lock:
+            return self._connect().execute(sql, tuple(params)).fetchall()
+
+    @staticmethod
+    def _row_to_record(row: Tuple) -> JobRecord:
+        job_id, status, created_at, started_at, finished_at, result, error, status_text, env, est_seconds = row
+        return JobRecord(
+            job_id=job_id,
+            status=status,
+            created_at=created_at,
+            started_at=started_at,
+            finished_at=finished_at,
+            result=json.loads(result) if result else None,
+            error=error,
+            status_text=status_text or "",
+            env=env or "development",
+            est_seconds=est_seconds,
+        )
+
+    # ------------------------------------------------------------------
+    # Records
+    # ------------------------------------------------------------------
+
+    def create(
+        self,
+        request: Optional[str] = None,
+        batch_key: Optional[str] = None,
+        items: int = 1,
+        pinned_to: Optional[str] = None,
+        temp_files: Optional[List[str]] = None,
+        env: str = "development",
+        est_seconds: Optional[float] = None,
+        dedup_key: Optional[str] = None,
+    ) -> JobRecord:
+        """
+        Create a queued job.
+
+        Args:
+            request: Serialized request; jobs without one are tracked but never claimed
+            batch_key: Jobs with equal non-null keys may be claimed into one batch
+            items: Number of audios the job produces (counts toward batch limits)
+            pinned_to: Worker id that must run the job (e.g. it streams to a local client)
+            temp_files: Uploaded files to delete once the job has run
+            env: Client environment tag
+            est_seconds: Predicted run time, used for queue ETAs
+            dedup_key: Key of deterministic requests, see ``create_or_join``
+        """
+        return self.create_with_id(
+            str(uuid4()),
+            env=env,
+            request=request,
+            batch_key=batch_key,
+            items=items,
+            pinned_to=pinned_to,
+            temp_files=temp_files,
+            est_seconds=est_seconds,
+            dedup_key=dedup_key,
+        )
+
+    def create_with_id(
+        self,
+        job_id: str,
+        env: str = "development",
+        request: Optional[str] = None,
+        batch_key: Optional[str] = None,
+        items: int = 1,
+        pinned_to: Optional[str] = None,
+        temp_files: Optional[List[str]] = None,
+        est_seconds: Optional[float] = None,
+        dedup_key: Optional[str] = None,
+    ) -> JobRecord:
+        """Create job record with specified ID"""
+        with self._lock:
+            return self._insert(
+                self._connect(), job_id, env, request, batch_key, items, pinned_to, temp_files, est_seconds, dedup_key
+            )
+
+    @staticmethod
+    def _insert(
+        conn: sqlite3.Connection,
+        job_id: str,
+        env: str,
+        request: Optional[str],
+        batch_key: Optional[str],
+        items: int,
+        pinned_to: Optional[str],
+        temp_files: Optional[List[str]],
+        est_seconds: Optional[float],
+        dedup_key: Optional[str],
+    ) -> JobRecord:
+        rec = JobRecord(job_id=job_id, status="queued", created_at=time.time(), env=env, est_seconds=est_seconds)
+        conn.execute(
+            "INSERT INTO jobs (job_id, status, created_at, env, request, batch_key, items, pinned_to, temp_files, "
+            "est_seconds, dedup_key, heartbeat_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                rec.job_id, rec.status, rec.created_at, env, request, batch_key, max(1, int(items)),
+                pinned_to, json.dumps(temp_files) if temp_files else None, est_seconds, dedup_key,
+                # Pinned jobs wait for one worker, so they hold its lease while queued
+                rec.created_at if pinned_to else None,
+            ),
+        )
+        return rec
+
+    def create_or_join(
+        self,
+        job_id: str,
+        dedup_key: str,
+        reusable: Optional[Callable[[JobRecord], bool]] = None,
+        env: str = "development",
+        request: Optional[str] = None,
+        batch_key: Optional[str] = None,
+        items: int = 1,
+        temp_files: Optional[List[str]] = None,
+        est_seconds: Optional[float] = None,
+        max_queued: Optional[int] = None,
+    ) -> Tuple[Optional[JobRecord], bool]:
+        """
+        Create a queued job unless an identical one can serve the request.
+
+        The newest job with the same ``dedup_key`` is joined if it is queued or
+        running, or if it succeeded and ``reusable(record)`` accepts its result
+        (e.g. its audio files still exist). Lookup and insert happen in one
+        write transaction, so identical requests racing in from several worker
+        processes end up on a single job. Joining ignores ``max_queued``, since
+        it adds no work.
+
+        Returns:
+            (record, created): ``created`` is False when an existing job was joined;
+            ``(None, False)`` if a new job was needed but the queue is full
+        """
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    f"SELECT {_RECORD_COLUMNS} FROM jobs WHERE dedup_key = ? "
+                    "AND status IN ('queued', 'running', 'succeeded') ORDER BY created_at DESC LIMIT 1",
+                    (dedup_key,),
+                ).fetchone()
+                existing = self._row_to_record(row) if row is not None else None
+                if existing is not None and (
+                    existing.status != "succeeded" or (reusable is not None and reusable(existing))
+                ):
+                    conn.execute("COMMIT")
+                    return existing, False
+                if max_queued is not None:
+                    queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+                    if queued >= max_queued:
+                        conn.execute("COMMIT")
+                        return None, False
+                rec = self._insert(
+                    conn, job_id, env, request, batch_key, items, None, temp_files, est_seconds, dedup_key
+                )
+                conn.execute("COMMIT")
+                return rec, True
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def get(self, job_id: str) -> Optional[JobRecord]:
+        row = self._fetchone(f"SELECT {_RECORD_COLUMNS} FROM jobs WHERE job_id = ?", (job_id,))
+        return self._row_to_record(row) if row else None
+
+    def get_many(self, job_ids: List[str]) -> Dict[str, JobRecord]:
+        """Look up many jobs by primary key; missing ids are absent from the result."""
+        records: Dict[str, JobRecord] = {}
+        ids = list(dict.fromkeys(job_ids))
+        for i in range(0, len(ids), _MAX_QUERY_PARAMS):
+            chunk = ids[i:i + _MAX_QUERY_PARAMS]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._fetchall(
+                f"SELECT {_RECORD_COLUMNS} FROM jobs WHERE job_id IN ({placeholders})", chunk
+            )
+            for row in rows:
+                rec = self._row_to_record(row)
+                records[rec.job_id] = rec
+        return records
+
+    def mark_running(self, job_id: str) -> None:
+        self._execute(
+            "UPDATE jobs SET status = 'running', started_at = COALESCE(started_at, ?) WHERE job_id = ?",
+            (time.time(), job_id),
+        )
+
+    def mark_succeeded(self, job_id: str, result: Dict[str, Any]) -> None:
+        self._execute(
+            "UPDATE jobs SET status = 'succeeded', finished_at = ?, result = ?, error = NULL, request = NULL "
+            "WHERE job_id = ?",
+            (time.time(), json.dumps(result, ensure_ascii=False, default=str), job_id),
+        )
+
+    def mark_failed(self, job_id: str, error: str) -> None:
+        self._execute(
+            "UPDATE jobs SET status = 'failed', finished_at = ?, result = NULL, error = ?, request = NULL "
+            "WHERE job_id = ?",
+            (time.time(), error, job_id),
+        )
+
+    def update_status_text(self, job_id: str, text: str) -> None:
+        self._execute("UPDATE jobs SET status_text = ? WHERE job_id = ?", (text, job_id))
+
+    # ------------------------------------------------------------------
+    # Queue
+    # ------------------------------------------------------------------
+
+    def claim_next(
+        self,
+        worker_id: str,
+        batch_key: Optional[str] = None,
+        max_items: Optional[int] = None,
+    ) -> Optional[Tuple[str, str, Optional[str], int]]:
+        """
+        Atomically move the oldest claimable queued job to ``running``.
+
+        Args:
+            worker_id: Id of the claiming worker (also matches jobs pinned to it)
+            batch_key: If set, only claim a job with this batch key
+            max_items: If set, only claim a job producing at most this many audios
+
+        Returns:
+            (job_id, request, batch_key, items) or None if nothing is claimable
+        """
+        sql = (
+            "SELECT job_id, request, batch_key, items FROM jobs "
+            "WHERE status = 'queued' AND request IS NOT NULL AND (pinned_to IS NULL OR pinned_to = ?)"
+        )
+        params: List[Any] = [worker_id]
+        if batch_key is not None:
+            sql += " AND batch_key = ?"
+            params.append(batch_key)
+        if max_items is not None:
+            sql += " AND items <= ?"
+            params.append(max_items)
+        sql += " ORDER BY created_at, rowid LIMIT 1"
+
+        with self._lock:
+            conn = self._connect()
+            # IMMEDIATE takes the write lock up front so two processes cannot claim the same row
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(sql, params).fetchone()
+                if row is not None:
+                    now = time.time()
+                    conn.execute(
+                        "UPDATE jobs SET status = 'running', started_at = ?, claimed_by = ?, heartbeat_at = ? "
+                        "WHERE job_id = ?",
+                        (now, worker_id, now, row[0]),
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return tuple(row) if row is not None else None
+
+    def queue_position(self, job_id: str) -> int:
+        """1-based position among queued jobs, or 0 if the job is not queued."""
+        row = self._fetchone(
+            "SELECT created_at, rowid FROM jobs WHERE job_id = ? AND status = 'queued'", (job_id,)
+        )
+        if row is None:
+            return 0
+        created_at, rowid = row
+        row = self._fetchone(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND "
+            "(created_at < ? OR (created_at = ? AND rowid <= ?))",
+            (created_at, created_at, rowid),
+        )
+        return int(row[0])
+
+    def queue_eta_inputs(self, job_id: str) -> Optional[Tuple[int, float, float]]:
+        """
+        For a queued job: (1-based position, predicted seconds of the queued jobs
+        ahead of it, its own predicted seconds). None if the job is not queued.
+        Jobs without an estimate count as ``0`` seconds.
+        """
+        row = self._fetchone(
+            "SELECT created_at, rowid, COALESCE(est_seconds, 0) FROM jobs WHERE job_id = ? AND status = 'queued'",
+            (job_id,),
+        )
+        if row is None:
+            return None
+        created_at, rowid, own = row
+        count, ahead = self._fetchone(
+            "SELECT COUNT(*), COALESCE(SUM(est_seconds), 0) FROM jobs WHERE status = 'queued' AND "
+            "(created_at < ? OR (created_at = ? AND rowid < ?))",
+            (created_at, created_at, rowid),
+        )
+        return int(count) + 1, float(ahead), float(own)
+
+    def running_backlog(self) -> Tuple[int, float]:
+        """(number of busy workers, predicted seconds left on running jobs) across all processes."""
+        now = time.time()
+        workers, remaining = self._fetchone(
+            "SELECT COUNT(DISTINCT claimed_by), "
+            "COALESCE(SUM(MAX(COALESCE(est_seconds, 0) - (? - COALESCE(started_at, ?)), 0)), 0) "
+            "FROM jobs WHERE status = 'running'",
+            (now, now),
+        )
+        return int(workers), float(remaining)
+
+    def queued_seconds(self) -> float:
+        """Predicted seconds of work waiting in the queue."""
+        return float(self._fetchone(
+            "SELECT COALESCE(SUM(est_seconds), 0) FROM jobs WHERE status = 'queued'"
+        )[0])
+
+    def queued_count(self) -> int:
+        return int(self._fetchone("SELECT COUNT(*) FROM jobs WHERE status = 'queued'")[0])
+
+    def pop_temp_files(self, job_id: str) -> List[str]:
+        """Return and forget the uploaded temp files of a job."""
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT temp_files FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if not row or not row[0]:
+                return []
+            conn.execute("UPDATE jobs SET temp_files = NULL WHERE job_id = ?", (job_id,))
+        try:
+            return list(json.loads(row[0]))
+        except Exception:
+            return []
+
+    def renew_leases(self, worker_id: str) -> int:
+        """Refresh the lease of the jobs this worker runs or that are pinned to it."""
+        return self._execute(
+            "UPDATE jobs SET heartbeat_at = ? "
+            "WHERE (status = 'running' AND claimed_by = ?) OR (status = 'queued' AND pinned_to = ?)",
+            (time.time(), worker_id, worker_id),
+        )
+
+    def requeue_expired(self, lease_seconds: float) -> int:
+        """
+        Requeue running jobs whose worker stopped renewing their lease.
+
+        Jobs pinned to that worker (live streams) are failed instead, since
+        nobody can deliver them any more. Returns the number of jobs recovered.
+        """
+        cutoff = time.time() - lease_seconds
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                recovered = conn.execute(
+                    "UPDATE jobs SET status = 'queued', started_at = NULL, claimed_by = NULL, heartbeat_at = NULL "
+                    "WHERE status = 'running' AND claimed_by IS NOT NULL AND heartbeat_at < ? "
+                    "AND request IS NOT NULL AND pinned_to IS NULL",
+                    (cutoff,),
+                ).rowcount or 0
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', finished_at = ?, request = NULL, "
+                    "error = 'Worker stopped renewing its lease before the job finished' "
+                    "WHERE heartbeat_at < ? AND ((status = 'running' AND claimed_by IS NOT NULL) "
+                    "OR (status = 'queued' AND pinned_to IS NOT NULL))",
+                    (time.time(), cutoff),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        if recovered:
+            logger.info(f"[SQLiteJobStore] Requeued {recovered} jobs with expired leases")
+        return recovered
+
+    def requeue_orphaned(self, own_worker_id: Optional[str] = None) -> int:
+        """
+        Requeue running jobs whose worker process on this host has exited.
+
+        A worker id with this process's PID but another suffix belongs to an
+        earlier process that had the same PID (e.g. PID 1 in a restarted
+        container), so it counts as exited. Other PIDs are probed with
+        ``os.kill``, except on Windows, where recovery is left to the lease
+        (see ``requeue_expired``).
+
+        Jobs pinned to a dead worker (live streams) are failed instead, since
+        nobody can deliver them any more. Returns the number of jobs recovered.
+        """
+        host = socket.gethostname()
+        own_pid = os.getpid()
+        rows = self._fetchall(
+            "SELECT DISTINCT COALESCE(claimed_by, pinned_to) FROM jobs "
+            "WHERE (status = 'running' AND claimed_by LIKE ?) OR (status = 'queued' AND pinned_to LIKE ?)",
+            (f"{host}:%", f"{host}:%"),
+        )
+        dead_workers = []
+        for (worker_id,) in rows:
+            if worker_id == own_worker_id:
+                continue
+            try:
+                pid = int(worker_id.split(":")[1])
+            except (AttributeError, IndexError, ValueError):
+                continue
+            if pid == own_pid or not _pid_alive(pid):
+                dead_workers.append(worker_id)
+
+        recovered = 0
+        now = time.time()
+        for worker_id in dead_workers:
+            recovered += self._execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL, claimed_by = NULL, heartbeat_at = NULL "
+                "WHERE status = 'running' AND claimed_by = ? AND request IS NOT NULL AND pinned_to IS NULL",
+                (worker_id,),
+            )
+            self._execute(
+                "UPDATE jobs SET status = 'failed', finished_at = ?, request = NULL, "
+                "error = 'Worker exited before the job finished' "
+                "WHERE (status = 'running' AND claimed_by = ?) OR (status = 'queued' AND pinned_to = ?)",
+                (now, worker_id, worker_id),
+            )
+        if recovered:
+            logger.info(f"[SQLiteJobStore] Requeued {recovered} jobs from exited workers")
+        return recovered
+
+    # ------------------------------------------------------------------
+    # Maintenance
+    # ------------------------------------------------------------------
+
+    def cleanup_old_jobs(self, max_age_seconds: Optional[int] = None) -> int:
+        """
+        Clean up completed jobs older than max_age_seconds.
+
+        Only removes jobs with status 'succeeded' or 'failed'.
+        Jobs that are 'queued' or 'running' are never removed.
+
+        Returns the number of jobs removed.
+        """
+        max_age = max_age_seconds if max_age_seconds is not None else self._max_age
+        cutoff = time.time() - max_age
+        return self._execute(
+            "DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND COALESCE(finished_at, created_at) < ?",
+            (cutoff,),
+        )
+
+    def get_stats(self) -> Dict[str, int]:
+        """Get statistics about jobs in the store."""
+        stats = {
+            "total": 0,
+            "queued": 0,
+            "running": 0,
+            "succeeded": 0,
+            "failed": 0,
+        }
+        for status, count in self._fetchall("SELECT status, COUNT(*) FROM jobs GROUP BY status"):
+            stats["total"] += count
+            if status in stats:
+                stats[status] += count
+        return stats
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
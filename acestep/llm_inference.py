@@ -3,18 +3,19 @@
 Handles all LM-related operations including initialization and generation
 """
 import os
+import threading
 import traceback
 import time
 import random
-from typing import Optional, Dict, Any, Tuple, List, Union
-from contextlib import contextmanager
+from typing import Optional, Dict, Any, Tuple, List, Union, Callable
+from contextlib import contextmanager, nullcontext
 
 import yaml
 import torch
 from loguru import logger
 from tqdm import tqdm
 from transformers import AutoTokenizer, AutoModelForCausalLM
-from transformers.generation.streamers import BaseStreamer
+from transformers.generation.streamers import BaseStreamer, TextStreamer
 from transformers.generation.logits_process import (
     LogitsProcessorList,
     RepetitionPenaltyLogitsProcessor,
@@ -24,6 +25,39 @@ from acestep.constants import DEFAULT_LM_INSTRUCTION, DEFAULT_LM_UNDERSTAND_INST
 from acestep.gpu_config import get_lm_gpu_memory_ratio, get_gpu_memory_gb, get_lm_model_size, get_global_gpu_config
 
 
+class _CallbackTextStreamer(TextStreamer):
+    """TextStreamer that hands finalized text deltas to a callback instead of printing them."""
+
+    def __init__(self, tokenizer, callback: Callable[[str], None], skip_prompt: bool):
+        super().__init__(tokenizer, skip_prompt=skip_prompt)
+        self.callback = callback
+
+    def on_finalized_text(self, text: str, stream_end: bool = False):
+        if text:
+            self.callback(text)
+
+
+class _RowTokenIds:
+    """Lazy per-row token ID lists over the left-padded token buffer of the PT batch loop.
+
+    Only rows the constrained processor actually reads (those not in codes generation)
+    are copied to Python lists.
+    """
+
+    def __init__(self, tokens: torch.Tensor, starts: List[int], length: int, rows: List[int]):
+        self.tokens = tokens
+        self.starts = starts
+        self.length = length
+        self.rows = rows
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, index: int) -> List[int]:
+        row = self.rows[index]
+        return self.tokens[row, self.starts[row]:self.length].tolist()
+
+
 class LLMHandler:
     """5Hz LM Handler for audio code generation"""
 
@@ -50,6 +84,17 @@ class LLMHandler:
 
         # Shared constrained decoding processor
         self.constrained_processor: Optional[MetadataConstrainedLogitsProcessor] = None
+        # Guards the shared processor while concurrent requests configure their clones
+        self._processor_lock = threading.Lock()
+        # Several API replicas may share this handler: nano-vllm calls are serialized unless
+        # the engine loop runs, and CPU offload is reference-counted across overlapping calls
+        self._vllm_call_lock = threading.Lock()
+        self._model_context_lock = threading.Lock()
+        self._model_context_users = 0
+
+        # Optional torch.compile of the PyTorch backend's decode step (built on first use)
+        self.compile_pt_decode = False
+        self._compiled_pt_forward = None
 
         # Shared HuggingFace model for perplexity calculation
         self._hf_model_for_scoring = None
@@ -148,12 +193,14 @@ class LLMHandler:
         skip_caption: bool,
         skip_language: bool,
         generation_phase: str,
-        is_batch: bool = False,
         metadata_temperature: Optional[float] = None,
         codes_temperature: Optional[float] = None,
     ) -> Optional[MetadataConstrainedLogitsProcessor]:
-        """Setup and configure constrained processor for generation"""
-        use_phase_temperatures = not is_batch and (metadata_temperature is not None or codes_temperature is not None)
+        """Setup and configure constrained processor for generation.
+
+        Configures the shared processor in place; batch callers clone() it per item.
+        """
+        use_phase_temperatures = metadata_temperature is not None or codes_temperature is not None
         
         if not use_constrained_decoding and not use_phase_temperatures:
             return None
@@ -164,37 +211,40 @@ class LLMHandler:
         # Use shared processor, just update settings
         self.constrained_processor.enabled = use_constrained_decoding
         self.constrained_processor.debug = constrained_decoding_debug
-        
-        # Phase temperatures only supported in single mode
-        if use_phase_temperatures:
-            self.constrained_processor.metadata_temperature = metadata_temperature
-            self.constrained_processor.codes_temperature = codes_temperature
-        else:
-            self.constrained_processor.metadata_temperature = None
-            self.constrained_processor.codes_temperature = None
+        self.constrained_processor.metadata_temperature = metadata_temperature
+        self.constrained_processor.codes_temperature = codes_temperature
         
         self.constrained_processor.set_target_duration(target_duration)
-        
-        # Batch mode uses default/disabled settings for these options
-        if is_batch:
-            self.constrained_processor.set_user_metadata(None)
-            self.constrained_processor.set_stop_at_reasoning(False)
-            self.constrained_processor.set_skip_genres(True)
-            self.constrained_processor.set_skip_caption(True)
-            self.constrained_processor.set_skip_language(True)
-        else:
-            # Single mode uses provided settings
-            self.constrained_processor.set_user_metadata(user_metadata)
-            self.constrained_processor.set_stop_at_reasoning(stop_at_reasoning)
-            self.constrained_processor.set_skip_genres(skip_genres)
-            self.constrained_processor.set_skip_caption(skip_caption)
-            self.constrained_processor.set_skip_language(skip_language)
+        self.constrained_processor.set_user_metadata(user_metadata)
+        self.constrained_processor.set_stop_at_reasoning(stop_at_reasoning)
+        self.constrained_processor.set_skip_genres(skip_genres)
+        self.constrained_processor.set_skip_caption(skip_caption)
+        self.constrained_processor.set_skip_language(skip_language)
         
         # Set generation phase for phase-aware processing
         self.constrained_processor.set_generation_phase(generation_phase)
         
         return self.constrained_processor
     
+    @staticmethod
+    def _per_item(value: Any, batch_size: int) -> List[Any]:
+        """Expand a scalar/dict argument to one value per batch item (lists are passed through)."""
+        if isinstance(value, list):
+            if len(value) != batch_size:
+                raise ValueError(f"Expected {batch_size} per-item values, got {len(value)}")
+            return value
+        return [value] * batch_size
+
+    def _max_tokens_for_duration(self, target_duration: Optional[float]) -> int:
+        """Token budget for one item: 5 audio codes per second plus ~500 tokens for CoT metadata and margin."""
+        if target_duration is not None and target_duration > 0:
+            # Ensure duration is within valid range (10-600 seconds)
+            effective_duration = max(10, min(600, target_duration))
+            # Cap at model's max length
+            return min(int(effective_duration * 5) + 500, self.max_model_len - 64)
+        # No duration constraint - use default (model will stop at EOS naturally)
+        return self.max_model_len - 64
+
     def _build_unconditional_prompt(
         self,
         caption: str,
@@ -226,6 +276,7 @@ class LLMHandler:
             else:
                 self.llm = self.llm.to("cpu").to(self.dtype)
             self.llm.eval()
+            self._compiled_pt_forward = None
             self.llm_backend = "pt"
             self.llm_initialized = True
             logger.info(f"5Hz LM initialized successfully using PyTorch backend on {device}")
@@ -253,53 +304,60 @@ class LLMHandler:
             logits[indices_to_remove] = float('-inf')
         return logits
     
-    def _sample_tokens(self, logits: torch.Tensor, temperature: float) -> torch.Tensor:
-        """Sample tokens from logits with temperature"""
+    def _sample_tokens(
+        self,
+        logits: torch.Tensor,
+        temperature: float,
+        generators: Optional[List[Optional[torch.Generator]]] = None,
+    ) -> torch.Tensor:
+        """Sample tokens from logits with temperature (one optional seeded generator per row)"""
         if temperature > 0:
             logits = logits / temperature
             probs = torch.softmax(logits, dim=-1)
-            return torch.multinomial(probs, num_samples=1).squeeze(1)
+            if generators is None or all(g is None for g in generators):
+                return torch.multinomial(probs, num_samples=1).squeeze(1)
+            return torch.cat([
+                torch.multinomial(probs[i:i+1], num_samples=1, generator=g).squeeze(1)
+                for i, g in enumerate(generators)
+            ])
         else:
             return torch.argmax(logits, dim=-1)
-    
-    def _check_eos_token(self, tokens: torch.Tensor, eos_token_id: int, pad_token_id: Optional[int]) -> bool:
-        """Check if any token in the batch is EOS or pad token"""
-        if torch.any(tokens == eos_token_id):
-            return True
-        if pad_token_id is not None and pad_token_id != eos_token_id:
-            if torch.any(tokens == pad_token_id):
-                return True
-        return False
-    
-    def _update_constrained_processor_state(self, constrained_processor: Optional[MetadataConstrainedLogitsProcessor], tokens: torch.Tensor):
-        """Update constrained processor state with generated tokens"""
-        if constrained_processor is not None:
-            for b in range(tokens.shape[0]):
-                constrained_processor.update_state(tokens[b].item())
-    
-    def _forward_pass(
-        self,
-        model: Any,
-        generated_ids: torch.Tensor,
-        model_kwargs: Dict[str, Any],
-        past_key_values: Optional[Any],
-        use_cache: bool,
-    ) -> Any:
-        """Perform forward pass with KV cache support"""
-        if past_key_values is None:
-            outputs = model(
-                input_ids=generated_ids,
-                **model_kwargs,
-                use_cache=use_cache,
-            )
-        else:
-            outputs = model(
-                input_ids=generated_ids[:, -1:],
-                past_key_values=past_key_values,
-                **model_kwargs,
-                use_cache=use_cache,
-            )
-        return outputs
+
+    def _make_pt_cache(self, batch_size: int, max_cache_len: int) -> Optional[Any]:
+        """
+        Preallocated StaticCache for the batched PyTorch loop.
+
+        The constructor changed across transformers releases (max_batch_size/device/dtype up
+        front vs. lazy allocation on the first forward), so both forms are tried. Returns None
+        when neither works; the loop then lets the model grow a DynamicCache.
+        """
+        try:
+            from transformers import StaticCache
+        except ImportError:
+            return None
+        for extra_kwargs in (
+            {"max_batch_size": batch_size, "device": self.device, "dtype": self.dtype},
+            {},
+        ):
+            try:
+                return StaticCache(config=self.llm.config, max_cache_len=max_cache_len, **extra_kwargs)
+            except (TypeError, ValueError):
+                continue
+        logger.warning("StaticCache unavailable for this model, PyTorch LM decoding uses a dynamic KV cache")
+        return None
+
+    def _pt_decode_forward(self, static_cache: bool) -> Callable[..., Any]:
+        """Model forward for single-token decode steps, compiled once when compile_pt_decode is on.
+
+        Only compiled with a static cache: a growing cache changes shapes every step.
+        """
+        if not (self.compile_pt_decode and static_cache):
+            return self.llm
+        if self._compiled_pt_forward is None:
+            mode = "reduce-overhead" if str(self.device).startswith("cuda") else None
+            logger.info(f"Compiling PyTorch LM decode step (mode={mode}), the first generation will be slow")
+            self._compiled_pt_forward = torch.compile(self.llm.forward, mode=mode, dynamic=False)
+        return self._compiled_pt_forward
     
     def _normalize_batch_input(self, formatted_prompts: Union[str, List[str]]) -> Tuple[List[str], bool]:
         """Normalize batch input: convert single string to list and return (list, is_batch)"""
@@ -318,6 +376,9 @@ class LLMHandler:
         offload_to_cpu: bool = False,
         dtype: Optional[torch.dtype] = None,
         disable_cuda_graphs: bool = False,
+        draft_lm_model_path: Optional[str] = None,
+        num_speculative_tokens: int = 4,
+        compile_pt_decode: bool = False,
     ) -> Tuple[str, bool]:
         """
         Initialize 5Hz LM model
@@ -331,6 +392,11 @@ class LLMHandler:
             dtype: Data type (if None, auto-detect based on device)
             disable_cuda_graphs: If True, disable CUDA graph capture for vLLM (use when LoRA
                 training may run in the same process to avoid cudaErrorStreamCaptureInvalidated).
+            draft_lm_model_path: Optional smaller LM (relative to checkpoint_dir, same vocabulary)
+                used by the vllm backend for speculative decoding
+            num_speculative_tokens: Tokens drafted per speculative step
+            compile_pt_decode: torch.compile the single-token decode step of the PyTorch
+                backend (static KV cache only; the first generation pays the compile time)
         
         Returns:
             (status_message, success)
@@ -346,6 +412,7 @@ class LLMHandler:
 
             self.device = device
             self.offload_to_cpu = offload_to_cpu
+            self.compile_pt_decode = compile_pt_decode
             # Set dtype based on device: bfloat16 for cuda, float32 for cpu
             if dtype is None:
                 self.dtype = torch.bfloat16 if device in ["cuda", "xpu"] else torch.float32
@@ -384,12 +451,28 @@ class LLMHandler:
                 debug=False,
                 max_duration=max_duration_for_constraint,
             )
+            # Compile field whitelists onto the generation device ahead of the first request
+            self.constrained_processor.compile_token_tables(device)
             logger.info(f"Constrained processor initialized in {time.time() - processor_start:.2f} seconds")
             
+            full_draft_model_path = None
+            if draft_lm_model_path:
+                full_draft_model_path = os.path.join(checkpoint_dir, draft_lm_model_path)
+                if not os.path.exists(full_draft_model_path):
+                    logger.warning(f"Draft LM not found at {full_draft_model_path}, speculative decoding disabled")
+                    full_draft_model_path = None
+                elif backend != "vllm":
+                    logger.warning("Speculative decoding needs the vllm backend, draft LM ignored")
+            
             # Initialize based on user-selected backend
             if backend == "vllm":
                 # Try to initialize with vllm
-                status_msg = self._initialize_5hz_lm_vllm(full_lm_model_path, enforce_eager=disable_cuda_graphs)
+                status_msg = self._initialize_5hz_lm_vllm(
+                    full_lm_model_path,
+                    enforce_eager=disable_cuda_graphs,
+                    draft_model_path=full_draft_model_path,
+                    num_speculative_tokens=num_speculative_tokens,
+                )
                 logger.info(f"5Hz LM status message: {status_msg}")
                 # Check if initialization failed (status_msg starts with ❌)
                 if status_msg.startswith("❌"):
@@ -412,9 +495,17 @@ class LLMHandler:
         except Exception as e:
             return f"❌ Error initializing 5Hz LM: {str(e)}\n\nTraceback:\n{traceback.format_exc()}", False
     
-    def _initialize_5hz_lm_vllm(self, model_path: str, enforce_eager: bool = False) -> str:
+    def _initialize_5hz_lm_vllm(
+        self,
+        model_path: str,
+        enforce_eager: bool = False,
+        draft_model_path: Optional[str] = None,
+        num_speculative_tokens: int = 4,
+    ) -> str:
         """Initialize 5Hz LM model using vllm backend. When enforce_eager is True, CUDA graph
-        capture is disabled (required when LoRA training may run in the same process)."""
+        capture is disabled (required when LoRA training may run in the same process).
+        With draft_model_path set, the draft LM proposes num_speculative_tokens tokens per
+        decode step and the main LM verifies them in one forward."""
         if not torch.cuda.is_available():
             self.llm_initialized = False
             logger.error("CUDA is not available. Please check your GPU setup.")
@@ -445,7 +536,7 @@ class LLMHandler:
             else:
                 self.max_model_len = 4096
             
-            logger.info(f"Initializing 5Hz LM with model: {model_path}, enforce_eager: {enforce_eager}, tensor_parallel_size: 1, max_model_len: {self.max_model_len}, gpu_memory_utilization: {gpu_memory_utilization:.3f}")
+            logger.info(f"Initializing 5Hz LM with model: {model_path}, enforce_eager: {enforce_eager}, tensor_parallel_size: 1, max_model_len: {self.max_model_len}, gpu_memory_utilization: {gpu_memory_utilization:.3f}, draft_model: {draft_model_path}")
             start_time = time.time()
             self.llm = LLM(
                 model=model_path,
@@ -454,11 +545,20 @@ class LLMHandler:
                 max_model_len=self.max_model_len,
                 gpu_memory_utilization=gpu_memory_utilization,
                 tokenizer=self.llm_tokenizer,
+                draft_model=draft_model_path,
+                num_speculative_tokens=num_speculative_tokens,
             )
             logger.info(f"5Hz LM initialized successfully in {time.time() - start_time:.2f} seconds")
+            # Persistent engine loop: concurrent requests share decode batches, so one
+            # request's CoT phase overlaps another's audio-code phase
+            if os.environ.get("ACESTEP_LM_ENGINE_LOOP", "1").lower() not in ("0", "false", "no"):
+                self.llm.start_loop()
             self.llm_initialized = True
             self.llm_backend = "vllm"
-            return f"✅ 5Hz LM initialized successfully\nModel: {model_path}\nDevice: {device_name}\nGPU Memory Utilization: {gpu_memory_utilization:.3f}\nLow GPU Memory Mode: {low_gpu_memory_mode}"
+            status_msg = f"✅ 5Hz LM initialized successfully\nModel: {model_path}\nDevice: {device_name}\nGPU Memory Utilization: {gpu_memory_utilization:.3f}\nLow GPU Memory Mode: {low_gpu_memory_mode}"
+            if draft_model_path:
+                status_msg += f"\nDraft Model: {draft_model_path} ({num_speculative_tokens} speculative tokens)"
+            return status_msg
         except Exception as e:
             self.llm_initialized = False
             return f"❌ Error initializing 5Hz LM: {str(e)}\n\nTraceback:\n{traceback.format_exc()}"
@@ -476,8 +576,8 @@ class LLMHandler:
         constrained_decoding_debug: bool = False,
         metadata_temperature: Optional[float] = None,
         codes_temperature: Optional[float] = None,
-        target_duration: Optional[float] = None,
-        user_metadata: Optional[Dict[str, Optional[str]]] = None,
+        target_duration: Optional[Union[float, List[Optional[float]]]] = None,
+        user_metadata: Optional[Union[Dict[str, Optional[str]], List[Optional[Dict[str, Optional[str]]]]]] = None,
         stop_at_reasoning: bool = False,
         skip_genres: bool = True,
         skip_caption: bool = False,
@@ -487,11 +587,15 @@ class LLMHandler:
         lyrics: str = "",
         cot_text: str = "",
         seeds: Optional[List[int]] = None,
+        stream_callback: Optional[Callable[[str], None]] = None,
     ) -> Union[str, List[str]]:
         """
         Unified vllm generation function supporting both single and batch modes.
         Accepts either a single formatted prompt (str) or a list of formatted prompts (List[str]).
         Returns a single string for single mode, or a list of strings for batch mode.
+        In batch mode target_duration and user_metadata may also be per-item lists; each item
+        gets its own constrained processor, so FSM state and phase temperatures are per item.
+        If stream_callback is given, it receives the text deltas of the first item every step.
         """
         from nanovllm import SamplingParams
 
@@ -500,69 +604,82 @@ class LLMHandler:
         batch_size = len(formatted_prompt_list)
 
         # Determine effective temperature for sampler
-        # Batch mode doesn't support phase temperatures, so use simple temperature
-        # Single mode supports phase temperatures
-        use_phase_temperatures = not is_batch and (metadata_temperature is not None or codes_temperature is not None)
+        # Phase temperatures are applied by the constrained processor, so the sampler runs at 1.0
+        use_phase_temperatures = metadata_temperature is not None or codes_temperature is not None
         effective_sampler_temp = 1.0 if use_phase_temperatures else temperature
 
-        # Setup constrained processor
-        constrained_processor = self._setup_constrained_processor(
-            use_constrained_decoding=use_constrained_decoding or use_phase_temperatures,
-            constrained_decoding_debug=constrained_decoding_debug,
-            target_duration=target_duration,
-            user_metadata=user_metadata,
-            stop_at_reasoning=stop_at_reasoning,
-            skip_genres=skip_genres,
-            skip_caption=skip_caption,
-            skip_language=skip_language,
-            generation_phase=generation_phase,
-            is_batch=is_batch,
-            metadata_temperature=metadata_temperature,
-            codes_temperature=codes_temperature,
-        )
+        target_durations = self._per_item(target_duration, batch_size)
+        user_metadatas = self._per_item(user_metadata, batch_size)
 
-        # Calculate max_tokens based on target_duration if specified
-        # 5 audio codes = 1 second, plus ~500 tokens for CoT metadata and safety margin
-        if target_duration is not None and target_duration > 0:
-            # Ensure duration is within valid range (10-600 seconds)
-            effective_duration = max(10, min(600, target_duration))
-            max_tokens = int(effective_duration * 5) + 500
-            # Cap at model's max length
-            max_tokens = min(max_tokens, self.max_model_len - 64)
-        else:
-            # No duration constraint - use default (model will stop at EOS naturally)
-            max_tokens = self.max_model_len - 64
-
-        sampling_params = SamplingParams(
-            max_tokens=max_tokens,
-            temperature=effective_sampler_temp,
-            cfg_scale=cfg_scale,
-            top_k=top_k,
-            top_p=top_p,
-            repetition_penalty=repetition_penalty,
-            logits_processor=constrained_processor,
-            logits_processor_update_state=constrained_processor.update_state if constrained_processor else None,
-        )
+        # One constrained processor per item (clones share the precomputed token tables).
+        # Other calls may run at the same time (engine loop, several API workers), so every
+        # call works on clones and the shared processor is only touched under the lock.
+        sampling_params = []
+        for item_duration, item_metadata in zip(target_durations, user_metadatas):
+            with self._processor_lock:
+                constrained_processor = self._setup_constrained_processor(
+                    use_constrained_decoding=use_constrained_decoding or use_phase_temperatures,
+                    constrained_decoding_debug=constrained_decoding_debug,
+                    target_duration=item_duration,
+                    user_metadata=item_metadata,
+                    stop_at_reasoning=stop_at_reasoning,
+                    skip_genres=skip_genres,
+                    skip_caption=skip_caption,
+                    skip_language=skip_language,
+                    generation_phase=generation_phase,
+                    metadata_temperature=metadata_temperature,
+                    codes_temperature=codes_temperature,
+                )
+                if constrained_processor is not None:
+                    constrained_processor = constrained_processor.clone()
 
-        if cfg_scale > 1.0:
-            # Build unconditional prompt based on generation phase
-            formatted_unconditional_prompt = self._build_unconditional_prompt(
-                caption=caption,
-                lyrics=lyrics,
-                cot_text=cot_text,
-                negative_prompt=negative_prompt,
-                generation_phase=generation_phase,
-                is_batch=is_batch,
-            )
-            unconditional_prompts = [formatted_unconditional_prompt] * batch_size
-            
-            outputs = self.llm.generate(
-                formatted_prompt_list,
-                sampling_params,
-                unconditional_prompts=unconditional_prompts,
-            )
-        else:
-            outputs = self.llm.generate(formatted_prompt_list, sampling_params)
+            sampling_params.append(SamplingParams(
+                max_tokens=self._max_tokens_for_duration(item_duration),
+                temperature=effective_sampler_temp,
+                cfg_scale=cfg_scale,
+                top_k=top_k,
+                top_p=top_p,
+                repetition_penalty=repetition_penalty,
+                logits_processor=constrained_processor,
+                logits_processor_update_state=constrained_processor.update_state if constrained_processor else None,
+                allowed_token_ids=constrained_processor.allowed_token_ids if constrained_processor else None,
+            ))
+
+        # Without the engine loop the engine is driven by the calling thread, one call at a time
+        engine_lock = nullcontext() if getattr(self.llm, "loop_running", False) else self._vllm_call_lock
+        with engine_lock:
+            if cfg_scale > 1.0:
+                # Build unconditional prompt based on generation phase
+                formatted_unconditional_prompt = self._build_unconditional_prompt(
+                    caption=caption,
+                    lyrics=lyrics,
+                    cot_text=cot_text,
+                    negative_prompt=negative_prompt,
+                    generation_phase=generation_phase,
+                    is_batch=is_batch,
+                )
+                unconditional_prompts = [formatted_unconditional_prompt] * batch_size
+                # The unconditional prompt is the instruction template filled with the negative
+                # prompt; keep its KV blocks cached for every item and later calls
+                self.llm.pin_prefix(formatted_unconditional_prompt)
+            else:
+                unconditional_prompts = None
+
+            if stream_callback is not None:
+                texts = [""] * batch_size
+                for event in self.llm.generate_stream(formatted_prompt_list, sampling_params, unconditional_prompts):
+                    texts[event["index"]] += event["text"]
+                    if event["index"] == 0 and event["text"]:
+                        stream_callback(event["text"])
+                outputs = [{"text": text} for text in texts]
+            elif unconditional_prompts is not None:
+                outputs = self.llm.generate(
+                    formatted_prompt_list,
+                    sampling_params,
+                    unconditional_prompts=unconditional_prompts,
+                )
+            else:
+                outputs = self.llm.generate(formatted_prompt_list, sampling_params)
 
         # Extract text from outputs
         output_texts = []
@@ -579,172 +696,6 @@ class LLMHandler:
         # Return single string for single mode, list for batch mode
         return output_texts[0] if not is_batch else output_texts
 
-    def _run_pt_single(
-        self,
-        formatted_prompt: str,
-        temperature: float,
-        cfg_scale: float,
-        negative_prompt: str,
-        top_k: Optional[int],
-        top_p: Optional[float],
-        repetition_penalty: float,
-        use_constrained_decoding: bool,
-        constrained_decoding_debug: bool,
-        target_duration: Optional[float],
-        user_metadata: Optional[Dict[str, Optional[str]]],
-        stop_at_reasoning: bool,
-        skip_genres: bool,
-        skip_caption: bool,
-        skip_language: bool,
-        generation_phase: str,
-        caption: str,
-        lyrics: str,
-        cot_text: str,
-    ) -> str:
-        """Internal helper function for single-item PyTorch generation."""
-        inputs = self.llm_tokenizer(
-            formatted_prompt,
-            return_tensors="pt",
-            padding=False,
-            truncation=True,
-        )
-
-        # Setup constrained processor
-        constrained_processor = self._setup_constrained_processor(
-            use_constrained_decoding=use_constrained_decoding,
-            constrained_decoding_debug=constrained_decoding_debug,
-            target_duration=target_duration,
-            user_metadata=user_metadata,
-            stop_at_reasoning=stop_at_reasoning,
-            skip_genres=skip_genres,
-            skip_caption=skip_caption,
-            skip_language=skip_language,
-            generation_phase=generation_phase,
-            is_batch=False,
-        )
-
-        with self._load_model_context():
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
-            
-            # Calculate max_new_tokens based on target_duration if specified
-            # 5 audio codes = 1 second, plus ~500 tokens for CoT metadata and safety margin
-            if target_duration is not None and target_duration > 0:
-                # Ensure duration is within valid range (10-600 seconds)
-                effective_duration = max(10, min(600, target_duration))
-                max_new_tokens = int(effective_duration * 5) + 500
-            else:
-                max_new_tokens = getattr(self.llm.config, "max_new_tokens", 4096)
-            
-            # Cap at model's max length
-            if hasattr(self, "max_model_len"):
-                max_new_tokens = min(max_new_tokens, self.max_model_len - 64)
-
-            # Build logits processor list (only for CFG and repetition penalty)
-            logits_processor = self._build_logits_processor(repetition_penalty)
-
-            if cfg_scale > 1.0:
-                # Build unconditional prompt based on generation phase
-                formatted_unconditional_prompt = self._build_unconditional_prompt(
-                    caption=caption,
-                    lyrics=lyrics,
-                    cot_text=cot_text,
-                    negative_prompt=negative_prompt,
-                    generation_phase=generation_phase,
-                    is_batch=False,
-                )
-                
-                # Tokenize both prompts together to ensure same length (with left padding)
-                # Left padding is important for generation tasks
-                batch_texts = [formatted_prompt, formatted_unconditional_prompt]
-                original_padding_side = self.llm_tokenizer.padding_side
-                self.llm_tokenizer.padding_side = 'left'
-                batch_inputs_tokenized = self.llm_tokenizer(
-                    batch_texts,
-                    return_tensors="pt",
-                    padding=True,
-                    truncation=True,
-                )
-                self.llm_tokenizer.padding_side = original_padding_side
-                batch_inputs_tokenized = {k: v.to(self.device) for k, v in batch_inputs_tokenized.items()}
-                
-                # Extract batch inputs
-                batch_input_ids = batch_inputs_tokenized['input_ids']
-                batch_attention_mask = batch_inputs_tokenized.get('attention_mask', None)
-
-                # Use custom CFG generation loop with constrained decoding
-                outputs = self._generate_with_cfg_custom(
-                    batch_input_ids=batch_input_ids,
-                    batch_attention_mask=batch_attention_mask,
-                    max_new_tokens=max_new_tokens,
-                    temperature=temperature,
-                    cfg_scale=cfg_scale,
-                    top_k=top_k,
-                    top_p=top_p,
-                    repetition_penalty=repetition_penalty,
-                    pad_token_id=self.llm_tokenizer.pad_token_id or self.llm_tokenizer.eos_token_id,
-                    streamer=None,
-                    constrained_processor=constrained_processor,
-                )
-                
-                # Extract only the conditional output (first in batch)
-                outputs = outputs[0:1]  # Keep only conditional output
-            elif use_constrained_decoding:
-                # Use custom constrained decoding loop for non-CFG
-                outputs = self._generate_with_constrained_decoding(
-                    input_ids=inputs["input_ids"],
-                    attention_mask=inputs.get("attention_mask"),
-                    max_new_tokens=max_new_tokens,
-                    temperature=temperature,
-                    top_k=top_k,
-                    top_p=top_p,
-                    repetition_penalty=repetition_penalty,
-                    pad_token_id=self.llm_tokenizer.pad_token_id or self.llm_tokenizer.eos_token_id,
-                    streamer=None,
-                    constrained_processor=constrained_processor,
-                )
-            else:
-                # Generate without CFG using native generate() parameters
-                with torch.no_grad():
-                    outputs = self.llm.generate(
-                        **inputs,
-                        max_new_tokens=max_new_tokens,
-                        temperature=temperature if temperature > 0 else 1.0,
-                        do_sample=True if temperature > 0 else False,
-                        top_k=top_k if top_k is not None and top_k > 0 else None,
-                        top_p=top_p if top_p is not None and 0.0 < top_p < 1.0 else None,
-                        logits_processor=logits_processor if len(logits_processor) > 0 else None,
-                        pad_token_id=self.llm_tokenizer.pad_token_id or self.llm_tokenizer.eos_token_id,
-                        streamer=None,
-                    )
-
-        # Decode the generated tokens
-        # outputs is a tensor with shape [batch_size, seq_len], extract first sequence
-        if isinstance(outputs, torch.Tensor):
-            if outputs.dim() == 2:
-                generated_ids = outputs[0]
-            else:
-                generated_ids = outputs
-        else:
-            generated_ids = outputs[0]
-        
-        # Only decode the newly generated tokens (skip the input prompt)
-        # Use the original input length (before batch processing for CFG)
-        if cfg_scale > 1.0:
-            # In CFG case, we need to use the conditional input length from batch_inputs_tokenized
-            # Both sequences have the same length due to padding
-            input_length = batch_inputs_tokenized['input_ids'].shape[1]
-        else:
-            input_length = inputs["input_ids"].shape[1]
-        
-        generated_ids = generated_ids[input_length:]
-        
-        # Move to CPU for decoding
-        if generated_ids.is_cuda:
-            generated_ids = generated_ids.cpu()
-        
-        output_text = self.llm_tokenizer.decode(generated_ids, skip_special_tokens=False)
-        return output_text
-
     def _run_pt(
         self,
         formatted_prompts: Union[str, List[str]],
@@ -756,8 +707,8 @@ class LLMHandler:
         repetition_penalty: float,
         use_constrained_decoding: bool = True,
         constrained_decoding_debug: bool = False,
-        target_duration: Optional[float] = None,
-        user_metadata: Optional[Dict[str, Optional[str]]] = None,
+        target_duration: Optional[Union[float, List[Optional[float]]]] = None,
+        user_metadata: Optional[Union[Dict[str, Optional[str]], List[Optional[Dict[str, Optional[str]]]]]] = None,
         stop_at_reasoning: bool = False,
         skip_genres: bool = True,
         skip_caption: bool = False,
@@ -767,77 +718,262 @@ class LLMHandler:
         lyrics: str = "",
         cot_text: str = "",
         seeds: Optional[List[int]] = None,
+        stream_callback: Optional[Callable[[str], None]] = None,
     ) -> Union[str, List[str]]:
         """
         Unified PyTorch generation function supporting both single and batch modes.
         Accepts either a single formatted prompt (str) or a list of formatted prompts (List[str]).
         Returns a single string for single mode, or a list of strings for batch mode.
-        Note: PyTorch backend processes batch items sequentially (doesn't support true batching efficiently).
+        All items are decoded together in one KV-cached batch (see _generate_pt_batch).
+        In batch mode target_duration and user_metadata may also be per-item lists; each item
+        gets its own constrained processor and token budget, and seeds[i] seeds item i.
+        If stream_callback is given, it receives the text deltas of the first item as they are decoded.
         """
         # Determine if batch mode
         formatted_prompt_list, is_batch = self._normalize_batch_input(formatted_prompts)
+        batch_size = len(formatted_prompt_list)
 
-        # For batch mode, process each item sequentially with different seeds
-        if is_batch:
-            output_texts = []
-            for i, formatted_prompt in enumerate(formatted_prompt_list):
-                # Set seed for this item if provided
-                if seeds and i < len(seeds):
-                    torch.manual_seed(seeds[i])
-                    if torch.cuda.is_available():
-                        torch.cuda.manual_seed_all(seeds[i])
-                
-                # Generate using single-item method with batch-mode defaults
-                output_text = self._run_pt_single(
-                    formatted_prompt=formatted_prompt,
-                    temperature=temperature,
-                    cfg_scale=cfg_scale,
-                    negative_prompt=negative_prompt,
-                    top_k=top_k,
-                    top_p=top_p,
-                    repetition_penalty=repetition_penalty,
+        target_durations = self._per_item(target_duration, batch_size)
+        user_metadatas = self._per_item(user_metadata, batch_size)
+
+        # One constrained processor per item (clones share the precomputed token tables).
+        # Clones are used even for a single item, since API workers may share this handler.
+        processors = []
+        for item_duration, item_metadata in zip(target_durations, user_metadatas):
+            with self._processor_lock:
+                constrained_processor = self._setup_constrained_processor(
                     use_constrained_decoding=use_constrained_decoding,
                     constrained_decoding_debug=constrained_decoding_debug,
-                    target_duration=target_duration,
-                    user_metadata=None,
-                    stop_at_reasoning=False,
-                    skip_genres=True,
-                    skip_caption=True,
-                    skip_language=True,
+                    target_duration=item_duration,
+                    user_metadata=item_metadata,
+                    stop_at_reasoning=stop_at_reasoning,
+                    skip_genres=skip_genres,
+                    skip_caption=skip_caption,
+                    skip_language=skip_language,
                     generation_phase=generation_phase,
-                    caption=caption,
-                    lyrics=lyrics,
-                    cot_text=cot_text,
                 )
-                
-                output_texts.append(output_text)
-            
-            return output_texts
+                if constrained_processor is not None:
+                    constrained_processor = constrained_processor.clone()
+            processors.append(constrained_processor)
 
-        # Single mode: process the formatted prompt
-        formatted_prompt = formatted_prompt_list[0]
-        
-        return self._run_pt_single(
-            formatted_prompt=formatted_prompt,
-            temperature=temperature,
-            cfg_scale=cfg_scale,
-            negative_prompt=negative_prompt,
-            top_k=top_k,
-            top_p=top_p,
-            repetition_penalty=repetition_penalty,
-            use_constrained_decoding=use_constrained_decoding,
-            constrained_decoding_debug=constrained_decoding_debug,
-            target_duration=target_duration,
-            user_metadata=user_metadata,
-            stop_at_reasoning=stop_at_reasoning,
-            skip_genres=skip_genres,
-            skip_caption=skip_caption,
-            skip_language=skip_language,
-            generation_phase=generation_phase,
-            caption=caption,
-            lyrics=lyrics,
-            cot_text=cot_text,
-        )
+        unconditional_prompts = None
+        if cfg_scale > 1.0:
+            # Build unconditional prompt based on generation phase
+            formatted_unconditional_prompt = self._build_unconditional_prompt(
+                caption=caption,
+                lyrics=lyrics,
+                cot_text=cot_text,
+                negative_prompt=negative_prompt,
+                generation_phase=generation_phase,
+                is_batch=False,
+            )
+            unconditional_prompts = [formatted_unconditional_prompt] * batch_size
+
+        streamer = None
+        if stream_callback is not None:
+            streamer = _CallbackTextStreamer(self.llm_tokenizer, stream_callback, skip_prompt=False)
+
+        with self._load_model_context():
+            generated = self._generate_pt_batch(
+                prompts=formatted_prompt_list,
+                unconditional_prompts=unconditional_prompts,
+                max_new_tokens=[self._max_tokens_for_duration(d) for d in target_durations],
+                temperature=temperature,
+                cfg_scale=cfg_scale,
+                top_k=top_k,
+                top_p=top_p,
+                repetition_penalty=repetition_penalty,
+                processors=processors,
+                seeds=seeds,
+                streamer=streamer,
+            )
+
+        output_texts = [self.llm_tokenizer.decode(ids, skip_special_tokens=False) for ids in generated]
+
+        # Return single string for single mode, list for batch mode
+        return output_texts[0] if not is_batch else output_texts
+
+    def _generate_pt_batch(
+        self,
+        prompts: List[str],
+        unconditional_prompts: Optional[List[str]],
+        max_new_tokens: List[int],
+        temperature: float,
+        cfg_scale: float,
+        top_k: Optional[int],
+        top_p: Optional[float],
+        repetition_penalty: float,
+        processors: List[Optional[MetadataConstrainedLogitsProcessor]],
+        seeds: Optional[List[int]] = None,
+        streamer: Optional[BaseStreamer] = None,
+    ) -> List[List[int]]:
+        """
+        Batched, KV-cached generation loop of the PyTorch backend.
+
+        Rows are the conditional prompts followed (with CFG) by their unconditional prompts.
+        They are left-padded into preallocated token/attention buffers sized for the longest
+        budget, so every step writes one column in place instead of concatenating, and the
+        model decodes into a StaticCache of the same length. CFG mixes row i with row
+        batch_size + i and the sampled token is written to both. Each item stops on its own
+        EOS/pad token or token budget; finished items only get pad tokens (which nobody reads)
+        until all are done.
+
+        Args:
+            prompts: Formatted conditional prompts, one per item
+            unconditional_prompts: Unconditional prompts for CFG (same length), or None
+            max_new_tokens: Token budget of each item
+            temperature: Sampling temperature (0 = greedy)
+            cfg_scale: CFG scale, used when unconditional_prompts is given
+            top_k: Top-k filter (None/0 = off)
+            top_p: Top-p filter (None/1.0 = off)
+            repetition_penalty: Repetition penalty over prompt + generated tokens
+            processors: Constrained processor of each item (None entries = unconstrained)
+            seeds: Optional per-item seeds; item i samples from its own generator
+            streamer: Optional streamer fed with the tokens of the first item
+
+        Returns:
+            Generated token IDs of each item (including the final EOS token, if any)
+        """
+        model = self.llm
+        device = self.device
+        tokenizer = self.llm_tokenizer
+        batch_size = len(prompts)
+        use_cfg = unconditional_prompts is not None
+        pad_token_id = tokenizer.pad_token_id or tokenizer.eos_token_id
+        eos_token_id = tokenizer.eos_token_id
+        if eos_token_id is None:
+            eos_token_id = pad_token_id
+
+        encoded = tokenizer(prompts + (unconditional_prompts or []), padding=False, truncation=True)["input_ids"]
+        num_rows = len(encoded)
+        prompt_len = max(len(ids) for ids in encoded)
+        max_steps = max(max_new_tokens)
+        total_len = prompt_len + max_steps
+
+        # Static buffers, left-padded so every prompt ends at column prompt_len - 1
+        tokens = torch.full((num_rows, total_len), pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((num_rows, total_len), dtype=torch.long)
+        for row, ids in enumerate(encoded):
+            tokens[row, prompt_len - len(ids):prompt_len] = torch.tensor(ids, dtype=torch.long)
+            attention_mask[row, prompt_len - len(ids):prompt_len] = 1
+        tokens = tokens.to(device)
+        attention_mask = attention_mask.to(device)
+        prompt_starts = [prompt_len - len(ids) for ids in encoded]
+        # Positions count real tokens only, so padded rows line up with unpadded ones
+        prompt_lengths = attention_mask[:, :prompt_len].sum(dim=-1, keepdim=True)
+        position_ids = (attention_mask[:, :prompt_len].cumsum(dim=-1) - 1).clamp(min=0)
+
+        cache = self._make_pt_cache(num_rows, total_len)
+        static_cache = cache is not None
+        decode_forward = self._pt_decode_forward(static_cache)
+        past_key_values = cache
+
+        generators = None
+        if seeds:
+            generators = []
+            for i in range(batch_size):
+                if i < len(seeds) and seeds[i] is not None:
+                    generators.append(torch.Generator(device=device).manual_seed(int(seeds[i])))
+                else:
+                    generators.append(None)
+
+        use_processors = all(p is not None for p in processors)
+        logits_processor = self._build_logits_processor(repetition_penalty)
+
+        finished = [False] * batch_size
+        num_generated = [0] * batch_size
+        input_ids = tokens[:, :prompt_len]
+        cache_position = torch.arange(prompt_len, device=device)
+
+        with torch.no_grad():
+            for step in tqdm(range(max_steps), desc="LLM Generation", unit="token"):
+                cur_len = prompt_len + step
+                forward = model if step == 0 else decode_forward
+                outputs = forward(
+                    input_ids=input_ids,
+                    attention_mask=attention_mask if static_cache else attention_mask[:, :cur_len],
+                    position_ids=position_ids,
+                    past_key_values=past_key_values,
+                    cache_position=cache_position,
+                    use_cache=True,
+                    logits_to_keep=1,
+                )
+                if not static_cache:
+                    past_key_values = outputs.past_key_values
+
+                next_token_logits = outputs.logits[:, -1, :].float()
+                if use_cfg:
+                    cond_logits = next_token_logits[:batch_size]
+                    uncond_logits = next_token_logits[batch_size:]
+                    next_token_logits = uncond_logits + cfg_scale * (cond_logits - uncond_logits)
+
+                active = [i for i in range(batch_size) if not finished[i]]
+                if len(active) < batch_size:
+                    next_token_logits = next_token_logits[active]
+
+                # Apply constrained processors FIRST (modify logits based on each item's FSM state)
+                if use_processors:
+                    next_token_logits = MetadataConstrainedLogitsProcessor.process_batch(
+                        [processors[i] for i in active],
+                        _RowTokenIds(tokens, prompt_starts, cur_len, active),
+                        next_token_logits,
+                    )
+                elif any(p is not None for p in processors):
+                    for k, i in enumerate(active):
+                        if processors[i] is not None:
+                            row_ids = tokens[i:i+1, prompt_starts[i]:cur_len]
+                            next_token_logits[k:k+1] = processors[i](row_ids, next_token_logits[k:k+1])
+
+                # Apply other logits processors (repetition penalty); pad columns repeat the
+                # last prompt token so they don't penalize the pad id
+                if len(logits_processor) > 0:
+                    history = tokens[active, :cur_len]
+                    history = torch.where(
+                        attention_mask[active, :cur_len].bool(), history, history[:, prompt_len - 1:prompt_len]
+                    )
+                    for processor in logits_processor:
+                        next_token_logits = processor(history, next_token_logits)
+
+                # Apply top-k and top-p filtering
+                next_token_logits = self._apply_top_k_filter(next_token_logits, top_k)
+                next_token_logits = self._apply_top_p_filter(next_token_logits, top_p)
+
+                # Apply temperature and sample
+                next_tokens = self._sample_tokens(
+                    next_token_logits,
+                    temperature,
+                    [generators[i] for i in active] if generators else None,
+                )
+
+                # Write the step column in place (same token for conditional and unconditional rows)
+                step_tokens = torch.full((batch_size,), pad_token_id, dtype=torch.long, device=device)
+                step_tokens[active] = next_tokens
+                tokens[:, cur_len] = step_tokens.repeat(2) if use_cfg else step_tokens
+                attention_mask[:, cur_len] = 1
+
+                next_token_list = next_tokens.tolist()
+                for k, i in enumerate(active):
+                    token = next_token_list[k]
+                    if processors[i] is not None:
+                        processors[i].update_state(token)
+                    num_generated[i] += 1
+                    if token == eos_token_id or token == pad_token_id or num_generated[i] >= max_new_tokens[i]:
+                        finished[i] = True
+
+                if streamer is not None and active[0] == 0:
+                    streamer.put(torch.tensor([next_token_list[0]]))
+
+                if all(finished):
+                    break
+
+                input_ids = tokens[:, cur_len:cur_len + 1]
+                position_ids = prompt_lengths + step
+                cache_position = cache_position[-1:] + 1
+
+        if streamer is not None:
+            streamer.end()
+
+        return [tokens[i, prompt_len:prompt_len + num_generated[i]].tolist() for i in range(batch_size)]
 
     def has_all_metas(self, user_metadata: Optional[Dict[str, Optional[str]]]) -> bool:
         """Check if all required metadata are present."""
@@ -897,6 +1033,7 @@ class LLMHandler:
         batch_size: Optional[int] = None,
         seeds: Optional[List[int]] = None,
         progress=None,
+        cot_callback: Optional[Callable[[str], None]] = None,
     ) -> Dict[str, Any]:
         """Two-phase LM generation: CoT generation followed by audio codes generation.
 
@@ -912,8 +1049,12 @@ class LLMHandler:
             use_cot_language: Whether to generate language in CoT (default True).
             batch_size: Optional batch size for batch generation. If None or 1, returns single result.
                        If > 1, returns batch results (lists).
-            seeds: Optional list of seeds for batch generation (for reproducibility).
-                  Only used when batch_size > 1. TODO: not used yet
+            seeds: Optional list of seeds (for reproducibility). With the pt backend item i
+                  samples from its own generator seeded with seeds[i]; in batch mode missing
+                  seeds are filled with random ones, and in single mode seeds[0] (if given)
+                  seeds both phases. The vllm backend does not use them yet.
+            cot_callback: Optional callable receiving the Phase 1 CoT text incrementally
+                          while it is generated (ends with the </think> tag).
         
         Returns:
             Dictionary containing:
@@ -991,10 +1132,12 @@ class LLMHandler:
                     # Pass context for building unconditional prompt in CoT phase
                     "caption": caption,
                     "lyrics": lyrics,
+                    "seeds": None if is_batch else seeds,  # Batch CoT is shared by all items
                 },
                 use_constrained_decoding=use_constrained_decoding,
                 constrained_decoding_debug=constrained_decoding_debug,
                 stop_at_reasoning=True,  # Always stop at </think> in Phase 1
+                stream_callback=cot_callback,
             )
             
             phase1_time = time.time() - phase1_start
@@ -1176,6 +1319,7 @@ class LLMHandler:
                     "caption": caption,
                     "lyrics": lyrics,
                     "cot_text": cot_text,
+                    "seeds": seeds,
                 },
                 use_constrained_decoding=use_constrained_decoding,
                 constrained_decoding_debug=constrained_decoding_debug,
@@ -1899,6 +2043,7 @@ class LLMHandler:
         use_constrained_decoding: bool = True,
         constrained_decoding_debug: bool = False,
         stop_at_reasoning: bool = False,
+        stream_callback: Optional[Callable[[str], None]] = None,
     ) -> Tuple[str, str]:
         """
         Generate raw LM text output from a pre-built formatted prompt.
@@ -1912,9 +2057,11 @@ class LLMHandler:
                 - top_k (int), top_p (float), repetition_penalty (float)
                 - target_duration (float): Target duration in seconds for codes generation
                 - generation_phase (str): "cot" or "codes" for phase-aware CFG
+                - seeds (List[int]): seeds[0] seeds sampling (pt backend)
             use_constrained_decoding: Whether to use FSM-based constrained decoding
             constrained_decoding_debug: Whether to enable debug logging for constrained decoding
             stop_at_reasoning: If True, stop generation immediately after </think> tag (no audio codes)
+            stream_callback: Optional callable receiving output text deltas as they are generated
 
         Returns:
             (output_text, status_message)
@@ -1945,6 +2092,7 @@ class LLMHandler:
         caption = cfg.get("caption", "")
         lyrics = cfg.get("lyrics", "")
         cot_text = cfg.get("cot_text", "")
+        seeds = cfg.get("seeds")
 
         try:
             if self.llm_backend == "vllm":
@@ -1968,6 +2116,8 @@ class LLMHandler:
                     caption=caption,
                     lyrics=lyrics,
                     cot_text=cot_text,
+                    seeds=seeds,
+                    stream_callback=stream_callback,
                 )
                 return output_text, f"✅ Generated successfully (vllm) | length={len(output_text)}"
 
@@ -1992,6 +2142,8 @@ class LLMHandler:
                 caption=caption,
                 lyrics=lyrics,
                 cot_text=cot_text,
+                seeds=seeds,
+                stream_callback=stream_callback,
             )
             return output_text, f"✅ Generated successfully (pt) | length={len(output_text)}"
 
@@ -2002,7 +2154,8 @@ class LLMHandler:
             logger.error(f"Error in generate_from_formatted_prompt: {type(e).__name__}: {e}\n{error_detail}")
             # Reset nano-vllm state on error to prevent stale context from causing
             # subsequent CUDA illegal memory access errors
-            if self.llm_backend == "vllm":
+            # (the engine loop owns that state and recovers from its own errors)
+            if self.llm_backend == "vllm" and not getattr(self.llm, "loop_running", False):
                 try:
                     from nanovllm.utils.context import reset_context
                     reset_context()
@@ -2024,219 +2177,6 @@ class LLMHandler:
                 torch.xpu.synchronize()
             return "", f"❌ Error generating from formatted prompt: {type(e).__name__}: {e or error_detail.splitlines()[-1]}"
     
-    def _generate_with_constrained_decoding(
-        self,
-        input_ids: torch.Tensor,
-        attention_mask: Optional[torch.Tensor],
-        max_new_tokens: int,
-        temperature: float,
-        top_k: Optional[int],
-        top_p: Optional[float],
-        repetition_penalty: float,
-        pad_token_id: int,
-        streamer: Optional[BaseStreamer],
-        constrained_processor: Optional[MetadataConstrainedLogitsProcessor] = None,
-    ) -> torch.Tensor:
-        """
-        Custom generation loop with constrained decoding support (non-CFG).
-        This allows us to call update_state() after each token generation.
-        """
-        model = self.llm
-        device = self.device
-        
-        # Initialize generated sequences
-        generated_ids = input_ids.clone()
-        if attention_mask is not None:
-            attn_mask = attention_mask.clone()
-        else:
-            attn_mask = torch.ones_like(input_ids)
-        
-        # Prepare model inputs
-        model_kwargs = {'attention_mask': attn_mask}
-        
-        # Past key values for KV cache
-        past_key_values = None
-        use_cache = hasattr(model, 'generation_config') and getattr(model.generation_config, 'use_cache', True)
-        
-        # Get EOS token ID
-        eos_token_id = self.llm_tokenizer.eos_token_id
-        if eos_token_id is None:
-            eos_token_id = pad_token_id
-        
-        # Build logits processor for repetition penalty
-        logits_processor = self._build_logits_processor(repetition_penalty)
-        
-        with torch.no_grad():
-            for step in tqdm(range(max_new_tokens), desc="LLM Constrained Decoding", unit="token"):
-                # Forward pass
-                outputs = self._forward_pass(model, generated_ids, model_kwargs, past_key_values, use_cache)
-                
-                # Get logits for the last position
-                next_token_logits = outputs.logits[:, -1, :]  # [batch_size, vocab_size]
-                
-                # Apply constrained processor FIRST (modifies logits based on FSM state)
-                if constrained_processor is not None:
-                    next_token_logits = constrained_processor(generated_ids, next_token_logits)
-                
-                # Apply other logits processors (repetition penalty)
-                for processor in logits_processor:
-                    next_token_logits = processor(generated_ids, next_token_logits)
-                
-                # Apply top-k and top-p filtering
-                next_token_logits = self._apply_top_k_filter(next_token_logits, top_k)
-                next_token_logits = self._apply_top_p_filter(next_token_logits, top_p)
-                
-                # Apply temperature and sample
-                next_tokens = self._sample_tokens(next_token_logits, temperature)
-                
-                # Update constrained processor state
-                self._update_constrained_processor_state(constrained_processor, next_tokens)
-                
-                # Check for EOS token
-                should_stop = self._check_eos_token(next_tokens, eos_token_id, pad_token_id)
-                
-                # Append token to sequence
-                next_tokens_unsqueezed = next_tokens.unsqueeze(1)
-                generated_ids = torch.cat([generated_ids, next_tokens_unsqueezed], dim=1)
-                attn_mask = torch.cat([attn_mask, torch.ones((input_ids.shape[0], 1), device=device, dtype=attn_mask.dtype)], dim=1)
-                model_kwargs['attention_mask'] = attn_mask
-                
-                # Update KV cache
-                if use_cache and hasattr(outputs, 'past_key_values'):
-                    past_key_values = outputs.past_key_values
-                
-                # Update streamer
-                if streamer is not None:
-                    streamer.put(next_tokens_unsqueezed)
-                
-                if should_stop:
-                    break
-        
-        if streamer is not None:
-            streamer.end()
-        
-        return generated_ids
-    
-    def _generate_with_cfg_custom(
-        self,
-        batch_input_ids: torch.Tensor,
-        batch_attention_mask: Optional[torch.Tensor],
-        max_new_tokens: int,
-        temperature: float,
-        cfg_scale: float,
-        top_k: Optional[int],
-        top_p: Optional[float],
-        repetition_penalty: float,
-        pad_token_id: int,
-        streamer: Optional[BaseStreamer],
-        constrained_processor: Optional[MetadataConstrainedLogitsProcessor] = None,
-    ) -> torch.Tensor:
-        """
-        Custom CFG generation loop that:
-        1. Processes both conditional and unconditional sequences in parallel
-        2. Applies CFG formula to logits
-        3. Samples tokens only for conditional sequences
-        4. Applies the same sampled tokens to both conditional and unconditional sequences
-        5. Optionally applies constrained decoding via FSM-based logits processor
-        
-        Batch format: [cond_input, uncond_input]
-        """
-        model = self.llm
-        device = self.device
-        batch_size = batch_input_ids.shape[0] // 2  # Half are conditional, half are unconditional
-        cond_start_idx = 0
-        uncond_start_idx = batch_size
-        
-        # Initialize generated sequences
-        generated_ids = batch_input_ids.clone()
-        if batch_attention_mask is not None:
-            attention_mask = batch_attention_mask.clone()
-        else:
-            attention_mask = torch.ones_like(batch_input_ids)
-        
-        # Prepare model inputs
-        model_kwargs = {}
-        if batch_attention_mask is not None:
-            model_kwargs['attention_mask'] = attention_mask
-        
-        # Past key values for KV cache (if model supports it)
-        past_key_values = None
-        use_cache = hasattr(model, 'generation_config') and getattr(model.generation_config, 'use_cache', True)
-        
-        # Get EOS token ID for stopping condition
-        eos_token_id = self.llm_tokenizer.eos_token_id
-        if eos_token_id is None:
-            eos_token_id = pad_token_id
-        
-        # Build logits processor for non-CFG operations (repetition penalty, top_k, top_p)
-        logits_processor = self._build_logits_processor(repetition_penalty)
-        
-        with torch.no_grad():
-            for step in tqdm(range(max_new_tokens), desc="LLM CFG Generation", unit="token"):
-                # Forward pass for the entire batch (conditional + unconditional)
-                outputs = self._forward_pass(model, generated_ids, model_kwargs, past_key_values, use_cache)
-                
-                # Get logits for the last position
-                next_token_logits = outputs.logits[:, -1, :]  # [batch_size*2, vocab_size]
-                
-                # Split conditional and unconditional logits
-                cond_logits = next_token_logits[cond_start_idx:cond_start_idx+batch_size]
-                uncond_logits = next_token_logits[uncond_start_idx:uncond_start_idx+batch_size]
-                
-                # Apply CFG formula: cfg_logits = uncond_logits + cfg_scale * (cond_logits - uncond_logits)
-                cfg_logits = uncond_logits + cfg_scale * (cond_logits - uncond_logits)
-                
-                # Apply constrained processor FIRST (modifies logits based on FSM state)
-                if constrained_processor is not None:
-                    current_input_ids = generated_ids[cond_start_idx:cond_start_idx+batch_size]
-                    cfg_logits = constrained_processor(current_input_ids, cfg_logits)
-                
-                # Apply logits processors (repetition penalty, top-k, top-p)
-                # Get current input_ids for repetition penalty (only conditional part)
-                current_input_ids = generated_ids[cond_start_idx:cond_start_idx+batch_size]
-                for processor in logits_processor:
-                    cfg_logits = processor(current_input_ids, cfg_logits)
-                
-                # Apply top-k and top-p filtering
-                cfg_logits = self._apply_top_k_filter(cfg_logits, top_k)
-                cfg_logits = self._apply_top_p_filter(cfg_logits, top_p)
-                
-                # Apply temperature and sample
-                next_tokens = self._sample_tokens(cfg_logits, temperature)
-                
-                # Update constrained processor state AFTER sampling
-                self._update_constrained_processor_state(constrained_processor, next_tokens)
-                
-                # Check for EOS token in conditional sequences BEFORE unsqueezing
-                # Stop if any conditional sequence generates EOS token
-                # next_tokens shape: [batch_size] (only conditional tokens)
-                should_stop = self._check_eos_token(next_tokens, eos_token_id, pad_token_id)
-                
-                # Apply the same sampled tokens to both conditional and unconditional sequences
-                next_tokens_unsqueezed = next_tokens.unsqueeze(1)
-                generated_ids = torch.cat([generated_ids, next_tokens_unsqueezed.repeat(2, 1)], dim=1)
-                attention_mask = torch.cat([attention_mask, torch.ones((batch_size*2, 1), device=device, dtype=attention_mask.dtype)], dim=1)
-                model_kwargs['attention_mask'] = attention_mask
-                
-                # Update past_key_values for next iteration
-                if use_cache and hasattr(outputs, 'past_key_values'):
-                    past_key_values = outputs.past_key_values
-                
-                # Update streamer
-                if streamer is not None:
-                    streamer.put(next_tokens_unsqueezed)  # Stream conditional tokens
-                
-                # Stop generation if EOS token detected
-                if should_stop:
-                    break
-        
-        if streamer is not None:
-            streamer.end()
-        
-        # Return the full batch (both conditional and unconditional)
-        # The caller will extract only the conditional output
-        return generated_ids
-    
     def parse_lm_output(self, output_text: str) -> Tuple[Dict[str, Any], str]:
         """
         Parse LM output to extract metadata and audio codes.
@@ -2362,6 +2302,7 @@ class LLMHandler:
         """
         Context manager to load a model to GPU and offload it back to CPU after use.
         Only used for PyTorch backend when offload_to_cpu is True.
+        Overlapping calls share one load: the model is offloaded when the last one exits.
         """
         if not self.offload_to_cpu:
             yield
@@ -2377,25 +2318,31 @@ class LLMHandler:
             yield
             return
         
-        # Load to GPU
-        logger.info(f"Loading LLM to {self.device}")
-        start_time = time.time()
-        if hasattr(model, "to"):
-            model.to(self.device).to(self.dtype)
-        load_time = time.time() - start_time
-        logger.info(f"Loaded LLM to {self.device} in {load_time:.4f}s")
+        with self._model_context_lock:
+            self._model_context_users += 1
+            if self._model_context_users == 1:
+                # Load to GPU
+                logger.info(f"Loading LLM to {self.device}")
+                start_time = time.time()
+                if hasattr(model, "to"):
+                    model.to(self.device).to(self.dtype)
+                load_time = time.time() - start_time
+                logger.info(f"Loaded LLM to {self.device} in {load_time:.4f}s")
 
         try:
             yield
         finally:
-            # Offload to CPU
-            logger.info(f"Offloading LLM to CPU")
-            start_time = time.time()
-            if hasattr(model, "to"):
-                model.to("cpu")
-            torch.cuda.empty_cache()
-            offload_time = time.time() - start_time
-            logger.info(f"Offloaded LLM to CPU in {offload_time:.4f}s")
+            with self._model_context_lock:
+                self._model_context_users -= 1
+                if self._model_context_users == 0:
+                    # Offload to CPU
+                    logger.info(f"Offloading LLM to CPU")
+                    start_time = time.time()
+                    if hasattr(model, "to"):
+                        model.to("cpu")
+                    torch.cuda.empty_cache()
+                    offload_time = time.time() - start_time
+                    logger.info(f"Offloaded LLM to CPU in {offload_time:.4f}s")
     
     def get_hf_model_for_scoring(self):
         """
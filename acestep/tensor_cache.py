@@ -0,0 +1,231 @@
+"""In-process LRU cache for tensors with an optional on-disk tier
+
+Used to skip recomputing encoder outputs (text/lyric embeddings, audio latents)
+for inputs that repeat across requests. Entries are bounded both by count and by
+total tensor bytes; when a disk directory is given, entries are also written
+there so they survive eviction and process restarts.
+"""
+
+import hashlib
+import os
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Optional
+
+import torch
+from loguru import logger
+
+
+def _nbytes(value: Any) -> int:
+    """Total tensor bytes held by a value (tensor, or dict/list/tuple of tensors)."""
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    if isinstance(value, dict):
+        return sum(_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_nbytes(v) for v in value)
+    return 0
+
+
+def _to_cpu(value: Any) -> Any:
+    """Detach tensors and move them to CPU so cached entries never pin GPU memory.
+
+    CPU tensors that are views into a larger storage are copied, so an entry never keeps
+    (or saves to disk) more than its own elements.
+    """
+    if isinstance(value, torch.Tensor):
+        value = value.detach().to("cpu")
+        if value.untyped_storage().nbytes() != value.numel() * value.element_size():
+            value = value.contiguous().clone()
+        return value
+    if isinstance(value, dict):
+        return {k: _to_cpu(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return tuple(_to_cpu(v) for v in value)
+    if isinstance(value, list):
+        return [_to_cpu(v) for v in value]
+    return value
+
+
+def make_cache_key(*parts: Any) -> str:
+    """Build a stable hex key from strings, bytes and tensors."""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, torch.Tensor):
+            t = part.detach().to("cpu").contiguous()
+            h.update(str(t.dtype).encode())
+            h.update(str(tuple(t.shape)).encode())
+            h.update(t.reshape(-1).view(torch.uint8).numpy().tobytes())
+        elif isinstance(part, bytes):
+            h.update(part)
+        else:
+            h.update(str(part).encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+class TensorLRUCache:
+    """
+    Thread-safe LRU cache for tensor values, capped by entry count and bytes.
+
+    Values are stored on CPU. If ``disk_dir`` is set, every put is also saved as
+    ``<disk_dir>/<key>.pt`` and memory misses fall back to the disk tier.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: int = 256,
+        max_bytes: int = 512 * 1024 * 1024,
+        disk_dir: Optional[str] = None,
+        disk_max_bytes: int = 4 * 1024 * 1024 * 1024,
+    ):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._lock = Lock()
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if disk_dir:
+            try:
+                os.makedirs(disk_dir, exist_ok=True)
+            except Exception as e:
+                logger.warning(f"[TensorLRUCache:{name}] Disk tier disabled, cannot create {disk_dir}: {e}")
+                self.disk_dir = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.pt")
+
+    def _insert(self, key: str, value: Any, size: int) -> None:
+        """Insert under lock and evict least recently used entries over the caps."""
+        if key in self._entries:
+            self._bytes -= self._sizes.pop(key)
+            del self._entries[key]
+        self._entries[key] = value
+        self._sizes[key] = size
+        self._bytes += size
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            old_key, _ = self._entries.popitem(last=False)
+            self._bytes -= self._sizes.pop(old_key)
+            self.evictions += 1
+
+    def __contains__(self, key: str) -> bool:
+        """Membership test that does not touch LRU order or hit/miss counters."""
+        if not self.enabled:
+            return False
+        with self._lock:
+            if key in self._entries:
+                return True
+        return bool(self.disk_dir) and os.path.exists(self._disk_path(key))
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value (CPU tensors) or None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            if os.path.exists(path):
+                try:
+                    value = torch.load(path, map_location="cpu", weights_only=True)
+                    os.utime(path)  # keep disk tier in LRU order by mtime
+                except Exception as e:
+                    logger.warning(f"[TensorLRUCache:{self.name}] Failed to read {path}: {e}")
+                    value = None
+                if value is not None:
+                    size = _nbytes(value)
+                    with self._lock:
+                        self.disk_hits += 1
+                        if size <= self.max_bytes:
+                            self._insert(key, value, size)
+                    return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, value: Any) -> None:
+        """Store a value; tensors are detached and copied to CPU."""
+        if not self.enabled:
+            return
+        value = _to_cpu(value)
+        size = _nbytes(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._insert(key, value, size)
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            if not os.path.exists(path):
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                try:
+                    torch.save(value, tmp_path)
+                    os.replace(tmp_path, path)
+                    self._prune_disk()
+                except Exception as e:
+                    logger.warning(f"[TensorLRUCache:{self.name}] Failed to write {path}: {e}")
+                    try:
+                        os.remove(tmp_path)
+                    except OSError:
+                        pass
+
+    def _prune_disk(self) -> None:
+        """Delete least recently used files until the disk tier fits its budget."""
+        try:
+            files = []
+            total = 0
+            for entry in os.scandir(self.disk_dir):
+                if entry.is_file() and entry.name.endswith(".pt"):
+                    st = entry.stat()
+                    files.append((st.st_mtime, st.st_size, entry.path))
+                    total += st.st_size
+            if total <= self.disk_max_bytes:
+                return
+            for _, size, path in sorted(files):
+                os.remove(path)
+                total -= size
+                if total <= self.disk_max_bytes:
+                    break
+        except Exception as e:
+            logger.warning(f"[TensorLRUCache:{self.name}] Disk prune failed: {e}")
+
+    def clear(self) -> None:
+        """Drop all in-memory entries (the disk tier is kept)."""
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "disk_dir": self.disk_dir,
+            }
@@ -2,6 +2,7 @@
 Test-Time Scaling Module
 Implements perplexity-based scoring for generated audio codes
 """
+import copy
 import torch
 import torch.nn.functional as F
 from typing import Tuple, Optional, Dict, Any, List
@@ -112,6 +113,111 @@ def _get_logits_and_target_for_scoring(llm_handler, formatted_prompt: str,
     return target_logits, target_ids
 
 
+# (prompt, target) rows teacher-forced per forward on top of the prompt caches; each row
+# holds its own copy of its prompt's KV, so this bounds memory for long audio-code prompts
+SCORING_BATCH_SIZE = 4
+
+
+def _score_targets(llm_handler, formatted_prompt: str,
+                   target_texts: List[str]) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+    """
+    Teacher-force several target texts against one prompt, reusing the prompt's KV cache.
+
+    Returns:
+        One (target_logits, target_ids) pair per target, as from _get_logits_and_target_for_scoring.
+    """
+    return _score_targets_batch(llm_handler, [formatted_prompt], target_texts)[0]
+
+
+def _score_targets_batch(llm_handler, formatted_prompts: List[str],
+                         target_texts: List[str]) -> List[List[Tuple[torch.Tensor, torch.Tensor]]]:
+    """
+    Teacher-force every target text against every prompt, running each prompt only once.
+
+    The prompts (thousands of audio code tokens each) run through the model as one
+    left-padded batch; the (prompt, target) pairs are then scored as right-padded
+    batches on top of the prompts' KV cache.
+        
+    Returns:
+        results[p][t]: (target_logits, target_ids) of target t under prompt p.
+    """
+    model = llm_handler.get_hf_model_for_scoring()
+    tokenizer = llm_handler.llm_tokenizer
+    device = llm_handler.device if llm_handler.llm_backend == "pt" else next(model.parameters()).device
+
+    prompt_ids = [tokenizer(prompt, return_tensors="pt", add_special_tokens=True)['input_ids'][0]
+                  for prompt in formatted_prompts]
+
+    results = [[None] * len(target_texts) for _ in formatted_prompts]
+    pending = []  # (prompt index, target index, target token ids)
+    for p, prompt in enumerate(formatted_prompts):
+        prompt_len = prompt_ids[p].shape[0]
+        for t, target_text in enumerate(target_texts):
+            # Tokenize prompt + target together so subword merging matches the single-target path
+            full_ids = tokenizer(prompt + target_text, return_tensors="pt", padding=False,
+                                 truncation=True, add_special_tokens=True)['input_ids'][0]
+            if full_ids.shape[0] <= prompt_len:
+                results[p][t] = (torch.empty(0, device=device), torch.empty(0, device=device))
+            elif torch.equal(full_ids[:prompt_len], prompt_ids[p]):
+                pending.append((p, t, full_ids[prompt_len:]))
+            else:
+                # The target merged into the prompt's last token; score it on its own
+                results[p][t] = _get_logits_and_target_for_scoring(llm_handler, prompt, target_text)
+    if not pending:
+        return results
+
+    # Similar lengths share a batch to keep padding small
+    pending.sort(key=lambda item: item[2].shape[0])
+    pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else 0
+    decoder = model.get_decoder()
+    lm_head = model.get_output_embeddings()
+
+    # Left-pad the prompts so every prompt ends at the same position
+    prompt_lens = [ids.shape[0] for ids in prompt_ids]
+    max_prompt_len = max(prompt_lens)
+    prefix_ids = torch.full((len(prompt_ids), max_prompt_len), pad_id, dtype=torch.long)
+    prefix_mask = torch.zeros((len(prompt_ids), max_prompt_len), dtype=torch.long)
+    for p, ids in enumerate(prompt_ids):
+        prefix_ids[p, max_prompt_len - ids.shape[0]:] = ids
+        prefix_mask[p, max_prompt_len - ids.shape[0]:] = 1
+    prefix_positions = (prefix_mask.cumsum(-1) - 1).clamp_min(0)
+
+    with torch.no_grad():
+        with llm_handler._load_model_context():
+            prefix = model(input_ids=prefix_ids.to(device), attention_mask=prefix_mask.to(device),
+                           position_ids=prefix_positions.to(device), use_cache=True, logits_to_keep=1)
+            first_logits = prefix.logits[:, -1:]  # predicts each prompt's first target token
+            prompt_cache = prefix.past_key_values
+
+            for start in range(0, len(pending), SCORING_BATCH_SIZE):
+                batch = pending[start:start + SCORING_BATCH_SIZE]
+                is_last = start + SCORING_BATCH_SIZE >= len(pending)
+                rows = torch.tensor([p for p, _, _ in batch], device=device)
+                cache = prompt_cache if is_last else copy.deepcopy(prompt_cache)
+                cache.batch_select_indices(rows)
+
+                max_len = max(ids.shape[0] for _, _, ids in batch)
+                input_ids = torch.full((len(batch), max_len), pad_id, dtype=torch.long)
+                target_mask = torch.zeros((len(batch), max_len), dtype=torch.long)
+                for row, (_, _, ids) in enumerate(batch):
+                    input_ids[row, :ids.shape[0]] = ids
+                    target_mask[row, :ids.shape[0]] = 1
+                positions = torch.tensor([prompt_lens[p] for p, _, _ in batch]).unsqueeze(1) + torch.arange(max_len)
+                attention_mask = torch.cat([prefix_mask[rows.cpu()], target_mask], dim=1)
+                # Right padding keeps every target token ahead of the padding
+                hidden = decoder(input_ids=input_ids.to(device), attention_mask=attention_mask.to(device),
+                                 position_ids=positions.to(device), past_key_values=cache,
+                                 use_cache=True).last_hidden_state
+
+                for row, (p, t, ids) in enumerate(batch):
+                    # Project only the real tokens; the last target token predicts nothing
+                    target_logits = torch.cat([first_logits[p], lm_head(hidden[row, :ids.shape[0] - 1])])
+                    results[p][t] = (target_logits, ids.to(device))
+                del cache, hidden
+
+    return results
+
+
 # ==============================================================================
 # Scoring Logic
 # ==============================================================================
@@ -127,7 +233,13 @@ def _calculate_topk_recall(llm_handler,
     """
     # Use the fixed helper to get aligned logits/labels
     pred_logits, target_ids = _get_logits_and_target_for_scoring(llm_handler, formatted_prompt, target_text)
+    return _topk_recall_from_logits(pred_logits, target_ids, topk=topk)
+
 
+def _topk_recall_from_logits(pred_logits: torch.Tensor,
+                             target_ids: torch.Tensor,
+                             topk: int = 10) -> Tuple[float, Dict[int, float]]:
+    """Top-k recall of target_ids under the aligned pred_logits."""
     if target_ids.shape[0] == 0:
         return 0.0, {}
 
@@ -209,7 +321,11 @@ def _calculate_log_prob(
     Calculate average log probability of target text given prompt.
     """
     pred_logits, target_ids = _get_logits_and_target_for_scoring(llm_handler, formatted_prompt, target_text)
+    return _log_prob_from_logits(pred_logits, target_ids)
 
+
+def _log_prob_from_logits(pred_logits: torch.Tensor, target_ids: torch.Tensor) -> float:
+    """Average log probability of target_ids under the aligned pred_logits."""
     if target_ids.shape[0] == 0:
         return float('-inf')
 
@@ -319,6 +435,57 @@ def calculate_reward_score(
 
     return total_score, "\n".join(breakdown_lines)
 
+# Metadata fields scored by top-k recall; caption and lyrics are scored by PMI
+METADATA_RECALL_KEYS = ['bpm', 'duration', 'genres', 'keyscale', 'language', 'timesignature']
+METADATA_PMI_KEYS = ['caption']
+
+
+def _build_scoring_targets(metadata: Optional[Dict[str, Any]],
+                           lyrics: str) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """Target texts to score, as ({recall field: text}, {PMI condition: text})."""
+    recall_targets = {}
+    pmi_targets = {}
+    if metadata and isinstance(metadata, dict):
+        # 1. Recall targets for Metadata Fields
+        for key in METADATA_RECALL_KEYS:
+            if key in metadata and metadata[key] is not None:
+                field_yaml = yaml.dump({key: metadata[key]}, allow_unicode=True, sort_keys=True).strip()
+                recall_targets[key] = f"<think>\n{field_yaml}\n</think>\n"
+
+        # 2. PMI targets for Caption
+        for key in METADATA_PMI_KEYS:
+            if key in metadata and metadata[key] is not None:
+                cot_yaml = yaml.dump({key: metadata[key]}, allow_unicode=True, sort_keys=True).strip()
+                pmi_targets[key] = f"<think>\n{cot_yaml}\n</think>\n"
+
+    # 3. PMI target for Lyrics
+    if lyrics:
+        pmi_targets['lyrics'] = f"<think>\n</think>\n# Lyric\n{lyrics}\n"
+    return recall_targets, pmi_targets
+
+
+def _condition_scores(recall_targets: Dict[str, str],
+                      pmi_targets: Dict[str, str],
+                      cond_scored: List[Tuple[torch.Tensor, torch.Tensor]],
+                      uncond_scored: List[Tuple[torch.Tensor, torch.Tensor]],
+                      topk: int,
+                      score_scale: float) -> Dict[str, float]:
+    """
+    Per-condition scores from scored targets.
+
+    cond_scored holds the recall targets then the PMI targets under the conditional prompt;
+    uncond_scored holds the PMI targets under the unconditional prompt.
+    """
+    scores = {}
+    for key, (pred_logits, target_ids) in zip(recall_targets, cond_scored):
+        scores[key], _ = _topk_recall_from_logits(pred_logits, target_ids, topk=topk)
+        logger.debug(f"Recall for {key}: {scores[key]:.4f}")
+    for key, cond, uncond in zip(pmi_targets, cond_scored[len(recall_targets):], uncond_scored):
+        log_prob_cond = _log_prob_from_logits(*cond)
+        log_prob_uncond = _log_prob_from_logits(*uncond)
+        scores[key] = pmi_to_normalized_score(log_prob_cond - log_prob_uncond, scale=score_scale)
+    return scores
+
 # ==============================================================================
 # Main Public API
 # ==============================================================================
@@ -351,40 +518,11 @@ def calculate_pmi_score_per_condition(
     formatted_prompt = llm_handler.build_formatted_prompt_for_understanding(audio_codes=audio_codes, is_negative_prompt=False)
     prompt_uncond = llm_handler.build_formatted_prompt_for_understanding(audio_codes="NO USER INPUT", is_negative_prompt=False)
     try:
-        # 1. Calculate Recall for Metadata Fields
-        if metadata and isinstance(metadata, dict):
-            scores = {}
-            # Define which fields use which metric
-            metadata_recall_keys = ['bpm', 'duration', 'genres', 'keyscale', 'language', 'timesignature']
-            metadata_pmi_keys = ['caption']
-            for key in metadata_recall_keys:
-                if key in metadata and metadata[key] is not None:
-                    recall_metadata = {key: metadata[key]}
-                    field_scores = _calculate_metadata_recall(llm_handler, formatted_prompt, recall_metadata, topk=topk)
-                    scores.update(field_scores)
-
-            # 2. Calculate PMI for Caption
-            for key in metadata_pmi_keys:
-                if key in metadata and metadata[key] is not None:
-                    cot_yaml = yaml.dump({key: metadata[key]}, allow_unicode=True, sort_keys=True).strip()
-                    target_text = f"<think>\n{cot_yaml}\n</think>\n"
-
-                    log_prob_cond = _calculate_log_prob(llm_handler, formatted_prompt, target_text)
-                    log_prob_uncond = _calculate_log_prob(llm_handler, prompt_uncond, target_text)
-
-                    pmi_normalized = pmi_to_normalized_score(log_prob_cond - log_prob_uncond, scale=score_scale)
-                    scores[key] = pmi_normalized
-
-        # 3. Calculate PMI for Lyrics
-        if lyrics:
-            target_text = f"<think>\n</think>\n# Lyric\n{lyrics}\n"
-
-            log_prob_cond = _calculate_log_prob(llm_handler, formatted_prompt, target_text)
-
-            prompt_uncond = llm_handler.build_formatted_prompt_for_understanding(audio_codes="NO USER INPUT", is_negative_prompt=False)
-            log_prob_uncond = _calculate_log_prob(llm_handler, prompt_uncond, target_text)
-
-            scores['lyrics'] = pmi_to_normalized_score(log_prob_cond - log_prob_uncond, scale=score_scale)
+        recall_targets, pmi_targets = _build_scoring_targets(metadata, lyrics)
+        cond_texts = list(recall_targets.values()) + list(pmi_targets.values())
+        cond_scored = _score_targets(llm_handler, formatted_prompt, cond_texts) if cond_texts else []
+        uncond_scored = _score_targets(llm_handler, prompt_uncond, list(pmi_targets.values())) if pmi_targets else []
+        scores = _condition_scores(recall_targets, pmi_targets, cond_scored, uncond_scored, topk, score_scale)
 
         if not scores:
             return {}, 0.0, "❌ No conditions to evaluate"
@@ -396,7 +534,7 @@ def calculate_pmi_score_per_condition(
         # Status Message
         status_lines = [breakdown_lines, "\n✅ Per-condition scores (0-1):"]
         for key, score in sorted(scores.items()):
-            metric = "Top-k Recall" if key in metadata_recall_keys else "PMI (Norm)"
+            metric = "Top-k Recall" if key in METADATA_RECALL_KEYS else "PMI (Norm)"
             status_lines.append(f"  {key}: {score:.4f} ({metric})")
         status = "\n".join(status_lines)
         logger.info(f"Calculated scores: {global_score:.4f}\n{status}")
@@ -408,3 +546,106 @@ def calculate_pmi_score_per_condition(
         logger.error(error_msg)
         logger.error(traceback.format_exc())
         return {}, float('-inf'), error_msg
+
+
+def score_batch(
+    llm_handler,
+    audio_codes_list: List[str],
+    caption: str = "",
+    lyrics: str = "",
+    metadata: Optional[Dict[str, Any]] = None,
+    topk: int = 10,
+    score_scale: float = 0.1,
+    dit_handler=None,
+    alignment_inputs: Optional[Dict[str, torch.Tensor]] = None,
+    vocal_language: str = "en",
+    inference_steps: int = 8,
+) -> List[Dict[str, Any]]:
+    """
+    Score a batch of candidates generated for the same conditions.
+
+    PMI / top-k recall (as calculate_pmi_score_per_condition) runs the candidates' prompts
+    through the LM in padded batches and the shared unconditional prompt once. Lyric
+    alignment (MusicLyricScorer, see AceStepHandler.get_lyric_scores) runs one DiT pass
+    for the whole batch.
+
+    Args:
+        llm_handler: LLM handler (None or uninitialized skips PMI scoring)
+        audio_codes_list: Audio code string of each candidate ("" skips its PMI scoring)
+        caption, lyrics, metadata: Conditions the candidates were generated for
+        topk, score_scale: As in calculate_pmi_score_per_condition
+        dit_handler: DiT handler for lyric alignment scoring (optional)
+        alignment_inputs: Batched DiT extra outputs: pred_latents, encoder_hidden_states,
+            encoder_attention_mask, context_latents and lyric_token_idss
+        vocal_language: Language code for lyrics header parsing
+        inference_steps: Inference steps used for the candidates
+
+    Returns:
+        One dict per candidate:
+        - scores: Per-condition scores (0-1)
+        - pmi_score: Reward of the per-condition scores (None if not scored)
+        - lm_alignment_score / dit_alignment_score: Lyric alignment scores (None if not scored)
+        - score: Mean of the available scores above, for ranking (None if nothing was scored)
+    """
+    results = [
+        {"scores": {}, "pmi_score": None, "lm_alignment_score": None, "dit_alignment_score": None, "score": None}
+        for _ in audio_codes_list
+    ]
+
+    metadata = dict(metadata or {})
+    if caption and "caption" not in metadata:
+        metadata["caption"] = caption
+    recall_targets, pmi_targets = _build_scoring_targets(metadata, lyrics)
+    cond_texts = list(recall_targets.values()) + list(pmi_targets.values())
+    scorable = [i for i, codes in enumerate(audio_codes_list) if codes and codes.strip()]
+
+    # 1. PMI / recall for candidates with audio codes
+    if llm_handler is not None and llm_handler.llm_initialized and scorable and cond_texts:
+        try:
+            uncond_scored = []
+            if pmi_targets:
+                prompt_uncond = llm_handler.build_formatted_prompt_for_understanding(
+                    audio_codes="NO USER INPUT", is_negative_prompt=False)
+                uncond_scored = _score_targets(llm_handler, prompt_uncond, list(pmi_targets.values()))
+            # Candidates are prefilled SCORING_BATCH_SIZE at a time to bound the prompt KV cache
+            for start in range(0, len(scorable), SCORING_BATCH_SIZE):
+                chunk = scorable[start:start + SCORING_BATCH_SIZE]
+                prompts = [
+                    llm_handler.build_formatted_prompt_for_understanding(
+                        audio_codes=audio_codes_list[i], is_negative_prompt=False)
+                    for i in chunk
+                ]
+                for i, cond_scored in zip(chunk, _score_targets_batch(llm_handler, prompts, cond_texts)):
+                    scores = _condition_scores(recall_targets, pmi_targets, cond_scored, uncond_scored,
+                                               topk, score_scale)
+                    results[i]["scores"] = scores
+                    results[i]["pmi_score"], _ = calculate_reward_score(scores)
+        except Exception:
+            logger.exception("[score_batch] PMI scoring failed")
+
+    # 2. Lyric alignment for the whole batch
+    if dit_handler is not None and alignment_inputs and lyrics and lyrics.strip():
+        try:
+            alignments = dit_handler.get_lyric_scores(
+                pred_latent=alignment_inputs["pred_latents"],
+                encoder_hidden_states=alignment_inputs["encoder_hidden_states"],
+                encoder_attention_mask=alignment_inputs["encoder_attention_mask"],
+                context_latents=alignment_inputs["context_latents"],
+                lyric_token_ids=alignment_inputs["lyric_token_idss"],
+                vocal_language=vocal_language or "en",
+                inference_steps=int(inference_steps),
+                seed=42,
+            )
+            for result, alignment in zip(results, alignments):
+                if alignment.get("success"):
+                    result["lm_alignment_score"] = float(alignment["lm_score"])
+                    result["dit_alignment_score"] = float(alignment["dit_score"])
+        except Exception:
+            logger.exception("[score_batch] Alignment scoring failed")
+
+    for result in results:
+        available = [result[key] for key in ("pmi_score", "lm_alignment_score", "dit_alignment_score")
+                     if result[key] is not None]
+        if available:
+            result["score"] = sum(available) / len(available)
+    return results
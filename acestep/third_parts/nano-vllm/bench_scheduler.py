@@ -0,0 +1,81 @@
+"""
+CPU benchmark for Scheduler / BlockManager bookkeeping.
+
+Drives the scheduler with thousands of synthetic CFG pairs (no model, no GPU)
+and reports the scheduling overhead per step for several max_num_seqs values.
+
+Usage:
+    python bench_scheduler.py [--num-requests 2048] [--max-num-seqs 64,256,512] [--num-blocks 16384]
+"""
+import argparse
+import time
+from random import randint, seed
+from types import SimpleNamespace
+
+from nanovllm import SamplingParams
+from nanovllm.engine.scheduler import Scheduler
+from nanovllm.engine.sequence import Sequence
+
+
+def add_requests(scheduler, num_requests, max_input_len, max_output_len, cfg):
+    # Same layout as LLMEngine.add_request: conditional first, unconditional paired to it
+    template = [randint(0, 10000) for _ in range(300)]
+    for _ in range(num_requests):
+        prompt = template + [randint(0, 10000) for _ in range(randint(1, max_input_len))]
+        sp = SamplingParams(ignore_eos=True, max_tokens=randint(1, max_output_len), cfg_scale=2.0 if cfg else 1.0)
+        if cfg:
+            uncond_seq = Sequence(template + [0], sp, is_unconditional=True)
+            cond_seq = Sequence(prompt, sp, conditional_seq=uncond_seq)
+            uncond_seq.paired_seq = cond_seq
+            scheduler.add(cond_seq)
+            scheduler.add(uncond_seq)
+        else:
+            scheduler.add(Sequence(prompt, sp))
+
+
+def run(args, max_num_seqs):
+    seed(0)
+    config = SimpleNamespace(
+        max_num_seqs=max_num_seqs,
+        max_num_batched_tokens=args.max_num_batched_tokens,
+        eos=-1,
+        num_kvcache_blocks=args.num_blocks,
+        kvcache_block_size=Sequence.block_size,
+        max_pinned_prefix_blocks=-1,
+        max_model_len=4096,
+        draft_model=None,
+        num_speculative_tokens=0,
+    )
+    scheduler = Scheduler(config)
+    add_requests(scheduler, args.num_requests, args.max_input_len, args.max_output_len, not args.no_cfg)
+
+    steps = 0
+    elapsed = 0.
+    while not scheduler.is_finished():
+        t = time.perf_counter()
+        seqs, _ = scheduler.schedule()
+        num_sampled = len(seqs) // 2 if seqs[0].cfg_scale > 1.0 else len(seqs)
+        scheduler.postprocess(seqs, [1] * num_sampled)
+        elapsed += time.perf_counter() - t
+        steps += 1
+    return steps, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--num-requests", type=int, default=2048)
+    parser.add_argument("--max-num-seqs", type=str, default="64,256,512")
+    parser.add_argument("--max-num-batched-tokens", type=int, default=16384)
+    parser.add_argument("--num-blocks", type=int, default=16384)
+    parser.add_argument("--max-input-len", type=int, default=512)
+    parser.add_argument("--max-output-len", type=int, default=256)
+    parser.add_argument("--no-cfg", action="store_true")
+    args = parser.parse_args()
+
+    for max_num_seqs in map(int, args.max_num_seqs.split(",")):
+        steps, elapsed = run(args, max_num_seqs)
+        print(f"max_num_seqs={max_num_seqs}: {steps} steps, {elapsed:.2f}s, {elapsed / steps * 1e6:.1f}us/step")
+
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,11 @@ class Config:
     eos: int = -1
     kvcache_block_size: int = 256
     num_kvcache_blocks: int = -1
+    max_pinned_prefix_blocks: int = -1
+    # Speculative decoding: a smaller LM sharing the tokenizer drafts tokens for the model to verify
+    draft_model: str | None = None
+    num_speculative_tokens: int = 4
+    draft_hf_config: AutoConfig | None = None
 
     def __post_init__(self):
         assert os.path.isdir(self.model)
@@ -24,3 +29,9 @@ class Config:
         self.hf_config = AutoConfig.from_pretrained(self.model)
         self.max_model_len = min(self.max_model_len, self.hf_config.max_position_embeddings)
         assert self.max_num_batched_tokens >= self.max_model_len
+        if self.draft_model:
+            assert os.path.isdir(self.draft_model)
+            assert self.tensor_parallel_size == 1, "speculative decoding requires tensor_parallel_size == 1"
+            assert self.num_speculative_tokens >= 1
+            self.draft_hf_config = AutoConfig.from_pretrained(self.draft_model)
+            assert self.draft_hf_config.vocab_size == self.hf_config.vocab_size, "draft model must share the vocabulary"
@@ -1,4 +1,4 @@
-from collections import deque
+from collections import OrderedDict
 import xxhash
 import numpy as np
 
@@ -25,12 +25,19 @@ class Block:
 
 class BlockManager:
 
-    def __init__(self, num_blocks: int, block_size: int):
+    def __init__(self, num_blocks: int, block_size: int, max_pinned_blocks: int = 0):
         self.block_size = block_size
         self.blocks: list[Block] = [Block(i) for i in range(num_blocks)]
         self.hash_to_block_id: dict[int, int] = dict()
-        self.free_block_ids: deque[int] = deque(range(num_blocks))
+        # Free list in release order; OrderedDict gives O(1) removal of an arbitrary block
+        self.free_block_ids: OrderedDict[int, None] = OrderedDict.fromkeys(range(num_blocks))
         self.used_block_ids: set[int] = set()
+        # Hot prefix blocks kept alive by an extra reference after their sequences finish,
+        # in LRU order (hash -> block_id). Released when free blocks run out.
+        self.max_pinned_blocks = max_pinned_blocks
+        self.pinned: OrderedDict[int, int] = OrderedDict()
+        # Block hashes requested through pin_prefix, pinned when first allocated
+        self.pin_requests: OrderedDict[int, None] = OrderedDict()
 
     @classmethod
     def compute_hash(cls, token_ids: list[int], prefix: int = -1):
@@ -44,17 +51,60 @@ class BlockManager:
         block = self.blocks[block_id]
         assert block.ref_count == 0
         block.reset()
-        self.free_block_ids.remove(block_id)
+        del self.free_block_ids[block_id]
         self.used_block_ids.add(block_id)
         return self.blocks[block_id]
 
     def _deallocate_block(self, block_id: int) -> Block:
         assert self.blocks[block_id].ref_count == 0
         self.used_block_ids.remove(block_id)
-        self.free_block_ids.append(block_id)
+        self.free_block_ids[block_id] = None
+
+    def _pin(self, block: Block):
+        if block.hash in self.pinned:
+            self.pinned.move_to_end(block.hash)
+            return
+        if len(self.pinned) >= self.max_pinned_blocks:
+            self._unpin(next(iter(self.pinned)))
+        block.ref_count += 1
+        self.pinned[block.hash] = block.block_id
+
+    def _unpin(self, h: int):
+        block_id = self.pinned.pop(h)
+        block = self.blocks[block_id]
+        block.ref_count -= 1
+        if block.ref_count == 0:
+            if self.hash_to_block_id.get(block.hash) == block_id:
+                del self.hash_to_block_id[block.hash]
+            self._deallocate_block(block_id)
+
+    def pin_prefix(self, token_ids: list[int]):
+        """Keep the full blocks of this prefix cached once a sequence has allocated them."""
+        h = -1
+        for i in range(len(token_ids) // self.block_size):
+            h = self.compute_hash(token_ids[i*self.block_size: (i+1)*self.block_size], h)
+            self.pin_requests[h] = None
+            self.pin_requests.move_to_end(h)
+        while len(self.pin_requests) > self.max_pinned_blocks:
+            self.pin_requests.popitem(last=False)
+
+    def unpin_all(self):
+        while self.pinned:
+            self._unpin(next(iter(self.pinned)))
+
+    def make_room(self, num_blocks: int) -> bool:
+        """Return whether num_blocks are free, releasing idle pinned blocks (LRU first) if needed."""
+        if len(self.free_block_ids) >= num_blocks:
+            return True
+        for h, block_id in list(self.pinned.items()):
+            if self.blocks[block_id].ref_count == 1:
+                self._unpin(h)
+                if len(self.free_block_ids) >= num_blocks:
+                    return True
+        return False
 
     def can_allocate(self, seq: Sequence) -> bool:
-        return len(self.free_block_ids) >= seq.num_blocks
+        return self.make_room(seq.num_blocks)
 
     def allocate(self, seq: Sequence):
         assert not seq.block_table
@@ -64,10 +114,12 @@ class BlockManager:
             token_ids = seq.block(i)
             h = self.compute_hash(token_ids, h) if len(token_ids) == self.block_size else -1
             block_id = self.hash_to_block_id.get(h, -1)
-            if block_id == -1 or self.blocks[block_id].token_ids != token_ids:
+            # The last block is always recomputed so a fully cached sequence (e.g. a
+            # preempted one ending on a block boundary) still has a token to prefill
+            if block_id == -1 or self.blocks[block_id].token_ids != token_ids or i == seq.num_blocks - 1:
                 cache_miss = True
             if cache_miss:
-                block_id = self.free_block_ids[0]
+                block_id = next(iter(self.free_block_ids))
                 block = self._allocate_block(block_id)
             else:
                 seq.num_cached_tokens += self.block_size
@@ -79,6 +131,9 @@ class BlockManager:
             if h != -1:
                 block.update(h, token_ids)
                 self.hash_to_block_id[h] = block_id
+                # Blocks reused by a second sequence or requested via pin_prefix are hot
+                if self.max_pinned_blocks > 0 and (not cache_miss or h in self.pin_requests):
+                    self._pin(block)
             seq.block_table.append(block_id)
 
     def deallocate(self, seq: Sequence):
@@ -93,27 +148,43 @@ class BlockManager:
                     cached_id = self.hash_to_block_id.get(block.hash)
                     if cached_id == block_id:
                         del self.hash_to_block_id[block.hash]
+                        if block.hash in self.pinned:
+                            # A pinned duplicate of this block still holds the same KV
+                            self.hash_to_block_id[block.hash] = self.pinned[block.hash]
                 self._deallocate_block(block_id)
         seq.num_cached_tokens = 0
         seq.block_table.clear()
 
-    def can_append(self, seq: Sequence) -> bool:
-        return len(self.free_block_ids) >= (len(seq) % self.block_size == 1)
+    def num_new_blocks(self, seq: Sequence, num_lookahead: int = 0) -> int:
+        """Blocks to add so the block table covers the sequence plus num_lookahead more tokens."""
+        num_blocks = (len(seq) + num_lookahead + self.block_size - 1) // self.block_size
+        return max(0, num_blocks - len(seq.block_table))
+
+    def can_append(self, seq: Sequence, num_lookahead: int = 0) -> bool:
+        return self.make_room(self.num_new_blocks(seq, num_lookahead))
 
-    def may_append(self, seq: Sequence):
+    def may_append(self, seq: Sequence, num_lookahead: int = 0):
+        """Hash the blocks filled since the last step and reserve blocks for the next tokens.
+
+        num_lookahead extra token slots are reserved for speculative decoding, whose steps
+        write KV past the sequence end and may append several tokens at once.
+        """
         block_table = seq.block_table
-        last_block = self.blocks[block_table[-1]]
-        if len(seq) % self.block_size == 1:
-            assert last_block.hash != -1
-            block_id = self.free_block_ids[0]
+        num_tokens = len(seq)
+        num_full_blocks = num_tokens // self.block_size
+        if num_full_blocks and self.blocks[block_table[num_full_blocks - 1]].hash == -1:
+            first = num_full_blocks - 1
+            while first > 0 and self.blocks[block_table[first - 1]].hash == -1:
+                first -= 1
+            for i in range(first, num_full_blocks):
+                block = self.blocks[block_table[i]]
+                token_ids = seq.block(i)
+                prefix = self.blocks[block_table[i - 1]].hash if i > 0 else -1
+                h = self.compute_hash(token_ids, prefix)
+                block.update(h, token_ids)
+                self.hash_to_block_id[h] = block.block_id
+        num_blocks = (num_tokens + num_lookahead + self.block_size - 1) // self.block_size
+        while len(block_table) < num_blocks:
+            block_id = next(iter(self.free_block_ids))
             self._allocate_block(block_id)
             block_table.append(block_id)
-        elif len(seq) % self.block_size == 0:
-            assert last_block.hash == -1
-            token_ids = seq.block(seq.num_blocks-1)
-            prefix = self.blocks[block_table[-2]].hash if len(block_table) > 1 else -1
-            h = self.compute_hash(token_ids, prefix)
-            last_block.update(h, token_ids)
-            self.hash_to_block_id[h] = last_block.block_id
-        else:
-            assert last_block.hash == -1
@@ -1,5 +1,10 @@
+import asyncio
 import atexit
+import queue
+import threading
+from concurrent.futures import Future, InvalidStateError
 from dataclasses import fields
+from typing import AsyncIterator, Callable, Iterator
 from time import perf_counter
 from tqdm.auto import tqdm
 from transformers import AutoTokenizer
@@ -12,6 +17,18 @@ from nanovllm.engine.scheduler import Scheduler
 from nanovllm.engine.model_runner import ModelRunner
 
 
+class _EngineRequest:
+    """A submit() call tracked by the engine loop."""
+
+    def __init__(self, future: Future, items: list, on_event: Callable[[dict], None] | None):
+        self.future = future
+        self.items = items  # (prompt token ids, sampling params, unconditional prompt) per prompt
+        self.on_event = on_event
+        # seq_id -> [prompt index, sequence, number of token ids emitted, detokenizer offsets]
+        self.states = {}
+        self.outputs = [None] * len(items)
+
+
 class LLMEngine:
 
     def __init__(self, model, **kwargs):
@@ -35,9 +52,12 @@ class LLMEngine:
             self.tokenizer = AutoTokenizer.from_pretrained(config.model, use_fast=True)
         config.eos = self.tokenizer.eos_token_id
         self.scheduler = Scheduler(config)
+        self._loop_thread = None
+        self._loop_queue = queue.Queue()
         atexit.register(self.exit)
 
     def exit(self):
+        self.stop_loop()
         self.model_runner.call("exit")
         del self.model_runner
         for p in self.ps:
@@ -67,9 +87,23 @@ class LLMEngine:
             # Add both sequences to scheduler
             self.scheduler.add(cond_seq)
             self.scheduler.add(uncond_seq)
-        else:
-            seq = Sequence(prompt, sampling_params)
-            self.scheduler.add(seq)
+            return cond_seq
+        seq = Sequence(prompt, sampling_params)
+        self.scheduler.add(seq)
+        return seq
+
+    def pin_prefix(self, prompt: str | list[int]):
+        """Keep the KV blocks of a shared prompt prefix cached across requests.
+
+        Only whole KV blocks are pinned; the blocks are kept after the first
+        sequence using them finishes and are released when memory runs out.
+        """
+        if isinstance(prompt, str):
+            prompt = self.tokenizer.encode(prompt)
+        if self._outside_loop():
+            self._loop_queue.put(lambda: self.scheduler.block_manager.pin_prefix(prompt))
+            return
+        self.scheduler.block_manager.pin_prefix(prompt)
 
     def step(self):
         seqs, is_prefill = self.scheduler.schedule()
@@ -78,9 +112,23 @@ class LLMEngine:
         # Only output conditional sequences (unconditional sequences are just for CFG computation)
         output_seqs = [seq for seq in seqs if seq.is_finished and (seq.cfg_scale <= 1.0 or not seq.is_unconditional)]
         outputs = [(seq.seq_id, seq.completion_token_ids) for seq in output_seqs]
-        num_tokens = sum(len(seq) for seq in seqs) if is_prefill else -len([s for s in seqs if not s.is_unconditional])
+        # Speculative decode steps return several tokens per sequence
+        num_tokens = sum(len(seq) for seq in seqs) if is_prefill else -sum(len(t) if isinstance(t, list) else 1 for t in token_ids)
         return outputs, num_tokens
 
+    @property
+    def speculative_stats(self) -> dict | None:
+        """Draft acceptance of speculative decoding (None without a draft model)."""
+        runner = self.model_runner
+        if runner.draft_model is None:
+            return None
+        return {
+            "acceptance_rate": runner.acceptance_rate,
+            "num_draft_tokens": runner.num_draft_tokens,
+            "num_accepted_tokens": runner.num_accepted_tokens,
+            "mean_acceptance_rate": runner.num_accepted_tokens / max(1, runner.num_draft_tokens),
+        }
+
     def is_finished(self):
         return self.scheduler.is_finished()
 
@@ -89,18 +137,26 @@ class LLMEngine:
         Reset the scheduler state and release all allocated blocks.
         This should be called when an exception occurs during generation to prevent
         KV cache block leaks that can cause 'deque index out of range' errors.
+        While the engine loop runs it owns the scheduler and recovers from its own
+        errors, so calls from other threads are ignored.
         """
+        if self._outside_loop():
+            return
         # Deallocate all running sequences
         while self.scheduler.running:
-            seq = self.scheduler.running.popleft()
+            _, seq = self.scheduler.running.popitem(last=False)
             if seq.block_table:  # Only deallocate if blocks are allocated
                 self.scheduler.block_manager.deallocate(seq)
         
         # Deallocate all waiting sequences (they might have blocks from preemption)
         while self.scheduler.waiting:
-            seq = self.scheduler.waiting.popleft()
+            _, seq = self.scheduler.waiting.popitem(last=False)
             if seq.block_table:
                 self.scheduler.block_manager.deallocate(seq)
+        self.scheduler.waiting_by_prefix.clear()
+
+        # Pinned blocks may have been allocated for a prefill that never ran
+        self.scheduler.block_manager.unpin_all()
 
     def generate(
         self,
@@ -109,6 +165,8 @@ class LLMEngine:
         use_tqdm: bool = True,
         unconditional_prompts: list[str] | list[list[int]] | None = None,
     ) -> list[str]:
+        if self._outside_loop():
+            return self.submit(prompts, sampling_params, unconditional_prompts).result()
         # Clean up any residual state from previous interrupted generations
         # This prevents 'deque index out of range' errors from accumulated block leaks
         if not self.is_finished():
@@ -133,10 +191,14 @@ class LLMEngine:
                         prefill_throughput = num_tokens / (perf_counter() - t)
                     else:
                         decode_throughput = -num_tokens / (perf_counter() - t)
-                    pbar.set_postfix({
+                    postfix = {
                         "Prefill": f"{int(prefill_throughput)}tok/s",
                         "Decode": f"{int(decode_throughput)}tok/s",
-                    })
+                        "Prefix hit": f"{self.scheduler.prefix_hit_rate:.0%}",
+                    }
+                    if self.model_runner.draft_model is not None:
+                        postfix["Accept"] = f"{self.model_runner.acceptance_rate:.0%}"
+                    pbar.set_postfix(postfix)
                 for seq_id, token_ids in output:
                     outputs[seq_id] = token_ids
                     if use_tqdm:
@@ -152,3 +214,244 @@ class LLMEngine:
         outputs = [outputs[seq_id] for seq_id in sorted(outputs.keys())]
         outputs = [{"text": self.tokenizer.decode(token_ids), "token_ids": token_ids} for token_ids in outputs]
         return outputs
+
+    def _decode_delta(self, token_ids: list[int], offsets: list[int], final: bool = False) -> str:
+        # Incremental detokenization: re-decode from the last safe boundary and emit the
+        # new suffix. Text ending in an incomplete UTF-8 sequence is held back until a
+        # later token completes it. offsets = [prefix_offset, read_offset], updated in place.
+        prefix_offset, read_offset = offsets
+        prefix_text = self.tokenizer.decode(token_ids[prefix_offset:read_offset])
+        new_text = self.tokenizer.decode(token_ids[prefix_offset:])
+        if len(new_text) <= len(prefix_text) or (new_text.endswith("\ufffd") and not final):
+            return ""
+        offsets[0], offsets[1] = read_offset, len(token_ids)
+        return new_text[len(prefix_text):]
+
+    def _poll_events(self, states: dict, decode_text: bool = True) -> list[dict]:
+        # New-token events for the tracked sequences since the last poll; finished
+        # sequences are dropped from `states` after their final event
+        events = []
+        for seq_id, state in list(states.items()):
+            index, seq, num_emitted, offsets = state
+            token_ids = seq.completion_token_ids
+            if len(token_ids) == num_emitted and not seq.is_finished:
+                continue
+            state[2] = len(token_ids)
+            if seq.is_finished:
+                del states[seq_id]
+            events.append({
+                "index": index,
+                "token_ids": token_ids[num_emitted:],
+                "text": self._decode_delta(token_ids, offsets, final=seq.is_finished) if decode_text else "",
+                "finished": seq.is_finished,
+            })
+        return events
+
+    def generate_stream(
+        self,
+        prompts: list[str] | list[list[int]],
+        sampling_params: SamplingParams | list[SamplingParams],
+        unconditional_prompts: list[str] | list[list[int]] | None = None,
+    ) -> Iterator[dict]:
+        """Like generate(), but yield each sequence's new tokens after every step.
+
+        Each event is a dict with the prompt ``index``, the new ``token_ids``, the
+        detokenized ``text`` delta and ``finished``. The last event of a sequence has
+        ``finished=True``; joining its ``text`` deltas gives the generate() text.
+        Closing the iterator early aborts the remaining sequences.
+        """
+        if self._outside_loop():
+            yield from self._stream_from_loop(prompts, sampling_params, unconditional_prompts)
+            return
+        if not self.is_finished():
+            self.reset()
+        if not isinstance(sampling_params, list):
+            sampling_params = [sampling_params] * len(prompts)
+        if unconditional_prompts is None:
+            unconditional_prompts = [None] * len(prompts)
+        # seq_id -> [prompt index, sequence, number of token ids emitted, detokenizer offsets]
+        active = {}
+        for index, (prompt, sp, uncond_prompt) in enumerate(zip(prompts, sampling_params, unconditional_prompts)):
+            seq = self.add_request(prompt, sp, uncond_prompt)
+            active[seq.seq_id] = [index, seq, 0, [0, 0]]
+        try:
+            while not self.is_finished():
+                self.step()
+                yield from self._poll_events(active)
+        except BaseException:
+            # Also reached through GeneratorExit when the consumer stops early
+            self.reset()
+            raise
+
+    def _stream_from_loop(self, prompts, sampling_params, unconditional_prompts) -> Iterator[dict]:
+        events = queue.Queue()
+        future = self.submit(prompts, sampling_params, unconditional_prompts, on_event=events.put)
+        # The loop emits every event before resolving the future, so None comes last
+        future.add_done_callback(lambda _: events.put(None))
+        try:
+            while (event := events.get()) is not None:
+                yield event
+        finally:
+            future.cancel()
+        future.result()
+
+    # ---- Engine loop: one thread owns the scheduler and batches every submitted request ----
+
+    @property
+    def loop_running(self) -> bool:
+        return self._loop_thread is not None
+
+    def _outside_loop(self) -> bool:
+        return self._loop_thread is not None and threading.current_thread() is not self._loop_thread
+
+    def start_loop(self):
+        """Start the engine loop thread.
+
+        While it runs, generate(), generate_stream() and submit() from any thread queue
+        their sequences to the loop, which keeps stepping all of them in shared batches
+        (e.g. one request's CoT phase decodes alongside another's audio-code phase).
+        """
+        if self._loop_thread is not None:
+            return
+        if not self.is_finished():
+            self.reset()
+        self._loop_thread = threading.Thread(target=self._engine_loop, name="nanovllm-engine", daemon=True)
+        self._loop_thread.start()
+
+    def stop_loop(self):
+        """Stop the engine loop; requests still in flight fail with RuntimeError."""
+        if self._loop_thread is None:
+            return
+        self._loop_queue.put(None)
+        self._loop_thread.join()
+        self._loop_thread = None
+
+    def submit(
+        self,
+        prompts: list[str] | list[list[int]],
+        sampling_params: SamplingParams | list[SamplingParams],
+        unconditional_prompts: list[str] | list[list[int]] | None = None,
+        on_event: Callable[[dict], None] | None = None,
+    ) -> Future:
+        """Queue prompts on the engine loop.
+
+        Returns a Future resolving to the generate() outputs. If on_event is given it is
+        called from the loop thread with every generate_stream() event of these prompts.
+        Cancelling the future aborts the prompts' sequences.
+        """
+        if self._loop_thread is None:
+            raise RuntimeError("Engine loop is not running; call start_loop() first")
+        if not isinstance(sampling_params, list):
+            sampling_params = [sampling_params] * len(prompts)
+        if unconditional_prompts is None:
+            unconditional_prompts = [None] * len(prompts)
+        encode = lambda p: self.tokenizer.encode(p) if isinstance(p, str) else p
+        items = [
+            (encode(prompt), sp, None if uncond is None else encode(uncond))
+            for prompt, sp, uncond in zip(prompts, sampling_params, unconditional_prompts)
+        ]
+        future = Future()
+        self._loop_queue.put(_EngineRequest(future, items, on_event))
+        return future
+
+    @staticmethod
+    def _resolve(future: Future, result=None, exception: BaseException | None = None):
+        # The caller may have cancelled the future in the meantime
+        try:
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+        except InvalidStateError:
+            pass
+
+    def _poll_request(self, request: _EngineRequest):
+        for index, seq, _, _ in request.states.values():
+            if seq.is_finished:
+                request.outputs[index] = seq.completion_token_ids
+        events = self._poll_events(request.states, decode_text=request.on_event is not None)
+        if request.on_event is not None:
+            try:
+                for event in events:
+                    request.on_event(event)
+            except Exception as e:
+                for _, seq, _, _ in request.states.values():
+                    self.scheduler.abort(seq)
+                request.states.clear()
+                self._resolve(request.future, exception=e)
+                return
+        if not request.states:
+            self._resolve(request.future, [
+                {"text": self.tokenizer.decode(token_ids), "token_ids": token_ids}
+                for token_ids in request.outputs
+            ])
+
+    def _engine_loop(self):
+        requests: list[_EngineRequest] = []
+        while True:
+            # Block for new work only while idle, otherwise just drain the queue
+            items = [self._loop_queue.get()] if not requests else []
+            while True:
+                try:
+                    items.append(self._loop_queue.get_nowait())
+                except queue.Empty:
+                    break
+            for item in items:
+                if item is None:
+                    error = RuntimeError("Engine loop stopped")
+                    for request in requests:
+                        self._resolve(request.future, exception=error)
+                    self.reset()
+                    return
+                if not isinstance(item, _EngineRequest):
+                    item()
+                    continue
+                try:
+                    for index, (prompt, sp, uncond_prompt) in enumerate(item.items):
+                        seq = self.add_request(prompt, sp, uncond_prompt)
+                        item.states[seq.seq_id] = [index, seq, 0, [0, 0]]
+                except Exception as e:
+                    for _, seq, _, _ in item.states.values():
+                        self.scheduler.abort(seq)
+                    self._resolve(item.future, exception=e)
+                    continue
+                requests.append(item)
+
+            for request in requests:
+                if request.future.cancelled():
+                    for _, seq, _, _ in request.states.values():
+                        self.scheduler.abort(seq)
+                    request.states.clear()
+            requests = [request for request in requests if not request.future.cancelled()]
+            if not self.is_finished():
+                try:
+                    self.step()
+                except Exception as e:
+                    for request in requests:
+                        self._resolve(request.future, exception=e)
+                    requests = []
+                    self.reset()
+
+            for request in requests:
+                self._poll_request(request)
+            requests = [request for request in requests if request.states]
+
+    async def generate_stream_async(
+        self,
+        prompts: list[str] | list[list[int]],
+        sampling_params: SamplingParams | list[SamplingParams],
+        unconditional_prompts: list[str] | list[list[int]] | None = None,
+    ) -> AsyncIterator[dict]:
+        """Async variant of generate_stream(); engine steps run in a worker thread."""
+        events = self.generate_stream(prompts, sampling_params, unconditional_prompts)
+        done = object()
+        try:
+            while (event := await asyncio.to_thread(next, events, done)) is not done:
+                yield event
+        finally:
+            try:
+                events.close()
+            except ValueError:
+                # Cancelled while a step is still running in the worker thread; the
+                # next generate call resets the engine
+                pass
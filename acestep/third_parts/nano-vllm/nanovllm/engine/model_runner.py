@@ -8,7 +8,7 @@ import sys
 from nanovllm.config import Config
 from nanovllm.engine.sequence import Sequence
 from nanovllm.models.qwen3 import Qwen3ForCausalLM
-from nanovllm.layers.sampler import Sampler
+from nanovllm.layers.sampler import Sampler, compute_probs, sample_from_probs
 from nanovllm.utils.context import set_context, get_context, reset_context
 from nanovllm.utils.loader import load_model
 
@@ -90,6 +90,16 @@ class ModelRunner:
         torch.set_default_device("cuda")
         self.model = Qwen3ForCausalLM(hf_config)
         load_model(self.model, config.model)
+        # Draft LM for speculative decoding. It runs on every forward of the model so its KV
+        # cache, laid out on the same blocks and slots, always covers the same tokens.
+        self.draft_model = None
+        if config.draft_model:
+            self.draft_model = Qwen3ForCausalLM(config.draft_hf_config)
+            load_model(self.draft_model, config.draft_model)
+        # Speculative decoding statistics: last step and running totals
+        self.acceptance_rate = 0.0
+        self.num_draft_tokens = 0
+        self.num_accepted_tokens = 0
         self.sampler = Sampler()
         
         # Pre-allocate buffers for sampling (optimization: avoid repeated tensor creation)
@@ -145,6 +155,9 @@ class ModelRunner:
         # Pre-allocate buffer for sequence token IDs (used in logits processor and sampler)
         # Max length is max_model_len since sequences can be that long
         self._seq_token_ids_buffer = torch.zeros(max_bs, self.config.max_model_len, dtype=torch.int64, device="cpu", pin_memory=True)
+        
+        # (host ids, device ids) of the last restricted vocabulary, reused across decode steps
+        self._vocab_ids_cache = None
 
     def exit(self):
         if self.world_size > 1:
@@ -154,6 +167,8 @@ class ModelRunner:
                 self.shm.unlink()
         if not self.enforce_eager:
             del self.graphs, self.graph_pool
+            if self.draft_model is not None:
+                del self.draft_graphs
         torch.cuda.synchronize()
         dist.destroy_process_group()
 
@@ -201,9 +216,12 @@ class ModelRunner:
         hf_config = config.hf_config
         free, total = torch.cuda.mem_get_info()
         current = torch.cuda.memory_stats()["allocated_bytes.all.current"]
-        num_kv_heads = hf_config.num_key_value_heads // self.world_size
-        head_dim = getattr(hf_config, "head_dim", hf_config.hidden_size // hf_config.num_attention_heads)
+        num_kv_heads, head_dim = self._kv_layout(hf_config)
         block_bytes = 2 * hf_config.num_hidden_layers * self.block_size * num_kv_heads * head_dim * self.dtype.itemsize
+        if self.draft_model is not None:
+            # Every block also holds the draft model's KV for the same tokens
+            draft_kv_heads, draft_head_dim = self._kv_layout(config.draft_hf_config)
+            block_bytes += 2 * config.draft_hf_config.num_hidden_layers * self.block_size * draft_kv_heads * draft_head_dim * self.dtype.itemsize
         
         # Calculate available memory for KV cache
         # After warmup_model, empty_cache has been called, so current represents model memory only
@@ -232,11 +250,23 @@ class ModelRunner:
             f"target: {target_total_usage / 1024**3:.2f} GB, block: {block_bytes / 1024**2:.2f} MB)"
         )
         self.kv_cache = torch.empty(2, hf_config.num_hidden_layers, config.num_kvcache_blocks, self.block_size, num_kv_heads, head_dim)
+        self._bind_kv_cache(self.model, self.kv_cache)
+        if self.draft_model is not None:
+            self.draft_kv_cache = torch.empty(2, config.draft_hf_config.num_hidden_layers, config.num_kvcache_blocks, self.block_size, draft_kv_heads, draft_head_dim)
+            self._bind_kv_cache(self.draft_model, self.draft_kv_cache)
+
+    def _kv_layout(self, hf_config) -> tuple[int, int]:
+        num_kv_heads = hf_config.num_key_value_heads // self.world_size
+        head_dim = getattr(hf_config, "head_dim", hf_config.hidden_size // hf_config.num_attention_heads)
+        return num_kv_heads, head_dim
+
+    @staticmethod
+    def _bind_kv_cache(model, kv_cache: torch.Tensor):
         layer_id = 0
-        for module in self.model.modules():
+        for module in model.modules():
             if hasattr(module, "k_cache") and hasattr(module, "v_cache"):
-                module.k_cache = self.kv_cache[0, layer_id]
-                module.v_cache = self.kv_cache[1, layer_id]
+                module.k_cache = kv_cache[0, layer_id]
+                module.v_cache = kv_cache[1, layer_id]
                 layer_id += 1
 
     def prepare_block_tables(self, seqs: list[Sequence]):
@@ -283,16 +313,22 @@ class ModelRunner:
         set_context(True, cu_seqlens_q, cu_seqlens_k, max_seqlen_q, max_seqlen_k, slot_mapping, None, block_tables)
         return input_ids, positions
 
-    def prepare_decode(self, seqs: list[Sequence]):
-        """Optimized decode preparation using pre-allocated buffers."""
+    def prepare_decode(self, seqs: list[Sequence], offset: int = 0, input_ids: list[int] | None = None):
+        """Optimized decode preparation using pre-allocated buffers.
+
+        Speculative drafting decodes ``offset`` positions past each sequence's last token,
+        feeding ``input_ids`` (one per sequence) instead of the last tokens.
+        """
         bs = len(seqs)
         
         # Use pre-allocated CPU buffers
         for i, seq in enumerate(seqs):
-            self._cpu_input_ids[i] = seq.last_token
-            self._cpu_positions[i] = len(seq) - 1
-            self._cpu_context_lens[i] = len(seq)
-            self._cpu_slot_mapping[i] = seq.block_table[-1] * self.block_size + seq.last_block_num_tokens - 1
+            position = len(seq) - 1 + offset
+            self._cpu_input_ids[i] = seq.last_token if input_ids is None else input_ids[i]
+            self._cpu_positions[i] = position
+            self._cpu_context_lens[i] = position + 1
+            # The block table may reach past the sequence end (slots reserved for speculation)
+            self._cpu_slot_mapping[i] = seq.block_table[position // self.block_size] * self.block_size + position % self.block_size
         
         # Transfer to GPU using sliced views
         input_ids = self._cpu_input_ids[:bs].cuda(non_blocking=True)
@@ -303,14 +339,40 @@ class ModelRunner:
         set_context(False, slot_mapping=slot_mapping, context_lens=context_lens, block_tables=block_tables)
         return input_ids, positions
 
-    def prepare_sample(self, seqs: list[Sequence], is_cfg_batch: bool = False):
-        """Optimized sample preparation using pre-allocated buffers."""
-        if is_cfg_batch:
-            num_seqs = len(seqs) // 2
-            target_seqs = seqs[:num_seqs]
-        else:
-            num_seqs = len(seqs)
-            target_seqs = seqs
+    def prepare_verify(self, seqs: list[Sequence], draft_token_ids: list[list[int]]):
+        """Prepare one forward over each sequence's last token followed by its draft tokens.
+
+        Runs as a prefill over the cached context that returns logits for every input token.
+        """
+        input_ids = []
+        positions = []
+        slot_mapping = []
+        cu_seqlens_q = [0]
+        cu_seqlens_k = [0]
+        for seq, draft in zip(seqs, draft_token_ids):
+            start = len(seq) - 1
+            input_ids.append(seq.last_token)
+            input_ids.extend(draft)
+            for position in range(start, start + len(draft) + 1):
+                positions.append(position)
+                slot_mapping.append(seq.block_table[position // self.block_size] * self.block_size + position % self.block_size)
+            cu_seqlens_q.append(cu_seqlens_q[-1] + len(draft) + 1)
+            cu_seqlens_k.append(cu_seqlens_k[-1] + start + len(draft) + 1)
+        max_seqlen_q = max(len(draft) for draft in draft_token_ids) + 1
+        max_seqlen_k = max(len(seq) + len(draft) for seq, draft in zip(seqs, draft_token_ids))
+        block_tables = self.prepare_block_tables(seqs)
+        input_ids = torch.tensor(input_ids, dtype=torch.int64, pin_memory=True).cuda(non_blocking=True)
+        positions = torch.tensor(positions, dtype=torch.int64, pin_memory=True).cuda(non_blocking=True)
+        cu_seqlens_q = torch.tensor(cu_seqlens_q, dtype=torch.int32, pin_memory=True).cuda(non_blocking=True)
+        cu_seqlens_k = torch.tensor(cu_seqlens_k, dtype=torch.int32, pin_memory=True).cuda(non_blocking=True)
+        slot_mapping = torch.tensor(slot_mapping, dtype=torch.int32, pin_memory=True).cuda(non_blocking=True)
+        set_context(True, cu_seqlens_q, cu_seqlens_k, max_seqlen_q, max_seqlen_k, slot_mapping, None, block_tables, all_logits=True)
+        return input_ids, positions
+
+    def prepare_sample(self, seqs: list[Sequence]):
+        """Optimized sample preparation using pre-allocated buffers (one row per sampled sequence)."""
+        num_seqs = len(seqs)
+        target_seqs = seqs
         
         # Fill pre-allocated CPU buffers
         top_ks_is_zero = True
@@ -323,10 +385,10 @@ class ModelRunner:
             if seq.top_k is not None and seq.top_k > 0:
                 top_ks_is_zero = False
             self._cpu_top_ps[i] = seq.top_p if seq.top_p is not None else 1.0
-            if seq.top_p is not None and seq.top_p == 1.0:
+            if seq.top_p is not None and seq.top_p != 1.0:
                 top_ps_is_one = False
             self._cpu_repetition_penalties[i] = seq.repetition_penalty if seq.repetition_penalty is not None else 1.0
-            if seq.repetition_penalty is not None and seq.repetition_penalty == 1.0:
+            if seq.repetition_penalty is not None and seq.repetition_penalty != 1.0:
                 repetition_penalties_is_one = False
         
         # Transfer to GPU using sliced views (single batched transfer)
@@ -338,35 +400,139 @@ class ModelRunner:
         
         return temperatures, cfg_scales, top_ks, top_ps, repetition_penalties
 
+    def prepare_vocab(self, seqs: list[Sequence]) -> torch.Tensor | None:
+        """Return the restricted token ids shared by every sequence in ``seqs``, on device.
+
+        Restriction only applies when all sequences report the very same id tensor (e.g. a batch
+        sharing one constrained processor in its codes phase) and tensor parallelism is off, since
+        the other ranks never see the sequences' callbacks.
+        """
+        if self.world_size > 1 or seqs[0].allowed_token_ids is None:
+            return None
+        ids = seqs[0].allowed_token_ids()
+        if ids is None:
+            return None
+        for seq in seqs[1:]:
+            if seq.allowed_token_ids is None or seq.allowed_token_ids() is not ids:
+                return None
+        cached = self._vocab_ids_cache
+        if cached is None or cached[0] is not ids:
+            cached = self._vocab_ids_cache = (ids, ids.to(device="cuda", dtype=torch.int64))
+        return cached[1]
+
+    def apply_repetition_penalty(
+        self,
+        logits: torch.Tensor,
+        seqs: list[Sequence],
+        repetition_penalties: torch.Tensor,
+        vocab_ids: torch.Tensor | None = None,
+        seen: torch.Tensor | None = None,
+    ) -> torch.Tensor:
+        """Apply repetition penalty to the whole batch in one pass.
+
+        Uses each sequence's device bitmap of completion tokens (prompt tokens are not penalized),
+        matching transformers: penalized scores are multiplied by the penalty when negative and
+        divided by it otherwise. Rows with penalty 1.0 are left unchanged. ``seen`` overrides the
+        bitmaps with one [vocab_size] row per logits row.
+        """
+        if seen is None:
+            seen = torch.stack([self.completion_mask(seq) for seq in seqs])
+        if vocab_ids is not None:
+            seen = seen[:, vocab_ids]
+        penalties = repetition_penalties.unsqueeze(1).to(logits.dtype)
+        penalized = torch.where(logits < 0, logits * penalties, logits / penalties)
+        return torch.where(seen, penalized, logits)
+
+    def completion_mask(self, seq: Sequence) -> torch.Tensor:
+        """Return the [vocab_size] bool bitmap of tokens in ``seq``'s completion, built on first use."""
+        if seq.completion_token_mask is None:
+            mask = torch.zeros(self.config.hf_config.vocab_size, dtype=torch.bool, device="cuda")
+            if seq.num_completion_tokens > 0:
+                mask[torch.tensor(seq.completion_token_ids, device="cuda")] = True
+            seq.completion_token_mask = mask
+        return seq.completion_token_mask
+
+    def update_completion_masks(self, seqs: list[Sequence], token_ids: list[int]):
+        """Record freshly sampled tokens in the bitmaps of sequences that keep one."""
+        for seq, token_id in zip(seqs, token_ids):
+            if seq.completion_token_mask is not None:
+                seq.completion_token_mask[token_id] = True
+
+    def apply_logits_processors(self, logits: torch.Tensor, seqs: list[Sequence]) -> torch.Tensor:
+        """Run each sequence's logits processor on its row of ``logits``.
+
+        When every processor is of one class that provides
+        ``process_batch(processors, token_ids, scores)``, the rows are handed over in a single call
+        so the processor can apply its masks to the whole batch; otherwise each row is processed
+        on its own with a [1, seq_len] input_ids tensor.
+        """
+        return self._process_logits(logits, [seq.logits_processor for seq in seqs], [seq.token_ids for seq in seqs])
+
+    @staticmethod
+    def _process_logits(logits: torch.Tensor, processors: list, token_ids: list[list[int]]) -> torch.Tensor:
+        # One (possibly None) processor and one token id list per row of logits
+        rows = [i for i, processor in enumerate(processors) if processor is not None]
+        if not rows:
+            return logits
+        processors = [processors[i] for i in rows]
+        processor_cls = type(processors[0])
+        process_batch = getattr(processor_cls, "process_batch", None)
+        if process_batch is not None and all(type(p) is processor_cls for p in processors):
+            row_token_ids = [token_ids[i] for i in rows]
+            if len(rows) == logits.size(0):
+                return process_batch(processors, row_token_ids, logits)
+            logits[rows] = process_batch(processors, row_token_ids, logits[rows]).to(logits.dtype)
+            return logits
+        for i, processor in zip(rows, processors):
+            seq_input_ids = torch.tensor([token_ids[i]], device=logits.device)
+            logits[i:i+1] = processor(seq_input_ids, logits[i:i+1])
+        return logits
+
+    def update_logits_processors(self, seqs: list[Sequence], token_ids: list[int]):
+        """Advance each sequence's constrained-decoding state with its sampled token.
+
+        A callback shared by several sequences (one processor passed for a whole batch) is only
+        called once, with the first of those sequences' tokens, so shared counters such as
+        codes_count are not advanced N times per step.
+        """
+        called = set()
+        for seq, token_id in zip(seqs, token_ids):
+            update_state = seq.logits_processor_update_state
+            if update_state is None or id(update_state) in called:
+                continue
+            called.add(id(update_state))
+            update_state(token_id)
+
     @torch.inference_mode()
-    def run_model(self, input_ids: torch.Tensor, positions: torch.Tensor, is_prefill: bool):
+    def run_model(self, input_ids: torch.Tensor, positions: torch.Tensor, is_prefill: bool, token_ids: torch.Tensor | None = None, draft: bool = False):
+        model = self.draft_model if draft else self.model
         if is_prefill or self.enforce_eager or input_ids.size(0) > 512:
-            return self.model.compute_logits(self.model(input_ids, positions))
+            return model.compute_logits(model(input_ids, positions), token_ids)
         else:
             bs = input_ids.size(0)
             context = get_context()
+            graphs, graph_vars = (self.draft_graphs, self.draft_graph_vars) if draft else (self.graphs, self.graph_vars)
             
             # Check if block_tables size exceeds pre-allocated buffer size
             # This can happen when conditional and unconditional sequences have different lengths
             # in CFG mode, causing block_tables to have more columns than expected
-            max_num_blocks = self.graph_vars["block_tables"].size(1)
+            max_num_blocks = graph_vars["block_tables"].size(1)
             if context.block_tables.size(1) > max_num_blocks:
                 # Fall back to eager mode when block_tables is too large for CUDA graph
-                return self.model.compute_logits(self.model(input_ids, positions))
+                return model.compute_logits(model(input_ids, positions), token_ids)
             
             # Fix: Also check if block_tables row count matches batch size
             # Dimension mismatch can cause CUDA illegal memory access during graph replay
             if context.block_tables.size(0) != bs:
                 # Fall back to eager mode when block_tables row count doesn't match batch size
-                return self.model.compute_logits(self.model(input_ids, positions))
+                return model.compute_logits(model(input_ids, positions), token_ids)
             
             # Fix: Verify slot_mapping and context_lens dimensions match batch size
             if context.slot_mapping.size(0) != bs or context.context_lens.size(0) != bs:
                 # Fall back to eager mode when dimensions don't match
-                return self.model.compute_logits(self.model(input_ids, positions))
+                return model.compute_logits(model(input_ids, positions), token_ids)
             
-            graph = self.graphs[next(x for x in self.graph_bs if x >= bs)]
-            graph_vars = self.graph_vars
+            graph = graphs[next(x for x in self.graph_bs if x >= bs)]
             graph_vars["input_ids"][:bs] = input_ids
             graph_vars["positions"][:bs] = positions
             graph_vars["slot_mapping"].fill_(-1)
@@ -377,168 +543,266 @@ class ModelRunner:
             graph_vars["block_tables"][:bs].fill_(-1)
             graph_vars["block_tables"][:bs, :context.block_tables.size(1)] = context.block_tables
             graph.replay()
-            return self.model.compute_logits(graph_vars["outputs"][:bs])
-
-    def run(self, seqs: list[Sequence], is_prefill: bool) -> list[int]:
-        """Run model forward and sampling. For CFG sequences, batch is structured as:
-        [cond_seq1, cond_seq2, ..., uncond_seq1, uncond_seq2, ...]
-        where uncond_seqi is the paired unconditional sequence of cond_seqi."""
-        # Check if this is a CFG batch (contains paired conditional and unconditional sequences)
-        is_cfg_batch = seqs[0].cfg_scale > 1.0 and seqs[0].paired_seq is not None
-        if is_cfg_batch:
-            # CFG batch: seqs = [cond_seq1, cond_seq2, ..., uncond_seq1, uncond_seq2, ...]
-            num_cond = len(seqs) // 2
-            cond_seqs = seqs[:num_cond]
-            # uncond_seqs = seqs[num_cond:]
-            
-            # Prepare inputs for both conditional and unconditional (they're already in the batch)
-            input_ids, positions = (self.prepare_prefill(seqs) if is_prefill else self.prepare_decode(seqs))
-            sample_params = self.prepare_sample(seqs, is_cfg_batch=True) if self.rank == 0 else None
-            if sample_params is not None:
-                temperatures, cfg_scales, top_ks, top_ps, repetition_penalties = sample_params
-            else:
-                temperatures = cfg_scales = top_ks = top_ps = repetition_penalties = None
-            
-            # Run model forward (processes entire batch: cond + uncond)
-            logits_all = self.run_model(input_ids, positions, is_prefill)
-            reset_context()
-            
-            if self.rank == 0:
-                # Split logits: first half is conditional, second half is unconditional
-                logits_cond = logits_all[:num_cond]
-                logits_uncond = logits_all[num_cond:]
-                
-                # Apply repetition penalty to conditional logits (before CFG)
-                if repetition_penalties is not None:
-                    for i, seq in enumerate(cond_seqs):
-                        penalty = repetition_penalties[i].item()
-                        if penalty != 1.0:
-                            # Only penalize completion tokens (not prompt tokens)
-                            completion_tokens = torch.tensor(seq.completion_token_ids, device=logits_cond.device)
-                            if len(completion_tokens) > 0:
-                                # Create token mask: mark tokens that appeared in completion
-                                token_mask = torch.zeros(logits_cond.shape[1], dtype=torch.bool, device=logits_cond.device)
-                                token_mask[completion_tokens] = True
-                                
-                                # Apply standard repetition penalty formula (matching transformers implementation):
-                                # For tokens in completion: if score < 0 then score * penalty, else score / penalty
-                                penalty_scores = torch.where(
-                                    logits_cond[i] < 0,
-                                    logits_cond[i] * penalty,
-                                    logits_cond[i] / penalty
-                                )
-                                # Only apply penalty to tokens that appeared in completion
-                                logits_cond[i] = torch.where(token_mask, penalty_scores, logits_cond[i])
-                
-                # Apply CFG formula: logits_cfg = logits_uncond + cfg_scale * (logits_cond - logits_uncond)
-                cfg_scales_tensor = cfg_scales.unsqueeze(1)  # [num_cond, 1]
-                logits_cfg = logits_uncond + cfg_scales_tensor * (logits_cond - logits_uncond)
-                
-                # Apply logits processor for constrained decoding (if any sequence has one)
-                for i, seq in enumerate(cond_seqs):
-                    if seq.logits_processor is not None:
-                        # Create input_ids tensor for this sequence
-                        seq_input_ids = torch.tensor([seq.token_ids], device=logits_cfg.device)
-                        # Apply processor to this sequence's logits
-                        logits_cfg[i:i+1] = seq.logits_processor(seq_input_ids, logits_cfg[i:i+1])
-                
-                # Prepare input_ids for sampler (for repetition penalty, though we already applied it)
-                # cond_input_ids = torch.tensor([seq.token_ids for seq in cond_seqs], device=logits_cfg.device)
-                
-                # Sample from CFG logits
-                token_ids_cfg = self.sampler(
-                    logits_cfg, 
-                    temperatures,
-                    top_ks=top_ks if top_ks is not None else None,
-                    top_ps=top_ps if top_ps is not None else None,
-                    repetition_penalties=None,  # Already applied above
-                    # input_ids=cond_input_ids,
-                ).tolist()
-                
-                # Update logits processor state after sampling
-                # NOTE: Only update for the first sequence since all sequences share the same processor
-                # Updating multiple times would cause duplicate state updates (e.g., codes_count += N instead of += 1)
-                if cond_seqs and cond_seqs[0].logits_processor_update_state is not None:
-                    cond_seqs[0].logits_processor_update_state(token_ids_cfg[0])
-                
-                # Return token_ids (will be applied to both conditional and unconditional sequences)
-                return token_ids_cfg
-            else:
-                return None
+            return model.compute_logits(graph_vars["outputs"][:bs], token_ids)
+
+    def run(self, seqs: list[Sequence], is_prefill: bool) -> list[int] | list[list[int]]:
+        """Run model forward and sampling. The batch is structured as:
+        [plain_seq1, ..., cond_seq1, cond_seq2, ..., uncond_seq1, uncond_seq2, ...]
+        where plain sequences do not use CFG and uncond_seqi is the paired unconditional
+        sequence of cond_seqi. Returns one token per plain and conditional sequence, or a
+        list of tokens per sequence when the decode step is speculative (see run_speculative)."""
+        num_plain = sum(1 for seq in seqs if seq.cfg_scale <= 1.0)
+        num_cond = (len(seqs) - num_plain) // 2
+        # Sequences that get a sampled token: plain ones, then conditional ones
+        sampled_seqs = seqs[:num_plain + num_cond]
+
+        if not is_prefill and self.draft_model is not None:
+            num_draft = self._num_draft_tokens(seqs, sampled_seqs)
+            if num_draft > 0:
+                return self.run_speculative(seqs, num_plain, num_draft)
+
+        # Prepare inputs for every sequence (unconditional ones only contribute logits)
+        input_ids, positions = (self.prepare_prefill(seqs) if is_prefill else self.prepare_decode(seqs))
+        sample_params = self.prepare_sample(sampled_seqs) if self.rank == 0 else None
+        if sample_params is not None:
+            temperatures, cfg_scales, top_ks, top_ps, repetition_penalties = sample_params
         else:
-            # Normal batch (non-CFG)
-            input_ids, positions = (self.prepare_prefill(seqs) if is_prefill 
-                                   else self.prepare_decode(seqs))
-            sample_params = self.prepare_sample(seqs, is_cfg_batch=False) if self.rank == 0 else None
-            if sample_params is not None:
-                temperatures, cfg_scales, top_ks, top_ps, repetition_penalties = sample_params
-            else:
-                temperatures = cfg_scales = top_ks = top_ps = repetition_penalties = None
-            logits = self.run_model(input_ids, positions, is_prefill)
+            temperatures = cfg_scales = top_ks = top_ps = repetition_penalties = None
+
+        # Restricted vocabulary (e.g. audio codes + EOS): logits come back as [batch, len(vocab_ids)]
+        vocab_ids = self.prepare_vocab(sampled_seqs) if self.rank == 0 else None
+
+        logits_all = self.run_model(input_ids, positions, is_prefill, vocab_ids)
+        if self.draft_model is not None:
+            # Write the same tokens into the draft KV cache
+            self.run_model(input_ids, positions, is_prefill, vocab_ids, draft=True)
+        reset_context()
+        if self.rank != 0:
+            return None
+
+        logits = logits_all[:len(sampled_seqs)]
+
+        # Apply repetition penalty to plain and conditional logits (before CFG)
+        if repetition_penalties is not None:
+            logits = self.apply_repetition_penalty(logits, sampled_seqs, repetition_penalties, vocab_ids)
+
+        if num_cond > 0:
+            # Apply CFG formula: logits_cfg = logits_uncond + cfg_scale * (logits_cond - logits_uncond)
+            logits_cond = logits[num_plain:]
+            logits_uncond = logits_all[len(sampled_seqs):]
+            logits_cfg = logits_uncond + cfg_scales[num_plain:].unsqueeze(1) * (logits_cond - logits_uncond)
+            logits = torch.cat([logits[:num_plain], logits_cfg]) if num_plain > 0 else logits_cfg
+        else:
+            # Clone logits to avoid in-place update issues in inference mode
+            logits = logits.clone()
+
+        # Apply logits processor for constrained decoding (if any sequence has one)
+        logits = self.apply_logits_processors(logits, sampled_seqs)
+
+        token_ids = self.sampler(
+            logits,
+            temperatures,
+            top_ks=top_ks if top_ks is not None else None,
+            top_ps=top_ps if top_ps is not None else None,
+            repetition_penalties=None,  # Already applied above
+        )
+        if vocab_ids is not None:
+            # Map sampled positions in the restricted row back to global token ids
+            token_ids = vocab_ids[token_ids]
+        token_ids = token_ids.tolist()
+        self.update_completion_masks(sampled_seqs, token_ids)
+
+        # Update logits processor state after sampling (each sequence advances its own FSM)
+        self.update_logits_processors(sampled_seqs, token_ids)
+
+        # Conditional tokens are applied to both sequences of each CFG pair by the scheduler
+        return token_ids
+
+    def _num_draft_tokens(self, seqs: list[Sequence], sampled_seqs: list[Sequence]) -> int:
+        """Number of tokens to draft for this decode batch, 0 to decode it normally.
+
+        Drafting advances copies of the logits processors, so each constrained sequence needs
+        its own processor with ``clone()``, and its state and vocabulary callbacks must be the
+        processor's own methods.
+        """
+        processor_ids = set()
+        for seq in sampled_seqs:
+            processor = seq.logits_processor
+            for callback in (seq.logits_processor_update_state, seq.allowed_token_ids):
+                if callback is not None and (processor is None or getattr(callback, "__self__", None) is not processor):
+                    return 0
+            if processor is None:
+                continue
+            if not hasattr(processor, "clone") or id(processor) in processor_ids:
+                return 0
+            processor_ids.add(id(processor))
+        # Drafts must fit in the reserved slots and the model's context
+        return min([self.config.num_speculative_tokens] + [self.config.max_model_len - len(seq) for seq in seqs])
+
+    def run_speculative(self, seqs: list[Sequence], num_plain: int, num_draft: int) -> list[list[int]]:
+        """Draft num_draft tokens per sequence with the draft model and verify them in one forward.
+
+        The draft model decodes the batch num_draft times through the same repetition penalty,
+        CFG, logits processors and sampling settings as the model; the processors are cloned so
+        each draft position sees the state left by the earlier drafts. The model then scores each
+        sequence's last token and drafts at once. A sequence keeps its drafts up to the first one
+        rejected by speculative sampling (draft d is accepted with probability min(1, p(d)/q(d)))
+        and one more token drawn from max(0, p - q), or from p when every draft was accepted,
+        so the output follows the model's distribution exactly.
+
+        Returns the accepted tokens of each plain and conditional sequence.
+        """
+        num_sampled = num_plain + (len(seqs) - num_plain) // 2
+        sampled_seqs = seqs[:num_sampled]
+        sample_params = self.prepare_sample(sampled_seqs)
+        vocab_ids = self.prepare_vocab(sampled_seqs)
+        seen = None
+        if sample_params[4] is not None:
+            seen = torch.stack([self.completion_mask(seq) for seq in sampled_seqs])
+
+        # `working` processors follow the drafts; snapshots[i] hold their state at draft position i
+        working = [None if seq.logits_processor is None else seq.logits_processor.clone() for seq in sampled_seqs]
+        snapshots, seen_snapshots = [], []
+        drafts, draft_probs = [], []
+        draft_tokens = [[] for _ in sampled_seqs]
+        inputs = None
+        for i in range(num_draft + 1):
+            input_ids, positions = self.prepare_decode(seqs, i, inputs)
+            logits = self.run_model(input_ids, positions, False, vocab_ids, draft=True)
             reset_context()
-            
-            if self.rank == 0:
-                # Apply repetition penalty to logits
-                if repetition_penalties is not None:
-                    for i, seq in enumerate(seqs):
-                        penalty = repetition_penalties[i].item()
-                        if penalty != 1.0:
-                            # Only penalize completion tokens (not prompt tokens)
-                            completion_tokens = torch.tensor(seq.completion_token_ids, device=logits.device)
-                            if len(completion_tokens) > 0:
-                                # Create token mask: mark tokens that appeared in completion
-                                token_mask = torch.zeros(logits.shape[1], dtype=torch.bool, device=logits.device)
-                                token_mask[completion_tokens] = True
-                                
-                                # Apply standard repetition penalty formula (matching transformers implementation):
-                                # For tokens in completion: if score < 0 then score * penalty, else score / penalty
-                                penalty_scores = torch.where(
-                                    logits[i] < 0,
-                                    logits[i] * penalty,
-                                    logits[i] / penalty
-                                )
-                                # Only apply penalty to tokens that appeared in completion
-                                logits[i] = torch.where(token_mask, penalty_scores, logits[i])
-                
-                # Apply logits processor for constrained decoding (if any sequence has one)
-                # Clone logits to avoid in-place update issues in inference mode
-                logits = logits.clone()
-                for i, seq in enumerate(seqs):
-                    if seq.logits_processor is not None:
-                        # Create input_ids tensor for this sequence
-                        seq_input_ids = torch.tensor([seq.token_ids], device=logits.device)
-                        # Apply processor to this sequence's logits (clone to avoid inference mode issues)
-                        processed = seq.logits_processor(seq_input_ids, logits[i:i+1].clone())
-                        logits[i] = processed[0]
-                
-                # Prepare input_ids for sampler
-                # seq_input_ids = torch.tensor([seq.token_ids for seq in seqs], device=logits.device)
-                
-                token_ids = self.sampler(
-                    logits, 
-                    temperatures,
-                    top_ks=top_ks if top_ks is not None else None,
-                    top_ps=top_ps if top_ps is not None else None,
-                    repetition_penalties=None,  # Already applied above
-                    # input_ids=seq_input_ids,
-                ).tolist()
-                
-                # Update logits processor state after sampling
-                # NOTE: Only update for the first sequence since all sequences may share the same processor
-                # (when using a single SamplingParams for batch generation)
-                # Updating multiple times would cause duplicate state updates (e.g., codes_count += N instead of += 1)
-                if seqs and seqs[0].logits_processor_update_state is not None:
-                    seqs[0].logits_processor_update_state(token_ids[0])
-                
-                return token_ids
-            else:
-                return None
+            if i == num_draft:
+                break    # this forward only writes the KV of the last draft token
+            snapshots.append([None if processor is None else processor.clone() for processor in working])
+            seen_snapshots.append(seen)
+            token_ids = self._draft_token_ids(sampled_seqs, draft_tokens, i)
+            probs = self._guided_probs(logits[None], num_plain, sample_params, vocab_ids, seen, [working], [token_ids])[0]
+            local = sample_from_probs(probs.clone())
+            draft_probs.append(probs)
+            drafts.append(local)
+            tokens = (vocab_ids[local] if vocab_ids is not None else local).tolist()
+            for processor, seq_tokens, token_id in zip(working, draft_tokens, tokens):
+                seq_tokens.append(token_id)
+                if processor is not None:
+                    processor.update_state(token_id)
+            if seen is not None:
+                seen = seen.clone()
+                seen[torch.arange(num_sampled, device=seen.device), torch.tensor(tokens, device=seen.device)] = True
+            # Unconditional sequences are fed their pair's draft
+            inputs = tokens + tokens[num_plain:]
+        snapshots.append(working)
+        seen_snapshots.append(seen)
+
+        # Score the last token and every draft in one forward: [num_seqs * (num_draft + 1), V] -> [num_draft + 1, num_seqs, V]
+        input_ids, positions = self.prepare_verify(seqs, draft_tokens + draft_tokens[num_plain:])
+        logits = self.run_model(input_ids, positions, True, vocab_ids)
+        reset_context()
+        logits = logits.view(len(seqs), num_draft + 1, -1).transpose(0, 1)
+        token_ids = [self._draft_token_ids(sampled_seqs, draft_tokens, i) for i in range(num_draft + 1)]
+        probs = self._guided_probs(
+            logits, num_plain, sample_params, vocab_ids,
+            torch.stack(seen_snapshots) if seen is not None else None, snapshots, token_ids,
+        )
+
+        # Speculative sampling
+        q = torch.stack(draft_probs)
+        d = torch.stack(drafts).unsqueeze(-1)
+        p_d = probs[:-1].gather(2, d).squeeze(-1)
+        q_d = q.gather(2, d).squeeze(-1)
+        accepted = torch.rand_like(q_d) * q_d < p_d
+        num_accepted = accepted.int().cumprod(0).sum(0)
+        q = torch.cat([q, torch.zeros_like(q[:1])])
+        index = num_accepted.view(1, -1, 1).expand(1, num_sampled, probs.size(-1))
+        p_next = probs.gather(0, index)[0]
+        residual = (p_next - q.gather(0, index)[0]).clamp_min_(0)
+        # p == q leaves no residual mass; the rejection then came from rounding, so sample p
+        residual = torch.where(residual.sum(-1, keepdim=True) > 0, residual, p_next)
+        local = sample_from_probs(residual)
+        next_tokens = (vocab_ids[local] if vocab_ids is not None else local).tolist()
+        num_accepted = num_accepted.tolist()
+
+        accepted_tokens = []
+        for i, (seq, count, token_id) in enumerate(zip(sampled_seqs, num_accepted, next_tokens)):
+            tokens = draft_tokens[i][:count] + [token_id]
+            accepted_tokens.append(tokens)
+            if seq.completion_token_mask is not None:
+                seq.completion_token_mask[tokens] = True
+            processor = snapshots[count][i]
+            if processor is not None:
+                # The copy for the first rejected position has seen every accepted draft
+                processor.update_state(token_id)
+                seq.logits_processor = processor
+                seq.logits_processor_update_state = processor.update_state
+                if seq.allowed_token_ids is not None:
+                    seq.allowed_token_ids = processor.allowed_token_ids
+
+        total_accepted = sum(num_accepted)
+        self.acceptance_rate = total_accepted / (num_sampled * num_draft)
+        self.num_draft_tokens += num_sampled * num_draft
+        self.num_accepted_tokens += total_accepted
+        return accepted_tokens
+
+    @staticmethod
+    def _draft_token_ids(seqs: list[Sequence], draft_tokens: list[list[int]], num_tokens: int) -> list[list[int] | None]:
+        # Token ids seen by the logits processors at a draft position (only built for rows that have one)
+        return [
+            None if seq.logits_processor is None else seq.token_ids + tokens[:num_tokens]
+            for seq, tokens in zip(seqs, draft_tokens)
+        ]
+
+    def _guided_probs(
+        self,
+        logits: torch.Tensor,
+        num_plain: int,
+        sample_params: tuple,
+        vocab_ids: torch.Tensor | None,
+        seen: torch.Tensor | None,
+        processors: list[list],
+        token_ids: list[list[list[int]]],
+    ) -> torch.Tensor:
+        """Sampling distributions for several positions of a batch, as run() would sample them.
+
+        logits is [positions, num_seqs, V] in batch layout; seen, processors and token_ids give
+        the repetition-penalty bitmaps, logits processors and token ids of each sampled sequence
+        at each position. Returns [positions, num_sampled, V] probabilities.
+        """
+        temperatures, cfg_scales, top_ks, top_ps, repetition_penalties = sample_params
+        num_positions, num_seqs, vocab_size = logits.shape
+        num_sampled = len(processors[0])
+        sampled = logits[:, :num_sampled].reshape(-1, vocab_size)
+        if repetition_penalties is not None:
+            sampled = self.apply_repetition_penalty(
+                sampled, None, repetition_penalties.repeat(num_positions), vocab_ids, seen.reshape(-1, seen.size(-1)),
+            )
+        sampled = sampled.view(num_positions, num_sampled, vocab_size)
+        if num_seqs > num_sampled:
+            logits_cond = sampled[:, num_plain:]
+            logits_uncond = logits[:, num_sampled:]
+            logits_cfg = logits_uncond + cfg_scales[num_plain:].view(1, -1, 1) * (logits_cond - logits_uncond)
+            sampled = torch.cat([sampled[:, :num_plain], logits_cfg], 1) if num_plain > 0 else logits_cfg
+        else:
+            sampled = sampled.clone()
+        rows = self._process_logits(
+            sampled.reshape(-1, vocab_size),
+            [processor for position in processors for processor in position],
+            [ids for position in token_ids for ids in position],
+        )
+        repeat = lambda t: None if t is None else t.repeat(num_positions)
+        probs = compute_probs(rows, repeat(temperatures), repeat(top_ks), repeat(top_ps))
+        return probs.view(num_positions, num_sampled, vocab_size)
 
     @torch.inference_mode()
     def capture_cudagraph(self):
-        config = self.config
-        hf_config = config.hf_config
         max_bs = min(self.config.max_num_seqs, 512)
+        self.graph_bs = [1, 2, 4, 8] + list(range(16, max_bs + 1, 16))
+        self.graph_pool = None
+        self.graphs, self.graph_vars = self._capture_graphs(self.model, self.config.hf_config)
+        if self.draft_model is not None:
+            # Replays never overlap, so the draft graphs share the memory pool
+            self.draft_graphs, self.draft_graph_vars = self._capture_graphs(self.draft_model, self.config.draft_hf_config)
+
+    def _capture_graphs(self, model, hf_config):
+        config = self.config
+        max_bs = min(config.max_num_seqs, 512)
         max_num_blocks = (config.max_model_len + self.block_size - 1) // self.block_size
         input_ids = torch.zeros(max_bs, dtype=torch.int64)
         positions = torch.zeros(max_bs, dtype=torch.int64)
@@ -546,23 +810,21 @@ class ModelRunner:
         context_lens = torch.zeros(max_bs, dtype=torch.int32)
         block_tables = torch.zeros(max_bs, max_num_blocks, dtype=torch.int32)
         outputs = torch.zeros(max_bs, hf_config.hidden_size)
-        self.graph_bs = [1, 2, 4, 8] + list(range(16, max_bs + 1, 16))
-        self.graphs = {}
-        self.graph_pool = None
+        graphs = {}
 
         for bs in reversed(self.graph_bs):
             graph = torch.cuda.CUDAGraph()
             set_context(False, slot_mapping=slot_mapping[:bs], context_lens=context_lens[:bs], block_tables=block_tables[:bs])
-            outputs[:bs] = self.model(input_ids[:bs], positions[:bs])    # warmup
+            outputs[:bs] = model(input_ids[:bs], positions[:bs])    # warmup
             with torch.cuda.graph(graph, self.graph_pool):
-                outputs[:bs] = self.model(input_ids[:bs], positions[:bs])    # capture
+                outputs[:bs] = model(input_ids[:bs], positions[:bs])    # capture
             if self.graph_pool is None:
                 self.graph_pool = graph.pool()
-            self.graphs[bs] = graph
+            graphs[bs] = graph
             torch.cuda.synchronize()
             reset_context()
 
-        self.graph_vars = dict(
+        graph_vars = dict(
             input_ids=input_ids,
             positions=positions,
             slot_mapping=slot_mapping,
@@ -570,3 +832,4 @@ class ModelRunner:
             block_tables=block_tables,
             outputs=outputs,
         )
+        return graphs, graph_vars
@@ -1,4 +1,4 @@
-from collections import deque
+from collections import OrderedDict
 
 from nanovllm.config import Config
 from nanovllm.engine.sequence import Sequence, SequenceStatus
@@ -11,32 +11,79 @@ class Scheduler:
         self.max_num_seqs = config.max_num_seqs
         self.max_num_batched_tokens = config.max_num_batched_tokens
         self.eos = config.eos
-        self.block_manager = BlockManager(config.num_kvcache_blocks, config.kvcache_block_size)
-        self.waiting: deque[Sequence] = deque()
-        self.running: deque[Sequence] = deque()
+        self.max_model_len = config.max_model_len
+        # Token slots reserved past each decoding sequence for speculative steps
+        self.num_speculative_tokens = config.num_speculative_tokens if config.draft_model else 0
+        max_pinned_blocks = config.max_pinned_prefix_blocks
+        if max_pinned_blocks < 0:
+            max_pinned_blocks = config.num_kvcache_blocks // 4
+        self.block_manager = BlockManager(config.num_kvcache_blocks, config.kvcache_block_size, max_pinned_blocks)
+        # Queues are insertion-ordered maps keyed by seq_id: O(1) append, pop, removal and membership
+        self.waiting: OrderedDict[int, Sequence] = OrderedDict()
+        self.running: OrderedDict[int, Sequence] = OrderedDict()
+        # Waiting sequences grouped by the hash of their first prompt block
+        self.waiting_by_prefix: dict[int, OrderedDict[int, Sequence]] = {}
+        # Prefix cache statistics: last prefill step and running totals
+        self.prefix_hit_rate = 0.0
+        self.num_prefill_tokens = 0
+        self.num_prefix_hit_tokens = 0
 
     def is_finished(self):
         return not self.waiting and not self.running
 
     def add(self, seq: Sequence):
-        self.waiting.append(seq)
+        # Sequences sharing the first prompt block are prefilled in the same step
+        # (see schedule), so the later ones hit the prefix cache.
+        # Unconditional CFG sequences are scheduled with their conditional partner.
+        if not seq.is_unconditional and seq.num_prompt_tokens >= seq.block_size:
+            seq.prefix_hash = self.block_manager.compute_hash(seq.block(0))
+        self._add_waiting(seq)
+
+    def _add_waiting(self, seq: Sequence, front: bool = False):
+        self.waiting[seq.seq_id] = seq
+        if front:
+            self.waiting.move_to_end(seq.seq_id, last=False)
+        if seq.prefix_hash != -1:
+            group = self.waiting_by_prefix.setdefault(seq.prefix_hash, OrderedDict())
+            group[seq.seq_id] = seq
+            if front:
+                group.move_to_end(seq.seq_id, last=False)
+
+    def _remove_waiting(self, seq: Sequence):
+        del self.waiting[seq.seq_id]
+        if seq.prefix_hash != -1:
+            group = self.waiting_by_prefix[seq.prefix_hash]
+            del group[seq.seq_id]
+            if not group:
+                del self.waiting_by_prefix[seq.prefix_hash]
+
+    def _next_waiting(self, prefix_hash: int) -> Sequence:
+        # Prefer a sequence sharing the prefix just scheduled, otherwise take the head
+        group = self.waiting_by_prefix.get(prefix_hash)
+        if group:
+            return next(iter(group.values()))
+        return next(iter(self.waiting.values()))
 
     def schedule(self) -> tuple[list[Sequence], bool]:
         # prefill
         scheduled_seqs = []
         num_seqs = 0
         num_batched_tokens = 0
-        processed_seqs = set()  # Track processed sequences to handle CFG pairs
+        prefix_hash = -1
         
         while self.waiting and num_seqs < self.max_num_seqs:
-            seq = self.waiting[0]
+            seq = self._next_waiting(prefix_hash)
+            if seq.is_unconditional and seq.paired_seq is not None:
+                # Preemption can leave an unconditional sequence ahead of its pair;
+                # pairs are always scheduled from the conditional side
+                seq = seq.paired_seq
             
             # For CFG sequences, ensure conditional and unconditional are scheduled together
             if seq.cfg_scale > 1.0 and seq.paired_seq is not None and not seq.is_unconditional:
                 # This is a conditional sequence, need to schedule its paired unconditional sequence too
                 paired_seq = seq.paired_seq
-                if paired_seq.status != SequenceStatus.WAITING:
-                    # Paired sequence not in waiting, skip this conditional sequence for now
+                if paired_seq.status != SequenceStatus.WAITING or num_seqs + 2 > self.max_num_seqs:
+                    # Paired sequence not in waiting (or the pair does not fit), stop here
                     break
                 
                 # Calculate tokens for both sequences
@@ -46,7 +93,7 @@ class Scheduler:
                 # The old check was wrong: it checked each sequence independently,
                 # but didn't account for the total blocks needed by both
                 total_blocks_needed = seq.num_blocks + paired_seq.num_blocks
-                can_allocate_both = len(self.block_manager.free_block_ids) >= total_blocks_needed
+                can_allocate_both = self.block_manager.make_room(total_blocks_needed)
                 
                 if num_batched_tokens + total_tokens > self.max_num_batched_tokens or not can_allocate_both:
                     break
@@ -57,26 +104,21 @@ class Scheduler:
                     self.block_manager.allocate(s)
                     num_batched_tokens += len(s) - s.num_cached_tokens
                     s.status = SequenceStatus.RUNNING
-                    self.waiting.remove(s)
-                    self.running.append(s)
+                    self._remove_waiting(s)
+                    self.running[s.seq_id] = s
                     scheduled_seqs.append(s)
-                    processed_seqs.add(s.seq_id)
             else:
-                # Normal sequence or unconditional sequence (already processed with its conditional)
-                if seq.seq_id in processed_seqs:
-                    # Skip if already processed as part of a CFG pair
-                    self.waiting.popleft()
-                    continue
-                    
+                # Normal sequence (unconditional sequences leave the queue with their conditional)
                 if num_batched_tokens + len(seq) > self.max_num_batched_tokens or not self.block_manager.can_allocate(seq):
                     break
                 num_seqs += 1
                 self.block_manager.allocate(seq)
                 num_batched_tokens += len(seq) - seq.num_cached_tokens
                 seq.status = SequenceStatus.RUNNING
-                self.waiting.popleft()
-                self.running.append(seq)
+                self._remove_waiting(seq)
+                self.running[seq.seq_id] = seq
                 scheduled_seqs.append(seq)
+            prefix_hash = seq.prefix_hash
                 
         if scheduled_seqs:
             # For CFG batches, ensure conditional sequences come before their unconditional pairs
@@ -86,86 +128,96 @@ class Scheduler:
             
             # Reorder: non-CFG, then CFG conditional, then CFG unconditional
             scheduled_seqs = non_cfg_seqs + cfg_cond_seqs + cfg_uncond_seqs
+
+            num_tokens = sum(len(s) for s in scheduled_seqs)
+            num_hit_tokens = sum(s.num_cached_tokens for s in scheduled_seqs)
+            self.prefix_hit_rate = num_hit_tokens / num_tokens
+            self.num_prefill_tokens += num_tokens
+            self.num_prefix_hit_tokens += num_hit_tokens
             return scheduled_seqs, True
 
         # decode
-        processed_seqs = set()
-        temp_running = list(self.running)  # Work with a copy
+        # Walk the running order lazily; `taken` holds sequences already scheduled
+        # or preempted this step. Preempted sequences leave self.running after the
+        # loop, so the map does not change while it is being iterated.
+        taken = set()
+        candidates = (s for s in self.running.values() if s.seq_id not in taken)
         
-        while temp_running and num_seqs < self.max_num_seqs:
-            seq = temp_running.pop(0)
+        while num_seqs < self.max_num_seqs:
+            seq = next(candidates, None)
+            if seq is None:
+                break
+            if seq.is_unconditional and seq.paired_seq is not None:
+                # Pairs are always scheduled from the conditional side
+                seq = seq.paired_seq
+                if seq.seq_id in taken:
+                    continue
+            taken.add(seq.seq_id)
             
             # For CFG sequences, ensure conditional and unconditional are scheduled together
             if seq.cfg_scale > 1.0 and seq.paired_seq is not None and not seq.is_unconditional:
                 paired_seq = seq.paired_seq
-                if paired_seq not in temp_running:
+                if paired_seq.status != SequenceStatus.RUNNING or paired_seq.seq_id in taken:
                     # Paired sequence not available, skip for now
                     continue
-                
-                # Remove paired_seq from temp_running
-                temp_running.remove(paired_seq)
+                if num_seqs + 2 > self.max_num_seqs:
+                    # The pair does not fit in this batch
+                    taken.discard(seq.seq_id)
+                    break
+                taken.add(paired_seq.seq_id)
                 
                 # FIX: Check if we have enough blocks for BOTH sequences to append
-                # Each sequence needs 1 block when at block boundary (len % block_size == 1)
-                block_size = self.block_manager.block_size
-                blocks_needed_seq = 1 if len(seq) % block_size == 1 else 0
-                blocks_needed_paired = 1 if len(paired_seq) % block_size == 1 else 0
-                total_blocks_needed = blocks_needed_seq + blocks_needed_paired
-                can_append_both = len(self.block_manager.free_block_ids) >= total_blocks_needed
+                if self.num_speculative_tokens:
+                    # Reserve room for the drafts; the longer sequence bounds the pair's lookahead
+                    lookahead = self._lookahead(max(len(seq), len(paired_seq)))
+                    total_blocks_needed = (self.block_manager.num_new_blocks(seq, lookahead) +
+                                           self.block_manager.num_new_blocks(paired_seq, lookahead))
+                else:
+                    # Each sequence needs 1 block when at block boundary (len % block_size == 1)
+                    lookahead = 0
+                    block_size = self.block_manager.block_size
+                    blocks_needed_seq = 1 if len(seq) % block_size == 1 else 0
+                    blocks_needed_paired = 1 if len(paired_seq) % block_size == 1 else 0
+                    total_blocks_needed = blocks_needed_seq + blocks_needed_paired
+                can_append_both = self.block_manager.make_room(total_blocks_needed)
+                
+                # Try preempting other sequences (with their CFG partners)
+                while not can_append_both:
+                    other_seq = next(candidates, None)
+                    if other_seq is None:
+                        break
+                    self._preempt_with_partner(other_seq, taken)
+                    can_append_both = self.block_manager.make_room(total_blocks_needed)
                 
                 if not can_append_both:
-                    # Try preempting other sequences
-                    preempted = False
-                    while not can_append_both and temp_running:
-                        other_seq = temp_running.pop(0)
-                        if other_seq != seq and other_seq != paired_seq:
-                            self.preempt(other_seq)
-                            # Recalculate with the same correct logic
-                            can_append_both = len(self.block_manager.free_block_ids) >= total_blocks_needed
-                            preempted = True
-                        else:
-                            temp_running.append(other_seq)
-                            break
-                    
-                    if not can_append_both:
-                        # Can't schedule this pair right now
-                        temp_running.append(seq)
-                        temp_running.append(paired_seq)
-                        continue
+                    # Nothing left to preempt: requeue this pair, conditional first
+                    self.preempt(paired_seq)
+                    self.preempt(seq)
+                    continue
                 
                 # Schedule both sequences
                 for s in [seq, paired_seq]:
                     num_seqs += 1
-                    self.block_manager.may_append(s)
+                    self.block_manager.may_append(s, lookahead)
                     scheduled_seqs.append(s)
-                    processed_seqs.add(s.seq_id)
-                    # Remove from actual running list if scheduled
-                    if s in self.running:
-                        self.running.remove(s)
             else:
-                # Normal sequence or unconditional (already processed)
-                if seq.seq_id in processed_seqs:
-                    continue
-                    
-                while not self.block_manager.can_append(seq):
-                    if temp_running:
-                        other_seq = temp_running.pop(0)
-                        if other_seq != seq:
-                            self.preempt(other_seq)
-                        else:
-                            temp_running.append(other_seq)
-                            break
+                # Normal sequence (unconditional sequences are taken with their conditional)
+                lookahead = self._lookahead(len(seq))
+                while not self.block_manager.can_append(seq, lookahead):
+                    other_seq = next(candidates, None)
+                    if other_seq is not None:
+                        self._preempt_with_partner(other_seq, taken)
                     else:
                         self.preempt(seq)
-                        if seq in self.running:
-                            self.running.remove(seq)
                         break
                 else:
                     num_seqs += 1
-                    self.block_manager.may_append(seq)
+                    self.block_manager.may_append(seq, lookahead)
                     scheduled_seqs.append(seq)
-                    if seq in self.running:
-                        self.running.remove(seq)
+
+        for seq_id in taken:
+            if self.running[seq_id].status == SequenceStatus.WAITING:
+                del self.running[seq_id]
                     
         if not scheduled_seqs:
             # No sequences could be scheduled - provide informative error
@@ -175,7 +227,7 @@ class Scheduler:
             total_blocks = len(self.block_manager.blocks)
 
             if waiting_count > 0:
-                seq = self.waiting[0]
+                seq = next(iter(self.waiting.values()))
                 blocks_needed = seq.num_blocks
                 prompt_tokens = len(seq)
                 if seq.cfg_scale > 1.0 and seq.paired_seq is not None:
@@ -200,32 +252,68 @@ class Scheduler:
         non_cfg_seqs = [s for s in scheduled_seqs if s.cfg_scale <= 1.0]
         scheduled_seqs = non_cfg_seqs + cfg_cond_seqs + cfg_uncond_seqs
         
-        self.running.extendleft(reversed(scheduled_seqs))
+        for seq in reversed(scheduled_seqs):
+            self.running.move_to_end(seq.seq_id, last=False)
         return scheduled_seqs, False
 
+    def _lookahead(self, num_tokens: int) -> int:
+        # Token slots reserved past the sequence end for the next speculative step
+        if not self.num_speculative_tokens:
+            return 0
+        return max(0, min(self.num_speculative_tokens, self.max_model_len - num_tokens))
+
     def preempt(self, seq: Sequence):
         seq.status = SequenceStatus.WAITING
         self.block_manager.deallocate(seq)
-        self.waiting.appendleft(seq)
-
-    def postprocess(self, seqs: list[Sequence], token_ids: list[int]) -> list[bool]:
-        # Check if this is a CFG batch
-        is_cfg_batch = False
-        if len(seqs) > 0 and seqs[0].cfg_scale > 1.0 and seqs[0].paired_seq is not None:
-            num_cond = len(seqs) // 2
-            is_cfg_batch = (num_cond > 0 and 
-                           not seqs[0].is_unconditional and 
-                           seqs[num_cond].is_unconditional)
-        
-        if is_cfg_batch:
-            # CFG batch: seqs = [cond_seq1, cond_seq2, ..., uncond_seq1, uncond_seq2, ...]
-            # token_ids correspond to conditional sequences only (sampled from CFG logits)
-            num_cond = len(seqs) // 2
-            cond_seqs = seqs[:num_cond]
-            uncond_seqs = seqs[num_cond:]
-            
-            # Apply the same sampled token to both conditional and unconditional sequences
-            for i, (cond_seq, uncond_seq, token_id) in enumerate(zip(cond_seqs, uncond_seqs, token_ids)):
+        self._add_waiting(seq, front=True)
+
+    def _preempt_with_partner(self, seq: Sequence, taken: set):
+        """Preempt seq and its running CFG partner, leaving the conditional ahead in the queue."""
+        pair = [seq]
+        paired = seq.paired_seq
+        if paired is not None and paired.status == SequenceStatus.RUNNING and paired.seq_id not in taken:
+            pair.append(paired)
+        pair.sort(key=lambda s: not s.is_unconditional)
+        for s in pair:
+            taken.add(s.seq_id)
+            self.preempt(s)
+
+    def abort(self, seq: Sequence):
+        """Drop a waiting or running sequence (and its CFG partner) and free its blocks."""
+        for s in (seq, seq.paired_seq):
+            if s is None or s.is_finished:
+                continue
+            if s.status == SequenceStatus.WAITING:
+                self._remove_waiting(s)
+            else:
+                del self.running[s.seq_id]
+            s.status = SequenceStatus.FINISHED
+            if s.block_table:
+                self.block_manager.deallocate(s)
+
+    def postprocess(self, seqs: list[Sequence], token_ids: list[int] | list[list[int]]) -> list[bool]:
+        # Batch layout (see schedule): [plain..., cond..., uncond...]; token_ids holds
+        # one entry per plain sequence followed by one per CFG pair (sampled from CFG logits).
+        # Speculative steps give each entry as a list of accepted tokens, appended until
+        # the sequence finishes.
+        num_plain = sum(1 for seq in seqs if seq.cfg_scale <= 1.0)
+        num_cond = (len(seqs) - num_plain) // 2
+
+        # Normal sequences
+        for seq, tokens in zip(seqs[:num_plain], token_ids):
+            for token_id in (tokens if isinstance(tokens, list) else [tokens]):
+                seq.append_token(token_id)
+                if (not seq.ignore_eos and token_id == self.eos) or seq.num_completion_tokens == seq.max_tokens:
+                    seq.status = SequenceStatus.FINISHED
+                    self.block_manager.deallocate(seq)
+                    del self.running[seq.seq_id]
+                    break
+
+        # CFG pairs: apply the same sampled token to both conditional and unconditional sequences
+        cond_seqs = seqs[num_plain:num_plain + num_cond]
+        uncond_seqs = seqs[num_plain + num_cond:]
+        for cond_seq, uncond_seq, tokens in zip(cond_seqs, uncond_seqs, token_ids[num_plain:]):
+            for token_id in (tokens if isinstance(tokens, list) else [tokens]):
                 cond_seq.append_token(token_id)
                 uncond_seq.append_token(token_id)  # Same token for unconditional
                 
@@ -241,15 +329,6 @@ class Scheduler:
                     uncond_seq.status = SequenceStatus.FINISHED
                     self.block_manager.deallocate(cond_seq)
                     self.block_manager.deallocate(uncond_seq)
-                    if cond_seq in self.running:
-                        self.running.remove(cond_seq)
-                    if uncond_seq in self.running:
-                        self.running.remove(uncond_seq)
-        else:
-            # Normal batch
-            for seq, token_id in zip(seqs, token_ids):
-                seq.append_token(token_id)
-                if (not seq.ignore_eos and token_id == self.eos) or seq.num_completion_tokens == seq.max_tokens:
-                    seq.status = SequenceStatus.FINISHED
-                    self.block_manager.deallocate(seq)
-                    self.running.remove(seq)
+                    self.running.pop(cond_seq.seq_id, None)
+                    self.running.pop(uncond_seq.seq_id, None)
+                    break
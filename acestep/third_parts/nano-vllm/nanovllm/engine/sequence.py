@@ -25,6 +25,8 @@ class Sequence:
         self.num_prompt_tokens = len(token_ids)
         self.num_cached_tokens = 0
         self.block_table = []
+        # Hash of the first full prompt block, used by the scheduler to group shared prefixes
+        self.prefix_hash = -1
         self.temperature = sampling_params.temperature
         self.max_tokens = sampling_params.max_tokens
         self.ignore_eos = sampling_params.ignore_eos
@@ -40,6 +42,10 @@ class Sequence:
         # For constrained decoding: logits processor and state update callback
         self.logits_processor: Optional[Any] = sampling_params.logits_processor
         self.logits_processor_update_state: Optional[Callable[[int], None]] = sampling_params.logits_processor_update_state
+        # For restricted-vocabulary decoding: callback returning the allowed token ids for the next step
+        self.allowed_token_ids: Optional[Callable[[], Optional[Any]]] = sampling_params.allowed_token_ids
+        # For repetition penalty: device bitmap of completion tokens, maintained by the model runner on rank 0
+        self.completion_token_mask: Optional[Any] = None
 
     def __len__(self):
         return self.num_tokens
@@ -44,6 +44,10 @@ class VocabParallelEmbedding(nn.Module):
 
 class ParallelLMHead(VocabParallelEmbedding):
 
+    # Restricted id sets that split into more contiguous runs than this are gathered into a
+    # dense sub-matrix instead of being computed run by run
+    max_weight_runs = 8
+
     def __init__(
         self,
         num_embeddings: int,
@@ -52,15 +56,50 @@ class ParallelLMHead(VocabParallelEmbedding):
     ):
         assert not bias
         super().__init__(num_embeddings, embedding_dim)
+        self._restricted_cache: tuple | None = None
 
-    def forward(self, x: torch.Tensor):
+    def _restricted_weight(self, token_ids: torch.Tensor):
+        """Return the weight rows for ``token_ids`` (sorted global ids), cached per id tensor.
+
+        Contiguous runs of ids are returned as zero-copy ``narrow`` views of the weight, so the
+        audio-code block plus EOS costs two small matmuls and no extra memory. Highly fragmented
+        id sets fall back to a single gathered copy.
+        """
+        key = (token_ids.data_ptr(), token_ids.numel(), self.weight.data_ptr())
+        if self._restricted_cache is not None and self._restricted_cache[0] == key:
+            return self._restricted_cache[1]
+        ids = token_ids.tolist()
+        runs = []
+        start = prev = ids[0]
+        for token_id in ids[1:]:
+            if token_id != prev + 1:
+                runs.append((start, prev - start + 1))
+                start = token_id
+            prev = token_id
+        runs.append((start, prev - start + 1))
+        if len(runs) <= self.max_weight_runs:
+            weights = [self.weight.narrow(0, start, length) for start, length in runs]
+        else:
+            weights = [self.weight.index_select(0, token_ids.to(self.weight.device))]
+        self._restricted_cache = (key, weights)
+        return weights
+
+    def forward(self, x: torch.Tensor, token_ids: torch.Tensor | None = None):
         context = get_context()
-        if context.is_prefill:
+        if context.is_prefill and not context.all_logits:
             last_indices = context.cu_seqlens_q[1:] - 1
             x = x[last_indices].contiguous()
+        if token_ids is not None and self.tp_size == 1:
+            # Restricted vocabulary: logits only for the requested ids, in token_ids order
+            weights = self._restricted_weight(token_ids)
+            if len(weights) == 1:
+                return F.linear(x, weights[0])
+            return torch.cat([F.linear(x, w) for w in weights], -1)
         logits = F.linear(x, self.weight)
         if self.tp_size > 1:
             all_logits = [torch.empty_like(logits) for _ in range(self.tp_size)] if self.tp_rank == 0 else None
             dist.gather(logits, all_logits, 0)
             logits = torch.cat(all_logits, -1) if self.tp_rank == 0 else None
+            if logits is not None and token_ids is not None:
+                logits = logits[:, token_ids]
         return logits
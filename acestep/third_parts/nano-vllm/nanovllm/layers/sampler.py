@@ -80,6 +80,26 @@ def apply_top_k_only(
     return logits
 
 
+def compute_probs(
+    logits: torch.Tensor,
+    temperatures: torch.Tensor,
+    top_ks: Optional[torch.Tensor] = None,
+    top_ps: Optional[torch.Tensor] = None,
+) -> torch.Tensor:
+    """Return the sampling distribution: temperature, then top-k/top-p, then softmax."""
+    logits = logits.float().div_(temperatures.unsqueeze(dim=1))
+    logits = apply_top_k_top_p(logits, top_ks, top_ps)
+    return torch.softmax(logits, dim=-1)
+
+
+def sample_from_probs(probs: torch.Tensor) -> torch.Tensor:
+    """Draw one index per row, proportional to the (not necessarily normalized) weights in probs.
+
+    probs is overwritten.
+    """
+    return probs.div_(torch.empty_like(probs).exponential_(1).clamp_min_(1e-10)).argmax(dim=-1)
+
+
 class Sampler(nn.Module):
 
     def __init__(self):
@@ -101,14 +121,5 @@ class Sampler(nn.Module):
         Condition checking is done OUTSIDE the compiled function to avoid
         graph breaks from .any() calls.
         """
-        # Apply temperature
-        logits = logits.float().div_(temperatures.unsqueeze(dim=1))
-
-        logits = apply_top_k_top_p(
-            logits,
-            top_ks,
-            top_ps,
-        )
-        probs = torch.softmax(logits, dim=-1)
-        sample_tokens = probs.div_(torch.empty_like(probs).exponential_(1).clamp_min_(1e-10)).argmax(dim=-1)
-        return sample_tokens
\ No newline at end of file
+        probs = compute_probs(logits, temperatures, top_ks, top_ps)
+        return sample_from_probs(probs)
\ No newline at end of file
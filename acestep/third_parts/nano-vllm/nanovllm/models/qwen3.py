@@ -225,5 +225,6 @@ class Qwen3ForCausalLM(nn.Module):
     def compute_logits(
         self,
         hidden_states: torch.Tensor,
+        token_ids: torch.Tensor | None = None,
     ) -> torch.Tensor:
-        return self.lm_head(hidden_states)
+        return self.lm_head(hidden_states, token_ids)
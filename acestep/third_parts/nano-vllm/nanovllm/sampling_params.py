@@ -17,6 +17,10 @@ class SamplingParams:
     # Optional callback to update processor state after each token
     # Should be a callable with signature: (token_id: int) -> None
     logits_processor_update_state: Optional[Callable[[int], None]] = field(default=None, repr=False)
+    # Optional callback returning the sorted global token ids allowed at the next step (or None for full vocab)
+    # When set, the LM head only computes logits for these ids and the logits processor/sampler see the
+    # reduced [batch, len(ids)] row; sampled indices are mapped back to global token ids by the engine
+    allowed_token_ids: Optional[Callable[[], Optional[Any]]] = field(default=None, repr=False)
 
     def __post_init__(self):
         assert self.temperature > 1e-10, "greedy sampling is not permitted"
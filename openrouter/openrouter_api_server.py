@@ -25,6 +25,7 @@ import traceback
 from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from typing import Any, Dict, List, Optional
+from urllib.parse import quote
 
 # Add parent directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -39,6 +40,8 @@ from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 
 from acestep.handler import AceStepHandler
+from acestep.audio_utils import audio_to_pcm16_bytes, pcm16_wav_header
+from acestep.audio_serving import audio_file_response
 from acestep.llm_inference import LLMHandler
 from acestep.inference import (
     GenerationParams,
@@ -105,6 +108,10 @@ class ChatCompletionRequest(BaseModel):
     messages: List[ChatMessage] = Field(default_factory=list)
     modalities: List[str] = Field(default=["audio"])
     stream: bool = False  # Enable streaming response
+    stream_audio: bool = True  # In streaming mode, also send WAV pieces while decoding
+    # Return a /v1/audio download URL instead of an inline base64 data URL
+    # (None: OPENROUTER_AUDIO_URL env default)
+    return_audio_url: Optional[bool] = None
     temperature: float = 0.85
     top_p: float = 0.9
     max_tokens: Optional[int] = None
@@ -128,7 +135,12 @@ class AudioUrlContent(BaseModel):
 
 
 class AudioOutputItem(BaseModel):
-    """Single audio output item in OpenRouter format."""
+    """Single audio output item in OpenRouter format.
+
+    Streaming responses may send ``type="audio_chunk"`` items first: consecutive
+    self-contained WAV pieces for progressive playback. The final ``audio_url``
+    item always carries the complete file.
+    """
     type: str = "audio_url"
     audio_url: AudioUrlContent = Field(default_factory=AudioUrlContent)
 
@@ -347,6 +359,14 @@ def _audio_to_base64_url(audio_path: str, audio_format: str = "mp3") -> str:
     return f"data:{mime_type};base64,{b64_data}"
 
 
+def _audio_chunk_to_wav_url(audio: Any, sample_rate: int) -> str:
+    """Encode a float audio tensor [channels, samples] as a 16-bit WAV data URL."""
+    pcm = audio_to_pcm16_bytes(audio)
+    header = pcm16_wav_header(sample_rate, audio.shape[0], num_frames=audio.shape[-1])
+    b64_data = base64.b64encode(header + pcm).decode("utf-8")
+    return f"data:audio/wav;base64,{b64_data}"
+
+
 def _format_lm_content(result: Dict[str, Any]) -> str:
     """
     Format LM generation result as content string.
@@ -561,6 +581,7 @@ def create_app() -> FastAPI:
     @app.post("/v1/chat/completions")
     async def chat_completions(
         request: ChatCompletionRequest,
+        http_request: Request,
         _: None = Depends(verify_api_key),
     ):
         """
@@ -591,6 +612,16 @@ def create_app() -> FastAPI:
         completion_id = f"chatcmpl-{os.urandom(8).hex()}"
         created_timestamp = int(time.time())
 
+        return_audio_url = request.return_audio_url
+        if return_audio_url is None:
+            return_audio_url = _env_bool("OPENROUTER_AUDIO_URL", False)
+
+        def _audio_output_url(audio_path: str) -> str:
+            """Download URL of the generated file, or an inline base64 data URL."""
+            if return_audio_url:
+                return f"{http_request.base_url}v1/audio?path={quote(audio_path)}"
+            return _audio_to_base64_url(audio_path, "mp3")
+
         def _run_lm_sample() -> Dict[str, Any]:
             """Run LLM sample generation or format_sample (blocking)."""
             nonlocal prompt, lyrics, instrumental
@@ -677,7 +708,9 @@ def create_app() -> FastAPI:
 
             return lm_result
 
-        def _run_audio_generation(lm_result: Dict[str, Any]) -> Dict[str, Any]:
+        def _run_audio_generation(
+            lm_result: Dict[str, Any], audio_chunk_callback=None, lm_text_callback=None
+        ) -> Dict[str, Any]:
             """Run audio generation (blocking)."""
             h: AceStepHandler = app.state.handler
             llm = app.state.llm_handler if app.state._llm_initialized else None
@@ -735,6 +768,8 @@ def create_app() -> FastAPI:
                 params=params,
                 config=config,
                 save_dir=app.state.temp_audio_dir,
+                audio_chunk_callback=audio_chunk_callback,
+                lm_text_callback=lm_text_callback,
             )
 
             if not result.success:
@@ -818,28 +853,76 @@ def create_app() -> FastAPI:
                     await asyncio.sleep(0)
                     print("[OpenRouter API] Stream: LM content sent")
 
-                # Step 2: Run audio generation with heartbeats
+                # Step 2: Run audio generation, forwarding the CoT text and decoded
+                # audio pieces as they arrive and sending heartbeats while waiting
                 print("[OpenRouter API] Stream: Starting audio generation...")
+                chunk_queue: asyncio.Queue = asyncio.Queue()
+                sample_rate = app.state.handler.sample_rate
+
+                def _on_audio_chunk(chunk) -> None:
+                    url = _audio_chunk_to_wav_url(chunk[0], sample_rate)
+                    loop.call_soon_threadsafe(chunk_queue.put_nowait, ("audio", url))
+
+                def _on_lm_text(text: str) -> None:
+                    loop.call_soon_threadsafe(chunk_queue.put_nowait, ("text", text))
+
                 audio_future = loop.run_in_executor(
                     executor,
-                    functools.partial(_run_audio_generation, lm_result)
+                    functools.partial(
+                        _run_audio_generation,
+                        lm_result,
+                        _on_audio_chunk if request.stream_audio else None,
+                        _on_lm_text,
+                    )
                 )
 
-                # Send heartbeat while waiting
+                def _stream_item(item) -> str:
+                    kind, value = item
+                    if kind == "text":
+                        return _make_stream_chunk(
+                            completion_id, created_timestamp, request.model, content=value
+                        )
+                    return _make_stream_chunk(
+                        completion_id, created_timestamp, request.model,
+                        audio=[AudioOutputItem(type="audio_chunk", audio_url=AudioUrlContent(url=value))]
+                    )
+
                 heartbeat_interval = 2.0
                 dot_count = 0
-                while not audio_future.done():
-                    try:
-                        await asyncio.wait_for(asyncio.shield(audio_future), timeout=heartbeat_interval)
-                        break
-                    except asyncio.TimeoutError:
-                        dot_count += 1
-                        yield _make_stream_chunk(
-                            completion_id, created_timestamp, request.model,
-                            content="."
+                chunk_count = 0
+                next_chunk = asyncio.ensure_future(chunk_queue.get())
+                try:
+                    while True:
+                        done, _ = await asyncio.wait(
+                            {next_chunk, audio_future},
+                            timeout=heartbeat_interval,
+                            return_when=asyncio.FIRST_COMPLETED,
                         )
-                        await asyncio.sleep(0)
-                        print(f"[OpenRouter API] Stream: Heartbeat {dot_count}")
+                        if next_chunk in done:
+                            item = next_chunk.result()
+                            chunk_count += item[0] == "audio"
+                            yield _stream_item(item)
+                            await asyncio.sleep(0)
+                            next_chunk = asyncio.ensure_future(chunk_queue.get())
+                        elif audio_future in done:
+                            # Chunks are queued before the future resolves; flush the rest
+                            while not chunk_queue.empty():
+                                item = chunk_queue.get_nowait()
+                                chunk_count += item[0] == "audio"
+                                yield _stream_item(item)
+                            break
+                        else:
+                            dot_count += 1
+                            yield _make_stream_chunk(
+                                completion_id, created_timestamp, request.model,
+                                content="."
+                            )
+                            await asyncio.sleep(0)
+                            print(f"[OpenRouter API] Stream: Heartbeat {dot_count}")
+                finally:
+                    next_chunk.cancel()
+                if chunk_count:
+                    print(f"[OpenRouter API] Stream: Sent {chunk_count} audio chunks")
 
                 # Get audio result
                 try:
@@ -861,12 +944,12 @@ def create_app() -> FastAPI:
                 # Send audio data
                 audio_path = audio_result.get("audio_path")
                 if audio_path and os.path.exists(audio_path):
-                    b64_url = _audio_to_base64_url(audio_path, "mp3")
-                    if b64_url:
+                    audio_url = _audio_output_url(audio_path)
+                    if audio_url:
                         audio_list = [
                             AudioOutputItem(
                                 type="audio_url",
-                                audio_url=AudioUrlContent(url=b64_url)
+                                audio_url=AudioUrlContent(url=audio_url)
                             )
                         ]
                         yield _make_stream_chunk(
@@ -918,12 +1001,12 @@ def create_app() -> FastAPI:
         audio_list = None
         audio_path = result.get("audio_path")
         if audio_path and os.path.exists(audio_path):
-            b64_url = _audio_to_base64_url(audio_path, "mp3")
-            if b64_url:
+            audio_url = _audio_output_url(audio_path)
+            if audio_url:
                 audio_list = [
                     AudioOutputItem(
                         type="audio_url",
-                        audio_url=AudioUrlContent(url=b64_url)
+                        audio_url=AudioUrlContent(url=audio_url)
                     )
                 ]
 
@@ -951,6 +1034,17 @@ def create_app() -> FastAPI:
 
         return response
     
+    @app.get("/v1/audio")
+    async def get_audio(path: str, request: Request, _: None = Depends(verify_api_key)):
+        """Serve a generated audio file (Range and ETag/Last-Modified aware)."""
+        resolved_path = os.path.realpath(path)
+        allowed_dir = os.path.realpath(request.app.state.temp_audio_dir)
+        if not resolved_path.startswith(allowed_dir + os.sep):
+            raise HTTPException(status_code=403, detail="Access denied: path outside allowed directory")
+        if not os.path.isfile(resolved_path):
+            raise HTTPException(status_code=404, detail="Audio file not found")
+        return audio_file_response(request, resolved_path)
+
     @app.get("/health")
     async def health_check():
         """Health check endpoint."""
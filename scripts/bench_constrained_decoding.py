@@ -0,0 +1,149 @@
+"""
+CPU micro-benchmark for the metadata field whitelists of constrained decoding.
+
+Builds a MetadataConstrainedLogitsProcessor on a stub tokenizer (single
+characters, a few merged words, 64000 audio-code tokens, filler up to a
+Qwen-sized vocabulary), then times one constrained step on every prefix node
+of the BPM, duration, keyscale, language and timesignature trees:
+
+- before: build the allowed-id list from the prefix tree and copy it to a new
+  index tensor (the per-step path used before compile_token_tables)
+- after:  look up the precompiled index tensor for the node
+
+Both variants must produce identical masks; the script exits non-zero if not.
+
+Usage:
+    python scripts/bench_constrained_decoding.py [--vocab-size 151669] [--rounds 20]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from acestep.constrained_logits_processor import MetadataConstrainedLogitsProcessor
+
+
+class StubTokenizer:
+    """Greedy longest-match tokenizer over a fixed vocabulary."""
+
+    WORDS = ["<think>", "</think>", "bpm", "duration", "keyscale", "language",
+             "timesignature", "caption", "genres", " major", " minor", "major", "minor",
+             "12", "120", "60", "90", " 1", " 2"]
+
+    def __init__(self, vocab_size: int):
+        chars = [chr(c) for c in range(32, 127)] + ["\n", "\t", "♯", "♭"]
+        tokens = ["<|endoftext|>"] + chars + self.WORDS
+        tokens += [f"<|audio_code_{i}|>" for i in range(64000)]
+        tokens += [f"<|extra_{i}|>" for i in range(max(0, vocab_size - len(tokens)))]
+        self._tokens = tokens
+        self._ids = {t: i for i, t in enumerate(tokens)}
+        self._max_len = max(len(t) for t in tokens if not t.startswith("<|"))
+        self.eos_token_id = 0
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def encode(self, text, add_special_tokens=False):
+        ids, pos = [], 0
+        while pos < len(text):
+            for size in range(min(self._max_len, len(text) - pos), 0, -1):
+                token_id = self._ids.get(text[pos:pos + size])
+                if token_id is not None:
+                    ids.append(token_id)
+                    pos += size
+                    break
+            else:
+                pos += 1
+        return ids
+
+    def decode(self, ids, **kwargs):
+        return "".join(self._tokens[i] for i in ids)
+
+
+FIELDS = {
+    "bpm": "bpm_prefix_tree",
+    "duration": "duration_prefix_tree",
+    "keyscale": "keyscale_prefix_tree",
+    "language": "language_prefix_tree",
+    "timesignature": "timesig_prefix_tree",
+}
+
+
+def _legacy_whitelist(proc, field, prefix):
+    """Allowed-id list exactly as the per-step code built it before precompilation."""
+    tree = getattr(proc, FIELDS[field])
+    allowed = list(tree.get(prefix, ()))
+    newline_ok = prefix in tree and proc.newline_token in tree[prefix]
+    if field in ("bpm", "duration"):
+        return allowed + [proc.newline_token] if newline_ok else allowed
+    if newline_ok:
+        return [proc.newline_token]
+    if not allowed and field != "timesignature":
+        return [proc.newline_token]
+    return allowed
+
+
+def _legacy_step(proc, field, scores):
+    proc._apply_whitelist_inplace(scores, _legacy_whitelist(proc, field, tuple(proc.accumulated_token_ids)))
+
+
+def _compiled_step(proc, field, scores):
+    proc._apply_whitelist_inplace(scores, proc._node_whitelist(field, scores.device))
+
+
+def _time(step, proc, nodes, logits, rounds):
+    # Scores are reused across steps: the whitelist cost does not depend on their values
+    scores = logits.clone()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for field, prefix in nodes:
+            proc.accumulated_token_ids = list(prefix)
+            step(proc, field, scores)
+    return len(nodes) * rounds / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--vocab-size", type=int, default=151669)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    start = time.perf_counter()
+    proc = MetadataConstrainedLogitsProcessor(StubTokenizer(args.vocab_size), enabled=True)
+    print(f"Processor built in {time.perf_counter() - start:.1f}s (vocab={proc.vocab_size})")
+    start = time.perf_counter()
+    proc.compile_token_tables("cpu")
+    print(f"Tables compiled in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    nodes = [(field, prefix) for field, attr in FIELDS.items() for prefix in getattr(proc, attr)]
+    logits = torch.randn(1, proc.vocab_size)
+
+    mismatches = 0
+    for field, prefix in nodes:
+        proc.accumulated_token_ids = list(prefix)
+        before, after = logits.clone(), logits.clone()
+        _legacy_step(proc, field, before)
+        _compiled_step(proc, field, after)
+        if not torch.equal(before, after):
+            mismatches += 1
+            print(f"  FAIL {field} prefix={prefix}")
+    print(f"{len(nodes)} prefix nodes checked, {mismatches} mismatches")
+
+    # Warm up both paths before timing
+    _time(_legacy_step, proc, nodes, logits, 1)
+    _time(_compiled_step, proc, nodes, logits, 1)
+    before = _time(_legacy_step, proc, nodes, logits, args.rounds)
+    after = _time(_compiled_step, proc, nodes, logits, args.rounds)
+    print(f"before: {before:,.0f} steps/s")
+    print(f"after:  {after:,.0f} steps/s ({after / before:.2f}x)")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""
+Benchmark of the batched wavefront DTW (dtw_batch) against the Numba dtw_cpu.
+
+For each batch size, builds random [tokens x frames] cost matrices with
+slightly different sizes on the chosen device and times:
+
+- dtw_cpu:   copy every matrix to the CPU and run the Numba DTW per sample
+             (what the aligners did before dtw_batch)
+- dtw_batch: one wavefront DTW over the whole batch on the device
+
+Paths of both must match; the script exits non-zero if not. On the CPU the
+Numba loop is expected to win (dtw_paths keeps it there); the wavefront is
+meant for matrices that already live on an accelerator.
+
+Usage:
+    python scripts/bench_dtw.py [--device cuda] [--tokens 300] [--frames 1500] [--batch-sizes 1,4,8] [--rounds 3]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from acestep.dit_alignment_score import dtw_batch, dtw_cpu
+
+
+def _sync(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    elif device.type == "mps":
+        torch.mps.synchronize()
+
+
+def _time(fn, device, rounds):
+    fn()  # warm up (Numba compilation, CUDA kernels)
+    _sync(device)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        result = fn()
+    _sync(device)
+    return (time.perf_counter() - start) / rounds, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--tokens", type=int, default=300)
+    parser.add_argument("--frames", type=int, default=1500)
+    parser.add_argument("--batch-sizes", default="1,4,8")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    generator = torch.Generator().manual_seed(0)
+    print(f"device={device} tokens~{args.tokens} frames~{args.frames}")
+
+    mismatches = 0
+    for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+        costs = [
+            -torch.rand(args.tokens - 7 * b, args.frames - 31 * b, generator=generator).to(device)
+            for b in range(batch_size)
+        ]
+        numba_time, numba_paths = _time(lambda: [dtw_cpu(c.cpu().numpy()) for c in costs], device, args.rounds)
+        batch_time, batch_paths = _time(lambda: dtw_batch(costs), device, args.rounds)
+        for reference, path in zip(numba_paths, batch_paths):
+            if not (np.array_equal(reference[0], path[0]) and np.array_equal(reference[1], path[1])):
+                mismatches += 1
+        print(
+            f"batch={batch_size}: dtw_cpu {numba_time * 1000:8.1f}ms  "
+            f"dtw_batch {batch_time * 1000:8.1f}ms  ({numba_time / batch_time:.2f}x)"
+        )
+
+    print(f"{mismatches} path mismatches")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,300 @@
+"""
+Check of the hook-based cross-attention capture used by lyric alignment.
+
+get_lyric_alignments captures the configured cross-attention heads with hooks on
+q_norm/k_norm (softmax(q k^T) recomputed for the selected heads) instead of
+running the decoder with output_attentions=True, once the capture has been
+verified against output_attentions for the loaded decoder.
+
+Without arguments, runs on CPU with two tiny stand-in decoders that have the
+DiT's decoder.layers[i].cross_attn.q_norm/k_norm layout:
+
+- plain: scores from the q_norm/k_norm outputs; the hook maps must equal the
+  output_attentions maps, the capture must be verified, and alignments must
+  match the output_attentions path
+- rope:  RoPE applied to q/k after the norms; the capture must be rejected and
+  alignments must still match the output_attentions path
+
+With --config-path, loads that DiT checkpoint instead, generates a short song
+and compares both paths on it (attention maps, LRC text, sentence timestamps
+and lm/dit scores). Exits non-zero on any mismatch.
+
+Usage:
+    python scripts/check_attention_capture.py
+    python scripts/check_attention_capture.py --config-path acestep-v15-turbo [--device auto]
+        [--duration 20] [--batch-size 2] [--atol 0.02]
+"""
+
+import argparse
+import os
+import sys
+from types import SimpleNamespace
+
+import torch
+import torch.nn as nn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from acestep.handler import AceStepHandler
+
+CAPTION = "An upbeat pop song with bright synths, punchy drums and a clear female lead vocal."
+LYRICS = """[Verse]
+Walking down the empty street
+Neon lights beneath my feet
+
+[Chorus]
+Sing it loud into the night
+Everything will be alright
+"""
+
+HIDDEN, HEADS, KV_HEADS, HEAD_DIM, LAYERS, LATENT_DIM = 32, 4, 2, 8, 6, 8
+
+
+def _rotate(x, positions):
+    """Rotary position embedding over the last dim of [batch, heads, length, head_dim]."""
+    half = x.shape[-1] // 2
+    freqs = positions[:, None].float() / (10000 ** (torch.arange(half).float() / half))
+    cos, sin = freqs.cos(), freqs.sin()
+    x1, x2 = x[..., :half], x[..., half:]
+    return torch.cat([x1 * cos - x2 * sin, x2 * cos + x1 * sin], dim=-1)
+
+
+class TinyAttention(nn.Module):
+    """Qwen3-style attention: per-head q_norm/k_norm, grouped KV heads."""
+
+    def __init__(self, rope=False):
+        super().__init__()
+        self.rope = rope
+        self.q_proj = nn.Linear(HIDDEN, HEADS * HEAD_DIM)
+        self.k_proj = nn.Linear(HIDDEN, KV_HEADS * HEAD_DIM)
+        self.v_proj = nn.Linear(HIDDEN, KV_HEADS * HEAD_DIM)
+        self.o_proj = nn.Linear(HEADS * HEAD_DIM, HIDDEN)
+        self.q_norm = nn.RMSNorm(HEAD_DIM)
+        self.k_norm = nn.RMSNorm(HEAD_DIM)
+        self.scaling = HEAD_DIM ** -0.5
+
+    def forward(self, x, source, key_mask=None, output_attentions=False):
+        batch, length, _ = x.shape
+        source_length = source.shape[1]
+        q = self.q_norm(self.q_proj(x).view(batch, length, HEADS, HEAD_DIM)).transpose(1, 2)
+        k = self.k_norm(self.k_proj(source).view(batch, source_length, KV_HEADS, HEAD_DIM)).transpose(1, 2)
+        v = self.v_proj(source).view(batch, source_length, KV_HEADS, HEAD_DIM).transpose(1, 2)
+        if self.rope:
+            q, k = _rotate(q, torch.arange(length)), _rotate(k, torch.arange(source_length))
+        k = k.repeat_interleave(HEADS // KV_HEADS, dim=1)
+        v = v.repeat_interleave(HEADS // KV_HEADS, dim=1)
+        scores = (q @ k.transpose(-1, -2)) * self.scaling
+        if key_mask is not None:
+            scores = scores.masked_fill(key_mask[:, None, None, :] == 0, torch.finfo(scores.dtype).min)
+        probs = scores.softmax(dim=-1)
+        out = self.o_proj((probs @ v).transpose(1, 2).reshape(batch, length, HEADS * HEAD_DIM))
+        return out, probs if output_attentions else None
+
+
+class TinyLayer(nn.Module):
+    def __init__(self, rope):
+        super().__init__()
+        self.self_attn = TinyAttention()
+        self.cross_attn = TinyAttention(rope=rope)
+
+
+class TinyDecoder(nn.Module):
+    """Stand-in for the DiT decoder with the same call signature and attention outputs."""
+
+    def __init__(self, rope=False):
+        super().__init__()
+        self.proj_in = nn.Linear(LATENT_DIM, HIDDEN)
+        self.context_in = nn.Linear(LATENT_DIM, HIDDEN)
+        self.layers = nn.ModuleList(TinyLayer(rope) for _ in range(LAYERS))
+
+    def forward(self, hidden_states, timestep, timestep_r, attention_mask, encoder_hidden_states,
+                encoder_attention_mask, context_latents, use_cache=False, past_key_values=None,
+                output_attentions=False, custom_layers_config=None, enable_early_exit=False):
+        h = self.proj_in(hidden_states) + self.context_in(context_latents) + timestep[:, None, None]
+        last = max(custom_layers_config) if enable_early_exit and custom_layers_config else len(self.layers)
+        attentions = []
+        for i, layer in enumerate(self.layers):
+            h = h + layer.self_attn(h, h)[0]
+            out, probs = layer.cross_attn(h, encoder_hidden_states, encoder_attention_mask, output_attentions)
+            h = h + out
+            attentions.append(probs)
+            if i >= last:
+                break
+        return h, None, tuple(attentions) if output_attentions else None
+
+
+class TinyTokenizer:
+    """Header of 3 tokens; id 5 is a newline, everything else a letter."""
+
+    def encode(self, text, add_special_tokens=False):
+        return [7] * 3
+
+    def decode(self, ids, skip_special_tokens=False):
+        return "".join("\n" if i == 5 else chr(97 + i % 26) for i in ids)
+
+
+def _compare_alignments(reference, captured, atol):
+    """Print per-item differences; returns the number of mismatching items."""
+    failures = 0
+    for b, (ref, cap) in enumerate(zip(reference, captured)):
+        if not (ref["success"] and cap["success"]):
+            print(f"  item {b}: alignment failed: {ref['error']} / {cap['error']}")
+            failures += 1
+            continue
+        score_diff = max(abs(ref["lm_score"] - cap["lm_score"]), abs(ref["dit_score"] - cap["dit_score"]))
+        stamps = list(zip(ref["sentence_timestamps"], cap["sentence_timestamps"]))
+        stamp_diff = max((max(abs(r.start - c.start), abs(r.end - c.end)) for r, c in stamps), default=0.0)
+        same_lrc = ref["lrc_text"] == cap["lrc_text"]
+        print(f"  item {b}: lm {ref['lm_score']:.4f}/{cap['lm_score']:.4f} "
+              f"dit {ref['dit_score']:.4f}/{cap['dit_score']:.4f} "
+              f"max timestamp diff {stamp_diff:.3f}s lrc {'same' if same_lrc else 'DIFFERENT'}")
+        failures += (
+            score_diff > atol
+            or stamp_diff > atol
+            or len(ref["sentence_timestamps"]) != len(cap["sentence_timestamps"])
+        )
+    return failures
+
+
+def _check_stand_ins():
+    """CPU check with the tiny stand-in decoders; returns the number of failures."""
+    torch.manual_seed(0)
+    batch, frames, tokens = 3, 120, 40
+    latents = torch.randn(batch, frames, LATENT_DIM)
+    encoder_hidden_states = torch.randn(batch, tokens, HIDDEN)
+    context_latents = torch.randn(batch, frames, LATENT_DIM)
+    encoder_attention_mask = torch.ones(batch, tokens)
+    encoder_attention_mask[1, 33:] = 0
+    lyric_token_ids = torch.randint(9, 30, (batch, tokens))
+    lyric_token_ids[:, [10, 20]] = 5
+    lyric_token_ids[1, 33] = 151643  # <|endoftext|>
+    inputs = dict(
+        pred_latent=latents, encoder_hidden_states=encoder_hidden_states,
+        encoder_attention_mask=encoder_attention_mask, context_latents=context_latents,
+        lyric_token_ids=lyric_token_ids, total_duration_seconds=4.8, inference_steps=8,
+    )
+    decoder_inputs = {
+        "hidden_states": latents, "timestep": torch.full((batch,), 0.125), "timestep_r": torch.full((batch,), 0.125),
+        "attention_mask": torch.ones(batch, frames), "encoder_hidden_states": encoder_hidden_states,
+        "encoder_attention_mask": encoder_attention_mask, "context_latents": context_latents,
+    }
+
+    failures = 0
+    for rope in (False, True):
+        handler = AceStepHandler()
+        handler.model = SimpleNamespace(decoder=TinyDecoder(rope=rope).eval())
+        handler.text_tokenizer = TinyTokenizer()
+        handler.device, handler.dtype = "cpu", torch.float32
+        handler.custom_layers_config = {1: [0, 3], 2: [2], 4: [1, 3]}
+        decoder, config = handler.model.decoder, handler.custom_layers_config
+        print(f"{'rope' if rope else 'plain'} stand-in decoder:")
+
+        with torch.no_grad():
+            captured = handler._capture_cross_attentions(decoder, decoder_inputs, config)
+            reference = handler._output_cross_attentions(decoder, decoder_inputs, config)
+            diff = (captured - reference).abs().max().item()
+            maps_match = diff <= 1e-5
+            verified = handler._attention_capture_verified_for(decoder, decoder_inputs, config)
+            default = handler.get_lyric_alignments(**inputs)
+            handler.attention_capture = False
+            fallback = handler.get_lyric_alignments(**inputs)
+
+        ok = maps_match != rope and verified != rope
+        print(f"  {'OK  ' if ok else 'FAIL'} hook maps vs output_attentions: max abs diff {diff:.2e}, "
+              f"capture {'verified' if verified else 'rejected'}")
+        failures += not ok
+        failures += _compare_alignments(fallback, default, atol=1e-4)
+    return failures
+
+
+def _record(maps, name, fn):
+    """Wrap an attention method so its last result is kept in maps[name]."""
+    def wrapper(*args, **kwargs):
+        maps[name] = fn(*args, **kwargs)
+        return maps[name]
+    return wrapper
+
+
+def _check_checkpoint(args):
+    """Compare both paths on a loaded DiT checkpoint; returns the number of failures."""
+    handler = AceStepHandler()
+    status, ok = handler.initialize_service(
+        project_root=handler._get_project_root(),
+        config_path=args.config_path,
+        device=args.device,
+    )
+    if not ok:
+        print(status)
+        return 1
+
+    result = handler.generate_music(
+        captions=CAPTION,
+        lyrics=LYRICS,
+        audio_duration=args.duration,
+        batch_size=args.batch_size,
+        inference_steps=args.inference_steps,
+        use_random_seed=False,
+        seed=42,
+    )
+    if not result["success"]:
+        print(f"generation failed: {result['error']}")
+        return 1
+    extra = result["extra_outputs"]
+
+    maps = {}
+    handler._capture_cross_attentions = _record(maps, "capture", handler._capture_cross_attentions)
+    handler._output_cross_attentions = _record(maps, "output_attentions", handler._output_cross_attentions)
+    # Force each path on the full input (skips the short verification run)
+    handler._attention_capture_verified[handler.model.decoder] = True
+
+    alignments = {}
+    for name, enabled in (("output_attentions", False), ("capture", True)):
+        handler.attention_capture = enabled
+        alignments[name] = handler.get_lyric_alignments(
+            pred_latent=extra["pred_latents"],
+            encoder_hidden_states=extra["encoder_hidden_states"],
+            encoder_attention_mask=extra["encoder_attention_mask"],
+            context_latents=extra["context_latents"],
+            lyric_token_ids=extra["lyric_token_idss"],
+            total_duration_seconds=args.duration,
+            vocal_language="en",
+            inference_steps=args.inference_steps,
+            seed=42,
+        )
+
+    reference, captured = maps.get("output_attentions"), maps.get("capture")
+    if captured is None:
+        print("capture: decoder layout not recognized (falls back to output_attentions)")
+        return 1
+    if reference is None or reference.shape != captured.shape:
+        print(f"attention shapes differ: {None if reference is None else tuple(reference.shape)} "
+              f"vs {tuple(captured.shape)}")
+        return 1
+
+    diff = (reference.float() - captured.float()).abs().max().item()
+    print(f"attention maps {tuple(captured.shape)}: max abs diff {diff:.5f}")
+    return int(diff > args.atol) + _compare_alignments(alignments["output_attentions"], alignments["capture"], args.atol)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--config-path", default=None, help="DiT checkpoint to compare on (default: CPU stand-ins)")
+    parser.add_argument("--device", default="auto")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--batch-size", type=int, default=2)
+    parser.add_argument("--inference-steps", type=int, default=8)
+    parser.add_argument("--atol", type=float, default=0.02,
+                        help="tolerance for attention probabilities, scores and timestamps (seconds)")
+    args = parser.parse_args()
+
+    if args.config_path:
+        with torch.no_grad():
+            failures = _check_checkpoint(args)
+    else:
+        failures = _check_stand_ins()
+    print("Hook capture matches output_attentions." if not failures else f"{failures} mismatches!")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
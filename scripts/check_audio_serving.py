@@ -0,0 +1,74 @@
+"""
+CPU check for audio downloads served by acestep.audio_serving.
+
+Serves a dummy file through ``audio_file_response`` and checks full downloads,
+single byte ranges (including suffix ranges), unsatisfiable ranges, If-Range
+and ETag/Last-Modified revalidation.
+
+Usage:
+    python scripts/check_audio_serving.py
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from acestep.audio_serving import audio_file_response
+
+
+def _check(name, ok):
+    print(f"  {'OK  ' if ok else 'FAIL'} {name}")
+    return ok
+
+
+def main():
+    ok = True
+    data = os.urandom(300_000)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "0f8e2c1a-5d3b-5e7f-9a21-6c4b8d0e1f23.mp3")
+        with open(path, "wb") as fh:
+            fh.write(data)
+
+        app = FastAPI()
+
+        @app.get("/audio")
+        async def audio(request: Request):
+            return audio_file_response(request, path)
+
+        client = TestClient(app)
+
+        r = client.get("/audio")
+        etag = r.headers.get("etag", "")
+        ok &= _check("full download", r.status_code == 200 and r.content == data)
+        ok &= _check("validators and Accept-Ranges", etag.startswith('"0f8e2c1a') and "last-modified" in r.headers
+                     and r.headers.get("accept-ranges") == "bytes" and r.headers.get("content-type") == "audio/mpeg")
+
+        r = client.get("/audio", headers={"Range": "bytes=1000-1999"})
+        ok &= _check("byte range", r.status_code == 206 and r.content == data[1000:2000]
+                     and r.headers.get("content-range") == f"bytes 1000-1999/{len(data)}")
+        r = client.get("/audio", headers={"Range": "bytes=299000-"})
+        ok &= _check("open-ended range", r.status_code == 206 and r.content == data[299000:])
+        r = client.get("/audio", headers={"Range": "bytes=-500"})
+        ok &= _check("suffix range", r.status_code == 206 and r.content == data[-500:])
+        r = client.get("/audio", headers={"Range": f"bytes={len(data)}-"})
+        ok &= _check("unsatisfiable range", r.status_code == 416
+                     and r.headers.get("content-range") == f"bytes */{len(data)}")
+        r = client.get("/audio", headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+        ok &= _check("stale If-Range sends whole file", r.status_code == 200 and r.content == data)
+
+        r = client.get("/audio", headers={"If-None-Match": etag})
+        ok &= _check("If-None-Match revalidation", r.status_code == 304 and not r.content)
+        r = client.get("/audio", headers={"If-Modified-Since": r.headers["last-modified"]})
+        ok &= _check("If-Modified-Since revalidation", r.status_code == 304)
+
+    print("Audio serving OK." if ok else "Audio serving check failed!")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+CPU check for the per-stage latency model behind API queue ETAs.
+
+Feeds synthetic ``time_costs`` from a known cost model (DiT time linear in
+batch * duration * steps, LM phase 2 linear in batch * duration, ...) and checks
+that predictions for unseen request shapes land close to the true cost, that
+models are kept apart, and that the state survives a save/load round trip.
+
+Usage:
+    python scripts/check_eta_model.py
+"""
+
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from acestep.eta_model import JobFeatures, StageLatencyModel
+
+
+def _true_costs(f: JobFeatures, speed: float = 1.0):
+    units = f.batch_size * f.duration
+    costs = {
+        "dit_encoder_time_cost": 0.05 * f.batch_size * speed,
+        "dit_model_time_cost": (0.2 + 0.0004 * units * f.inference_steps) * speed,
+        "dit_vae_decode_time_cost": (0.1 + 0.004 * units) * speed,
+        "dit_offload_time_cost": 0.0,
+        "save_time": 0.002 * units,
+    }
+    costs["lm_phase1_time"] = 1.5 if f.lm_phase1 else 0.0
+    costs["lm_phase2_time"] = 0.02 * units if f.lm_phase2 else 0.0
+    return costs
+
+
+def _check(name, predicted, expected, rel=0.1):
+    ok = predicted is not None and abs(predicted - expected) <= rel * expected
+    print(f"  {'OK  ' if ok else 'FAIL'} {name}: predicted={predicted if predicted is None else round(predicted, 2)} expected={expected:.2f}")
+    return ok
+
+
+def main():
+    rng = random.Random(0)
+    model = StageLatencyModel(decay=0.97)
+    ok = True
+
+    ok &= model.predict(JobFeatures(dit_model="turbo"), fallback=5.0) == 5.0
+
+    for _ in range(200):
+        f = JobFeatures(
+            dit_model=rng.choice(["turbo", "base"]),
+            lm_model="lm-1.7B",
+            batch_size=rng.choice([1, 2, 4]),
+            duration=rng.uniform(10, 240),
+            inference_steps=rng.choice([8, 32, 50]),
+            lm_phase1=rng.random() < 0.7,
+        )
+        f.lm_phase2 = f.lm_phase1 and rng.random() < 0.5
+        costs = _true_costs(f, speed=1.0 if f.dit_model == "turbo" else 3.0)
+        wall = sum(costs.values()) + 0.3  # fixed per-job overhead not in time_costs
+        model.observe(f, costs, wall_seconds=wall)
+
+    cases = [
+        ("turbo, short, no LM", JobFeatures("turbo", "lm-1.7B", 1, 30.0, 8), 1.0),
+        ("turbo, long batch with thinking", JobFeatures("turbo", "lm-1.7B", 4, 180.0, 8, True, True), 1.0),
+        ("base, 50 steps", JobFeatures("base", "lm-1.7B", 2, 120.0, 50, True, False), 3.0),
+    ]
+    for name, f, speed in cases:
+        expected = sum(_true_costs(f, speed).values()) + 0.3
+        ok &= _check(name, model.predict(f), expected)
+
+    stages = model.predict_stages(JobFeatures("turbo", "lm-1.7B", 1, 60.0, 8))
+    ok &= "lm_phase1" not in stages and "dit_model" in stages
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "eta.json")
+        model.save(path)
+        restored = StageLatencyModel()
+        restored.load(path)
+        f = cases[1][1]
+        ok &= _check("restored model", restored.predict(f), model.predict(f), rel=1e-6)
+
+    print("ETA model OK." if ok else "ETA model check failed!")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
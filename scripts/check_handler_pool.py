@@ -0,0 +1,115 @@
+"""
+CPU check for the DiT handler pool used by the API server.
+
+Registers fake handlers for two models on several "devices", then checks
+model-aware routing with default-model fallback, least-loaded device and
+replica choice, parallel execution across replicas and the per-replica metrics.
+
+Usage:
+    python scripts/check_handler_pool.py
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from acestep.handler_pool import HandlerPool, parse_devices
+
+
+class FakeHandler:
+    """Stand-in for AceStepHandler: sleeps instead of generating."""
+
+    def __init__(self, model, device):
+        self.model = model
+        self.device = device
+
+    def generate(self, seconds):
+        time.sleep(seconds)
+        return self.device
+
+
+def _check(name, ok):
+    print(f"  {'OK  ' if ok else 'FAIL'} {name}")
+    return ok
+
+
+async def _run():
+    ok = True
+    pool = HandlerPool()
+    devices = ["cpu:0", "cpu:1"]
+    for model_idx, model in enumerate(["turbo", "base"]):
+        for dev in devices:
+            pool.add(model, dev, FakeHandler(model, dev), is_default=model_idx == 0, initialized=True)
+    pool.add("sft", "cpu:0", FakeHandler("sft", "cpu:0"), initialized=False)
+
+    ok &= _check("models() lists initialized models, default first", pool.models() == ["turbo", "base"])
+
+    replica, matched = pool.acquire("base")
+    ok &= _check("requested model is served", matched and replica.model == "base")
+    other, _ = pool.acquire("base")
+    ok &= _check("second job goes to the idle replica", other.device != replica.device)
+    pool.release(replica)
+    pool.release(other)
+
+    replica, _ = pool.acquire("turbo")
+    other, _ = pool.acquire("base")
+    ok &= _check("another model's job goes to the idle device", other.device != replica.device)
+    pool.release(replica)
+    pool.release(other)
+
+    replica, matched = pool.acquire("sft")
+    ok &= _check("uninitialized model falls back to default", not matched and replica.model == "turbo")
+    pool.release(replica)
+    replica, matched = pool.acquire(None)
+    ok &= _check("no model selects default", not matched and replica.model == "turbo")
+    pool.release(replica)
+
+    # Four jobs of 0.2s on two turbo replicas should finish in about two rounds
+    async def job():
+        r, _ = pool.acquire("turbo")
+        try:
+            return await pool.run(r, lambda: r.handler.generate(0.2))
+        finally:
+            pool.release(r)
+
+    t0 = time.time()
+    results = await asyncio.gather(*[job() for _ in range(4)])
+    elapsed = time.time() - t0
+    ok &= _check(f"jobs run in parallel on both devices ({elapsed:.2f}s)", set(results) == set(devices) and elapsed < 0.7)
+
+    async def failing():
+        r, _ = pool.acquire("base")
+        try:
+            await pool.run(r, lambda: 1 / 0)
+        finally:
+            pool.release(r)
+
+    try:
+        await failing()
+    except ZeroDivisionError:
+        pass
+
+    stats = {s["name"]: s for s in pool.stats()}
+    turbo = [stats["turbo@cpu:0"], stats["turbo@cpu:1"]]
+    ok &= _check("queue depth back to zero", all(s["queue_depth"] == 0 for s in stats.values()))
+    ok &= _check("jobs and busy time recorded per replica",
+                 all(s["jobs"] == 2 and s["busy_seconds"] >= 0.35 for s in turbo))
+    ok &= _check("failures recorded", sum(s["failures"] for s in stats.values()) == 1)
+
+    ok &= _check("parse_devices", parse_devices(" cuda:0, cuda:1,cuda:0 ") == ["cuda:0", "cuda:1"]
+                 and parse_devices("", default="auto") == ["auto"])
+    pool.shutdown()
+    return ok
+
+
+def main():
+    ok = asyncio.run(_run())
+    print("Handler pool routing and metrics OK." if ok else "Handler pool check failed!")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()